@@ -10,18 +10,36 @@ from __future__ import print_function
 from os.path import join, basename
 import numpy as np
 import pickle
-from tqdm import tqdm
 
 from utils.util import mkdir_join
-from utils.inputs.segmentation import segment
-from utils.inputs.htk import read, write
+from utils.parallel import ParallelExecutor
+from utils.io_queue import AsyncWriter
+from utils.distributed import allreduce_sum
+from utils.inputs.segmentation import Segmenter
+from utils.inputs.feature_extraction import init_feature_worker
+from utils.inputs.feature_extraction import RECORDING_SLOT_BYTES
+from utils.inputs.htk import read_header
+from utils.inputs.ledger import Ledger, make_config_hash
+from utils.inputs.ledger import make_feature_hash
+from utils.inputs.frame_num import read_frame_num, count_utterance_frames
+from utils.inputs.online_cmvn import online_cmvn
+from utils.inputs.dtype_policy import ACCUMULATOR_DTYPE, check_dtype
+from utils.inputs.dtype_policy import sum_squared_deviations
+from utils.inputs.frame_stacking import stack_frame, stacked_frame_num
+from utils.inputs.quantization import Quantizer, PRECISIONS
+from utils.inputs.quantization import standard_quantizer, save_quantizer
+from utils.inputs.statistics import Statistics, StatisticsSampler
+from utils.inputs.statistics import STATISTICS_NAME
 
 
 def read_audio(audio_paths, speaker_dict, tool, config, normalize, is_training,
                save_path=None, save_format='numpy',
                global_mean_male=None, global_mean_female=None,
                global_std_male=None, global_std_female=None,
-               dtype=np.float32):
+               dtype=np.float32, num_workers=1, store_path=None,
+               stats_sample_rate=1., stats_max_frames=None,
+               online_window=600, transport=None,
+               stack_frames=1, skip_frames=1, precision='float32'):
     """Read HTK or WAV files.
     Args:
         audio_paths (list): paths to HTK or WAV files
@@ -34,14 +52,20 @@ def read_audio(audio_paths, speaker_dict, tool, config, normalize, is_training,
             htk or librosa or python_speech_features
         config (dict): a configuration for feature extraction
         normalize (string):
-            no => normalization will be not conducted
+            no => normalization will be not conducted. Statistics per
+                  gender & speaker over the training set are saved to
+                  normalize features on load instead.
             global => normalize input features by global mean & std over
                       the training set per gender
             speaker => normalize input features by mean & std per speaker
             utterance => normalize input features by mean & std per utterancet
                          data by mean & std per utterance
+            online => normalize input features by mean & std over the past
+                      `online_window` frames with global mean & std over
+                      the training set as the prior
         is_training (bool, optional): training or not
-        save_path (string): path to save npy files
+        save_path (string): path to save npy files. Utterances recorded in
+            the ledger there by an interrupted run are not saved again.
         save_format (string, optional): numpy or htk
         global_mean_male (np.ndarray, optional): global mean of male over the
             training set
@@ -52,6 +76,29 @@ def read_audio(audio_paths, speaker_dict, tool, config, normalize, is_training,
         global_std_female (np.ndarray, optional): global standard deviation of
             female over the training set
         dtype (optional): the type of data, default is np.float32
+        num_workers (int, optional): the number of processes to extract
+            features. Files which fail are skipped and reported at the end.
+        store_path (string, optional): path to the feature store shared
+            among data sizes. Unnormalized features of each audio file are
+            saved there once and reused by later passes and data sizes.
+        stats_sample_rate (float, optional): the rate of files sampled per
+            gender to compute statistics over the training set. Ignored if
+            normalize is speaker.
+        stats_max_frames (int, optional): the maximum number of frames per
+            gender to compute statistics. Ignored if normalize is speaker.
+        online_window (int, optional): the number of frames to compute
+            mean & std if normalize is online
+        transport (Transport, optional): if given, statistics over the
+            training set are summed over all shards of the training set
+            through it before features are normalized
+        stack_frames (int, optional): the number of frames to stack into
+            one frame after normalization
+        skip_frames (int, optional): the number of frames to skip. The
+            number of frames is reduced to 1 / skip_frames.
+        precision (string, optional): the precision to save features in,
+            float32 or float16 or int16 or int8. Integers cover +-4 std of
+            features over the training set per dimension with equal steps. The
+            error per dimension is saved in quantization.npz.
     Returns:
         global_mean_male (np.ndarray): global mean of male over the
             training set
@@ -65,48 +112,104 @@ def read_audio(audio_paths, speaker_dict, tool, config, normalize, is_training,
             key => utterance name
             value => the number of frames
     """
-    if not is_training:
+    # NOTE: statistics over the training set are needed to normalize
+    # features, and to store them as integers
+    need_statistics = normalize != 'no' or precision in ['int16', 'int8']
+    if not is_training and need_statistics:
         if global_mean_male is None or global_mean_female is None:
             raise ValueError('Set mean & std computed in the training set.')
-    if normalize not in ['global', 'speaker', 'utterance', 'no']:
+    if normalize not in ['global', 'speaker', 'utterance', 'online', 'no']:
         raise ValueError(
-            'normalize must be "utterance" or "speaker" or "global" or "no".')
+            'normalize must be "utterance" or "speaker" or "global" or "online" or "no".')
+    if (stack_frames > 1 or skip_frames > 1) and normalize == 'no':
+        raise ValueError('Frames are stacked after normalization. Set '
+                         'normalize except no to stack frames.')
+    if precision not in PRECISIONS:
+        raise ValueError(
+            'precision must be "float32" or "float16" or "int16" or "int8".')
+    if save_format == 'htk' and precision in ['float16', 'int8']:
+        raise ValueError('HTK files are saved as float32 or int16.')
     if tool not in ['htk', 'python_speech_features', 'librosa']:
         raise TypeError(
             'tool must be "htk" or "python_speech_features"' +
             ' or "librosa".')
 
     audio_path_list_male, audio_path_list_female = [], []
+    ledger = None
+    if save_path is not None:
+        if is_training:
+            config_hash = make_feature_hash(tool, config, normalize)
+            if stats_sample_rate < 1 or stats_max_frames is not None:
+                config_hash = make_config_hash(
+                    config_hash, stats_sample_rate, stats_max_frames)
+        else:
+            config_hash = make_feature_hash(
+                tool, config, normalize, global_mean_male, global_std_male,
+                global_mean_female, global_std_female)
+        if stack_frames > 1 or skip_frames > 1:
+            config_hash = make_config_hash(
+                config_hash, stack_frames, skip_frames)
+        if precision != 'float32':
+            config_hash = make_config_hash(config_hash, precision)
+        ledger = Ledger(save_path, save_format, config_hash)
+
     total_frame_num_male, total_frame_num_female = 0, 0
     total_frame_num_dict = {}
     speaker_mean_dict = {}
 
     # NOTE: 講演ごとに異なるspeakerとみなす
 
+    executor = ParallelExecutor(num_workers=num_workers,
+                                initializer=init_feature_worker,
+                                initargs=(tool, config),
+                                slot_bytes=RECORDING_SLOT_BYTES)
+    # NOTE: features are handed over from workers through shared memory
+
     # Loop 1: Computing global mean and statistics
-    if is_training and normalize != 'no':
+    if is_training and need_statistics:
         print('=====> Reading audio files...')
-        for i, audio_path in enumerate(tqdm(audio_paths)):
+        # NOTE: statistics are computed from files sampled per gender. Each
+        # speaker has only one file, so all files are used for speaker
+        # normalization.
+        if normalize == 'speaker':
+            sampler = StatisticsSampler(audio_paths,
+                                        group_func=lambda p: _speaker(p)[3])
+        else:
+            sampler = StatisticsSampler(audio_paths,
+                                        group_func=lambda p: _speaker(p)[3],
+                                        sample_rate=stats_sample_rate,
+                                        max_frames=stats_max_frames,
+                                        frame_func=lambda p: read_frame_num(
+                                            p, tool, config))
+        segment_args = []
+        for audio_path in sampler.items:
             speaker = basename(audio_path).split('.')[0]
-
+            segment_args.append(
+                (audio_path, speaker, speaker_dict[speaker], None))
+        for (audio_path, speaker, _, _), outputs in executor.imap(
+                Segmenter(is_training=True, sil_duration=0, tool=tool,
+                          config=config, keep_features=False,
+                          store_path=store_path, dtype=dtype),
+                segment_args):
+            if sampler.is_full():
+                break
+            if not sampler.is_sampled(audio_path):
+                continue
             # Divide each audio file into utterances
-            _, input_utt_sum, speaker_mean, _, total_frame_num_speaker = segment(
-                audio_path,
-                speaker,
-                speaker_dict[speaker],
-                is_training=True,
-                sil_duration=0,
-                tool=tool,
-                config=config)
-
-            if i == 0:
+            _, input_utt_sum, speaker_mean, _, total_frame_num_speaker = outputs[:5]
+            sampler.add(audio_path, input_utt_sum, total_frame_num_speaker)
+
+            if global_mean_male is None:
                 # Initialize global statistics
                 feature_dim = input_utt_sum.shape[0]
-                global_mean_male = np.zeros((feature_dim,), dtype=dtype)
+                global_mean_male = np.zeros(
+                    (feature_dim,), dtype=ACCUMULATOR_DTYPE)
                 global_mean_female = np.zeros(
-                    (feature_dim,), dtype=dtype)
-                global_std_male = np.zeros((feature_dim,), dtype=dtype)
-                global_std_female = np.zeros((feature_dim,), dtype=dtype)
+                    (feature_dim,), dtype=ACCUMULATOR_DTYPE)
+                global_std_male = np.zeros(
+                    (feature_dim,), dtype=ACCUMULATOR_DTYPE)
+                global_std_female = np.zeros(
+                    (feature_dim,), dtype=ACCUMULATOR_DTYPE)
 
             # For computing global mean
             if speaker[3] == 'M':
@@ -127,41 +230,68 @@ def read_audio(audio_paths, speaker_dict, tool, config, normalize, is_training,
                 # NOTE: speaker mean is already computed
 
         print('=====> Computing global mean & stddev...')
+        if transport is not None:
+            # Sum statistics over all shards
+            (global_mean_male, total_frame_num_male, global_mean_female,
+             total_frame_num_female) = allreduce_sum(
+                transport, [global_mean_male, total_frame_num_male,
+                            global_mean_female, total_frame_num_female],
+                tag='mean', dtype=ACCUMULATOR_DTYPE)
+            if global_std_male is None:
+                # NOTE: no files in this shard
+                global_std_male = np.zeros_like(global_mean_male)
+                global_std_female = np.zeros_like(global_mean_female)
         # Compute global mean per gender
         global_mean_male /= total_frame_num_male
         global_mean_female /= total_frame_num_female
 
-        for audio_path in tqdm(audio_paths):
-            speaker = basename(audio_path).split('.')[0]
+        used_items = set(sampler.used_items)
+        segment_args = [segment_arg for segment_arg in segment_args
+                        if segment_arg[0] in used_items]
 
+        for (audio_path, speaker, _, _), outputs in executor.imap(
+                Segmenter(is_training=True, sil_duration=0, tool=tool,
+                          config=config, store_path=store_path, dtype=dtype),
+                segment_args):
             # Divide each audio into utterances
-            input_data_dict_speaker, _, _, _, _ = segment(
-                audio_path,
-                speaker,
-                speaker_dict[speaker],
-                is_training=True,
-                sil_duration=0,
-                tool=tool,
-                config=config)
+            input_data_dict_speaker = outputs[0]
 
             # For computing global stddev
             if speaker[3] == 'M':
                 for input_utt in input_data_dict_speaker.values():
-                    global_std_male += np.sum(
-                        np.abs(input_utt - global_mean_male) ** 2, axis=0)
+                    global_std_male += sum_squared_deviations(
+                        input_utt, global_mean_male)
             elif speaker[3] == 'F':
                 for input_utt in input_data_dict_speaker.values():
-                    global_std_female += np.sum(
-                        np.abs(input_utt - global_mean_female) ** 2, axis=0)
+                    global_std_female += sum_squared_deviations(
+                        input_utt, global_mean_female)
             else:
                 raise ValueError
 
+        if transport is not None:
+            global_std_male, global_std_female = allreduce_sum(
+                transport, [global_std_male, global_std_female], tag='std',
+                dtype=ACCUMULATOR_DTYPE)
         # Compute global stddev per gender
         global_std_male = np.sqrt(
             global_std_male / (total_frame_num_male - 1))
         global_std_female = np.sqrt(
             global_std_female / (total_frame_num_female - 1))
 
+        if sampler.sampled:
+            sampler.report(
+                std_func=lambda group: global_std_male if group == 'M'
+                else global_std_female,
+                save_path=None if save_path is None else join(
+                    save_path, 'statistics_ci.npz'))
+
+        # NOTE: statistics are accumulated in float64, and features are
+        # normalized in dtype
+        global_mean_male = global_mean_male.astype(dtype)
+        global_mean_female = global_mean_female.astype(dtype)
+        global_std_male = global_std_male.astype(dtype)
+        global_std_female = global_std_female.astype(dtype)
+
         if save_path is not None:
             # Save global mean & std per gender
             np.save(join(save_path, 'global_mean_male.npy'),
@@ -173,34 +303,80 @@ def read_audio(audio_paths, speaker_dict, tool, config, normalize, is_training,
             np.save(join(save_path, 'global_std_female.npy'),
                     global_std_female)
 
+    quantizer = None
+    if save_path is not None and precision == 'float16':
+        quantizer = Quantizer(precision)
+    elif save_path is not None and precision != 'float32':
+        if normalize == 'no':
+            # NOTE: unnormalized features of both genders are stored in the
+            # range over the training set
+            quantizer = standard_quantizer(
+                precision, [global_mean_male, global_mean_female],
+                [global_std_male, global_std_female])
+        else:
+            # NOTE: features normalized by the statistics have zero mean
+            # and unit variance
+            feature_dim = global_mean_male.shape[0] * stack_frames
+            quantizer = standard_quantizer(
+                precision, np.zeros(feature_dim), np.ones(feature_dim))
+
     # Loop 2: Normalization and Saving
     print('=====> Normalization...')
     frame_num_dict = {}
+    # NOTE: files are written in background threads
+    writer = AsyncWriter()
     sampPeriod, parmKind = None, None
-    for audio_path in tqdm(audio_paths):
+    statistics = None
+    if is_training and normalize == 'no' and save_path is not None:
+        # NOTE: statistics need all utterances including saved ones
+        statistics = Statistics(key_funcs={
+            'gender': lambda speaker: speaker[3],
+            'speaker': lambda speaker: speaker})
+    segment_args = []
+    for audio_path in audio_paths:
         speaker = basename(audio_path).split('.')[0]
+        if ledger is not None and statistics is None and all(
+                ledger.is_done(speaker + '_' + utt_index)
+                for utt_index in speaker_dict[speaker].keys()):
+            continue
+            # NOTE: files saved by an interrupted run are skipped
 
         if normalize == 'speaker' and is_training:
+            if speaker not in speaker_mean_dict.keys():
+                continue
+                # NOTE: files failed in Loop 1 are skipped
             speaker_mean = speaker_mean_dict[speaker]
         else:
             speaker_mean = None
+        segment_args.append(
+            (audio_path, speaker, speaker_dict[speaker], speaker_mean))
+        # NOTE: speaker_mean is used to compute speaker sttdev
 
+    for (audio_path, speaker, _, _), outputs in executor.imap(
+            Segmenter(is_training=is_training, sil_duration=0, tool=tool,
+                      config=config, store_path=store_path, dtype=dtype),
+            segment_args):
         # Divide each audio into utterances
-        input_data_dict_speaker, _, speaker_mean, speaker_std, _ = segment(
-            audio_path,
-            speaker,
-            speaker_dict[speaker],
-            is_training=is_training,
-            sil_duration=0,
-            tool=tool,
-            config=config,
-            mean=speaker_mean)  # for compute speaker sttdev
+        input_data_dict_speaker, _, speaker_mean, speaker_std, _ = outputs[:5]
         # NOTE: input_data_dict_speaker have been not normalized yet
 
         for utt_index, input_utt in input_data_dict_speaker.items():
+            if statistics is not None:
+                statistics.add(input_utt, speaker)
+            if ledger is not None and ledger.is_done(speaker + '_' + utt_index):
+                continue
 
             if normalize == 'no':
                 pass
+            elif normalize == 'online':
+                # Normalize by mean & std over the past frames
+                if speaker[3] == 'M':
+                    prior_mean, prior_std = global_mean_male, global_std_male
+                else:
+                    prior_mean, prior_std = global_mean_female, global_std_female
+                input_utt = online_cmvn(
+                    input_utt, window=online_window, prior_mean=prior_mean,
+                    prior_std=prior_std, dtype=dtype)
             elif normalize == 'global' or not is_training:
                 # Normalize by mean & std over the training set per gender
                 if speaker[3] == 'M':
@@ -216,12 +392,20 @@ def read_audio(audio_paths, speaker_dict, tool, config, normalize, is_training,
                 input_utt = (input_utt - speaker_mean) / speaker_std
             elif normalize == 'utterance':
                 # Normalize by mean & std per utterance
-                utt_mean = np.mean(input_utt, axis=0, dtype=dtype)
-                utt_std = np.std(input_utt, axis=0, dtype=dtype)
+                utt_mean = np.mean(input_utt, axis=0,
+                                   dtype=ACCUMULATOR_DTYPE).astype(dtype)
+                utt_std = np.std(input_utt, axis=0,
+                                 dtype=ACCUMULATOR_DTYPE).astype(dtype)
                 input_utt = (input_utt - utt_mean) / utt_std
             else:
                 raise ValueError
 
+            check_dtype(input_utt, dtype, 'normalization')
+
+            if stack_frames > 1 or skip_frames > 1:
+                # Stack frames after normalization
+                input_utt = stack_frame(input_utt, stack_frames, skip_frames)
+
             frame_num_dict[speaker + '_' + utt_index] = input_utt.shape[0]
 
             if save_path is not None:
@@ -229,22 +413,70 @@ def read_audio(audio_paths, speaker_dict, tool, config, normalize, is_training,
                 if save_format == 'numpy':
                     input_data_save_path = mkdir_join(
                         save_path, speaker, speaker + '_' + utt_index + '.npy')
-                    np.save(input_data_save_path, input_utt)
-                elif save_format == 'htk':
-                    if sampPeriod is None:
-                        _, sampPeriod, parmKind = read(audio_path)
-                    write(input_utt,
-                          htk_path=mkdir_join(
-                              save_path, speaker, speaker + '_' + utt_index + '.htk'),
-                          sampPeriod=sampPeriod,
-                          parmKind=parmKind)
+                    htk_header = (None, None)
                 else:
-                    raise ValueError('save_format is numpy or htk.')
+                    if sampPeriod is None:
+                        # NOTE: read the header only, not features
+                        _, sampPeriod, _, parmKind = read_header(audio_path)
+                    htk_header = (sampPeriod * skip_frames, parmKind)
+                    input_data_save_path = mkdir_join(
+                        save_path, speaker, speaker + '_' + utt_index + '.htk')
+                writer.submit(ledger.save, speaker + '_' + utt_index,
+                              input_data_save_path, input_utt, *htk_header,
+                              quantizer=quantizer)
+
+    writer.close()
+    if quantizer is not None:
+        save_quantizer(quantizer, save_path, ledger.config_hash)
+
+    if statistics is not None:
+        statistics.save(join(save_path, STATISTICS_NAME))
 
     if save_path is not None:
+        # Rebuild the frame number dictionary including the interrupted run
+        frame_num_dict = ledger.frame_num_dict()
+
         # Save the frame number dictionary
         with open(join(save_path, 'frame_num.pickle'), 'wb') as f:
             pickle.dump(frame_num_dict, f)
 
+    executor.report(save_path=None if save_path is None else join(
+        save_path, 'failed_files.txt'))
+
     return (global_mean_male, global_mean_female,
             global_std_male, global_std_female, frame_num_dict)
+
+
+def make_frame_num_dict(audio_paths, speaker_dict, tool, config,
+                        skip_frames=1):
+    """Count frames of each utterance from headers of audio files. The
+       result is the same as frame_num_dict of `read_audio`, but it is
+       available before features are extracted.
+    Args:
+        audio_paths (list): paths to HTK or WAV files
+        speaker_dict (dict): dictionary of speakers
+            key (string) => speaker
+            value (dict) => dictionary of utterance information of each speaker
+        tool (string): htk or python_speech_features or librosa
+        config (dict): a configuration for feature extraction
+        skip_frames (int, optional): the number of frames to skip in
+            `read_audio`
+    Returns:
+        frame_num_dict (dict):
+            key => speaker_utt_index
+            value => the number of frames
+    """
+    frame_num_dict = {}
+    for audio_path in audio_paths:
+        speaker = _speaker(audio_path)
+        utt_frame_nums = count_utterance_frames(
+            read_frame_num(audio_path, tool, config), speaker_dict[speaker],
+            sil_duration=0)
+        for utt_index, frame_num in utt_frame_nums.items():
+            frame_num_dict[speaker + '_' + utt_index] = stacked_frame_num(
+                frame_num, skip_frames)
+    return frame_num_dict
+
+
+def _speaker(audio_path):
+    return basename(audio_path).split('.')[0]
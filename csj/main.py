@@ -9,8 +9,9 @@ from __future__ import absolute_import
 from __future__ import division
 from __future__ import print_function
 
-from os.path import join, isfile
+from os.path import join, isfile, basename
 import sys
+from functools import partial
 import argparse
 from tqdm import tqdm
 import numpy as np
@@ -22,8 +23,17 @@ from csj.path import Path
 from csj.input_data import read_audio
 from csj.labels.transcript import read_sdb
 from utils.util import mkdir_join
-from utils.inputs.wav_split import split_wav
+from utils.inputs.wav_split import split_wav, make_wav_manifest
+from utils.inputs.wav_split import WavManifest, MANIFEST_NAME
 from utils.dataset import add_element
+from utils.pipeline import Pipeline
+from utils.shard import prepare_shard, reduce_shards, shard_path
+from utils.distributed import make_transport
+from utils.inputs.frame_num import read_frame_num
+from utils.inputs.feature_store import FeatureStore
+from utils.inputs.ledger import FEATURE_VERSIONS, make_feature_hash
+from utils.inputs.feature_extraction import fill_feature_store
+from utils.inputs.feature_extraction import parse_feature_specs
 
 parser = argparse.ArgumentParser()
 parser.add_argument('--data_path', type=str, help='path to CSJ dataset')
@@ -37,7 +47,9 @@ parser.add_argument('--tool', type=str,
                     choices=['htk', 'python_speech_features', 'librosa'])
 parser.add_argument('--htk_save_path', type=str, help='path to save features')
 parser.add_argument('--normalize', type=str,
-                    choices=['global', 'speaker', 'utterance', 'no'])
+                    choices=['global', 'speaker', 'utterance', 'online', 'no'],
+                    help='If no, unnormalized features are saved with ' +
+                    'statistics to normalize them on load in any mode.')
 parser.add_argument('--save_format', type=str, choices=['numpy', 'htk', 'wav'])
 
 parser.add_argument('--feature_type', type=str, choices=['fbank', 'mfcc'])
@@ -50,15 +62,62 @@ parser.add_argument('--energy', type=int, help='if 1, add the energy feature')
 parser.add_argument('--delta', type=int, help='if 1, add the energy feature')
 parser.add_argument('--deltadelta', type=int,
                     help='if 1, double delta features are also extracted')
+parser.add_argument('--num_workers', type=int, default=1,
+                    help='the number of processes to extract features')
+parser.add_argument('--share_features', type=int, default=1,
+                    help='If 1, unnormalized features are extracted once ' +
+                    'into feature_save_path/raw and shared among data sizes.')
+parser.add_argument('--extra_features', type=str, default='',
+                    help='other kinds of features extracted in the same ' +
+                    'pass into feature_save_path/raw as feature_type:channels ' +
+                    'separated by commas (ex. fbank:80,mfcc:13). Later runs ' +
+                    'with them load features from there.')
+parser.add_argument('--stats_sample_rate', type=float, default=1.,
+                    help='the rate of files sampled to compute statistics ' +
+                    'over the training set')
+parser.add_argument('--stats_max_frames', type=int, default=0,
+                    help='the maximum number of frames per group to compute ' +
+                    'statistics. If 0, not bounded.')
 parser.add_argument('--subset', type=int,
                     help='If True, create small dataset.')
 parser.add_argument('--fullset', type=int,
                     help='If True, create full-size dataset.')
+parser.add_argument('--virtual_wav', type=int, default=0,
+                    help='If 1, save a manifest of utterances in WAV files ' +
+                    'instead of splitting them (save_format is wav).')
+parser.add_argument('--online_window', type=int, default=600,
+                    help='the number of past frames to compute mean & ' +
+                    'std if normalize is online')
+parser.add_argument('--stack_frames', type=int, default=1,
+                    help='the number of frames to stack into one frame')
+parser.add_argument('--skip_frames', type=int, default=1,
+                    help='the number of frames to skip. The frame rate is ' +
+                    'reduced to 1 / skip_frames.')
+parser.add_argument('--precision', type=str, default='float32',
+                    choices=['float32', 'float16', 'int16', 'int8'],
+                    help='the precision to save features in. HTK files ' +
+                    'are saved as float32 or int16 (compressed).')
+parser.add_argument('--shard_num', type=int, default=1,
+                    help='the number of shards to split the training set ' +
+                    'into to extract features on several nodes')
+parser.add_argument('--shard_index', type=int, default=-1,
+                    help='If 0 or more, extract features of this shard of ' +
+                    'the training set only. If -1, outputs of all shards ' +
+                    'are merged and the rest of the dataset is made.')
+parser.add_argument('--shard_transport', type=str, default='',
+                    choices=['', 'dir', 'tcp'],
+                    help='how shards exchange statistics over the training ' +
+                    'set to normalize features (through a shared directory ' +
+                    'or TCP). If empty, statistics are not exchanged.')
+parser.add_argument('--shard_address', type=str, default='',
+                    help='path to the shared directory (dir) or host:port ' +
+                    'of shard 0 (tcp)')
 
 args = parser.parse_args()
 path = Path(data_path=args.data_path,
             config_path='./config',
-            htk_save_path=args.htk_save_path)
+            htk_save_path=args.htk_save_path,
+            catalog_path=join(args.dataset_save_path, '.catalog'))
 
 CONFIG = {
     'feature_type': args.feature_type,
@@ -73,257 +132,513 @@ CONFIG = {
 
 if args.save_format == 'htk':
     assert args.tool == 'htk'
+if (args.stack_frames > 1 or args.skip_frames > 1) and \
+        (args.save_format == 'wav' or args.normalize == 'no'):
+    raise ValueError('Frames are stacked after normalization. Set '
+                     'save_format numpy or htk and normalize except no.')
+if args.precision != 'float32' and args.save_format == 'wav':
+    raise ValueError('Only features are saved with reduced precision.')
+if args.shard_num > 1 and args.save_format == 'wav':
+    raise ValueError('Only feature extraction is split into shards.')
+if args.shard_num > 1 and args.shard_transport == '' and \
+        (args.normalize != 'no' or args.precision in ['int16', 'int8']):
+    # NOTE: global mean & std are saved for the evaluation sets even when
+    # normalizing per utterance
+    raise ValueError('Statistics over the whole training set are needed to '
+                     'normalize features or to store them as integers. Set '
+                     'shard_transport, or set normalize no and precision '
+                     'float32 or float16.')
+EXTRA_CONFIGS = parse_feature_specs(args.extra_features, CONFIG)
+if len(EXTRA_CONFIGS) > 0 and \
+        (args.tool == 'htk' or not bool(args.share_features)):
+    raise ValueError('Other kinds of features are saved in the shared '
+                     'feature store. Set tool python_speech_features or '
+                     'librosa and share_features 1.')
+
+DATASET_NAMES = ['kanji', 'kanji_divide', 'kana', 'kana_divide', 'phone',
+                 'phone_divide', 'word_freq1', 'word_freq5', 'word_freq10',
+                 'word_freq15']
 
 
 def main(data_size):
 
-    speaker_dict_dict = {}  # dict of speaker_dict
+    cache_path = mkdir_join(
+        args.dataset_save_path, args.save_format, data_size, '.cache')
+    if args.shard_index >= 0:
+        cache_path = mkdir_join(cache_path, 'shard' + str(args.shard_index))
+    pipeline = Pipeline(cache_path=cache_path)
+    extract_config = {
+        'tool': args.tool,
+        'version': FEATURE_VERSIONS[args.tool],
+        'save_format': args.save_format,
+        'feature_save_path': args.feature_save_path,
+        'config': CONFIG,
+        'share_features': args.share_features
+    }
+    if len(EXTRA_CONFIGS) > 0:
+        extract_config['extra_features'] = args.extra_features
+    feature_config = {
+        'tool': args.tool,
+        'version': FEATURE_VERSIONS[args.tool],
+        'normalize': args.normalize,
+        'save_format': args.save_format,
+        'feature_save_path': args.feature_save_path,
+        'config': CONFIG,
+        'stats_sample_rate': args.stats_sample_rate,
+        'stats_max_frames': args.stats_max_frames,
+        'online_window': args.online_window,
+        'virtual_wav': args.virtual_wav
+    }
+    if args.stack_frames > 1 or args.skip_frames > 1:
+        feature_config['stack'] = [args.stack_frames, args.skip_frames]
+    if args.precision != 'float32':
+        feature_config['precision'] = args.precision
+    if len(EXTRA_CONFIGS) > 0:
+        feature_config['extra_features'] = args.extra_features
+    if args.shard_num > 1:
+        extract_config['shard'] = [args.shard_num, args.shard_index]
+        feature_config['shard'] = [args.shard_num, args.shard_index]
+    store_outputs = []
+    if args.save_format in ['numpy', 'htk'] and args.tool != 'htk' and \
+            bool(args.share_features):
+        store_outputs = [
+            FeatureStore(join(args.feature_save_path, 'raw'), args.tool,
+                         config).store_path
+            for config in [CONFIG] + EXTRA_CONFIGS]
     for data_type in ['train', 'eval1', 'eval2', 'eval3']:
-        print('=' * 50)
-        print(' ' * 20 + data_type + ' (' + data_size + ')' + ' ' * 20)
-        print('=' * 50)
-
-        ########################################
-        # labels
-        ########################################
-        if data_type == 'train':
-            label_paths = path.trans(data_type='train_' + data_size)
+        pipeline.add('path_' + data_type, partial(scan, data_size, data_type),
+                     always=True)
+        vocab_inputs = [] if data_type == 'train' else ['label_train']
+        pipeline.add('label_' + data_type,
+                     partial(make_label, data_size, data_type),
+                     inputs=['path_' + data_type] + vocab_inputs)
+        # NOTE: unnormalized features are extracted once, and normalized
+        # again when only the normalization changes
+        pipeline.add('extract_' + data_type,
+                     partial(extract, data_size, data_type),
+                     inputs=['path_' + data_type], config=extract_config,
+                     outputs=store_outputs)
+        save_path = join(args.feature_save_path, args.save_format,
+                         data_size, data_type)
+        if data_type == 'train' and args.shard_index >= 0:
+            save_path = shard_path(save_path, args.shard_index)
+        stat_inputs = [] if data_type == 'train' else ['input_train']
+        pipeline.add('input_' + data_type,
+                     partial(make_input, data_size, data_type),
+                     inputs=['path_' + data_type, 'label_' + data_type,
+                             'extract_' + data_type] + stat_inputs,
+                     config=feature_config,
+                     outputs=[join(save_path, 'complete.txt')])
+        pipeline.add('dataset_' + data_type,
+                     partial(make_dataset, data_size, data_type),
+                     inputs=['label_' + data_type, 'input_' + data_type],
+                     config={'dataset_save_path': args.dataset_save_path},
+                     outputs=[join(args.dataset_save_path, args.save_format,
+                                   data_size, data_type, name + '.csv')
+                              for name in DATASET_NAMES])
+    if args.shard_index >= 0:
+        # NOTE: the other stages are run after outputs of all shards are
+        # merged
+        pipeline.run('input_train')
+        return
+    pipeline.run()
+
+
+def scan(data_size, data_type):
+    """Collect paths to audio and transcript files.
+    Args:
+        data_size (string): subset or fullset
+        data_type (string): train or eval1 or eval2 or eval3
+    Returns:
+        paths (dict): lists of paths
+    """
+    paths = {}
+    if data_type == 'train':
+        paths['trans'] = path.trans(data_type='train_' + data_size)
+        if args.save_format == 'wav':
+            paths['audio'] = path.wav(corpus='train' + data_size)
+        elif args.tool == 'htk':
+            paths['audio'] = path.htk(data_type='train_' + data_size)
         else:
-            label_paths = path.trans(data_type=data_type)
-        save_vocab_file = True if data_type == 'train' else False
-        is_test = True if 'eval' in data_type else False
-
-        print('=> Processing transcripts...')
-        speaker_dict_dict[data_type] = read_sdb(
-            label_paths=label_paths,
-            data_size=data_size,
-            vocab_file_save_path=mkdir_join('./config', 'vocab_files'),
-            save_vocab_file=save_vocab_file,
-            is_test=is_test,
-            data_type=data_type)
-
-        ########################################
-        # inputs
-        ########################################
-        print('\n=> Processing input data...')
-        input_save_path = mkdir_join(
-            args.feature_save_path, args.save_format, data_size)
-        if isfile(join(input_save_path, data_type, 'complete.txt')):
-            print('Already exists.')
+            paths['audio'] = path.wav(data_type='train_' + data_size)
+    else:
+        paths['trans'] = path.trans(data_type=data_type)
+        if args.save_format == 'wav':
+            paths['audio'] = path.wav(corpus=data_type)
+        elif args.tool == 'htk':
+            paths['audio'] = path.htk(data_type=data_type)
         else:
-            if args.save_format == 'wav':
-                ########################################
-                # Split WAV files per utterance
-                ########################################
-                if data_type == 'train':
-                    wav_paths = path.wav(corpus='train' + data_size)
-                else:
-                    wav_paths = path.wav(corpus=data_type)
-
-                split_wav(wav_paths=wav_paths,
-                          speaker_dict=speaker_dict_dict[data_type],
-                          save_path=mkdir_join(input_save_path, data_type))
-                # NOTE: ex.) save_path:
-                # csj/feature/save_format/data_size/data_type/speaker/utt_name.npy
-
-            elif args.save_format in ['numpy', 'htk']:
-                if data_type == 'train':
-                    if args.tool == 'htk':
-                        audio_paths = path.htk(data_type='train_' + data_size)
-                    else:
-                        audio_paths = path.wav(data_type='train_' + data_size)
-                    is_training = True
-                    global_mean_male, global_std_male, global_mean_female, global_std_female = None, None, None, None
-                else:
-                    if args.tool == 'htk':
-                        audio_paths = path.htk(data_type=data_type)
-                    else:
-                        audio_paths = path.wav(data_type=data_type)
-                    is_training = False
-
-                    # Load statistics over train dataset
-                    global_mean_male = np.load(
-                        join(input_save_path, 'train/global_mean_male.npy'))
-                    global_std_male = np.load(
-                        join(input_save_path, 'train/global_std_male.npy'))
-                    global_mean_female = np.load(
-                        join(input_save_path, 'train/global_mean_female.npy'))
-                    global_std_female = np.load(
-                        join(input_save_path, 'train/global_std_female.npy'))
-
-                read_audio(audio_paths=audio_paths,
-                           speaker_dict=speaker_dict_dict[data_type],
-                           tool=args.tool,
-                           config=CONFIG,
-                           normalize=args.normalize,
-                           is_training=is_training,
-                           save_path=mkdir_join(input_save_path, data_type),
-                           save_format=args.save_format,
-                           global_mean_male=global_mean_male,
-                           global_std_male=global_std_male,
-                           global_mean_female=global_mean_female,
-                           global_std_female=global_std_female)
-                # NOTE: ex.) save_path:
-                # csj/feature/save_format/data_size/data_type/speaker/*.npy
-
-            # Make a confirmation file to prove that dataset was saved
-            # correctly
-            with open(join(input_save_path, data_type, 'complete.txt'), 'w') as f:
-                f.write('')
-
+            paths['audio'] = path.wav(data_type=data_type)
+    return paths
+
+
+def make_label(data_size, data_type, paths, *unused):
+    """
+    Args:
+        data_size (string): subset or fullset
+        data_type (string): train or eval1 or eval2 or eval3
+        paths (dict): the result of `scan`
+    Returns:
+        speaker_dict (dict)
+    """
+    print('=' * 50)
+    print(' ' * 20 + data_type + ' (' + data_size + ')' + ' ' * 20)
+    print('=' * 50)
+
+    ########################################
+    # labels
+    ########################################
+    save_vocab_file = True if data_type == 'train' else False
+    is_test = True if 'eval' in data_type else False
+
+    print('=> Processing transcripts...')
+    return read_sdb(
+        label_paths=paths['trans'],
+        data_size=data_size,
+        vocab_file_save_path=mkdir_join('./config', 'vocab_files'),
+        save_vocab_file=save_vocab_file,
+        is_test=is_test,
+        data_type=data_type)
+
+
+def split_shard(audio_paths, save_path):
+    """
+    Args:
+        audio_paths (list): paths to audio files of the training set
+        save_path (string): path to the directory of the whole outputs
+    Returns:
+        audio_paths (list): files of the shard
+        save_path (string): path to the directory of outputs of the shard
+    """
+    # NOTE: speakers are not split into shards
+    return prepare_shard(
+        audio_paths, save_path, args.shard_num, args.shard_index,
+        group_func=lambda p: basename(p).split('.')[0],
+        weight_func=lambda p: read_frame_num(p, args.tool, CONFIG))
+
+
+def extract(data_size, data_type, paths):
+    """Extract unnormalized features of wav files (and the other kinds of
+       features) into the feature store shared among data sizes.
+    Args:
+        data_size (string): subset or fullset
+        data_type (string): train or eval1 or eval2 or eval3
+        paths (dict): the result of `scan`
+    Returns:
+        store_path (string): path to the feature store (None if features
+            are not shared)
+    """
+    if args.save_format not in ['numpy', 'htk'] or args.tool == 'htk' or \
+            not bool(args.share_features):
+        return None
+    store_path = mkdir_join(args.feature_save_path, 'raw')
+
+    audio_paths = paths['audio']
+    if data_type == 'train' and args.shard_num > 1:
+        if args.shard_index < 0:
+            # NOTE: features have been extracted by shards
+            return store_path
+        audio_paths, _ = split_shard(
+            audio_paths, mkdir_join(args.feature_save_path, args.save_format,
+                                    data_size, data_type))
+
+    fill_feature_store(
+        audio_paths, args.tool, [CONFIG] + EXTRA_CONFIGS, store_path,
+        num_workers=args.num_workers)
+    return store_path
+
+
+def make_input(data_size, data_type, paths, speaker_dict, store_path,
+               *unused):
+    """Read htk or wav files, and save input data and frame num dict.
+    Args:
+        data_size (string): subset or fullset
+        data_type (string): train or eval1 or eval2 or eval3
+        paths (dict): the result of `scan`
+        speaker_dict (dict): the result of `make_label`
+        store_path (string): the result of `extract`
+    Returns:
+        frame_num_dict (dict)
+    """
+    ########################################
+    # inputs
+    ########################################
+    print('\n=> Processing input data...')
+    input_save_path = mkdir_join(
+        args.feature_save_path, args.save_format, data_size)
+    save_path = mkdir_join(input_save_path, data_type)
+    frame_num_dict = None
+    if args.save_format == 'wav':
         ########################################
-        # dataset (csv)
+        # Split WAV files per utterance
         ########################################
-        print('\n=> Saving dataset files...')
-        dataset_save_path = mkdir_join(
-            args.dataset_save_path, args.save_format, data_size, data_type)
-
-        df_columns = ['frame_num', 'input_path', 'transcript']
-        df_kanji = pd.DataFrame([], columns=df_columns)
-        df_kanji_divide = pd.DataFrame([], columns=df_columns)
-        df_kana = pd.DataFrame([], columns=df_columns)
-        df_kana_divide = pd.DataFrame([], columns=df_columns)
-        df_phone = pd.DataFrame([], columns=df_columns)
-        df_phone_divide = pd.DataFrame([], columns=df_columns)
-        df_word_freq1 = pd.DataFrame([], columns=df_columns)
-        df_word_freq5 = pd.DataFrame([], columns=df_columns)
-        df_word_freq10 = pd.DataFrame([], columns=df_columns)
-        df_word_freq15 = pd.DataFrame([], columns=df_columns)
-
+        if bool(args.virtual_wav):
+            frame_num_dict = make_wav_manifest(
+                wav_paths=paths['audio'],
+                speaker_dict=speaker_dict,
+                save_path=mkdir_join(input_save_path, data_type))
+            # NOTE: ex.) manifest:
+            # csj/feature/save_format/data_size/data_type/wav_manifest.tsv
+        else:
+            split_wav(wav_paths=paths['audio'],
+                      speaker_dict=speaker_dict,
+                      save_path=mkdir_join(input_save_path, data_type),
+                      num_workers=args.num_workers)
+        # NOTE: ex.) save_path:
+        # csj/feature/save_format/data_size/data_type/speaker/utt_name.npy
+
+    elif args.save_format in ['numpy', 'htk']:
+        if data_type == 'train':
+            is_training = True
+            global_mean_male, global_std_male, global_mean_female, global_std_female = None, None, None, None
+        else:
+            is_training = False
+
+            if args.normalize == 'no' and \
+                    args.precision not in ['int16', 'int8']:
+                # NOTE: features are normalized on load
+                global_mean_male, global_std_male, global_mean_female, global_std_female = None, None, None, None
+            else:
+                # Load statistics over train dataset
+                global_mean_male = np.load(
+                    join(input_save_path, 'train/global_mean_male.npy'))
+                global_std_male = np.load(
+                    join(input_save_path, 'train/global_std_male.npy'))
+                global_mean_female = np.load(
+                    join(input_save_path, 'train/global_mean_female.npy'))
+                global_std_female = np.load(
+                    join(input_save_path, 'train/global_std_female.npy'))
+
+        audio_paths = paths['audio']
+        transport = None
+        if data_type == 'train' and args.shard_num > 1:
+            if args.shard_index < 0:
+                # Merge outputs of all shards
+                frame_num_dict = reduce_shards(save_path, args.shard_num)
+                with open(join(save_path, 'complete.txt'), 'w') as f:
+                    f.write('')
+                return frame_num_dict
+
+            audio_paths, save_path = split_shard(audio_paths, save_path)
+            if args.shard_transport != '':
+                # NOTE: payloads left by a run with another configuration
+                # or shards (ex. one which crashed) are not reduced
+                run_id = make_feature_hash(
+                    args.tool, CONFIG, args.normalize, args.precision,
+                    args.stats_sample_rate, args.stats_max_frames,
+                    args.shard_num, sorted(paths['audio']))
+                # NOTE: statistics are exchanged per data size
+                transport = make_transport(
+                    args.shard_transport,
+                    join(args.shard_address, data_size)
+                    if args.shard_transport == 'dir' else args.shard_address,
+                    args.shard_index, args.shard_num, run_id=run_id)
+
+        _, _, _, _, frame_num_dict = read_audio(
+            audio_paths=audio_paths,
+            speaker_dict=speaker_dict,
+            tool=args.tool,
+            config=CONFIG,
+            normalize=args.normalize,
+            is_training=is_training,
+            save_path=save_path,
+            save_format=args.save_format,
+            global_mean_male=global_mean_male,
+            global_std_male=global_std_male,
+            global_mean_female=global_mean_female,
+            global_std_female=global_std_female,
+            num_workers=args.num_workers,
+            store_path=store_path,
+            stats_sample_rate=args.stats_sample_rate,
+            stats_max_frames=args.stats_max_frames if args.stats_max_frames > 0 else None,
+            online_window=args.online_window,
+            transport=transport,
+            stack_frames=args.stack_frames,
+            skip_frames=args.skip_frames,
+            precision=args.precision)
+        # NOTE: ex.) save_path:
+        # csj/feature/save_format/data_size/data_type/speaker/*.npy
+
+    # Make a confirmation file to prove that dataset was saved
+    # correctly
+    with open(join(save_path, 'complete.txt'), 'w') as f:
+        f.write('')
+
+    return frame_num_dict
+
+
+def make_dataset(data_size, data_type, speaker_dict, frame_num_dict):
+    """Save dataset files.
+    Args:
+        data_size (string): subset or fullset
+        data_type (string): train or eval1 or eval2 or eval3
+        speaker_dict (dict): the result of `make_label`
+        frame_num_dict (dict): the result of `make_input`
+    """
+    input_save_path = mkdir_join(
+        args.feature_save_path, args.save_format, data_size)
+    if frame_num_dict is None:
         with open(join(input_save_path, data_type, 'frame_num.pickle'), 'rb') as f:
             frame_num_dict = pickle.load(f)
 
-        utt_count = 0
-        df_kanji_list, df_kanji_divide_list = [], []
-        df_kana_list,  df_kana_divide_list = [], []
-        df_phone_list, df_phone_divide_list = [], []
-        df_word_freq1_list, df_word_freq5_list = [], []
-        df_word_freq10_list, df_word_freq15_list = [], []
-        speaker_dict = speaker_dict_dict[data_type]
-        for speaker, utt_dict in tqdm(speaker_dict.items()):
-            for utt_index, utt_info in utt_dict.items():
-                kanji_indices, kanji_divide_indices = utt_info[2:4]
-                kana_indices, kana_divide_indices = utt_info[4:6]
-                phone_indices, phone_divide_indices = utt_info[6:8]
-                word_freq1_indices, word_freq5_indices = utt_info[8:10]
-                word_freq10_indices, word_freq15_indices = utt_info[10:12]
-
-                if args.save_format == 'numpy':
-                    input_utt_save_path = join(
-                        input_save_path, data_type, speaker, speaker + '_' + utt_index + '.npy')
-                elif args.save_format == 'htk':
-                    input_utt_save_path = join(
-                        input_save_path, data_type, speaker, speaker + '_' + utt_index + '.htk')
-                elif args.save_format == 'wav':
-                    input_utt_save_path = path.utt2wav(utt_index)
-                else:
-                    raise ValueError('save_format is numpy or htk or wav.')
-
+    ########################################
+    # dataset (csv)
+    ########################################
+    print('\n=> Saving dataset files...')
+    dataset_save_path = mkdir_join(
+        args.dataset_save_path, args.save_format, data_size, data_type)
+
+    df_columns = ['frame_num', 'input_path', 'transcript']
+    df_kanji = pd.DataFrame([], columns=df_columns)
+    df_kanji_divide = pd.DataFrame([], columns=df_columns)
+    df_kana = pd.DataFrame([], columns=df_columns)
+    df_kana_divide = pd.DataFrame([], columns=df_columns)
+    df_phone = pd.DataFrame([], columns=df_columns)
+    df_phone_divide = pd.DataFrame([], columns=df_columns)
+    df_word_freq1 = pd.DataFrame([], columns=df_columns)
+    df_word_freq5 = pd.DataFrame([], columns=df_columns)
+    df_word_freq10 = pd.DataFrame([], columns=df_columns)
+    df_word_freq15 = pd.DataFrame([], columns=df_columns)
+
+    manifest = None
+    if args.save_format == 'wav' and bool(args.virtual_wav):
+        manifest = WavManifest(
+            join(input_save_path, data_type, MANIFEST_NAME))
+
+    utt_count = 0
+    df_kanji_list, df_kanji_divide_list = [], []
+    df_kana_list,  df_kana_divide_list = [], []
+    df_phone_list, df_phone_divide_list = [], []
+    df_word_freq1_list, df_word_freq5_list = [], []
+    df_word_freq10_list, df_word_freq15_list = [], []
+    for speaker, utt_dict in tqdm(speaker_dict.items()):
+        for utt_index, utt_info in utt_dict.items():
+            kanji_indices, kanji_divide_indices = utt_info[2:4]
+            kana_indices, kana_divide_indices = utt_info[4:6]
+            phone_indices, phone_divide_indices = utt_info[6:8]
+            word_freq1_indices, word_freq5_indices = utt_info[8:10]
+            word_freq10_indices, word_freq15_indices = utt_info[10:12]
+
+            if args.save_format == 'numpy':
+                input_utt_save_path = join(
+                    input_save_path, data_type, speaker, speaker + '_' + utt_index + '.npy')
+            elif args.save_format == 'htk':
+                input_utt_save_path = join(
+                    input_save_path, data_type, speaker, speaker + '_' + utt_index + '.htk')
+            elif args.save_format == 'wav' and bool(args.virtual_wav):
+                input_utt_save_path = manifest.reference(
+                    speaker + '_' + utt_index)
+            elif args.save_format == 'wav':
+                input_utt_save_path = path.utt2wav(utt_index)
+            else:
+                raise ValueError('save_format is numpy or htk or wav.')
+
+            if manifest is None:
                 assert isfile(input_utt_save_path)
-                frame_num = frame_num_dict[speaker + '_' + utt_index]
-
-                df_kanji = add_element(
-                    df_kanji, [frame_num, input_utt_save_path, kanji_indices])
-                df_kanji_divide = add_element(
-                    df_kanji_divide, [frame_num, input_utt_save_path, kanji_divide_indices])
-                df_kana = add_element(
-                    df_kana, [frame_num, input_utt_save_path, kana_indices])
-                df_kana_divide = add_element(
-                    df_kana_divide, [frame_num, input_utt_save_path, kana_divide_indices])
-                df_phone = add_element(
-                    df_phone, [frame_num, input_utt_save_path, phone_indices])
-                df_phone_divide = add_element(
-                    df_phone_divide, [frame_num, input_utt_save_path, phone_divide_indices])
-                df_word_freq1 = add_element(
-                    df_word_freq1, [frame_num, input_utt_save_path, word_freq1_indices])
-                df_word_freq5 = add_element(
-                    df_word_freq5, [frame_num, input_utt_save_path, word_freq5_indices])
-                df_word_freq10 = add_element(
-                    df_word_freq10, [frame_num, input_utt_save_path, word_freq10_indices])
-                df_word_freq15 = add_element(
-                    df_word_freq15, [frame_num, input_utt_save_path, word_freq15_indices])
-                utt_count += 1
-
-                # Reset
-                if utt_count == 10000:
-                    df_kanji_list.append(df_kanji)
-                    df_kanji_divide_list.append(df_kanji_divide)
-                    df_kana_list.append(df_kana)
-                    df_kana_divide_list.append(df_kana_divide)
-                    df_phone_list.append(df_phone)
-                    df_phone_divide_list.append(df_phone_divide)
-                    df_word_freq1_list.append(df_word_freq1)
-                    df_word_freq5_list.append(df_word_freq5)
-                    df_word_freq10_list.append(df_word_freq10)
-                    df_word_freq15_list.append(df_word_freq15)
-
-                    df_kanji = pd.DataFrame([], columns=df_columns)
-                    df_kanji_divide = pd.DataFrame([], columns=df_columns)
-                    df_kana = pd.DataFrame([], columns=df_columns)
-                    df_kana_divide = pd.DataFrame([], columns=df_columns)
-                    df_phone = pd.DataFrame([], columns=df_columns)
-                    df_phone_divide = pd.DataFrame([], columns=df_columns)
-                    df_word_freq1 = pd.DataFrame([], columns=df_columns)
-                    df_word_freq5 = pd.DataFrame([], columns=df_columns)
-                    df_word_freq10 = pd.DataFrame([], columns=df_columns)
-                    df_word_freq15 = pd.DataFrame([], columns=df_columns)
-                    utt_count = 0
-
-        # Last dataframe
-        df_kanji_list.append(df_kanji)
-        df_kanji_divide_list.append(df_kanji_divide)
-        df_kana_list.append(df_kana)
-        df_kana_divide_list.append(df_kana_divide)
-        df_phone_list.append(df_phone)
-        df_phone_divide_list.append(df_phone_divide)
-        df_word_freq1_list.append(df_word_freq1)
-        df_word_freq5_list.append(df_word_freq5)
-        df_word_freq10_list.append(df_word_freq10)
-        df_word_freq15_list.append(df_word_freq15)
-
-        # Concatenate all dataframes
-        df_kanji = df_kanji_list[0]
-        df_kanji_divide = df_kanji_divide_list[0]
-        df_kana = df_kana_list[0]
-        df_kana_divide = df_kana_divide_list[0]
-        df_phone = df_phone_list[0]
-        df_phone_divide = df_phone_divide_list[0]
-        df_word_freq1 = df_word_freq1_list[0]
-        df_word_freq5 = df_word_freq5_list[0]
-        df_word_freq10 = df_word_freq10_list[0]
-        df_word_freq15 = df_word_freq15_list[0]
-
-        for df_i in df_kanji_list[1:]:
-            df_kanji = pd.concat([df_kanji, df_i], axis=0)
-        for df_i in df_kanji_divide_list[1:]:
-            df_kanji_divide = pd.concat([df_kanji_divide, df_i], axis=0)
-        for df_i in df_kana_list[1:]:
-            df_kana = pd.concat([df_kana, df_i], axis=0)
-        for df_i in df_kana_divide_list[1:]:
-            df_kana_divide = pd.concat([df_kana_divide, df_i], axis=0)
-        for df_i in df_phone_list[1:]:
-            df_phone = pd.concat([df_phone, df_i], axis=0)
-        for df_i in df_phone_divide_list[1:]:
-            df_phone_divide = pd.concat([df_phone_divide, df_i], axis=0)
-        for df_i in df_word_freq1_list[1:]:
-            df_word_freq1 = pd.concat([df_word_freq1, df_i], axis=0)
-        for df_i in df_word_freq5_list[1:]:
-            df_word_freq5 = pd.concat([df_word_freq5, df_i], axis=0)
-        for df_i in df_word_freq10_list[1:]:
-            df_word_freq10 = pd.concat([df_word_freq10, df_i], axis=0)
-        for df_i in df_word_freq15_list[1:]:
-            df_word_freq15 = pd.concat([df_word_freq15, df_i], axis=0)
-
-        df_kanji.to_csv(join(dataset_save_path, 'kanji.csv'))
-        df_kanji_divide.to_csv(join(dataset_save_path, 'kanji_divide.csv'))
-        df_kana.to_csv(join(dataset_save_path, 'kana.csv'))
-        df_kana_divide.to_csv(join(dataset_save_path, 'kana_divide.csv'))
-        df_phone.to_csv(join(dataset_save_path, 'phone.csv'))
-        df_phone_divide.to_csv(join(dataset_save_path, 'phone_divide.csv'))
-        df_word_freq1.to_csv(join(dataset_save_path, 'word_freq1.csv'))
-        df_word_freq5.to_csv(join(dataset_save_path, 'word_freq5.csv'))
-        df_word_freq10.to_csv(join(dataset_save_path, 'word_freq10.csv'))
-        df_word_freq15.to_csv(join(dataset_save_path, 'word_freq15.csv'))
+            frame_num = frame_num_dict[speaker + '_' + utt_index]
+
+            df_kanji = add_element(
+                df_kanji, [frame_num, input_utt_save_path, kanji_indices])
+            df_kanji_divide = add_element(
+                df_kanji_divide, [frame_num, input_utt_save_path, kanji_divide_indices])
+            df_kana = add_element(
+                df_kana, [frame_num, input_utt_save_path, kana_indices])
+            df_kana_divide = add_element(
+                df_kana_divide, [frame_num, input_utt_save_path, kana_divide_indices])
+            df_phone = add_element(
+                df_phone, [frame_num, input_utt_save_path, phone_indices])
+            df_phone_divide = add_element(
+                df_phone_divide, [frame_num, input_utt_save_path, phone_divide_indices])
+            df_word_freq1 = add_element(
+                df_word_freq1, [frame_num, input_utt_save_path, word_freq1_indices])
+            df_word_freq5 = add_element(
+                df_word_freq5, [frame_num, input_utt_save_path, word_freq5_indices])
+            df_word_freq10 = add_element(
+                df_word_freq10, [frame_num, input_utt_save_path, word_freq10_indices])
+            df_word_freq15 = add_element(
+                df_word_freq15, [frame_num, input_utt_save_path, word_freq15_indices])
+            utt_count += 1
+
+            # Reset
+            if utt_count == 10000:
+                df_kanji_list.append(df_kanji)
+                df_kanji_divide_list.append(df_kanji_divide)
+                df_kana_list.append(df_kana)
+                df_kana_divide_list.append(df_kana_divide)
+                df_phone_list.append(df_phone)
+                df_phone_divide_list.append(df_phone_divide)
+                df_word_freq1_list.append(df_word_freq1)
+                df_word_freq5_list.append(df_word_freq5)
+                df_word_freq10_list.append(df_word_freq10)
+                df_word_freq15_list.append(df_word_freq15)
+
+                df_kanji = pd.DataFrame([], columns=df_columns)
+                df_kanji_divide = pd.DataFrame([], columns=df_columns)
+                df_kana = pd.DataFrame([], columns=df_columns)
+                df_kana_divide = pd.DataFrame([], columns=df_columns)
+                df_phone = pd.DataFrame([], columns=df_columns)
+                df_phone_divide = pd.DataFrame([], columns=df_columns)
+                df_word_freq1 = pd.DataFrame([], columns=df_columns)
+                df_word_freq5 = pd.DataFrame([], columns=df_columns)
+                df_word_freq10 = pd.DataFrame([], columns=df_columns)
+                df_word_freq15 = pd.DataFrame([], columns=df_columns)
+                utt_count = 0
+
+    # Last dataframe
+    df_kanji_list.append(df_kanji)
+    df_kanji_divide_list.append(df_kanji_divide)
+    df_kana_list.append(df_kana)
+    df_kana_divide_list.append(df_kana_divide)
+    df_phone_list.append(df_phone)
+    df_phone_divide_list.append(df_phone_divide)
+    df_word_freq1_list.append(df_word_freq1)
+    df_word_freq5_list.append(df_word_freq5)
+    df_word_freq10_list.append(df_word_freq10)
+    df_word_freq15_list.append(df_word_freq15)
+
+    # Concatenate all dataframes
+    df_kanji = df_kanji_list[0]
+    df_kanji_divide = df_kanji_divide_list[0]
+    df_kana = df_kana_list[0]
+    df_kana_divide = df_kana_divide_list[0]
+    df_phone = df_phone_list[0]
+    df_phone_divide = df_phone_divide_list[0]
+    df_word_freq1 = df_word_freq1_list[0]
+    df_word_freq5 = df_word_freq5_list[0]
+    df_word_freq10 = df_word_freq10_list[0]
+    df_word_freq15 = df_word_freq15_list[0]
+
+    for df_i in df_kanji_list[1:]:
+        df_kanji = pd.concat([df_kanji, df_i], axis=0)
+    for df_i in df_kanji_divide_list[1:]:
+        df_kanji_divide = pd.concat([df_kanji_divide, df_i], axis=0)
+    for df_i in df_kana_list[1:]:
+        df_kana = pd.concat([df_kana, df_i], axis=0)
+    for df_i in df_kana_divide_list[1:]:
+        df_kana_divide = pd.concat([df_kana_divide, df_i], axis=0)
+    for df_i in df_phone_list[1:]:
+        df_phone = pd.concat([df_phone, df_i], axis=0)
+    for df_i in df_phone_divide_list[1:]:
+        df_phone_divide = pd.concat([df_phone_divide, df_i], axis=0)
+    for df_i in df_word_freq1_list[1:]:
+        df_word_freq1 = pd.concat([df_word_freq1, df_i], axis=0)
+    for df_i in df_word_freq5_list[1:]:
+        df_word_freq5 = pd.concat([df_word_freq5, df_i], axis=0)
+    for df_i in df_word_freq10_list[1:]:
+        df_word_freq10 = pd.concat([df_word_freq10, df_i], axis=0)
+    for df_i in df_word_freq15_list[1:]:
+        df_word_freq15 = pd.concat([df_word_freq15, df_i], axis=0)
+
+    df_kanji.to_csv(join(dataset_save_path, 'kanji.csv'))
+    df_kanji_divide.to_csv(join(dataset_save_path, 'kanji_divide.csv'))
+    df_kana.to_csv(join(dataset_save_path, 'kana.csv'))
+    df_kana_divide.to_csv(join(dataset_save_path, 'kana_divide.csv'))
+    df_phone.to_csv(join(dataset_save_path, 'phone.csv'))
+    df_phone_divide.to_csv(join(dataset_save_path, 'phone_divide.csv'))
+    df_word_freq1.to_csv(join(dataset_save_path, 'word_freq1.csv'))
+    df_word_freq5.to_csv(join(dataset_save_path, 'word_freq5.csv'))
+    df_word_freq10.to_csv(join(dataset_save_path, 'word_freq10.csv'))
+    df_word_freq15.to_csv(join(dataset_save_path, 'word_freq15.csv'))
 
 
 if __name__ == '__main__':
@@ -7,8 +7,9 @@ from __future__ import absolute_import
 from __future__ import division
 from __future__ import print_function
 
-from os.path import join, basename, isfile, abspath
-from glob import glob
+from os.path import join, basename, abspath
+
+from utils.catalog import Catalog
 
 
 class Path(object):
@@ -16,13 +17,17 @@ class Path(object):
     Args:
         data_path (string): path to CSJ corpus
         config_path (string): path to config dir
+        catalog_path (string, optional): path to save the catalog of files
+            in the corpus. If None, directories are scanned every time.
     """
 
-    def __init__(self, data_path, config_path, htk_save_path=None):
+    def __init__(self, data_path, config_path, htk_save_path=None,
+                 catalog_path=None):
 
         self.data_path = data_path
         self.config_path = config_path
         self.htk_save_path = htk_save_path
+        self.catalog_path = catalog_path
 
         self.wav_path = join(self.data_path, 'WAV')
         # NOTE: Update ver. (CSJ ver 4.)
@@ -69,8 +74,10 @@ class Path(object):
             'dialog': []  # ?? files
         }
 
+        wav_catalog = Catalog(self.wav_path, cache_path=self.catalog_path)
+
         # Core
-        for wav_path in glob(join(self.wav_path, 'CORE/*/*/*.wav')):
+        for wav_path in wav_catalog.glob('CORE/*/*/*.wav'):
             speaker = basename(wav_path).split('.')[0]
             if speaker in eval1_speakers:
                 self.wav_paths['eval1'].append(wav_path)
@@ -92,7 +99,7 @@ class Path(object):
                 self.wav_paths['train_fullset'].append(wav_path)
 
         # Noncore
-        for wav_path in glob(join(self.wav_path, 'NONCORE/*/*/*/*.wav')):
+        for wav_path in wav_catalog.glob('NONCORE/*/*/*/*.wav'):
             speaker = basename(wav_path).split('.')[0]
             if speaker in eval1_speakers:
                 self.wav_paths['eval1'].append(wav_path)
@@ -110,7 +117,7 @@ class Path(object):
                 self.wav_paths['train_fullset'].append(wav_path)
 
         # Noncore dialog
-        for wav_path in glob(join(self.wav_path, 'NONCORE-DIALOG/*/*.wav')):
+        for wav_path in wav_catalog.glob('NONCORE-DIALOG/*/*.wav'):
             speaker = basename(wav_path).split('.')[0]
             if speaker.split('-')[0] in excluded_speakers:
                 continue
@@ -135,12 +142,13 @@ class Path(object):
             'dialog': []
         }
 
+        ver4_catalog = Catalog(self.ver4_path, cache_path=self.catalog_path)
         for data_type in ['train_subset', 'train_fullset',
                           'eval1', 'eval2', 'eval3']:
             for i, wav_path in enumerate(self.wav_paths[data_type]):
                 speaker = basename(wav_path).split('.')[0]
                 ver4_path = join(self.ver4_path, speaker + '.sdb')
-                if isfile(ver4_path):
+                if ver4_catalog.isfile(ver4_path):
                     self.trans_paths[data_type].append(ver4_path)
                 else:
                     self.trans_paths[data_type].append(
@@ -168,7 +176,8 @@ class Path(object):
             raise ValueError('Set path to htk files.')
 
         # NOTE: ex.) cdj/htk/data_type/*.htk
-        return [p for p in glob(join(self.htk_save_path, data_type, '*.htk'))]
+        return Catalog(self.htk_save_path, cache_path=self.catalog_path).glob(
+            data_type + '/*.htk')
 
     def trans(self, data_type):
         """Get paths to transcription (.sdb) files.
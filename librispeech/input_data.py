@@ -8,21 +8,39 @@ from __future__ import division
 from __future__ import print_function
 
 from os.path import join, basename
+import shutil
 import numpy as np
 import pickle
-from tqdm import tqdm
 
 from utils.util import mkdir_join
-from utils.inputs.htk import read, write
-from utils.inputs.wav2feature_python_speech_features import wav2feature as w2f_psf
-from utils.inputs.wav2feature_librosa import wav2feature as w2f_librosa
+from utils.parallel import ParallelExecutor
+from utils.io_queue import AsyncWriter
+from utils.distributed import allreduce_sum
+from utils.inputs.ledger import Ledger, make_config_hash
+from utils.inputs.ledger import make_feature_hash
+from utils.inputs.frame_num import read_frame_num
+from utils.inputs.online_cmvn import online_cmvn
+from utils.inputs.dtype_policy import ACCUMULATOR_DTYPE, check_dtype
+from utils.inputs.dtype_policy import sum_frames, sum_squared_deviations
+from utils.inputs.frame_stacking import stack_frame, stacked_frame_num
+from utils.inputs.quantization import Quantizer, PRECISIONS
+from utils.inputs.quantization import standard_quantizer, save_quantizer
+from utils.inputs.statistics import Statistics, StatisticsSampler
+from utils.inputs.statistics import STATISTICS_NAME
+from utils.inputs.feature_extraction import FeatureExtractor, init_feature_worker
+from utils.inputs.feature_extraction import UTTERANCE_SLOT_BYTES
+from utils.inputs.feature_store import make_spill_path
 
 
 def read_audio(audio_paths, tool, config, normalize, is_training,
                speaker_gender_dict, save_path=None, save_format=None,
                global_mean_male=None, global_mean_female=None,
                global_std_male=None, global_std_female=None,
-               dtype=np.float32):
+               dtype=np.float32, num_workers=1, max_memory=None,
+               store_path=None, stats_sample_rate=1., stats_max_frames=None,
+               online_window=600, transport=None,
+               stack_frames=1, skip_frames=1, precision='float32',
+               batch_size=1):
     """Read audio files.
     Args:
         audio_paths (list): paths to HTK or WAV files
@@ -30,17 +48,23 @@ def read_audio(audio_paths, tool, config, normalize, is_training,
             htk or librosa or python_speech_features
         config (dict): a configuration for feature extraction
         normalize (string):
-            no => normalization will be not conducted
+            no => normalization will be not conducted. Statistics per
+                  gender & speaker over the training set are saved to
+                  normalize features on load instead.
             global => normalize input features by global mean & std over
                       the training set per gender
             speaker => normalize input features by mean & std per speaker
             utterance => normalize input features by mean & std per utterancet
                          data by mean & std per utterance
+            online => normalize input features by mean & std over the past
+                      `online_window` frames with global mean & std over
+                      the training set as the prior
         is_training (bool): Set True if save as training set
         speaker_gender_dict (dict): A dictionary of speakers' gender information
             key (string) => speaker
             value (string) => F or M
-        save_path (string): path to save npy files
+        save_path (string): path to save npy files. Utterances recorded in
+            the ledger there by an interrupted run are not saved again.
         save_format (string, optional): numpy as htk
         global_mean_male (np.ndarray, optional): global mean of male over
             the training set
@@ -51,6 +75,41 @@ def read_audio(audio_paths, tool, config, normalize, is_training,
         global_std_female (np.ndarray, optional): global standard
             deviation of female over the training set
         dtype (optional): the type of data, default is np.float32
+        num_workers (int, optional): the number of processes to extract
+            features. Files which fail are skipped and reported at the end.
+        max_memory (int, optional): the maximum number of utterances kept
+            in memory. If None, extracted features are not bounded while
+            they wait to be normalized and saved. Otherwise, without
+            store_path, features of files sampled for statistics over the
+            training set are spilled to disk in save_path in the first pass
+            and removed after the last one, which needs disk space for
+            unnormalized features instead of extracting them 3 times.
+        store_path (string, optional): path to the feature store shared
+            among data sizes. Unnormalized features of each audio file are
+            saved there once and reused by later passes and data sizes.
+        stats_sample_rate (float, optional): the rate of files sampled per
+            gender (per speaker if normalize is speaker) to compute
+            statistics over the training set
+        stats_max_frames (int, optional): the maximum number of frames per
+            gender (per speaker) to compute statistics
+        online_window (int, optional): the number of frames to compute
+            mean & std if normalize is online
+        transport (Transport, optional): if given, statistics over the
+            training set are summed over all shards of the training set
+            through it before features are normalized
+        stack_frames (int, optional): the number of frames to stack into
+            one frame after normalization
+        skip_frames (int, optional): the number of frames to skip. The
+            number of frames is reduced to 1 / skip_frames.
+        precision (string, optional): the precision to save features in,
+            float32 or float16 or int16 or int8. Integers cover +-4 std of
+            features over the training set per dimension with equal steps. The
+            error per dimension is saved in quantization.npz.
+        batch_size (int, optional): the number of files to extract features
+            of at once. Frames of all files in a batch are transformed
+            together, which is faster for short utterances. Batches in
+            memory count as max_memory // 2 utterances (at least one
+            batch).
     Returns:
         global_mean_male (np.ndarray): global mean of male over the
             training set
@@ -64,75 +123,118 @@ def read_audio(audio_paths, tool, config, normalize, is_training,
             key => utterance name
             value => the number of frames
     """
-    if not is_training:
+    # NOTE: statistics over the training set are needed to normalize
+    # features, and to store them as integers
+    need_statistics = normalize != 'no' or precision in ['int16', 'int8']
+    if not is_training and need_statistics:
         if global_mean_male is None or global_std_male is None:
             raise ValueError('Set mean & std computed in the training set.')
-    if normalize not in ['global', 'speaker', 'utterance', 'no']:
+    if normalize not in ['global', 'speaker', 'utterance', 'online', 'no']:
         raise ValueError(
-            'normalize must be "utterance" or "speaker" or "global" or "no".')
+            'normalize must be "utterance" or "speaker" or "global" or "online" or "no".')
+    if (stack_frames > 1 or skip_frames > 1) and normalize == 'no':
+        raise ValueError('Frames are stacked after normalization. Set '
+                         'normalize except no to stack frames.')
+    if precision not in PRECISIONS:
+        raise ValueError(
+            'precision must be "float32" or "float16" or "int16" or "int8".')
+    if save_format == 'htk' and precision in ['float16', 'int8']:
+        raise ValueError('HTK files are saved as float32 or int16.')
     if tool not in ['htk', 'python_speech_features', 'librosa']:
         raise TypeError(
             'tool must be "htk" or "python_speech_features"' +
             ' or "librosa".')
 
+    if max_memory is not None and max_memory < 2:
+        raise ValueError('max_memory must be larger than 1.')
+
+    ledger = None
+    if save_path is not None:
+        if is_training:
+            config_hash = make_feature_hash(tool, config, normalize)
+            if stats_sample_rate < 1 or stats_max_frames is not None:
+                config_hash = make_config_hash(
+                    config_hash, stats_sample_rate, stats_max_frames)
+        else:
+            config_hash = make_feature_hash(
+                tool, config, normalize, global_mean_male, global_std_male,
+                global_mean_female, global_std_female)
+        if stack_frames > 1 or skip_frames > 1:
+            config_hash = make_config_hash(
+                config_hash, stack_frames, skip_frames)
+        if precision != 'float32':
+            config_hash = make_config_hash(config_hash, precision)
+        ledger = Ledger(save_path, save_format, config_hash)
+
     audio_path_dict = {}
-    audio_path_list_male, audio_path_list_female = [], []
     total_frame_num_male, total_frame_num_female = 0, 0
     total_frame_num_dict = {}
     speaker_mean_dict, speaker_std_dict = {}, {}
 
+    # NOTE: a half of utterances is for reading, the rest for writing
+    executor = ParallelExecutor(
+        num_workers=num_workers,
+        initializer=init_feature_worker,
+        initargs=(tool, config),
+        # NOTE: features of a batch are handed over in one slot
+        slot_bytes=UTTERANCE_SLOT_BYTES * batch_size,
+        max_pending=None if max_memory is None else max(
+            max_memory // 2 // batch_size, 1))
+    spill_path = None
+    if store_path is None and max_memory is not None and tool != 'htk' \
+            and is_training and need_statistics:
+        # NOTE: features are extracted in the first pass only
+        spill_path = make_spill_path(save_path)
+        store_path = spill_path
+    # NOTE: features are handed over from workers through shared memory
+    extractor = FeatureExtractor(tool, config, store_path, dtype)
+
     # Loop 1: Divide all audio paths into speakers
     print('=====> Reading audio files...')
-    for i, audio_path in enumerate(tqdm(audio_paths)):
+    for audio_path in audio_paths:
         # ex.) audio_path: speaker-book-utt_index.***
         speaker = basename(audio_path).split('.')[0].split('-')[0]
         if speaker not in audio_path_dict.keys():
             audio_path_dict[speaker] = []
         audio_path_dict[speaker].append(audio_path)
 
-        if is_training:
-            # Read each audio file
-            if tool == 'htk':
-                input_utt, sampPeriod, parmKind = read(audio_path)
-            elif tool == 'python_speech_features':
-                input_utt = w2f_psf(
-                    audio_path,
-                    feature_type=config['feature_type'],
-                    feature_dim=config['channels'],
-                    use_energy=config['energy'],
-                    use_delta1=config['delta'],
-                    use_delta2=config['deltadelta'],
-                    window=config['window'],
-                    slide=config['slide'])
-            elif tool == 'librosa':
-                input_utt = w2f_librosa(
-                    audio_path,
-                    feature_type=config['feature_type'],
-                    feature_dim=config['channels'],
-                    use_energy=config['energy'],
-                    use_delta1=config['delta'],
-                    use_delta2=config['deltadelta'],
-                    window=config['window'],
-                    slide=config['slide'])
-
-            input_utt_sum = np.sum(input_utt, axis=0)
-
-            if i == 0:
+    if is_training and need_statistics:
+        # NOTE: statistics are computed from files sampled per group
+        sampler = StatisticsSampler(
+            audio_paths,
+            group_func=lambda p: _speaker(p) if normalize == 'speaker'
+            else speaker_gender_dict[_speaker(p)],
+            sample_rate=stats_sample_rate,
+            max_frames=stats_max_frames,
+            frame_func=lambda p: read_frame_num(p, tool, config))
+        for audio_path, (input_utt, _, _) in executor.imap_batched(
+                extractor, extractor.extract_batch, sampler.items,
+                batch_size):
+            if sampler.is_full():
+                break
+            if not sampler.is_sampled(audio_path):
+                continue
+            speaker = basename(audio_path).split('.')[0].split('-')[0]
+            input_utt_sum = sum_frames(input_utt)
+            sampler.add(audio_path, input_utt_sum, input_utt.shape[0])
+
+            if global_mean_male is None:
                 # Initialize global statistics
                 feature_dim = input_utt.shape[1]
-                global_mean_male = np.zeros((feature_dim,), dtype=dtype)
+                global_mean_male = np.zeros(
+                    (feature_dim,), dtype=ACCUMULATOR_DTYPE)
                 global_mean_female = np.zeros(
-                    (feature_dim,), dtype=dtype)
-                global_std_male = np.zeros((feature_dim,), dtype=dtype)
-                global_std_female = np.zeros((feature_dim,), dtype=dtype)
+                    (feature_dim,), dtype=ACCUMULATOR_DTYPE)
+                global_std_male = np.zeros(
+                    (feature_dim,), dtype=ACCUMULATOR_DTYPE)
+                global_std_female = np.zeros(
+                    (feature_dim,), dtype=ACCUMULATOR_DTYPE)
 
             # For computing global mean
             if speaker_gender_dict[speaker] == 'M':
-                audio_path_list_male.append(input_utt)
                 global_mean_male += input_utt_sum
                 total_frame_num_male += input_utt.shape[0]
             elif speaker_gender_dict[speaker] == 'F':
-                audio_path_list_female.append(input_utt)
                 global_mean_female += input_utt_sum
                 total_frame_num_female += input_utt.shape[0]
             else:
@@ -144,75 +246,86 @@ def read_audio(audio_paths, tool, config, normalize, is_training,
                     total_frame_num_dict[speaker] = 0
                     # Initialize speaker statistics
                     speaker_mean_dict[speaker] = np.zeros(
-                        (feature_dim,), dtype=dtype)
+                        (feature_dim,), dtype=ACCUMULATOR_DTYPE)
                     speaker_std_dict[speaker] = np.zeros(
-                        (feature_dim,), dtype=dtype)
+                        (feature_dim,), dtype=ACCUMULATOR_DTYPE)
                 speaker_mean_dict[speaker] += input_utt_sum
                 total_frame_num_dict[speaker] += input_utt.shape[0]
 
     # Loop 2: Computing global mean and sttdev
-    if is_training and normalize != 'no':
+    if is_training and need_statistics:
         print('=====> Computing global mean & stddev...')
+        if transport is not None:
+            # Sum statistics over all shards
+            (global_mean_male, total_frame_num_male, global_mean_female,
+             total_frame_num_female) = allreduce_sum(
+                transport, [global_mean_male, total_frame_num_male,
+                            global_mean_female, total_frame_num_female],
+                tag='mean', dtype=ACCUMULATOR_DTYPE)
+            if global_std_male is None:
+                # NOTE: no files in this shard
+                global_std_male = np.zeros_like(global_mean_male)
+                global_std_female = np.zeros_like(global_mean_female)
         # Compute global mean per gender
         global_mean_male /= total_frame_num_male
         global_mean_female /= total_frame_num_female
 
-        for speaker, audio_paths_speaker in tqdm(audio_path_dict.items()):
-            if normalize == 'speaker':
-                # Compute speaker mean
+        if normalize == 'speaker':
+            # Compute speaker mean
+            for speaker in speaker_mean_dict.keys():
                 speaker_mean_dict[speaker] /= total_frame_num_dict[speaker]
 
-            for audio_path in audio_paths_speaker:
-                # Read each audio file
-                if tool == 'htk':
-                    input_utt, sampPeriod, parmKind = read(audio_path)
-                elif tool == 'python_speech_features':
-                    input_utt = w2f_psf(
-                        audio_path,
-                        feature_type=config['feature_type'],
-                        feature_dim=config['channels'],
-                        use_energy=config['energy'],
-                        use_delta1=config['delta'],
-                        use_delta2=config['deltadelta'],
-                        window=config['window'],
-                        slide=config['slide'])
-                elif tool == 'librosa':
-                    input_utt = w2f_librosa(
-                        audio_path,
-                        feature_type=config['feature_type'],
-                        feature_dim=config['channels'],
-                        use_energy=config['energy'],
-                        use_delta1=config['delta'],
-                        use_delta2=config['deltadelta'],
-                        window=config['window'],
-                        slide=config['slide'])
-
-                # For computing global stddev
-                if speaker_gender_dict[speaker] == 'M':
-                    global_std_male += np.sum(
-                        np.abs(input_utt - global_mean_male) ** 2, axis=0)
-                elif speaker_gender_dict[speaker] == 'F':
-                    global_std_female += np.sum(
-                        np.abs(input_utt - global_mean_female) ** 2, axis=0)
-                else:
-                    raise ValueError('gender is M or F.')
-
-                if normalize == 'speaker':
-                    # For computing speaker stddev
-                    speaker_std_dict[speaker] += np.sum(
-                        np.abs(input_utt - speaker_mean_dict[speaker]) ** 2, axis=0)
+        for audio_path, (input_utt, _, _) in executor.imap_batched(
+                extractor, extractor.extract_batch, sampler.used_items,
+                batch_size):
+            speaker = basename(audio_path).split('.')[0].split('-')[0]
+
+            # For computing global stddev
+            if speaker_gender_dict[speaker] == 'M':
+                global_std_male += sum_squared_deviations(
+                    input_utt, global_mean_male)
+            elif speaker_gender_dict[speaker] == 'F':
+                global_std_female += sum_squared_deviations(
+                    input_utt, global_mean_female)
+            else:
+                raise ValueError('gender is M or F.')
 
             if normalize == 'speaker':
-                # Compute speaker stddev
+                # For computing speaker stddev
+                speaker_std_dict[speaker] += sum_squared_deviations(
+                    input_utt, speaker_mean_dict[speaker])
+
+        if normalize == 'speaker':
+            # Compute speaker stddev
+            for speaker in speaker_std_dict.keys():
                 speaker_std_dict[speaker] = np.sqrt(
                     speaker_std_dict[speaker] / (total_frame_num_dict[speaker] - 1))
 
+        if transport is not None:
+            global_std_male, global_std_female = allreduce_sum(
+                transport, [global_std_male, global_std_female], tag='std',
+                dtype=ACCUMULATOR_DTYPE)
         # Compute global stddev per gender
         global_std_male = np.sqrt(
             global_std_male / (total_frame_num_male - 1))
         global_std_female = np.sqrt(
             global_std_female / (total_frame_num_female - 1))
 
+        if sampler.sampled:
+            sampler.report(
+                std_func=lambda group: speaker_std_dict[group]
+                if normalize == 'speaker' else
+                global_std_male if group == 'M' else global_std_female,
+                save_path=None if save_path is None else join(
+                    save_path, 'statistics_ci.npz'))
+
+        # NOTE: statistics are accumulated in float64, and features are
+        # normalized in dtype
+        global_mean_male = global_mean_male.astype(dtype)
+        global_mean_female = global_mean_female.astype(dtype)
+        global_std_male = global_std_male.astype(dtype)
+        global_std_female = global_std_female.astype(dtype)
+
         if save_path is not None:
             # Save global mean & std per gender
             np.save(join(save_path, 'global_mean_male.npy'),
@@ -224,82 +337,156 @@ def read_audio(audio_paths, tool, config, normalize, is_training,
             np.save(join(save_path, 'global_std_female.npy'),
                     global_std_female)
 
+    quantizer = None
+    if save_path is not None and precision == 'float16':
+        quantizer = Quantizer(precision)
+    elif save_path is not None and precision != 'float32':
+        if normalize == 'no':
+            # NOTE: unnormalized features of both genders are stored in the
+            # range over the training set
+            quantizer = standard_quantizer(
+                precision, [global_mean_male, global_mean_female],
+                [global_std_male, global_std_female])
+        else:
+            # NOTE: features normalized by the statistics have zero mean
+            # and unit variance
+            feature_dim = global_mean_male.shape[0] * stack_frames
+            quantizer = standard_quantizer(
+                precision, np.zeros(feature_dim), np.ones(feature_dim))
+
     # Loop 3: Normalization and Saving
     print('=====> Normalization...')
+    if spill_path is not None:
+        # NOTE: features spilled in the first pass are loaded, and files
+        # not sampled for statistics are not spilled
+        extractor = FeatureExtractor(tool, config, spill_path, dtype,
+                                     update_store=False)
     frame_num_dict = {}
-    for speaker, audio_paths_speaker in tqdm(audio_path_dict.items()):
-        for audio_path in audio_paths_speaker:
-            # Read each audio file
-            if tool == 'htk':
-                input_utt, sampPeriod, parmKind = read(audio_path)
-            elif tool == 'python_speech_features':
-                input_utt = w2f_psf(
-                    audio_path,
-                    feature_type=config['feature_type'],
-                    feature_dim=config['channels'],
-                    use_energy=config['energy'],
-                    use_delta1=config['delta'],
-                    use_delta2=config['deltadelta'],
-                    window=config['window'],
-                    slide=config['slide'])
-            elif tool == 'librosa':
-                input_utt = w2f_librosa(
-                    audio_path,
-                    feature_type=config['feature_type'],
-                    feature_dim=config['channels'],
-                    use_energy=config['energy'],
-                    use_delta1=config['delta'],
-                    use_delta2=config['deltadelta'],
-                    window=config['window'],
-                    slide=config['slide'])
-
-            if normalize == 'no':
-                pass
-            elif normalize == 'global' or not is_training:
-                # Normalize by mean & std over the training set per gender
-                if speaker_gender_dict[speaker] == 'M':
-                    input_utt -= global_mean_male
-                    input_utt /= global_std_male
-                elif speaker_gender_dict[speaker] == 'F':
-                    input_utt -= global_mean_female
-                    input_utt /= global_std_female
-                else:
-                    raise ValueError('gender is M or F.')
-            elif normalize == 'speaker':
-                # Normalize by mean & std per speaker
-                input_utt -= speaker_mean_dict[speaker]
-                input_utt /= speaker_std_dict[speaker]
-            elif normalize == 'utterance':
-                # Normalize by mean & std per utterance
-                utt_mean = np.mean(input_utt, axis=0, dtype=dtype)
-                utt_std = np.std(input_utt, axis=0, dtype=dtype)
-                input_utt = (input_utt - utt_mean) / utt_std
+    # NOTE: files are written in background threads
+    if max_memory is None:
+        writer = AsyncWriter()
+    else:
+        writer = AsyncWriter(max_pending=max_memory - max_memory // 2)
+    statistics = None
+    if is_training and normalize == 'no' and save_path is not None:
+        # NOTE: statistics need all utterances including saved ones
+        statistics = Statistics(key_funcs={
+            'gender': lambda speaker: speaker_gender_dict[speaker],
+            'speaker': lambda speaker: speaker})
+    elif ledger is not None:
+        # Skip utterances saved by an interrupted run
+        audio_paths = [p for p in audio_paths
+                       if not ledger.is_done(basename(p).split('.')[0])]
+    for audio_path, (input_utt, sampPeriod, parmKind) in \
+            executor.imap_batched(extractor, extractor.extract_batch,
+                                  audio_paths, batch_size):
+        speaker = basename(audio_path).split('.')[0].split('-')[0]
+
+        if statistics is not None:
+            statistics.add(input_utt, speaker)
+
+        if normalize == 'no':
+            pass
+        elif normalize == 'online':
+            # Normalize by mean & std over the past frames
+            if speaker_gender_dict[speaker] == 'M':
+                prior_mean, prior_std = global_mean_male, global_std_male
+            else:
+                prior_mean, prior_std = global_mean_female, global_std_female
+            input_utt = online_cmvn(
+                input_utt, window=online_window, prior_mean=prior_mean,
+                prior_std=prior_std, dtype=dtype)
+        elif normalize == 'global' or not is_training:
+            # Normalize by mean & std over the training set per gender
+            if speaker_gender_dict[speaker] == 'M':
+                input_utt -= global_mean_male
+                input_utt /= global_std_male
+            elif speaker_gender_dict[speaker] == 'F':
+                input_utt -= global_mean_female
+                input_utt /= global_std_female
+            else:
+                raise ValueError('gender is M or F.')
+        elif normalize == 'speaker':
+            # Normalize by mean & std per speaker
+            input_utt -= speaker_mean_dict[speaker]
+            input_utt /= speaker_std_dict[speaker]
+        elif normalize == 'utterance':
+            # Normalize by mean & std per utterance
+            utt_mean = np.mean(input_utt, axis=0,
+                               dtype=ACCUMULATOR_DTYPE).astype(dtype)
+            utt_std = np.std(input_utt, axis=0,
+                             dtype=ACCUMULATOR_DTYPE).astype(dtype)
+            input_utt = (input_utt - utt_mean) / utt_std
+        else:
+            raise ValueError
+
+        check_dtype(input_utt, dtype, 'normalization')
+
+        if stack_frames > 1 or skip_frames > 1:
+            # Stack frames after normalization
+            input_utt = stack_frame(input_utt, stack_frames, skip_frames)
+
+        frame_num_dict[basename(audio_path).split('.')[
+            0]] = input_utt.shape[0]
+
+        input_name = basename(audio_path).split('.')[0]
+        if save_path is not None and not ledger.is_done(input_name):
+            # Save input features
+            if save_format == 'numpy':
+                input_data_save_path = mkdir_join(
+                    save_path, speaker, input_name + '.npy')
             else:
-                raise ValueError
-
-            frame_num_dict[basename(audio_path).split('.')[
-                0]] = input_utt.shape[0]
-
-            if save_path is not None:
-                # Save input features
-                input_name = basename(audio_path).split('.')[0]
-                if save_format == 'numpy':
-                    input_data_save_path = mkdir_join(
-                        save_path, speaker, input_name + '.npy')
-                    np.save(input_data_save_path, input_utt)
-                elif save_format == 'htk':
-                    write(input_utt,
-                          htk_path=mkdir_join(
-                              save_path, speaker, input_name + '.htk'),
-                          sampPeriod=sampPeriod,
-                          parmKind=parmKind)
-                else:
-                    raise ValueError('save_format is numpy or htk.')
+                input_data_save_path = mkdir_join(
+                    save_path, speaker, input_name + '.htk')
+            writer.submit(ledger.save, input_name, input_data_save_path,
+                          input_utt, sampPeriod if sampPeriod is None else sampPeriod * skip_frames,
+                          parmKind, quantizer=quantizer)
+
+    writer.close()
+    if spill_path is not None:
+        shutil.rmtree(spill_path)
+    if quantizer is not None:
+        save_quantizer(quantizer, save_path, ledger.config_hash)
+
+    if statistics is not None:
+        statistics.save(join(save_path, STATISTICS_NAME))
 
     if save_path is not None:
+        # Rebuild the frame number dictionary including the interrupted run
+        frame_num_dict = ledger.frame_num_dict()
+
         # Save the frame number dictionary
         with open(join(save_path, 'frame_num.pickle'), 'wb') as f:
             pickle.dump(frame_num_dict, f)
 
+    executor.report(save_path=None if save_path is None else join(
+        save_path, 'failed_files.txt'))
+
     return (global_mean_male, global_mean_female,
             global_std_male, global_std_female, frame_num_dict)
+
+
+def make_frame_num_dict(audio_paths, tool, config,
+                        skip_frames=1):
+    """Count frames of each utterance from headers of audio files. The
+       result is the same as frame_num_dict of `read_audio`, but it is
+       available before features are extracted.
+    Args:
+        audio_paths (list): paths to HTK or WAV files
+        tool (string): htk or python_speech_features or librosa
+        config (dict): a configuration for feature extraction
+        skip_frames (int, optional): the number of frames to skip in
+            `read_audio`
+    Returns:
+        frame_num_dict (dict):
+            key => utt_name
+            value => the number of frames
+    """
+    return {basename(audio_path).split('.')[0]: stacked_frame_num(
+        read_frame_num(audio_path, tool, config), skip_frames)
+        for audio_path in audio_paths}
+
+
+def _speaker(audio_path):
+    # ex.) audio_path: speaker-book-utt_index.***
+    return basename(audio_path).split('.')[0].split('-')[0]
@@ -9,7 +9,8 @@ from __future__ import print_function
 
 import re
 from os.path import join, basename, splitext
-from glob import glob
+
+from utils.catalog import Catalog
 
 
 class Path(object):
@@ -17,12 +18,15 @@ class Path(object):
     Args:
         data_path (string): path to Librispeech corpus
         htk_save_path (string, optional): path to htk files
+        catalog_path (string, optional): path to save the catalog of files
+            in the corpus. If None, directories are scanned every time.
     """
 
-    def __init__(self, data_path, htk_save_path=None):
+    def __init__(self, data_path, htk_save_path=None, catalog_path=None):
 
         self.data_path = data_path
         self.htk_save_path = htk_save_path
+        self.catalog = Catalog(data_path, cache_path=catalog_path)
 
         # Paths to Librispeech data
         self.data_paths = {
@@ -75,7 +79,8 @@ class Path(object):
         }
 
         for data_type in self._wav_paths.keys():
-            for file_path in glob(join(self.data_paths[data_type], '*/*/*')):
+            for file_path in self.catalog.glob(
+                    basename(self.data_paths[data_type]) + '/*/*/*'):
                 if splitext(basename(file_path))[1] == '.wav':
                     self._wav_paths[data_type].append(file_path)
                     self._utt2wav[basename(file_path)] = file_path
@@ -14,6 +14,7 @@ from tqdm import tqdm
 from utils.labels.character import Char2idx
 from utils.labels.word import Word2idx
 from utils.util import mkdir_join
+from utils.parallel import ParallelExecutor, get_worker_state
 
 # NOTE:
 ############################################################
@@ -55,7 +56,7 @@ OOV = 'OOV'
 
 
 def read_trans(label_paths, data_size, vocab_file_save_path, is_test=False,
-               save_vocab_file=False, data_type=None):
+               save_vocab_file=False, data_type=None, num_workers=1):
     """Read transcript.
     Args:
         label_paths (list): list of paths to label files
@@ -64,6 +65,7 @@ def read_trans(label_paths, data_size, vocab_file_save_path, is_test=False,
         is_test (bool, optional): if True, compute OOV rate
         save_vocab_file (bool, optional): if True, save vocabulary files
         data_type (string, optional): test_clean or test_other
+        num_workers (int, optional): the number of processes to tokenize
     Returns:
         trans_dict (dict):
             key (string) => speaker-book-utt_index
@@ -227,45 +229,69 @@ def read_trans(label_paths, data_size, vocab_file_save_path, is_test=False,
 
     # Tokenize
     print('=====> Tokenize...')
-    char2idx = Char2idx(char_vocab_file_path)
-    char2idx_capital = Char2idx(
-        char_capital_vocab_file_path, capital_divide=True)
-    word2idx_freq1 = Word2idx(word_freq1_vocab_file_path)
-    word2idx_freq5 = Word2idx(word_freq5_vocab_file_path)
-    word2idx_freq10 = Word2idx(word_freq10_vocab_file_path)
-    word2idx_freq15 = Word2idx(word_freq15_vocab_file_path)
-    for speaker, utt_dict in tqdm(speaker_dict.items()):
-        for utt_name, transcript in utt_dict.items():
-            if is_test:
+    if is_test:
+        for speaker, utt_dict in speaker_dict.items():
+            for utt_name, transcript in utt_dict.items():
                 utt_dict[utt_name] = [transcript] * 6
-            else:
-                char_indices = char2idx(transcript)
-                char_indices_capital = char2idx_capital(transcript)
-                word_freq1_indices = word2idx_freq1(transcript)
-                word_freq5_indices = word2idx_freq5(transcript)
-                word_freq10_indices = word2idx_freq10(transcript)
-                word_freq15_indices = word2idx_freq15(transcript)
-
-                char_indices = ' '.join(list(map(str, char_indices.tolist())))
-                char_indices_capital = ' '.join(
-                    list(map(str, char_indices_capital.tolist())))
-                word_freq1_indices = ' '.join(
-                    list(map(str, word_freq1_indices.tolist())))
-                word_freq5_indices = ' '.join(
-                    list(map(str, word_freq5_indices.tolist())))
-                word_freq10_indices = ' '.join(
-                    list(map(str, word_freq10_indices.tolist())))
-                word_freq15_indices = ' '.join(
-                    list(map(str, word_freq15_indices.tolist())))
-
-                utt_dict[utt_name] = [char_indices, char_indices_capital,
-                                      word_freq1_indices, word_freq5_indices,
-                                      word_freq10_indices, word_freq15_indices]
-        speaker_dict[speaker] = utt_dict
+    else:
+        vocab_file_paths = (char_vocab_file_path,
+                            char_capital_vocab_file_path,
+                            word_freq1_vocab_file_path,
+                            word_freq5_vocab_file_path,
+                            word_freq10_vocab_file_path,
+                            word_freq15_vocab_file_path)
+        executor = ParallelExecutor(num_workers=num_workers,
+                                    initializer=_init_tokenizers,
+                                    initargs=vocab_file_paths)
+        utt_list = [(speaker, utt_name, transcript)
+                    for speaker, utt_dict in speaker_dict.items()
+                    for utt_name, transcript in utt_dict.items()]
+        indices_list = executor.map(
+            _Tokenizer(*vocab_file_paths),
+            [transcript for _, _, transcript in utt_list])
+        for (speaker, utt_name, _), indices in zip(utt_list, indices_list):
+            if indices is None:
+                # Failed to tokenize
+                del speaker_dict[speaker][utt_name]
+                continue
+            speaker_dict[speaker][utt_name] = indices
+        executor.report()
 
     return speaker_dict
 
 
+def _build_tokenizers(char_vocab_file_path, char_capital_vocab_file_path,
+                      word_freq1_vocab_file_path, word_freq5_vocab_file_path,
+                      word_freq10_vocab_file_path, word_freq15_vocab_file_path):
+    return (Char2idx(char_vocab_file_path),
+            Char2idx(char_capital_vocab_file_path, capital_divide=True),
+            Word2idx(word_freq1_vocab_file_path),
+            Word2idx(word_freq5_vocab_file_path),
+            Word2idx(word_freq10_vocab_file_path),
+            Word2idx(word_freq15_vocab_file_path))
+
+
+def _init_tokenizers(*vocab_file_paths):
+    get_worker_state(('tokenizers',) + vocab_file_paths,
+                     _build_tokenizers, *vocab_file_paths)
+
+
+class _Tokenizer(object):
+    """Convert a transcript to indices with tokenizers built once per process.
+    Args:
+        vocab_file_paths (string): paths to vocabulary files
+    """
+
+    def __init__(self, *vocab_file_paths):
+        self.vocab_file_paths = vocab_file_paths
+
+    def __call__(self, transcript):
+        tokenizers = get_worker_state(('tokenizers',) + self.vocab_file_paths,
+                                      _build_tokenizers, *self.vocab_file_paths)
+        return [' '.join(list(map(str, tokenizer(transcript).tolist())))
+                for tokenizer in tokenizers]
+
+
 def compute_oov_rate(speaker_dict, vocab_file_path):
 
     with open(vocab_file_path, 'r') as f:
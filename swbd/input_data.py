@@ -10,16 +10,34 @@ from __future__ import print_function
 from os.path import join, basename
 import numpy as np
 import pickle
-from tqdm import tqdm
 
 from utils.util import mkdir_join
-from utils.inputs.segmentation import segment
-from utils.inputs.htk import read, write
+from utils.parallel import ParallelExecutor
+from utils.io_queue import AsyncWriter
+from utils.distributed import allreduce_sum
+from utils.inputs.segmentation import Segmenter
+from utils.inputs.feature_extraction import init_feature_worker
+from utils.inputs.feature_extraction import RECORDING_SLOT_BYTES
+from utils.inputs.htk import read_header
+from utils.inputs.ledger import Ledger, make_config_hash
+from utils.inputs.ledger import make_feature_hash
+from utils.inputs.frame_num import read_frame_num, count_utterance_frames
+from utils.inputs.online_cmvn import online_cmvn
+from utils.inputs.dtype_policy import ACCUMULATOR_DTYPE, check_dtype
+from utils.inputs.dtype_policy import sum_squared_deviations
+from utils.inputs.frame_stacking import stack_frame, stacked_frame_num
+from utils.inputs.quantization import Quantizer, PRECISIONS
+from utils.inputs.quantization import standard_quantizer, save_quantizer
+from utils.inputs.statistics import Statistics, StatisticsSampler
+from utils.inputs.statistics import STATISTICS_NAME
 
 
 def read_audio(audio_paths, speaker_dict, tool, config, normalize, is_training,
                save_path=None, save_format=None, global_mean=None, global_std=None,
-               dtype=np.float32):
+               dtype=np.float32, num_workers=1, store_path=None,
+               stats_sample_rate=1., stats_max_frames=None,
+               online_window=600, transport=None,
+               stack_frames=1, skip_frames=1, precision='float32'):
     """Read HTK or WAV files.
     Args:
         audio_paths (list): paths to HTK or WAV files
@@ -32,19 +50,48 @@ def read_audio(audio_paths, speaker_dict, tool, config, normalize, is_training,
             htk or librosa or python_speech_features
         config (dict): a configuration for feature extraction
         normalize (string):
-            no => normalization will be not conducted
+            no => normalization will be not conducted. Statistics over
+                  the training set and per speaker, channel & corpus are
+                  saved to normalize features on load instead.
             global => normalize input features by global mean & std over
                       the training set per gender
             speaker => normalize input features by mean & std per speaker
             utterance => normalize input features by mean & std per utterancet
                          data by mean & std per utterance
+            online => normalize input features by mean & std over the past
+                      `online_window` frames with global mean & std over
+                      the training set as the prior
         is_training (bool): training or not
-        save_path (string): path to save npy files
+        save_path (string): path to save npy files. Utterances recorded in
+            the ledger there by an interrupted run are not saved again.
         save_format (string, optional): numpy as htk
         global_mean (np.ndarray, optional): global mean over the training set
         global_std (np.ndarray, optional): global standard deviation over the
             training set
         dtype (optional): the type of data, default is np.float32
+        num_workers (int, optional): the number of processes to extract
+            features. Files which fail are skipped and reported at the end.
+        store_path (string, optional): path to the feature store shared
+            among data sizes. Unnormalized features of each audio file are
+            saved there once and reused by later passes and data sizes.
+        stats_sample_rate (float, optional): the rate of files sampled per
+            corpus (Switchboard or Fisher) to compute statistics over the
+            training set. Ignored if normalize is speaker.
+        stats_max_frames (int, optional): the maximum number of frames per
+            corpus to compute statistics. Ignored if normalize is speaker.
+        online_window (int, optional): the number of frames to compute
+            mean & std if normalize is online
+        transport (Transport, optional): if given, statistics over the
+            training set are summed over all shards of the training set
+            through it before features are normalized
+        stack_frames (int, optional): the number of frames to stack into
+            one frame after normalization
+        skip_frames (int, optional): the number of frames to skip. The
+            number of frames is reduced to 1 / skip_frames.
+        precision (string, optional): the precision to save features in,
+            float32 or float16 or int16 or int8. Integers cover +-4 std of
+            features over the training set per dimension with equal steps. The
+            error per dimension is saved in quantization.npz.
     Returns:
         global_mean (np.ndarray): global mean over the training set
         global_std (np.ndarray): global standard deviation over the
@@ -53,46 +100,91 @@ def read_audio(audio_paths, speaker_dict, tool, config, normalize, is_training,
             key => utterance name
             value => the number of frames
     """
-    if not is_training:
+    # NOTE: statistics over the training set are needed to normalize
+    # features, and to store them as integers
+    need_statistics = normalize != 'no' or precision in ['int16', 'int8']
+    if not is_training and need_statistics:
         if global_mean is None or global_std is None:
             raise ValueError('Set mean & std computed in the training set.')
-    if normalize not in ['global', 'speaker', 'utterance', 'no']:
+    if normalize not in ['global', 'speaker', 'utterance', 'online', 'no']:
         raise ValueError(
-            'normalize must be "utterance" or "speaker" or "global" or "no".')
+            'normalize must be "utterance" or "speaker" or "global" or "online" or "no".')
+    if (stack_frames > 1 or skip_frames > 1) and normalize == 'no':
+        raise ValueError('Frames are stacked after normalization. Set '
+                         'normalize except no to stack frames.')
+    if precision not in PRECISIONS:
+        raise ValueError(
+            'precision must be "float32" or "float16" or "int16" or "int8".')
+    if save_format == 'htk' and precision in ['float16', 'int8']:
+        raise ValueError('HTK files are saved as float32 or int16.')
+
+    ledger = None
+    if save_path is not None:
+        if is_training:
+            config_hash = make_feature_hash(tool, config, normalize)
+            if stats_sample_rate < 1 or stats_max_frames is not None:
+                config_hash = make_config_hash(
+                    config_hash, stats_sample_rate, stats_max_frames)
+        else:
+            config_hash = make_feature_hash(
+                tool, config, normalize, global_mean, global_std)
+        if stack_frames > 1 or skip_frames > 1:
+            config_hash = make_config_hash(
+                config_hash, stack_frames, skip_frames)
+        if precision != 'float32':
+            config_hash = make_config_hash(config_hash, precision)
+        ledger = Ledger(save_path, save_format, config_hash)
 
     total_frame_num = 0
     total_frame_num_dict = {}
     speaker_mean_dict = {}
 
-    # Loop 1: Computing global mean and statistics
-    if is_training and normalize != 'no':
-        print('=====> Reading audio files...')
-        for i, audio_path in enumerate(tqdm(audio_paths)):
-            speaker = basename(audio_path).split('.')[0]
+    executor = ParallelExecutor(num_workers=num_workers,
+                                initializer=init_feature_worker,
+                                initargs=(tool, config),
+                                slot_bytes=RECORDING_SLOT_BYTES)
+    # NOTE: features are handed over from workers through shared memory
 
-            # Fix speaker name
-            speaker = speaker.replace('sw0', 'sw')
-            # ex.) sw04771-A => sw4771-A (LDC97S62)
-            speaker = speaker.replace('sw_', 'sw')
-            # ex.) sw_4771-A => sw4771-A (eval2000, swbd)
-            speaker = speaker.replace('en_', 'en')
-            # ex.) en_4156-A => en4156-A (eval2000, ch)
+    segment_args = []
+    for audio_path in audio_paths:
+        speaker = _speaker(audio_path)
+        segment_args.append((audio_path, speaker, speaker_dict[speaker], None))
 
+    # Loop 1: Computing global mean and statistics
+    if is_training and need_statistics:
+        print('=====> Reading audio files...')
+        # NOTE: statistics are computed from files sampled per corpus. Each
+        # speaker has only one file, so all files are used for speaker
+        # normalization.
+        segment_arg_dict = {segment_arg[0]: segment_arg
+                            for segment_arg in segment_args}
+        group_func = lambda p: _corpus(segment_arg_dict[p][1])
+        if normalize == 'speaker':
+            sampler = StatisticsSampler(audio_paths, group_func)
+        else:
+            sampler = StatisticsSampler(audio_paths, group_func,
+                                        sample_rate=stats_sample_rate,
+                                        max_frames=stats_max_frames,
+                                        frame_func=lambda p: read_frame_num(
+                                            p, tool, config))
+        for (audio_path, speaker, _, _), outputs in executor.imap(
+                Segmenter(is_training=True, sil_duration=0, tool=tool,
+                          config=config, keep_features=False,
+                          store_path=store_path, dtype=dtype),
+                [segment_arg_dict[p] for p in sampler.items]):
+            if sampler.is_full():
+                break
+            if not sampler.is_sampled(audio_path):
+                continue
             # Divide each audio file into utterances
-            _, input_utt_sum, speaker_mean, _, total_frame_num_speaker = segment(
-                audio_path,
-                speaker,
-                speaker_dict[speaker],
-                is_training=True,
-                sil_duration=0,
-                tool=tool,
-                config=config)
-
-            if i == 0:
+            _, input_utt_sum, speaker_mean, _, total_frame_num_speaker = outputs[:5]
+            sampler.add(audio_path, input_utt_sum, total_frame_num_speaker)
+
+            if global_mean is None:
                 # Initialize global statistics
                 feature_dim = input_utt_sum.shape[0]
-                global_mean = np.zeros((feature_dim,), dtype=dtype)
-                global_std = np.zeros((feature_dim,), dtype=dtype)
+                global_mean = np.zeros((feature_dim,), dtype=ACCUMULATOR_DTYPE)
+                global_std = np.zeros((feature_dim,), dtype=ACCUMULATOR_DTYPE)
 
             global_mean += input_utt_sum
             total_frame_num += total_frame_num_speaker
@@ -104,73 +196,113 @@ def read_audio(audio_paths, speaker_dict, tool, config, normalize, is_training,
                 # NOTE: speaker mean is already computed
 
         print('=====> Computing global mean & stddev...')
+        if transport is not None:
+            # Sum statistics over all shards
+            global_mean, total_frame_num = allreduce_sum(
+                transport, [global_mean, total_frame_num], tag='mean',
+                dtype=ACCUMULATOR_DTYPE)
+            if global_std is None:
+                # NOTE: no files in this shard
+                global_std = np.zeros_like(global_mean)
         # Compute global mean
         global_mean /= total_frame_num
 
-        for audio_path in tqdm(audio_paths):
-            speaker = basename(audio_path).split('.')[0]
-
-            # Normalize speaker name
-            speaker = speaker.replace('sw0', 'sw')
-            speaker = speaker.replace('sw_', 'sw')
-            speaker = speaker.replace('en_', 'en')
-
+        for (audio_path, speaker, _, _), outputs in executor.imap(
+                Segmenter(is_training=True, sil_duration=0, tool=tool,
+                          config=config, store_path=store_path, dtype=dtype),
+                [segment_arg_dict[p] for p in sampler.used_items]):
             # Divide each audio into utterances
-            input_data_dict_speaker, _, _, _, _ = segment(
-                audio_path,
-                speaker,
-                speaker_dict[speaker],
-                is_training=True,
-                sil_duration=0,
-                tool=tool,
-                config=config)
+            input_data_dict_speaker = outputs[0]
 
             # For computing global stddev
             for input_utt in input_data_dict_speaker.values():
-                global_std += np.sum(
-                    np.abs(input_utt - global_mean) ** 2, axis=0)
+                global_std += sum_squared_deviations(
+                    input_utt, global_mean)
 
+        if transport is not None:
+            global_std, = allreduce_sum(
+                transport, [global_std], tag='std', dtype=ACCUMULATOR_DTYPE)
         # Compute global stddev
         global_std = np.sqrt(global_std / (total_frame_num - 1))
 
+        if sampler.sampled:
+            sampler.report(
+                std_func=lambda group: global_std,
+                save_path=None if save_path is None else join(
+                    save_path, 'statistics_ci.npz'))
+
+        # NOTE: statistics are accumulated in float64, and features are
+        # normalized in dtype
+        global_mean = global_mean.astype(dtype)
+        global_std = global_std.astype(dtype)
+
         if save_path is not None:
             # Save global mean & std per gender
             np.save(join(save_path, 'global_mean.npy'), global_mean)
             np.save(join(save_path, 'global_std.npy'), global_std)
 
+    quantizer = None
+    if save_path is not None and precision == 'float16':
+        quantizer = Quantizer(precision)
+    elif save_path is not None and precision != 'float32':
+        if normalize == 'no':
+            # NOTE: unnormalized features are stored in the range over the
+            # training set
+            quantizer = standard_quantizer(precision, global_mean, global_std)
+        else:
+            # NOTE: features normalized by the statistics have zero mean
+            # and unit variance
+            feature_dim = global_mean.shape[0] * stack_frames
+            quantizer = standard_quantizer(
+                precision, np.zeros(feature_dim), np.ones(feature_dim))
+
     # Loop 2: Normalization and Saving
     print('=====> Normalization...')
     frame_num_dict = {}
+    # NOTE: files are written in background threads
+    writer = AsyncWriter()
     sampPeriod, parmKind = None, None
-    for audio_path in tqdm(audio_paths):
-        speaker = basename(audio_path).split('.')[0]
-
-        # Normalize speaker name
-        speaker = speaker.replace('sw0', 'sw')
-        speaker = speaker.replace('sw_', 'sw')
-        speaker = speaker.replace('en_', 'en')
-
-        if normalize == 'speaker' and is_training:
-            speaker_mean = speaker_mean_dict[speaker]
-        else:
-            speaker_mean = None
+    statistics = None
+    if is_training and normalize == 'no' and save_path is not None:
+        # NOTE: statistics need all utterances including saved ones
+        statistics = Statistics(key_funcs={
+            'speaker': lambda speaker: speaker,
+            'channel': lambda speaker: speaker.split('-')[-1],
+            'corpus': _corpus})
+    if normalize == 'speaker' and is_training:
+        segment_args = [(audio_path, speaker, utt_dict, speaker_mean_dict[speaker])
+                        for audio_path, speaker, utt_dict, _ in segment_args
+                        if speaker in speaker_mean_dict.keys()]
+        # NOTE: speaker mean is used to compute speaker sttdev
+        # NOTE: files failed in Loop 1 are skipped
+    if ledger is not None and statistics is None:
+        segment_args = [(audio_path, speaker, utt_dict, speaker_mean)
+                        for audio_path, speaker, utt_dict, speaker_mean in segment_args
+                        if not all(ledger.is_done(speaker + '_' + utt_index)
+                                   for utt_index in utt_dict.keys())]
+        # NOTE: files saved by an interrupted run are skipped
 
+    for (audio_path, speaker, _, _), outputs in executor.imap(
+            Segmenter(is_training=is_training, sil_duration=0, tool=tool,
+                      config=config, store_path=store_path, dtype=dtype),
+            segment_args):
         # Divide each audio into utterances
-        input_data_dict_speaker, _, speaker_mean, speaker_std, _ = segment(
-            audio_path,
-            speaker,
-            speaker_dict[speaker],
-            is_training=is_training,
-            sil_duration=0,
-            tool=tool,
-            config=config,
-            mean=speaker_mean)  # for compute speaker sttdev
+        input_data_dict_speaker, _, speaker_mean, speaker_std, _ = outputs[:5]
         # NOTE: input_data_dict_speaker have been not normalized yet
 
         for utt_index, input_utt in input_data_dict_speaker.items():
+            if statistics is not None:
+                statistics.add(input_utt, speaker)
+            if ledger is not None and ledger.is_done(speaker + '_' + utt_index):
+                continue
 
             if normalize == 'no':
                 pass
+            elif normalize == 'online':
+                # Normalize by mean & std over the past frames
+                input_utt = online_cmvn(
+                    input_utt, window=online_window, prior_mean=global_mean,
+                    prior_std=global_std, dtype=dtype)
             elif normalize == 'global' or not is_training:
                 # Normalize by mean & std over the training set
                 input_utt -= global_mean
@@ -180,12 +312,20 @@ def read_audio(audio_paths, speaker_dict, tool, config, normalize, is_training,
                 input_utt = (input_utt - speaker_mean) / speaker_std
             elif normalize == 'utterance':
                 # Normalize by mean & std per utterance
-                utt_mean = np.mean(input_utt, axis=0, dtype=dtype)
-                utt_std = np.std(input_utt, axis=0, dtype=dtype)
+                utt_mean = np.mean(input_utt, axis=0,
+                                   dtype=ACCUMULATOR_DTYPE).astype(dtype)
+                utt_std = np.std(input_utt, axis=0,
+                                 dtype=ACCUMULATOR_DTYPE).astype(dtype)
                 input_utt = (input_utt - utt_mean) / utt_std
             else:
                 ValueError
 
+            check_dtype(input_utt, dtype, 'normalization')
+
+            if stack_frames > 1 or skip_frames > 1:
+                # Stack frames after normalization
+                input_utt = stack_frame(input_utt, stack_frames, skip_frames)
+
             frame_num_dict[speaker + '_' + utt_index] = input_utt.shape[0]
 
             if save_path is not None:
@@ -193,21 +333,87 @@ def read_audio(audio_paths, speaker_dict, tool, config, normalize, is_training,
                 if save_format == 'numpy':
                     input_data_save_path = mkdir_join(
                         save_path, speaker, speaker + '_' + utt_index + '.npy')
-                    np.save(input_data_save_path, input_utt)
-                elif save_format == 'htk':
-                    if sampPeriod is None:
-                        _, sampPeriod, parmKind = read(audio_path)
-                    write(input_utt,
-                          htk_path=mkdir_join(
-                              save_path, speaker, speaker + '_' + utt_index + '.htk'),
-                          sampPeriod=sampPeriod,
-                          parmKind=parmKind)
+                    htk_header = (None, None)
                 else:
-                    raise ValueError('save_format is numpy or htk.')
+                    if sampPeriod is None:
+                        # NOTE: read the header only, not features
+                        _, sampPeriod, _, parmKind = read_header(audio_path)
+                    htk_header = (sampPeriod * skip_frames, parmKind)
+                    input_data_save_path = mkdir_join(
+                        save_path, speaker, speaker + '_' + utt_index + '.htk')
+                writer.submit(ledger.save, speaker + '_' + utt_index,
+                              input_data_save_path, input_utt, *htk_header,
+                              quantizer=quantizer)
+
+    writer.close()
+    if quantizer is not None:
+        save_quantizer(quantizer, save_path, ledger.config_hash)
+
+    if statistics is not None:
+        statistics.save(join(save_path, STATISTICS_NAME))
 
     if save_path is not None:
+        # Rebuild the frame number dictionary including the interrupted run
+        frame_num_dict = ledger.frame_num_dict()
+
         # Save the frame number dictionary
         with open(join(save_path, 'frame_num.pickle'), 'wb') as f:
             pickle.dump(frame_num_dict, f)
 
+    executor.report(save_path=None if save_path is None else join(
+        save_path, 'failed_files.txt'))
+
     return global_mean, global_std, frame_num_dict
+
+
+def make_frame_num_dict(audio_paths, speaker_dict, tool, config,
+                        skip_frames=1):
+    """Count frames of each utterance from headers of audio files. The
+       result is the same as frame_num_dict of `read_audio`, but it is
+       available before features are extracted.
+    Args:
+        audio_paths (list): paths to HTK or WAV files
+        speaker_dict (dict): dictionary of speakers
+            key (string) => speaker
+            value (dict) => dictionary of utterance information of each speaker
+        tool (string): htk or python_speech_features or librosa
+        config (dict): a configuration for feature extraction
+        skip_frames (int, optional): the number of frames to skip in
+            `read_audio`
+    Returns:
+        frame_num_dict (dict):
+            key => speaker_utt_index
+            value => the number of frames
+    """
+    frame_num_dict = {}
+    for audio_path in audio_paths:
+        speaker = _speaker(audio_path)
+        utt_frame_nums = count_utterance_frames(
+            read_frame_num(audio_path, tool, config), speaker_dict[speaker],
+            sil_duration=0)
+        for utt_index, frame_num in utt_frame_nums.items():
+            frame_num_dict[speaker + '_' + utt_index] = stacked_frame_num(
+                frame_num, skip_frames)
+    return frame_num_dict
+
+
+def _speaker(audio_path):
+    speaker = basename(audio_path).split('.')[0]
+
+    # Fix speaker name
+    speaker = speaker.replace('sw0', 'sw')
+    # ex.) sw04771-A => sw4771-A (LDC97S62)
+    speaker = speaker.replace('sw_', 'sw')
+    # ex.) sw_4771-A => sw4771-A (eval2000, swbd)
+    speaker = speaker.replace('en_', 'en')
+    # ex.) en_4156-A => en4156-A (eval2000, ch)
+    return speaker
+
+
+def _corpus(speaker):
+    # ex.) sw4771-A (Switchboard), en4156-A (CallHome), fe_03_00001-A (Fisher)
+    if speaker.startswith('fe_'):
+        return 'fisher'
+    elif speaker.startswith('en'):
+        return 'callhome'
+    return 'swbd'
@@ -9,8 +9,9 @@ from __future__ import absolute_import
 from __future__ import division
 from __future__ import print_function
 
-from os.path import join, isfile
+from os.path import join, isfile, basename
 import sys
+from functools import partial
 import argparse
 from tqdm import tqdm
 import numpy as np
@@ -25,8 +26,17 @@ from swbd.labels.ldc97s62.character import read_trans
 from swbd.labels.fisher.character import read_trans as read_trans_fisher
 from swbd.labels.eval2000.stm import read_stm
 from utils.util import mkdir_join
-from utils.inputs.wav_split import split_wav
+from utils.inputs.wav_split import split_wav, make_wav_manifest
+from utils.inputs.wav_split import WavManifest, MANIFEST_NAME
 from utils.dataset import add_element
+from utils.pipeline import Pipeline
+from utils.shard import prepare_shard, reduce_shards, shard_path
+from utils.distributed import make_transport
+from utils.inputs.frame_num import read_frame_num
+from utils.inputs.feature_store import FeatureStore
+from utils.inputs.ledger import FEATURE_VERSIONS, make_feature_hash
+from utils.inputs.feature_extraction import fill_feature_store
+from utils.inputs.feature_extraction import parse_feature_specs
 
 parser = argparse.ArgumentParser()
 parser.add_argument('--swbd_audio_path', type=str,
@@ -49,7 +59,9 @@ parser.add_argument('--tool', type=str,
 parser.add_argument('--wav_save_path', type=str, help='path to wav files.')
 parser.add_argument('--htk_save_path', type=str, help='path to htk files.')
 parser.add_argument('--normalize', type=str,
-                    choices=['global', 'speaker', 'utterance', 'no'])
+                    choices=['global', 'speaker', 'utterance', 'online', 'no'],
+                    help='If no, unnormalized features are saved with ' +
+                    'statistics to normalize them on load in any mode.')
 parser.add_argument('--save_format', type=str, choices=['numpy', 'htk', 'wav'])
 
 parser.add_argument('--feature_type', type=str, choices=['fbank', 'mfcc'])
@@ -62,8 +74,54 @@ parser.add_argument('--energy', type=int, help='if 1, add the energy feature')
 parser.add_argument('--delta', type=int, help='if 1, add the energy feature')
 parser.add_argument('--deltadelta', type=int,
                     help='if 1, double delta features are also extracted')
+parser.add_argument('--num_workers', type=int, default=1,
+                    help='the number of processes to extract features')
+parser.add_argument('--share_features', type=int, default=1,
+                    help='If 1, unnormalized features are extracted once ' +
+                    'into feature_save_path/raw and shared among data sizes.')
+parser.add_argument('--extra_features', type=str, default='',
+                    help='other kinds of features extracted in the same ' +
+                    'pass into feature_save_path/raw as feature_type:channels ' +
+                    'separated by commas (ex. fbank:80,mfcc:13). Later runs ' +
+                    'with them load features from there.')
+parser.add_argument('--stats_sample_rate', type=float, default=1.,
+                    help='the rate of files sampled to compute statistics ' +
+                    'over the training set')
+parser.add_argument('--stats_max_frames', type=int, default=0,
+                    help='the maximum number of frames per group to compute ' +
+                    'statistics. If 0, not bounded.')
 parser.add_argument('--fisher', type=int,
                     help='If True, create large-size dataset (2000h).')
+parser.add_argument('--virtual_wav', type=int, default=0,
+                    help='If 1, save a manifest of utterances in WAV files ' +
+                    'instead of splitting them (save_format is wav).')
+parser.add_argument('--online_window', type=int, default=600,
+                    help='the number of past frames to compute mean & ' +
+                    'std if normalize is online')
+parser.add_argument('--stack_frames', type=int, default=1,
+                    help='the number of frames to stack into one frame')
+parser.add_argument('--skip_frames', type=int, default=1,
+                    help='the number of frames to skip. The frame rate is ' +
+                    'reduced to 1 / skip_frames.')
+parser.add_argument('--precision', type=str, default='float32',
+                    choices=['float32', 'float16', 'int16', 'int8'],
+                    help='the precision to save features in. HTK files ' +
+                    'are saved as float32 or int16 (compressed).')
+parser.add_argument('--shard_num', type=int, default=1,
+                    help='the number of shards to split the training set ' +
+                    'into to extract features on several nodes')
+parser.add_argument('--shard_index', type=int, default=-1,
+                    help='If 0 or more, extract features of this shard of ' +
+                    'the training set only. If -1, outputs of all shards ' +
+                    'are merged and the rest of the dataset is made.')
+parser.add_argument('--shard_transport', type=str, default='',
+                    choices=['', 'dir', 'tcp'],
+                    help='how shards exchange statistics over the training ' +
+                    'set to normalize features (through a shared directory ' +
+                    'or TCP). If empty, statistics are not exchanged.')
+parser.add_argument('--shard_address', type=str, default='',
+                    help='path to the shared directory (dir) or host:port ' +
+                    'of shard 0 (tcp)')
 
 args = parser.parse_args()
 path = Path(swbd_audio_path=args.swbd_audio_path,
@@ -73,7 +131,8 @@ path = Path(swbd_audio_path=args.swbd_audio_path,
             eval2000_trans_path=args.eval2000_trans_path,
             wav_save_path=args.wav_save_path,
             htk_save_path=args.htk_save_path,
-            run_root_path='./')
+            run_root_path='./',
+            catalog_path=join(args.dataset_save_path, '.catalog'))
 
 CONFIG = {
     'feature_type': args.feature_type,
@@ -88,6 +147,31 @@ CONFIG = {
 
 if args.save_format == 'htk':
     assert args.tool == 'htk'
+if (args.stack_frames > 1 or args.skip_frames > 1) and \
+        (args.save_format == 'wav' or args.normalize == 'no'):
+    raise ValueError('Frames are stacked after normalization. Set '
+                     'save_format numpy or htk and normalize except no.')
+if args.precision != 'float32' and args.save_format == 'wav':
+    raise ValueError('Only features are saved with reduced precision.')
+if args.shard_num > 1 and args.save_format == 'wav':
+    raise ValueError('Only feature extraction is split into shards.')
+if args.shard_num > 1 and args.shard_transport == '' and \
+        (args.normalize != 'no' or args.precision in ['int16', 'int8']):
+    # NOTE: global mean & std are saved for the evaluation sets even when
+    # normalizing per utterance
+    raise ValueError('Statistics over the whole training set are needed to '
+                     'normalize features or to store them as integers. Set '
+                     'shard_transport, or set normalize no and precision '
+                     'float32 or float16.')
+EXTRA_CONFIGS = parse_feature_specs(args.extra_features, CONFIG)
+if len(EXTRA_CONFIGS) > 0 and \
+        (args.tool == 'htk' or not bool(args.share_features)):
+    raise ValueError('Other kinds of features are saved in the shared '
+                     'feature store. Set tool python_speech_features or '
+                     'librosa and share_features 1.')
+
+DATASET_NAMES = ['character', 'character_capital_divide', 'word_freq1',
+                 'word_freq5', 'word_freq10', 'word_freq15']
 
 
 def main(data_size):
@@ -96,234 +180,480 @@ def main(data_size):
     print('  data_size: %s' % data_size)
     print('=' * 50)
 
+    cache_path = mkdir_join(
+        args.dataset_save_path, args.save_format, data_size, '.cache')
+    if args.shard_index >= 0:
+        cache_path = mkdir_join(cache_path, 'shard' + str(args.shard_index))
+    pipeline = Pipeline(cache_path=cache_path)
+    extract_config = {
+        'tool': args.tool,
+        'version': FEATURE_VERSIONS[args.tool],
+        'save_format': args.save_format,
+        'feature_save_path': args.feature_save_path,
+        'config': CONFIG,
+        'share_features': args.share_features
+    }
+    if len(EXTRA_CONFIGS) > 0:
+        extract_config['extra_features'] = args.extra_features
+    feature_config = {
+        'tool': args.tool,
+        'version': FEATURE_VERSIONS[args.tool],
+        'normalize': args.normalize,
+        'save_format': args.save_format,
+        'feature_save_path': args.feature_save_path,
+        'config': CONFIG,
+        'stats_sample_rate': args.stats_sample_rate,
+        'stats_max_frames': args.stats_max_frames,
+        'online_window': args.online_window,
+        'virtual_wav': args.virtual_wav
+    }
+    if args.stack_frames > 1 or args.skip_frames > 1:
+        feature_config['stack'] = [args.stack_frames, args.skip_frames]
+    if args.precision != 'float32':
+        feature_config['precision'] = args.precision
+    if len(EXTRA_CONFIGS) > 0:
+        feature_config['extra_features'] = args.extra_features
+    if args.shard_num > 1:
+        extract_config['shard'] = [args.shard_num, args.shard_index]
+        feature_config['shard'] = [args.shard_num, args.shard_index]
+    store_outputs = []
+    if args.save_format in ['numpy', 'htk'] and args.tool != 'htk' and \
+            bool(args.share_features):
+        store_outputs = [
+            FeatureStore(join(args.feature_save_path, 'raw'), args.tool,
+                         config).store_path
+            for config in [CONFIG] + EXTRA_CONFIGS]
+    pipeline.add('path', partial(scan, data_size), always=True)
+    pipeline.add('label_train', partial(make_label_train, data_size),
+                 inputs=['path'])
+    pipeline.add('label_eval2000', make_label_eval2000, inputs=['path'])
+    for data_type in ['train', 'eval2000_swbd', 'eval2000_ch']:
+        label_stage = 'label_train' if data_type == 'train' else 'label_eval2000'
+        # NOTE: unnormalized features are extracted once, and normalized
+        # again when only the normalization changes
+        pipeline.add('extract_' + data_type,
+                     partial(extract, data_size, data_type),
+                     inputs=['path'], config=extract_config,
+                     outputs=store_outputs)
+        save_path = join(args.feature_save_path, args.save_format,
+                         data_size, data_type)
+        if data_type == 'train' and args.shard_index >= 0:
+            save_path = shard_path(save_path, args.shard_index)
+        stat_inputs = [] if data_type == 'train' else ['input_train']
+        pipeline.add('input_' + data_type,
+                     partial(make_input, data_size, data_type),
+                     inputs=['path', label_stage,
+                             'extract_' + data_type] + stat_inputs,
+                     config=feature_config,
+                     outputs=[join(save_path, 'complete.txt')])
+        pipeline.add('dataset_' + data_type,
+                     partial(make_dataset, data_size, data_type),
+                     inputs=[label_stage, 'input_' + data_type],
+                     config={'dataset_save_path': args.dataset_save_path},
+                     outputs=[join(args.dataset_save_path, args.save_format,
+                                   data_size, data_type, name + '.csv')
+                              for name in DATASET_NAMES])
+    if args.shard_index >= 0:
+        # NOTE: the other stages are run after outputs of all shards are
+        # merged
+        pipeline.run('input_train')
+        return
+    pipeline.run()
+
+
+def scan(data_size):
+    """Collect paths to audio and transcript files.
+    Args:
+        data_size (string): 300h or 2000h
+    Returns:
+        paths (dict): lists of paths
+    """
+    paths = {'trans': path.trans(corpus='swbd'),
+             'word': path.word(corpus='swbd'),
+             'stm': path.stm_path,
+             'pem': path.pem_path,
+             'glm': path.glm_path}
+    if data_size == '2000h':
+        paths['trans_fisher'] = path.trans(corpus='fisher')
+
+    for data_type in ['train', 'eval2000_swbd', 'eval2000_ch']:
+        if args.save_format != 'wav' and args.tool == 'htk':
+            corpus_paths = path.htk
+        else:
+            corpus_paths = path.wav
+        if data_type == 'train':
+            audio_paths = corpus_paths(corpus='swbd')
+            if data_size == '2000h':
+                audio_paths += corpus_paths(corpus='fisher')
+        else:
+            audio_paths = corpus_paths(corpus=data_type)
+        paths['audio_' + data_type] = audio_paths
+    return paths
+
+
+def make_label_train(data_size, paths):
+    """
+    Args:
+        data_size (string): 300h or 2000h
+        paths (dict): the result of `scan`
+    Returns:
+        speaker_dict (dict)
+    """
     ########################################
     # labels
     ########################################
     print('=> Processing transcripts...')
-    speaker_dict_dict = {}  # dict of speaker_dict
     print('---------- train ----------')
     if data_size == '300h':
-        speaker_dict_dict['train'] = read_trans(
-            label_paths=path.trans(corpus='swbd'),
-            word_boundary_paths=path.word(corpus='swbd'),
+        return read_trans(
+            label_paths=paths['trans'],
+            word_boundary_paths=paths['word'],
             run_root_path='./',
             vocab_file_save_path=mkdir_join('./config/vocab_files'),
             save_vocab_file=True)
-    elif data_size == '2000h':
-        speaker_dict_a, char_set_a, char_capital_set_a, word_count_dict_a = read_trans_fisher(
-            label_paths=path.trans(corpus='fisher'),
-            target_speaker='A')
-        speaker_dict_b, char_set_b, char_capital_set_b, word_count_dict_b = read_trans_fisher(
-            label_paths=path.trans(corpus='fisher'),
-            target_speaker='B')
-
-        # Meage 2 dictionaries
-        speaker_dict = merge_dicts([speaker_dict_a, speaker_dict_b])
-        char_set = char_set_a | char_set_b
-        char_capital_set = char_capital_set_a | char_capital_set_b
-        word_count_dict_fisher = dict(
-            Counter(word_count_dict_a) + Counter(word_count_dict_b))
-
-        speaker_dict_dict['train'] = read_trans(
-            label_paths=path.trans(corpus='swbd'),
-            word_boundary_paths=path.word(corpus='swbd'),
-            run_root_path='./',
-            vocab_file_save_path=mkdir_join('./config/vocab_files'),
-            save_vocab_file=True,
-            speaker_dict_fisher=speaker_dict,
-            char_set=char_set,
-            char_capital_set=char_capital_set,
-            word_count_dict=word_count_dict_fisher)
-        del speaker_dict
 
+    speaker_dict_a, char_set_a, char_capital_set_a, word_count_dict_a = read_trans_fisher(
+        label_paths=paths['trans_fisher'],
+        target_speaker='A')
+    speaker_dict_b, char_set_b, char_capital_set_b, word_count_dict_b = read_trans_fisher(
+        label_paths=paths['trans_fisher'],
+        target_speaker='B')
+
+    # Meage 2 dictionaries
+    speaker_dict = merge_dicts([speaker_dict_a, speaker_dict_b])
+    char_set = char_set_a | char_set_b
+    char_capital_set = char_capital_set_a | char_capital_set_b
+    word_count_dict_fisher = dict(
+        Counter(word_count_dict_a) + Counter(word_count_dict_b))
+
+    return read_trans(
+        label_paths=paths['trans'],
+        word_boundary_paths=paths['word'],
+        run_root_path='./',
+        vocab_file_save_path=mkdir_join('./config/vocab_files'),
+        save_vocab_file=True,
+        speaker_dict_fisher=speaker_dict,
+        char_set=char_set,
+        char_capital_set=char_capital_set,
+        word_count_dict=word_count_dict_fisher)
+
+
+def make_label_eval2000(paths):
+    """
+    Args:
+        paths (dict): the result of `scan`
+    Returns:
+        speaker_dict_dict (dict):
+            key => eval2000_swbd or eval2000_ch
+            value => speaker_dict
+    """
     print('---------- eval2000 (swbd + ch) ----------')
-    speaker_dict_dict['eval2000_swbd'], speaker_dict_dict['eval2000_ch'] = read_stm(
-        stm_path=path.stm_path,
-        pem_path=path.pem_path,
-        glm_path=path.glm_path,
+    speaker_dict_swbd, speaker_dict_ch = read_stm(
+        stm_path=paths['stm'],
+        pem_path=paths['pem'],
+        glm_path=paths['glm'],
         run_root_path='./')
+    return {'eval2000_swbd': speaker_dict_swbd,
+            'eval2000_ch': speaker_dict_ch}
+
+
+def split_shard(audio_paths, save_path):
+    """
+    Args:
+        audio_paths (list): paths to audio files of the training set
+        save_path (string): path to the directory of the whole outputs
+    Returns:
+        audio_paths (list): files of the shard
+        save_path (string): path to the directory of outputs of the shard
+    """
+    # NOTE: speakers are not split into shards
+    return prepare_shard(
+        audio_paths, save_path, args.shard_num, args.shard_index,
+        group_func=lambda p: basename(p).split('.')[0],
+        weight_func=lambda p: read_frame_num(p, args.tool, CONFIG))
+
+
+def extract(data_size, data_type, paths):
+    """Extract unnormalized features of wav files (and the other kinds of
+       features) into the feature store shared among data sizes.
+    Args:
+        data_size (string): 300h or 2000h
+        data_type (string): train or eval2000_swbd or eval2000_ch
+        paths (dict): the result of `scan`
+    Returns:
+        store_path (string): path to the feature store (None if features
+            are not shared)
+    """
+    if args.save_format not in ['numpy', 'htk'] or args.tool == 'htk' or \
+            not bool(args.share_features):
+        return None
+    store_path = mkdir_join(args.feature_save_path, 'raw')
+
+    audio_paths = paths['audio_' + data_type]
+    if data_type == 'train' and args.shard_num > 1:
+        if args.shard_index < 0:
+            # NOTE: features have been extracted by shards
+            return store_path
+        audio_paths, _ = split_shard(
+            audio_paths, mkdir_join(args.feature_save_path, args.save_format,
+                                    data_size, data_type))
+
+    fill_feature_store(
+        audio_paths, args.tool, [CONFIG] + EXTRA_CONFIGS, store_path,
+        num_workers=args.num_workers)
+    return store_path
+
+
+def make_input(data_size, data_type, paths, speaker_dict, store_path,
+               *unused):
+    """Read htk or wav files, and save input data and frame num dict.
+    Args:
+        data_size (string): 300h or 2000h
+        data_type (string): train or eval2000_swbd or eval2000_ch
+        paths (dict): the result of `scan`
+        speaker_dict (dict): the result of `make_label_train` or
+            `make_label_eval2000`
+        store_path (string): the result of `extract`
+    Returns:
+        frame_num_dict (dict)
+    """
+    if data_type != 'train':
+        speaker_dict = speaker_dict[data_type]
 
     ########################################
     # inputs
     ########################################
     print('\n=> Processing input data...')
+    print('---------- %s ----------' % data_type)
     input_save_path = mkdir_join(
         args.feature_save_path, args.save_format, data_size)
-    for data_type in ['train', 'eval2000_swbd', 'eval2000_ch']:
-        print('---------- %s ----------' % data_type)
-        if isfile(join(input_save_path, data_type, 'complete.txt')):
-            print('Already exists.')
-        else:
-            if args.save_format == 'wav':
-                ########################################
-                # Split WAV files per utterance
-                ########################################
-                if data_type == 'train':
-                    wav_paths = path.wav(corpus='swbd')
-                    if data_size == '2000h':
-                        wav_paths += path.wav(corpus='fisher')
-                else:
-                    wav_paths = path.wav(corpus=data_type)
-
-                split_wav(wav_paths=wav_paths,
-                          speaker_dict=speaker_dict_dict[data_type],
-                          save_path=mkdir_join(input_save_path, data_type))
-                # NOTE: ex.) save_path:
-                # swbd/feature/save_format/data_size/data_type/speaker/utt_name.npy
-
-            elif args.save_format in ['numpy', 'htk']:
-                if data_type == 'train':
-                    if args.tool == 'htk':
-                        audio_paths = path.htk(corpus='swbd')
-                        if data_size == '2000h':
-                            audio_paths += path.htk(corpus='fisher')
-                    else:
-                        audio_paths = path.wav(corpus='swbd')
-                        if data_size == '2000h':
-                            audio_paths += path.wav(corpus='fisher')
-                    is_training = True
-                    global_mean, global_std = None, None
-                else:
-                    if args.tool == 'htk':
-                        audio_paths = path.htk(corpus=data_type)
-                    else:
-                        audio_paths = path.wav(corpus=data_type)
-                    is_training = False
-
-                    # Load statistics over train dataset
-                    global_mean = np.load(
-                        join(input_save_path, 'train/global_mean.npy'))
-                    global_std = np.load(
-                        join(input_save_path, 'train/global_std.npy'))
-
-                read_audio(audio_paths=audio_paths,
-                           tool=args.tool,
-                           config=CONFIG,
-                           normalize=args.normalize,
-                           speaker_dict=speaker_dict_dict[data_type],
-                           is_training=is_training,
-                           save_path=mkdir_join(input_save_path, data_type),
-                           save_format=args.save_format,
-                           global_mean=global_mean,
-                           global_std=global_std)
-                # NOTE: ex.) save_path:
-                # swbd/feature/save_format/data_size/data_type/speaker/*.npy
-
-            # Make a confirmation file to prove that dataset was saved
-            # correctly
-            with open(join(input_save_path, data_type, 'complete.txt'), 'w') as f:
-                f.write('')
-
+    save_path = mkdir_join(input_save_path, data_type)
+    frame_num_dict = None
+    if args.save_format == 'wav':
         ########################################
-        # dataset (csv)
+        # Split WAV files per utterance
         ########################################
-        print('\n=> Saving dataset files...')
-        dataset_save_path = mkdir_join(
-            args.dataset_save_path, args.save_format, data_size, data_type)
-
-        print('---------- %s ----------' % data_type)
-        df_columns = ['frame_num', 'input_path', 'transcript']
-        df_char = pd.DataFrame([], columns=df_columns)
-        df_char_capital = pd.DataFrame([], columns=df_columns)
-        df_word_freq1 = pd.DataFrame([], columns=df_columns)
-        df_word_freq5 = pd.DataFrame([], columns=df_columns)
-        df_word_freq10 = pd.DataFrame([], columns=df_columns)
-        df_word_freq15 = pd.DataFrame([], columns=df_columns)
-
+        if bool(args.virtual_wav):
+            frame_num_dict = make_wav_manifest(
+                wav_paths=paths['audio_' + data_type],
+                speaker_dict=speaker_dict,
+                save_path=mkdir_join(input_save_path, data_type))
+            # NOTE: ex.) manifest:
+            # swbd/feature/save_format/data_size/data_type/wav_manifest.tsv
+        else:
+            split_wav(wav_paths=paths['audio_' + data_type],
+                      speaker_dict=speaker_dict,
+                      save_path=mkdir_join(input_save_path, data_type),
+                      num_workers=args.num_workers)
+        # NOTE: ex.) save_path:
+        # swbd/feature/save_format/data_size/data_type/speaker/utt_name.npy
+
+    elif args.save_format in ['numpy', 'htk']:
+        if data_type == 'train':
+            is_training = True
+            global_mean, global_std = None, None
+        else:
+            is_training = False
+
+            if args.normalize == 'no' and \
+                    args.precision not in ['int16', 'int8']:
+                # NOTE: features are normalized on load
+                global_mean, global_std = None, None
+            else:
+                # Load statistics over train dataset
+                global_mean = np.load(
+                    join(input_save_path, 'train/global_mean.npy'))
+                global_std = np.load(
+                    join(input_save_path, 'train/global_std.npy'))
+
+        audio_paths = paths['audio_' + data_type]
+        transport = None
+        if data_type == 'train' and args.shard_num > 1:
+            if args.shard_index < 0:
+                # Merge outputs of all shards
+                frame_num_dict = reduce_shards(save_path, args.shard_num)
+                with open(join(save_path, 'complete.txt'), 'w') as f:
+                    f.write('')
+                return frame_num_dict
+
+            audio_paths, save_path = split_shard(audio_paths, save_path)
+            if args.shard_transport != '':
+                # NOTE: payloads left by a run with another configuration
+                # or shards (ex. one which crashed) are not reduced
+                run_id = make_feature_hash(
+                    args.tool, CONFIG, args.normalize, args.precision,
+                    args.stats_sample_rate, args.stats_max_frames,
+                    args.shard_num, sorted(paths['audio_' + data_type]))
+                # NOTE: statistics are exchanged per data size
+                transport = make_transport(
+                    args.shard_transport,
+                    join(args.shard_address, data_size)
+                    if args.shard_transport == 'dir' else args.shard_address,
+                    args.shard_index, args.shard_num, run_id=run_id)
+
+        _, _, frame_num_dict = read_audio(
+            audio_paths=audio_paths,
+            tool=args.tool,
+            config=CONFIG,
+            normalize=args.normalize,
+            speaker_dict=speaker_dict,
+            is_training=is_training,
+            save_path=save_path,
+            save_format=args.save_format,
+            global_mean=global_mean,
+            global_std=global_std,
+            num_workers=args.num_workers,
+            store_path=store_path,
+            stats_sample_rate=args.stats_sample_rate,
+            stats_max_frames=args.stats_max_frames if args.stats_max_frames > 0 else None,
+            online_window=args.online_window,
+            transport=transport,
+            stack_frames=args.stack_frames,
+            skip_frames=args.skip_frames,
+            precision=args.precision)
+        # NOTE: ex.) save_path:
+        # swbd/feature/save_format/data_size/data_type/speaker/*.npy
+
+    # Make a confirmation file to prove that dataset was saved
+    # correctly
+    with open(join(save_path, 'complete.txt'), 'w') as f:
+        f.write('')
+
+    return frame_num_dict
+
+
+def make_dataset(data_size, data_type, speaker_dict, frame_num_dict):
+    """Save dataset files.
+    Args:
+        data_size (string): 300h or 2000h
+        data_type (string): train or eval2000_swbd or eval2000_ch
+        speaker_dict (dict): the result of `make_label_train` or
+            `make_label_eval2000`
+        frame_num_dict (dict): the result of `make_input`
+    """
+    if data_type != 'train':
+        speaker_dict = speaker_dict[data_type]
+    input_save_path = mkdir_join(
+        args.feature_save_path, args.save_format, data_size)
+    if frame_num_dict is None:
         with open(join(input_save_path, data_type, 'frame_num.pickle'), 'rb') as f:
             frame_num_dict = pickle.load(f)
 
-        utt_count = 0
-        df_char_list, df_char_capital_list = [], []
-        df_word_freq1_list, df_word_freq5_list = [], []
-        df_word_freq10_list, df_word_freq15_list = [], []
-        speaker_dict = speaker_dict_dict[data_type]
-        for speaker, utt_dict in tqdm(speaker_dict.items()):
-            for utt_index, utt_info in utt_dict.items():
-                if args.save_format == 'numpy':
-                    input_utt_save_path = join(
-                        input_save_path, data_type, speaker, speaker + '_' + utt_index + '.npy')
-                elif args.save_format == 'htk':
-                    input_utt_save_path = join(
-                        input_save_path, data_type, speaker, speaker + '_' + utt_index + '.htk')
-                elif args.save_format == 'wav':
-                    input_utt_save_path = path.utt2wav(utt_index)
-                else:
-                    raise ValueError('save_format is numpy or htk or wav.')
-
+    ########################################
+    # dataset (csv)
+    ########################################
+    print('\n=> Saving dataset files...')
+    dataset_save_path = mkdir_join(
+        args.dataset_save_path, args.save_format, data_size, data_type)
+
+    print('---------- %s ----------' % data_type)
+    df_columns = ['frame_num', 'input_path', 'transcript']
+    df_char = pd.DataFrame([], columns=df_columns)
+    df_char_capital = pd.DataFrame([], columns=df_columns)
+    df_word_freq1 = pd.DataFrame([], columns=df_columns)
+    df_word_freq5 = pd.DataFrame([], columns=df_columns)
+    df_word_freq10 = pd.DataFrame([], columns=df_columns)
+    df_word_freq15 = pd.DataFrame([], columns=df_columns)
+
+    manifest = None
+    if args.save_format == 'wav' and bool(args.virtual_wav):
+        manifest = WavManifest(
+            join(input_save_path, data_type, MANIFEST_NAME))
+
+    utt_count = 0
+    df_char_list, df_char_capital_list = [], []
+    df_word_freq1_list, df_word_freq5_list = [], []
+    df_word_freq10_list, df_word_freq15_list = [], []
+    for speaker, utt_dict in tqdm(speaker_dict.items()):
+        for utt_index, utt_info in utt_dict.items():
+            if args.save_format == 'numpy':
+                input_utt_save_path = join(
+                    input_save_path, data_type, speaker, speaker + '_' + utt_index + '.npy')
+            elif args.save_format == 'htk':
+                input_utt_save_path = join(
+                    input_save_path, data_type, speaker, speaker + '_' + utt_index + '.htk')
+            elif args.save_format == 'wav' and bool(args.virtual_wav):
+                input_utt_save_path = manifest.reference(
+                    speaker + '_' + utt_index)
+            elif args.save_format == 'wav':
+                input_utt_save_path = path.utt2wav(utt_index)
+            else:
+                raise ValueError('save_format is numpy or htk or wav.')
+
+            if manifest is None:
                 assert isfile(input_utt_save_path)
-                frame_num = frame_num_dict[speaker + '_' + utt_index]
-
-                char_indices, char_indices_capital, word_freq1_indices = utt_info[2:5]
-                word_freq5_indices, word_freq10_indices, word_freq15_indices = utt_info[5:8]
-
-                df_char = add_element(
-                    df_char, [frame_num, input_utt_save_path, char_indices])
-                df_char_capital = add_element(
-                    df_char_capital, [frame_num, input_utt_save_path, char_indices_capital])
-                df_word_freq1 = add_element(
-                    df_word_freq1, [frame_num, input_utt_save_path, word_freq1_indices])
-                df_word_freq5 = add_element(
-                    df_word_freq5, [frame_num, input_utt_save_path, word_freq5_indices])
-                df_word_freq10 = add_element(
-                    df_word_freq10, [frame_num, input_utt_save_path, word_freq10_indices])
-                df_word_freq15 = add_element(
-                    df_word_freq15, [frame_num, input_utt_save_path, word_freq15_indices])
-                utt_count += 1
-
-                # Reset
-                if utt_count == 10000:
-                    df_char_list.append(df_char)
-                    df_char_capital_list.append(df_char_capital)
-                    df_word_freq1_list.append(df_word_freq1)
-                    df_word_freq5_list.append(df_word_freq5)
-                    df_word_freq10_list.append(df_word_freq10)
-                    df_word_freq15_list.append(df_word_freq15)
-
-                    df_char = pd.DataFrame([], columns=df_columns)
-                    df_char_capital = pd.DataFrame([], columns=df_columns)
-                    df_word_freq1 = pd.DataFrame([], columns=df_columns)
-                    df_word_freq5 = pd.DataFrame([], columns=df_columns)
-                    df_word_freq10 = pd.DataFrame([], columns=df_columns)
-                    df_word_freq15 = pd.DataFrame([], columns=df_columns)
-                    utt_count = 0
-
-        # Last dataframe
-        df_char_list.append(df_char)
-        df_char_capital_list.append(df_char_capital)
-        df_word_freq1_list.append(df_word_freq1)
-        df_word_freq5_list.append(df_word_freq5)
-        df_word_freq10_list.append(df_word_freq10)
-        df_word_freq15_list.append(df_word_freq15)
-
-        # Concatenate all dataframes
-        df_char = df_char_list[0]
-        df_char_capital = df_char_capital_list[0]
-        df_word_freq1 = df_word_freq1_list[0]
-        df_word_freq5 = df_word_freq5_list[0]
-        df_word_freq10 = df_word_freq10_list[0]
-        df_word_freq15 = df_word_freq15_list[0]
-
-        for df_i in df_char_list[1:]:
-            df_char = pd.concat([df_char, df_i], axis=0)
-        for df_i in df_char_list[1:]:
-            df_char_capital = pd.concat([df_char_capital, df_i], axis=0)
-        for df_i in df_word_freq1_list[1:]:
-            df_word_freq1 = pd.concat([df_word_freq1, df_i], axis=0)
-        for df_i in df_word_freq5_list[1:]:
-            df_word_freq5 = pd.concat([df_word_freq5, df_i], axis=0)
-        for df_i in df_word_freq10_list[1:]:
-            df_word_freq10 = pd.concat([df_word_freq10, df_i], axis=0)
-        for df_i in df_word_freq15_list[1:]:
-            df_word_freq15 = pd.concat([df_word_freq15, df_i], axis=0)
-
-        df_char.to_csv(join(dataset_save_path, 'character.csv'))
-        df_char_capital.to_csv(
-            join(dataset_save_path, 'character_capital_divide.csv'))
-        df_word_freq1.to_csv(join(dataset_save_path, 'word_freq1.csv'))
-        df_word_freq5.to_csv(join(dataset_save_path, 'word_freq5.csv'))
-        df_word_freq10.to_csv(join(dataset_save_path, 'word_freq10.csv'))
-        df_word_freq15.to_csv(join(dataset_save_path, 'word_freq15.csv'))
+            frame_num = frame_num_dict[speaker + '_' + utt_index]
+
+            char_indices, char_indices_capital, word_freq1_indices = utt_info[2:5]
+            word_freq5_indices, word_freq10_indices, word_freq15_indices = utt_info[5:8]
+
+            df_char = add_element(
+                df_char, [frame_num, input_utt_save_path, char_indices])
+            df_char_capital = add_element(
+                df_char_capital, [frame_num, input_utt_save_path, char_indices_capital])
+            df_word_freq1 = add_element(
+                df_word_freq1, [frame_num, input_utt_save_path, word_freq1_indices])
+            df_word_freq5 = add_element(
+                df_word_freq5, [frame_num, input_utt_save_path, word_freq5_indices])
+            df_word_freq10 = add_element(
+                df_word_freq10, [frame_num, input_utt_save_path, word_freq10_indices])
+            df_word_freq15 = add_element(
+                df_word_freq15, [frame_num, input_utt_save_path, word_freq15_indices])
+            utt_count += 1
+
+            # Reset
+            if utt_count == 10000:
+                df_char_list.append(df_char)
+                df_char_capital_list.append(df_char_capital)
+                df_word_freq1_list.append(df_word_freq1)
+                df_word_freq5_list.append(df_word_freq5)
+                df_word_freq10_list.append(df_word_freq10)
+                df_word_freq15_list.append(df_word_freq15)
+
+                df_char = pd.DataFrame([], columns=df_columns)
+                df_char_capital = pd.DataFrame([], columns=df_columns)
+                df_word_freq1 = pd.DataFrame([], columns=df_columns)
+                df_word_freq5 = pd.DataFrame([], columns=df_columns)
+                df_word_freq10 = pd.DataFrame([], columns=df_columns)
+                df_word_freq15 = pd.DataFrame([], columns=df_columns)
+                utt_count = 0
+
+    # Last dataframe
+    df_char_list.append(df_char)
+    df_char_capital_list.append(df_char_capital)
+    df_word_freq1_list.append(df_word_freq1)
+    df_word_freq5_list.append(df_word_freq5)
+    df_word_freq10_list.append(df_word_freq10)
+    df_word_freq15_list.append(df_word_freq15)
+
+    # Concatenate all dataframes
+    df_char = df_char_list[0]
+    df_char_capital = df_char_capital_list[0]
+    df_word_freq1 = df_word_freq1_list[0]
+    df_word_freq5 = df_word_freq5_list[0]
+    df_word_freq10 = df_word_freq10_list[0]
+    df_word_freq15 = df_word_freq15_list[0]
+
+    for df_i in df_char_list[1:]:
+        df_char = pd.concat([df_char, df_i], axis=0)
+    for df_i in df_char_list[1:]:
+        df_char_capital = pd.concat([df_char_capital, df_i], axis=0)
+    for df_i in df_word_freq1_list[1:]:
+        df_word_freq1 = pd.concat([df_word_freq1, df_i], axis=0)
+    for df_i in df_word_freq5_list[1:]:
+        df_word_freq5 = pd.concat([df_word_freq5, df_i], axis=0)
+    for df_i in df_word_freq10_list[1:]:
+        df_word_freq10 = pd.concat([df_word_freq10, df_i], axis=0)
+    for df_i in df_word_freq15_list[1:]:
+        df_word_freq15 = pd.concat([df_word_freq15, df_i], axis=0)
+
+    df_char.to_csv(join(dataset_save_path, 'character.csv'))
+    df_char_capital.to_csv(
+        join(dataset_save_path, 'character_capital_divide.csv'))
+    df_word_freq1.to_csv(join(dataset_save_path, 'word_freq1.csv'))
+    df_word_freq5.to_csv(join(dataset_save_path, 'word_freq5.csv'))
+    df_word_freq10.to_csv(join(dataset_save_path, 'word_freq10.csv'))
+    df_word_freq15.to_csv(join(dataset_save_path, 'word_freq15.csv'))
 
 
 def merge_dicts(dicts):
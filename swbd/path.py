@@ -8,7 +8,8 @@ from __future__ import division
 from __future__ import print_function
 
 from os.path import join, basename
-from glob import glob
+
+from utils.catalog import Catalog
 
 
 class Path(object):
@@ -20,11 +21,13 @@ class Path(object):
         eval2000_trans_path (string): path to trans files of eval2000 corpus
         fisher_path (string): path to Fisher corpus
         run_root_path (string): path to ./make.sh
+        catalog_path (string, optional): path to save catalogs of files
+            in the corpora. If None, directories are scanned every time.
     """
 
     def __init__(self, swbd_audio_path, swbd_trans_path, eval2000_audio_path,
                  eval2000_trans_path, run_root_path, fisher_path=None,
-                 wav_save_path=None, htk_save_path=None):
+                 wav_save_path=None, htk_save_path=None, catalog_path=None):
 
         self.swbd_audio_path = swbd_audio_path
         self.swbd_trans_path = swbd_trans_path
@@ -33,6 +36,8 @@ class Path(object):
         self.fisher_path = fisher_path
         self.wav_save_path = wav_save_path
         self.htk_save_path = htk_save_path
+        self.catalog_path = catalog_path
+        self._catalogs = {}
         self.pem_path = None
         # NOTE: hub5e_00.pem file is a segmentation file
         self.stm_path = None
@@ -43,6 +48,18 @@ class Path(object):
 
         self.__make()
 
+    def _glob(self, root, pattern):
+        """
+        Args:
+            root (string): path to a directory
+            pattern (string): a pattern relative to root
+        Returns:
+            sorted paths to files matching the pattern
+        """
+        if root not in self._catalogs.keys():
+            self._catalogs[root] = Catalog(root, cache_path=self.catalog_path)
+        return self._catalogs[root].glob(pattern)
+
     def __make(self):
 
         self._sph_paths = {
@@ -72,12 +89,11 @@ class Path(object):
         if self.swbd_audio_path is not None:
             self.word_dict_path = join(
                 self.swbd_audio_path, 'sw-ms98-dict.text')
-            for sph_path in glob(join(self.swbd_audio_path, '*/data/*.sph')):
+            for sph_path in self._glob(self.swbd_audio_path, '*/data/*.sph'):
                 self._sph_paths['swbd'].append(sph_path)
 
         if self.swbd_trans_path is not None:
-            for trans_path in glob(join(self.swbd_trans_path,
-                                        '*/*/*.text')):
+            for trans_path in self._glob(self.swbd_trans_path, '*/*/*.text'):
                 if trans_path.split('.')[0][-4:] == 'word':
                     self._word_paths['swbd'].append(trans_path)
                 elif trans_path.split('.')[0][-5:] == 'trans':
@@ -87,17 +103,17 @@ class Path(object):
         # train (Fisher)
         ####################
         if self.fisher_path is not None:
-            for sph_path in glob(join(self.fisher_path, 'audio/*/*.sph')):
+            for sph_path in self._glob(self.fisher_path, 'audio/*/*.sph'):
                 self._sph_paths['fisher'].append(sph_path)
 
-            for trans_path in glob(join(self.fisher_path, 'data/trans/*/*.txt')):
+            for trans_path in self._glob(self.fisher_path, 'data/trans/*/*.txt'):
                 self._trans_paths['fisher'].append(trans_path)
 
         ########################################
         # test (eval2000)
         ########################################
         if self.eval2000_audio_path is not None:
-            for file_path in glob(join(self.eval2000_audio_path, 'english/*')):
+            for file_path in self._glob(self.eval2000_audio_path, 'english/*'):
                 file_name = basename(file_path)
                 if file_name[:2] == 'sw':
                     self._sph_paths['eval2000_swbd'].append(file_path)
@@ -107,7 +123,7 @@ class Path(object):
                     self.pem_path = file_path
 
         if self.eval2000_trans_path is not None:
-            for file_path in glob(join(self.eval2000_trans_path, 'reference/english/*')):
+            for file_path in self._glob(self.eval2000_trans_path, 'reference/english/*'):
                 file_name = basename(file_path)
                 if file_name[:2] == 'sw':
                     self._trans_paths['eval2000_swbd'].append(file_path)
@@ -140,19 +156,19 @@ class Path(object):
             raise ValueError('Set path to wav files.')
 
         if corpus == 'swbd':
-            return [p for p in glob(join(self.wav_save_path, 'swbd/*.wav'))]
+            return self._glob(self.wav_save_path, 'swbd/*.wav')
             # ex.) wav/swbd/
         elif corpus == 'fisher':
             if self.fisher_path is None:
                 raise ValueError('Set path to fisher corpus.')
 
-            return [p for p in glob(join(self.wav_save_path, 'fisher/*/*.wav'))]
+            return self._glob(self.wav_save_path, 'fisher/*/*.wav')
             # ex.) wav/fisher/speaker/*.wav
         elif corpus == 'eval2000_swbd':
-            return [p for p in glob(join(self.wav_save_path, 'eval2000/swbd/*.wav'))]
+            return self._glob(self.wav_save_path, 'eval2000/swbd/*.wav')
             # ex.) wav/eval2000/swbd/*.wav
         elif corpus == 'eval2000_ch':
-            return [p for p in glob(join(self.wav_save_path, 'eval2000/callhome/*.wav'))]
+            return self._glob(self.wav_save_path, 'eval2000/callhome/*.wav')
             # ex.) wav/eval2000/callhome/*.wav
         else:
             raise TypeError
@@ -169,19 +185,19 @@ class Path(object):
             raise ValueError('Set path to htk files.')
 
         if corpus == 'swbd':
-            return [p for p in glob(join(self.htk_save_path, 'swbd/*.htk'))]
+            return self._glob(self.htk_save_path, 'swbd/*.htk')
             # ex.) htk/swbd/
         elif corpus == 'fisher':
             if self.fisher_path is None:
                 raise ValueError('Set path to fisher corpus.')
 
-            return [p for p in glob(join(self.htk_save_path, 'fisher/*/*.htk'))]
+            return self._glob(self.htk_save_path, 'fisher/*/*.htk')
             # ex.) htk/fisher/speaker/*.htk
         elif corpus == 'eval2000_swbd':
-            return [p for p in glob(join(self.htk_save_path, 'eval2000/swbd/*.htk'))]
+            return self._glob(self.htk_save_path, 'eval2000/swbd/*.htk')
             # ex.) htk/eval2000/swbd/*.htk
         elif corpus == 'eval2000_ch':
-            return [p for p in glob(join(self.htk_save_path, 'eval2000/callhome/*.htk'))]
+            return self._glob(self.htk_save_path, 'eval2000/callhome/*.htk')
             # ex.) htk/eval2000/callhome/*.htk
         else:
             raise TypeError
@@ -8,21 +8,38 @@ from __future__ import division
 from __future__ import print_function
 
 from os.path import join, basename
+import shutil
 import numpy as np
 import pickle
 from tqdm import tqdm
 
 from utils.util import mkdir_join
-from utils.inputs.htk import read, write
-from utils.inputs.wav2feature_python_speech_features import wav2feature as w2f_psf
-from utils.inputs.wav2feature_librosa import wav2feature as w2f_librosa
+from utils.parallel import ParallelExecutor
+from utils.io_queue import AsyncWriter
+from utils.distributed import allreduce_sum
+from utils.inputs.ledger import Ledger, make_config_hash
+from utils.inputs.ledger import make_feature_hash
+from utils.inputs.frame_num import read_frame_num
+from utils.inputs.online_cmvn import online_cmvn
+from utils.inputs.dtype_policy import ACCUMULATOR_DTYPE, check_dtype
+from utils.inputs.dtype_policy import sum_frames, sum_squared_deviations
+from utils.inputs.frame_stacking import stack_frame, stacked_frame_num
+from utils.inputs.quantization import Quantizer, PRECISIONS
+from utils.inputs.quantization import standard_quantizer, save_quantizer
+from utils.inputs.statistics import Statistics, STATISTICS_NAME
+from utils.inputs.feature_extraction import FeatureExtractor, init_feature_worker
+from utils.inputs.feature_extraction import UTTERANCE_SLOT_BYTES
+from utils.inputs.feature_store import make_spill_path
 
 
 def read_audio(audio_paths, tool, config, normalize, is_training,
                save_path=None, save_format=None,
                global_mean_male=None, global_std_male=None,
                global_mean_female=None, global_std_female=None,
-               dtype=np.float32):
+               dtype=np.float32, num_workers=1, max_memory=None,
+               store_path=None, online_window=600, transport=None,
+               stack_frames=1, skip_frames=1, precision='float32',
+               batch_size=1):
     """Read audio files.
     Args:
         audio_paths (list): paths to audio files
@@ -30,14 +47,20 @@ def read_audio(audio_paths, tool, config, normalize, is_training,
             htk or librosa or python_speech_features
         config (dict): a configuration for feature extraction
         normalize (string):
-            no => normalization will be not conducted
+            no => normalization will be not conducted. Statistics per
+                  gender & speaker over the training set are saved to
+                  normalize features on load instead.
             global => normalize input features by global mean & std over
                       the training set per gender
             speaker => normalize input features by mean & std per speaker
             utterance => normalize input features by mean & std per utterancet
                          data by mean & std per utterance
+            online => normalize input features by mean & std over the past
+                      `online_window` frames with global mean & std over
+                      the training set as the prior
         is_training (bool, optional):  Set True when proccessing the training set
-        save_path (string): path to save npy files
+        save_path (string): path to save npy files. Utterances recorded in
+            the ledger there by an interrupted run are not saved again.
         save_format (string, optional): numpy as htk
         global_mean_male (np.ndarray, optional): global mean of male over
             the training set
@@ -48,6 +71,36 @@ def read_audio(audio_paths, tool, config, normalize, is_training,
         global_std_female (np.ndarray, optional): global standard
             deviation of female over the training set
         dtype (optional): the type of data, default is np.float32
+        num_workers (int, optional): the number of processes to extract
+            features. Files which fail are skipped and reported at the end.
+        max_memory (int, optional): the maximum number of utterances kept
+            in memory. If None, all utterances are loaded in advance.
+            Otherwise unnormalized features are loaded from store_path in
+            each pass. Without store_path, features of the training set
+            are spilled to disk in save_path in the first pass and removed
+            after the last one, which needs disk space for unnormalized
+            features instead of extracting them 3 times.
+        store_path (string, optional): path to the feature store.
+            Unnormalized features of each audio file are loaded from there
+            (and saved there if they are not stored yet).
+        online_window (int, optional): the number of frames to compute
+            mean & std if normalize is online
+        transport (Transport, optional): if given, statistics over the
+            training set are summed over all shards of the training set
+            through it before features are normalized
+        stack_frames (int, optional): the number of frames to stack into
+            one frame after normalization
+        skip_frames (int, optional): the number of frames to skip. The
+            number of frames is reduced to 1 / skip_frames.
+        precision (string, optional): the precision to save features in,
+            float32 or float16 or int16 or int8. Integers cover +-4 std of
+            features over the training set per dimension with equal steps. The
+            error per dimension is saved in quantization.npz.
+        batch_size (int, optional): the number of files to extract features
+            of at once. Frames of all files in a batch are transformed
+            together, which is faster for short utterances. Batches in
+            memory count as max_memory // 2 utterances (at least one
+            batch).
     Returns:
         global_mean_male (np.ndarray): global mean of male over the
             training set
@@ -61,126 +114,160 @@ def read_audio(audio_paths, tool, config, normalize, is_training,
             key => utterance name
             value => the number of frames
     """
-    if not is_training:
+    # NOTE: statistics over the training set are needed to normalize
+    # features, and to store them as integers
+    need_statistics = normalize != 'no' or precision in ['int16', 'int8']
+    if not is_training and need_statistics:
         if global_mean_male is None or global_std_male is None:
             raise ValueError(
                 'Set global mean & std computed over the training set.')
-    if normalize not in ['global', 'speaker', 'utterance', 'no']:
+    if normalize not in ['global', 'speaker', 'utterance', 'online', 'no']:
         raise ValueError(
-            'normalize must be "utterance" or "speaker" or "global" or "no".')
+            'normalize must be "utterance" or "speaker" or "global" or "online" or "no".')
+    if (stack_frames > 1 or skip_frames > 1) and normalize == 'no':
+        raise ValueError('Frames are stacked after normalization. Set '
+                         'normalize except no to stack frames.')
+    if precision not in PRECISIONS:
+        raise ValueError(
+            'precision must be "float32" or "float16" or "int16" or "int8".')
+    if save_format == 'htk' and precision in ['float16', 'int8']:
+        raise ValueError('HTK files are saved as float32 or int16.')
+    if max_memory is not None and max_memory < 2:
+        raise ValueError('max_memory must be larger than 1.')
+
+    ledger = None
+    if save_path is not None:
+        if is_training:
+            config_hash = make_feature_hash(tool, config, normalize)
+        else:
+            config_hash = make_feature_hash(
+                tool, config, normalize, global_mean_male, global_std_male,
+                global_mean_female, global_std_female)
+        if stack_frames > 1 or skip_frames > 1:
+            config_hash = make_config_hash(
+                config_hash, stack_frames, skip_frames)
+        if precision != 'float32':
+            config_hash = make_config_hash(config_hash, precision)
+        ledger = Ledger(save_path, save_format, config_hash)
 
-    # Read each audio file
-    print('=====> Reading audio files...')
-    audio_paths_male, audio_paths_female = [], []
-    input_data_list_male, input_data_list_female = [], []
     total_frame_num_male, total_frame_num_female = 0, 0
     total_frame_num_dict = {}
     speaker_mean_dict, speaker_std_dict = {}, {}
-    for audio_path in tqdm(audio_paths):
-        speaker = audio_path.split('/')[-2]
-        gender = speaker[0]  # f (female) or m (male)
-        utt_index = basename(audio_path).split('.')[0]
+    # NOTE: features of a batch are handed over in one slot
+    slot_bytes = UTTERANCE_SLOT_BYTES * batch_size
+    # NOTE: files are written in background threads
+    if max_memory is None:
+        executor = ParallelExecutor(num_workers=num_workers,
+                                    initializer=init_feature_worker,
+                                    initargs=(tool, config),
+                                    slot_bytes=slot_bytes)
+        writer = AsyncWriter()
+        # NOTE: Load all data in advance because TIMIT is a small dataset.
+        input_data_list = []
+    else:
+        # NOTE: a half of utterances is for reading, the rest for writing
+        executor = ParallelExecutor(num_workers=num_workers,
+                                    initializer=init_feature_worker,
+                                    initargs=(tool, config),
+                                    slot_bytes=slot_bytes,
+                                    max_pending=max(max_memory // 2 // batch_size, 1))
+        writer = AsyncWriter(max_pending=max_memory - max_memory // 2)
+        input_data_list = None
+    spill_path = None
+    if store_path is None and max_memory is not None and tool != 'htk' \
+            and is_training and need_statistics:
+        # NOTE: features are extracted in the first pass only
+        spill_path = make_spill_path(save_path)
+        store_path = spill_path
+    extractor = FeatureExtractor(tool, config, store_path, dtype)
 
-        if tool == 'htk':
-            input_utt, sampPeriod, parmKind = read(audio_path)
-            # NOTE: audio_path is a htk file path in this case
-        elif tool == 'python_speech_features':
-            input_utt = w2f_psf(
-                audio_path,
-                feature_type=config['feature_type'],
-                feature_dim=config['channels'],
-                use_energy=config['energy'],
-                use_delta1=config['delta'],
-                use_delta2=config['deltadelta'],
-                window=config['window'],
-                slide=config['slide'])
-        elif tool == 'librosa':
-            input_utt = w2f_librosa(
-                audio_path,
-                feature_type=config['feature_type'],
-                feature_dim=config['channels'],
-                use_energy=config['energy'],
-                use_delta1=config['delta'],
-                use_delta2=config['deltadelta'],
-                window=config['window'],
-                slide=config['slide'])
-
-        # for debug
-        # print(input_utt.shape)
-
-        if gender == 'm':
-            input_data_list_male.append(input_utt)
-            audio_paths_male.append(audio_path)
-        elif gender == 'f':
-            input_data_list_female.append(input_utt)
-            audio_paths_female.append(audio_path)
-        else:
-            raise ValueError('gender is m or f.')
-
-        if is_training:
+    # Loop 1: Read each audio file and compute mean
+    if input_data_list is not None or (is_training and need_statistics):
+        print('=====> Reading audio files...')
+        for audio_path, input_utt, sampPeriod, parmKind in _iter_features(
+                executor, extractor, audio_paths, None, batch_size):
             speaker = audio_path.split('/')[-2]
-            gender = speaker[0]
-            frame_num_utt, feat_dim = input_utt.shape
-
-            if gender == 'm':
-                total_frame_num_male += frame_num_utt
-            elif gender == 'f':
-                total_frame_num_female += frame_num_utt
-            else:
+            gender = speaker[0]  # f (female) or m (male)
+            if gender not in ['m', 'f']:
                 raise ValueError('gender is m or f.')
 
-            if normalize == 'speaker':
-                # Initialization
-                if speaker not in total_frame_num_dict.keys():
-                    total_frame_num_dict[speaker] = 0
-                    speaker_mean_dict[speaker] = np.zeros((feat_dim,),
-                                                          dtype=dtype)
-                    speaker_std_dict[speaker] = np.zeros((feat_dim,),
-                                                         dtype=dtype)
-
-                total_frame_num_dict[speaker] += frame_num_utt
-                speaker_mean_dict[speaker] += np.sum(input_utt, axis=0)
-    # NOTE: Load all data in advance because TIMIT is a small dataset.
-
-    if is_training and normalize != 'no':
+            # for debug
+            # print(input_utt.shape)
+
+            if input_data_list is not None:
+                # NOTE: copy from the shared memory to keep features of all
+                # files
+                input_data_list.append(
+                    (audio_path, np.array(input_utt), sampPeriod, parmKind))
+
+            if is_training and need_statistics:
+                frame_num_utt, feat_dim = input_utt.shape
+
+                if global_mean_male is None:
+                    # Initialize global statistics
+                    global_mean_male = np.zeros(
+                        (feat_dim,), dtype=ACCUMULATOR_DTYPE)
+                    global_mean_female = np.zeros(
+                        (feat_dim,), dtype=ACCUMULATOR_DTYPE)
+                    global_std_male = np.zeros(
+                        (feat_dim,), dtype=ACCUMULATOR_DTYPE)
+                    global_std_female = np.zeros(
+                        (feat_dim,), dtype=ACCUMULATOR_DTYPE)
+
+                if gender == 'm':
+                    global_mean_male += sum_frames(input_utt)
+                    total_frame_num_male += frame_num_utt
+                else:
+                    global_mean_female += sum_frames(input_utt)
+                    total_frame_num_female += frame_num_utt
+
+                if normalize == 'speaker':
+                    # Initialization
+                    if speaker not in total_frame_num_dict.keys():
+                        total_frame_num_dict[speaker] = 0
+                        speaker_mean_dict[speaker] = np.zeros(
+                            (feat_dim,), dtype=ACCUMULATOR_DTYPE)
+                        speaker_std_dict[speaker] = np.zeros(
+                            (feat_dim,), dtype=ACCUMULATOR_DTYPE)
+
+                    total_frame_num_dict[speaker] += frame_num_utt
+                    speaker_mean_dict[speaker] += sum_frames(input_utt)
+
+    # Loop 2: Compute global mean & std per gender
+    if is_training and need_statistics:
         # Compute speaker mean
         if normalize == 'speaker':
             for speaker in speaker_mean_dict.keys():
                 speaker_mean_dict[speaker] /= total_frame_num_dict[speaker]
 
-        # Compute global mean & std per gender
         print('=====> Computing global mean & std over the training set...')
-        frame_offset = 0
-        feat_dim = input_data_list_male[0].shape[1]
-        train_data_male = np.empty((total_frame_num_male, feat_dim))
-        train_data_female = np.empty((total_frame_num_female, feat_dim))
-        # male
-        for input_utt, audio_path in zip(tqdm(input_data_list_male),
-                                         audio_paths_male):
+        if transport is not None:
+            # Sum statistics over all shards
+            (global_mean_male, total_frame_num_male, global_mean_female,
+             total_frame_num_female) = allreduce_sum(
+                transport, [global_mean_male, total_frame_num_male,
+                            global_mean_female, total_frame_num_female],
+                tag='mean', dtype=ACCUMULATOR_DTYPE)
+            if global_std_male is None:
+                # NOTE: no files in this shard
+                global_std_male = np.zeros_like(global_mean_male)
+                global_std_female = np.zeros_like(global_mean_female)
+        global_mean_male /= total_frame_num_male
+        global_mean_female /= total_frame_num_female
+        for audio_path, input_utt, _, _ in _iter_features(
+                executor, extractor, audio_paths, input_data_list, batch_size):
             speaker = audio_path.split('/')[-2]
-            frame_num_utt = input_utt.shape[0]
-            train_data_male[frame_offset:frame_offset +
-                            frame_num_utt] = input_utt
-            frame_offset += frame_num_utt
 
-            if normalize == 'speaker':
-                speaker_std_dict[speaker] += np.sum(
-                    np.abs(input_utt -
-                           speaker_mean_dict[speaker]) ** 2, axis=0)
-        # female
-        frame_offset = 0
-        for input_utt, audio_path in zip(tqdm(input_data_list_female),
-                                         audio_paths_female):
-            speaker = audio_path.split('/')[-2]
-            frame_num_utt = input_utt.shape[0]
-            train_data_female[frame_offset:frame_offset +
-                              frame_num_utt] = input_utt
-            frame_offset += frame_num_utt
+            if speaker[0] == 'm':
+                global_std_male += sum_squared_deviations(
+                    input_utt, global_mean_male)
+            else:
+                global_std_female += sum_squared_deviations(
+                    input_utt, global_mean_female)
 
             if normalize == 'speaker':
-                speaker_std_dict[speaker] += np.sum(
-                    np.abs(input_utt -
-                           speaker_mean_dict[speaker]) ** 2, axis=0)
+                speaker_std_dict[speaker] += sum_squared_deviations(
+                    input_utt, speaker_mean_dict[speaker])
 
         # Compute speaker std
         if normalize == 'speaker':
@@ -188,10 +275,20 @@ def read_audio(audio_paths, tool, config, normalize, is_training,
                 speaker_std_dict[speaker] = np.sqrt(
                     speaker_std_dict[speaker] / (total_frame_num_dict[speaker] - 1))
 
-        global_mean_male = np.mean(train_data_male, axis=0)
-        global_std_male = np.std(train_data_male, axis=0)
-        global_mean_female = np.mean(train_data_female, axis=0)
-        global_std_female = np.std(train_data_female, axis=0)
+        if transport is not None:
+            global_std_male, global_std_female = allreduce_sum(
+                transport, [global_std_male, global_std_female], tag='std',
+                dtype=ACCUMULATOR_DTYPE)
+        global_std_male = np.sqrt(global_std_male / total_frame_num_male)
+        global_std_female = np.sqrt(
+            global_std_female / total_frame_num_female)
+
+        # NOTE: statistics are accumulated in float64, and features are
+        # normalized in dtype
+        global_mean_male = global_mean_male.astype(dtype)
+        global_mean_female = global_mean_female.astype(dtype)
+        global_std_male = global_std_male.astype(dtype)
+        global_std_female = global_std_female.astype(dtype)
 
         if save_path is not None:
             # Save global mean & std
@@ -204,17 +301,63 @@ def read_audio(audio_paths, tool, config, normalize, is_training,
             np.save(join(save_path, 'global_std_female.npy'),
                     global_std_female)
 
-    # Save input features as npy files
+    quantizer = None
+    if save_path is not None and precision == 'float16':
+        quantizer = Quantizer(precision)
+    elif save_path is not None and precision != 'float32':
+        if normalize == 'no':
+            # NOTE: unnormalized features of both genders are stored in the
+            # range over the training set
+            quantizer = standard_quantizer(
+                precision, [global_mean_male, global_mean_female],
+                [global_std_male, global_std_female])
+        else:
+            # NOTE: features normalized by the statistics have zero mean
+            # and unit variance
+            feature_dim = global_mean_male.shape[0] * stack_frames
+            quantizer = standard_quantizer(
+                precision, np.zeros(feature_dim), np.ones(feature_dim))
+
+    # Loop 3: Normalization and saving input features as npy files
     print('=====> Normalization...')
+    if spill_path is not None:
+        # NOTE: features spilled in the first pass are loaded
+        extractor = FeatureExtractor(tool, config, spill_path, dtype,
+                                     update_store=False)
     frame_num_dict = {}
-    for input_utt, audio_path in zip(tqdm(input_data_list_male + input_data_list_female),
-                                     audio_paths_male + audio_paths_female):
+    statistics = None
+    if is_training and normalize == 'no' and save_path is not None:
+        # NOTE: statistics need all utterances including saved ones
+        statistics = Statistics(key_funcs={
+            'gender': lambda speaker: speaker[0],
+            'speaker': lambda speaker: speaker})
+    elif ledger is not None:
+        # Skip utterances saved by an interrupted run
+        audio_paths = [p for p in audio_paths
+                       if not ledger.is_done(_utt_name(p))]
+        if input_data_list is not None:
+            input_data_list = [x for x in input_data_list
+                               if not ledger.is_done(_utt_name(x[0]))]
+    for audio_path, input_utt, sampPeriod, parmKind in _iter_features(
+            executor, extractor, audio_paths, input_data_list, batch_size):
         speaker = audio_path.split('/')[-2]
         utt_index = basename(audio_path).split('.')[0]
         gender = speaker[0]
 
+        if statistics is not None:
+            statistics.add(input_utt, speaker)
+
         if normalize == 'no':
             pass
+        elif normalize == 'online':
+            # Normalize by mean & std over the past frames
+            if gender == 'm':
+                prior_mean, prior_std = global_mean_male, global_std_male
+            else:
+                prior_mean, prior_std = global_mean_female, global_std_female
+            input_utt = online_cmvn(
+                input_utt, window=online_window, prior_mean=prior_mean,
+                prior_std=prior_std, dtype=dtype)
         elif normalize == 'global' or not is_training:
             # Normalize by global mean & std over the training set
             if gender == 'm':
@@ -231,32 +374,104 @@ def read_audio(audio_paths, tool, config, normalize, is_training,
             input_utt /= speaker_std_dict[speaker]
         elif normalize == 'utterance':
             # Normalize by mean & std per utterance
-            utt_mean = np.mean(input_utt, axis=0, dtype=dtype)
-            utt_std = np.std(input_utt, axis=0, dtype=dtype)
+            utt_mean = np.mean(input_utt, axis=0,
+                               dtype=ACCUMULATOR_DTYPE).astype(dtype)
+            utt_std = np.std(input_utt, axis=0,
+                             dtype=ACCUMULATOR_DTYPE).astype(dtype)
             input_utt = (input_utt - utt_mean) / utt_std
         else:
             raise ValueError
 
+        check_dtype(input_utt, dtype, 'normalization')
+
+        if stack_frames > 1 or skip_frames > 1:
+            # Stack frames after normalization
+            input_utt = stack_frame(input_utt, stack_frames, skip_frames)
+
         frame_num_dict[speaker + '_' + utt_index] = input_utt.shape[0]
 
-        if save_path is not None:
+        if save_path is not None and not ledger.is_done(speaker + '_' + utt_index):
             # Save input features
             if save_format == 'numpy':
-                np.save(mkdir_join(save_path, speaker, speaker + '_' +
-                                   utt_index + '.npy'), input_utt)
-            elif save_format == 'htk':
-                write(input_utt,
-                      htk_path=mkdir_join(
-                          save_path, speaker, speaker + '_' + utt_index + '.htk'),
-                      sampPeriod=sampPeriod,
-                      parmKind=parmKind)
+                input_data_save_path = mkdir_join(
+                    save_path, speaker, speaker + '_' + utt_index + '.npy')
             else:
-                raise ValueError('save_format is numpy or htk.')
+                input_data_save_path = mkdir_join(
+                    save_path, speaker, speaker + '_' + utt_index + '.htk')
+            writer.submit(ledger.save, speaker + '_' + utt_index,
+                          input_data_save_path, input_utt,
+                          sampPeriod if sampPeriod is None else sampPeriod * skip_frames,
+                          parmKind, quantizer=quantizer)
+    writer.close()
+    if spill_path is not None:
+        shutil.rmtree(spill_path)
+    if quantizer is not None:
+        save_quantizer(quantizer, save_path, ledger.config_hash)
+
+    if statistics is not None:
+        statistics.save(join(save_path, STATISTICS_NAME))
 
     if save_path is not None:
+        # Rebuild the frame number dictionary including the interrupted run
+        frame_num_dict = ledger.frame_num_dict()
+
         # Save the frame number dictionary
         with open(join(save_path, 'frame_num.pickle'), 'wb') as f:
             pickle.dump(frame_num_dict, f)
 
+    executor.report(save_path=None if save_path is None else join(
+        save_path, 'failed_files.txt'))
+
     return (global_mean_male, global_std_male,
             global_mean_female, global_std_female, frame_num_dict)
+
+
+def make_frame_num_dict(audio_paths, tool, config,
+                        skip_frames=1):
+    """Count frames of each utterance from headers of audio files. The
+       result is the same as frame_num_dict of `read_audio`, but it is
+       available before features are extracted.
+    Args:
+        audio_paths (list): paths to HTK or WAV files
+        tool (string): htk or python_speech_features or librosa
+        config (dict): a configuration for feature extraction
+        skip_frames (int, optional): the number of frames to skip in
+            `read_audio`
+    Returns:
+        frame_num_dict (dict):
+            key => utt_name
+            value => the number of frames
+    """
+    return {_utt_name(audio_path): stacked_frame_num(
+        read_frame_num(audio_path, tool, config), skip_frames)
+        for audio_path in audio_paths}
+
+
+def _utt_name(audio_path):
+    speaker = audio_path.split('/')[-2]
+    return speaker + '_' + basename(audio_path).split('.')[0]
+
+
+def _iter_features(executor, extractor, audio_paths, input_data_list,
+                   batch_size):
+    """Iterate features kept in memory or extract them again.
+    Args:
+        executor (ParallelExecutor):
+        extractor (FeatureExtractor):
+        audio_paths (list): paths to audio files
+        input_data_list (list): tuples of
+            (audio_path, input_utt, sampPeriod, parmKind), or None
+        batch_size (int): the number of files to extract features of at
+            once
+    Yields:
+        audio_path, input_utt, sampPeriod, parmKind
+    """
+    if input_data_list is not None:
+        for audio_path, input_utt, sampPeriod, parmKind in tqdm(
+                input_data_list):
+            yield audio_path, input_utt, sampPeriod, parmKind
+    else:
+        for audio_path, (input_utt, sampPeriod, parmKind) in \
+                executor.imap_batched(extractor, extractor.extract_batch,
+                                      audio_paths, batch_size):
+            yield audio_path, input_utt, sampPeriod, parmKind
@@ -9,6 +9,7 @@ from __future__ import print_function
 
 from os.path import join, isfile
 import sys
+from functools import partial
 import argparse
 from tqdm import tqdm
 import numpy as np
@@ -22,6 +23,10 @@ from timit.transcript_phone import read_phone
 from timit.input_data import read_audio
 from utils.util import mkdir_join
 from utils.dataset import add_element
+from utils.pipeline import Pipeline
+from utils.inputs.feature_store import FeatureStore
+from utils.inputs.ledger import FEATURE_VERSIONS
+from utils.inputs.feature_extraction import fill_feature_store
 
 parser = argparse.ArgumentParser()
 parser.add_argument('--data_path', type=str, help='path to TIMIT dataset')
@@ -34,7 +39,9 @@ parser.add_argument('--tool', type=str,
                     choices=['htk', 'python_speech_features', 'librosa'])
 parser.add_argument('--htk_save_path', type=str, help='path to save htk files')
 parser.add_argument('--normalize', type=str,
-                    choices=['global', 'speaker', 'utterance', 'no'])
+                    choices=['global', 'speaker', 'utterance', 'online', 'no'],
+                    help='If no, unnormalized features are saved with ' +
+                    'statistics to normalize them on load in any mode.')
 parser.add_argument('--save_format', type=str, choices=['numpy', 'htk', 'wav'])
 
 parser.add_argument('--feature_type', type=str, choices=['fbank', 'mfcc'])
@@ -47,11 +54,36 @@ parser.add_argument('--energy', type=int, help='if 1, add the energy feature')
 parser.add_argument('--delta', type=int, help='if 1, add the energy feature')
 parser.add_argument('--deltadelta', type=int,
                     help='if 1, double delta features are also extracted')
+parser.add_argument('--num_workers', type=int, default=1,
+                    help='the number of processes to extract features')
+parser.add_argument('--batch_size', type=int, default=8,
+                    help='the number of utterances to extract features of ' +
+                    'at once. Frames of all of them are transformed together.')
+parser.add_argument('--share_features', type=int, default=0,
+                    help='If 1, unnormalized features are extracted once ' +
+                    'into feature_save_path/raw, and reused when only the ' +
+                    'normalization changes.')
+parser.add_argument('--max_memory', type=int, default=0,
+                    help='the maximum number of utterances kept in memory. ' +
+                    'If 0, memory usage is not bounded.')
+parser.add_argument('--online_window', type=int, default=600,
+                    help='the number of past frames to compute mean & ' +
+                    'std if normalize is online')
+parser.add_argument('--stack_frames', type=int, default=1,
+                    help='the number of frames to stack into one frame')
+parser.add_argument('--skip_frames', type=int, default=1,
+                    help='the number of frames to skip. The frame rate is ' +
+                    'reduced to 1 / skip_frames.')
+parser.add_argument('--precision', type=str, default='float32',
+                    choices=['float32', 'float16', 'int16', 'int8'],
+                    help='the precision to save features in. HTK files ' +
+                    'are saved as float32 or int16 (compressed).')
 
 args = parser.parse_args()
 path = Path(data_path=args.data_path,
             config_path=args.config_path,
-            htk_save_path=args.htk_save_path)
+            htk_save_path=args.htk_save_path,
+            catalog_path=join(args.dataset_save_path, '.catalog'))
 
 CONFIG = {
     'feature_type': args.feature_type,
@@ -66,166 +98,331 @@ CONFIG = {
 
 if args.save_format == 'htk':
     assert args.tool == 'htk'
+if (args.stack_frames > 1 or args.skip_frames > 1) and \
+        (args.save_format == 'wav' or args.normalize == 'no'):
+    raise ValueError('Frames are stacked after normalization. Set '
+                     'save_format numpy or htk and normalize except no.')
+if args.precision != 'float32' and args.save_format == 'wav':
+    raise ValueError('Only features are saved with reduced precision.')
+
+VOCAB_FILE_SAVE_PATH = join('./config', 'vocab_files')
+DATASET_NAMES = ['character', 'character_capital_divide',
+                 'phone61', 'phone48', 'phone39']
 
 
 def main():
 
+    pipeline = Pipeline(cache_path=mkdir_join(
+        args.dataset_save_path, args.save_format, '.cache'))
+    extract_config = {
+        'tool': args.tool,
+        'version': FEATURE_VERSIONS[args.tool],
+        'save_format': args.save_format,
+        'feature_save_path': args.feature_save_path,
+        'config': CONFIG,
+        'share_features': args.share_features
+    }
+    feature_config = {
+        'tool': args.tool,
+        'version': FEATURE_VERSIONS[args.tool],
+        'normalize': args.normalize,
+        'save_format': args.save_format,
+        'feature_save_path': args.feature_save_path,
+        'config': CONFIG,
+        'online_window': args.online_window
+    }
+    if args.stack_frames > 1 or args.skip_frames > 1:
+        feature_config['stack'] = [args.stack_frames, args.skip_frames]
+    if args.precision != 'float32':
+        feature_config['precision'] = args.precision
     for data_type in ['train', 'dev', 'test']:
-        print('=' * 50)
-        print(' ' * 20 + data_type + ' ' * 20)
-        print('=' * 50)
-
-        ########################################
-        # inputs
-        ########################################
-        print('=> Processing input data...')
+        pipeline.add('path_' + data_type, partial(scan, data_type),
+                     always=True)
+        # NOTE: vocabulary files are saved by the stages of the training set
+        vocab_inputs = [] if data_type == 'train' else ['char_train']
+        vocab_outputs = [] if data_type != 'train' else [
+            join(VOCAB_FILE_SAVE_PATH, name + '.txt')
+            for name in ['character', 'character_capital_divide']]
+        pipeline.add('char_' + data_type, partial(make_char, data_type),
+                     inputs=['path_' + data_type] + vocab_inputs,
+                     outputs=vocab_outputs)
+        vocab_inputs = [] if data_type == 'train' else ['phone_train']
+        vocab_outputs = [] if data_type != 'train' else [
+            join(VOCAB_FILE_SAVE_PATH, name + '.txt')
+            for name in ['phone61', 'phone48', 'phone39']]
+        pipeline.add('phone_' + data_type, partial(make_phone, data_type),
+                     inputs=['path_' + data_type] + vocab_inputs,
+                     outputs=vocab_outputs)
+        store_outputs = []
+        if args.save_format in ['numpy', 'htk'] and args.tool != 'htk' and \
+                bool(args.share_features):
+            store_outputs = [FeatureStore(
+                join(args.feature_save_path, 'raw'), args.tool,
+                CONFIG).store_path]
+        # NOTE: with share_features, unnormalized features are extracted
+        # once, and normalized again when only the normalization changes
+        pipeline.add('extract_' + data_type, partial(extract, data_type),
+                     inputs=['path_' + data_type], config=extract_config,
+                     outputs=store_outputs)
+        input_outputs = []
         if args.save_format in ['numpy', 'htk']:
-            input_save_path = mkdir_join(
-                args.feature_save_path, args.save_format)
-            if isfile(join(input_save_path, data_type, 'complete.txt')):
-                print('Already exists.')
-            else:
-                if args.tool == 'htk':
-                    audio_paths = path.htk(data_type=data_type)
-                else:
-                    audio_paths = path.wav(data_type=data_type)
-
-                if data_type != 'train':
-                    is_training = False
-
-                    # Load statistics over train dataset
-                    global_mean_male = np.load(
-                        join(input_save_path, 'train/global_mean_male.npy'))
-                    global_std_male = np.load(
-                        join(input_save_path, 'train/global_std_male.npy'))
-                    global_mean_female = np.load(
-                        join(input_save_path, 'train/global_mean_female.npy'))
-                    global_std_female = np.load(
-                        join(input_save_path, 'train/global_std_female.npy'))
-                else:
-                    is_training = True
-                    global_mean_male, global_std_male, global_mean_female, global_std_female = None, None, None, None
-
-                # Read htk or wav files, and save input data and frame num dict
-                read_audio(audio_paths=audio_paths,
-                           tool=args.tool,
-                           config=CONFIG,
-                           normalize=args.normalize,
-                           is_training=is_training,
-                           save_path=mkdir_join(input_save_path, data_type),
-                           save_format=args.save_format,
-                           global_mean_male=global_mean_male,
-                           global_std_male=global_std_male,
-                           global_mean_female=global_mean_female,
-                           global_std_female=global_std_female)
-                # NOTE: ex.) save_path:
-                # timit/feature/save_format/data_type/*.npy
-
-            # Make a confirmation file to prove that dataset was saved
-            # correctly
-            with open(join(input_save_path, data_type, 'complete.txt'), 'w') as f:
-                f.write('')
-
-        ########################################
-        # labels (character)
-        ########################################
-        print('\n=> Processing transcripts (char)...')
-        save_vocab_file = True if data_type == 'train' else False
-        is_test = True if data_type == 'test' else False
-        trans_dict = read_char(
-            label_paths=path.trans(data_type=data_type),
-            vocab_file_save_path=mkdir_join('./config', 'vocab_files'),
-            save_vocab_file=save_vocab_file,
-            is_test=is_test)
-
-        ########################################
-        # dataset (character, csv)
-        ########################################
-        print('\n=> Saving dataset files (char)...')
-        dataset_save_path = mkdir_join(
-            args.dataset_save_path, args.save_format, data_type)
-        df_columns = ['frame_num', 'input_path', 'transcript']
-        df_char = pd.DataFrame([], columns=df_columns)
-        df_char_capital = pd.DataFrame([], columns=df_columns)
-
+            input_outputs = [join(args.feature_save_path, args.save_format,
+                                  data_type, 'complete.txt')]
+        stat_inputs = [] if data_type == 'train' else ['input_train']
+        pipeline.add('input_' + data_type, partial(make_input, data_type),
+                     inputs=['path_' + data_type,
+                             'extract_' + data_type] + stat_inputs,
+                     config=feature_config, outputs=input_outputs)
+        pipeline.add('dataset_' + data_type, partial(make_dataset, data_type),
+                     inputs=['char_' + data_type, 'phone_' + data_type,
+                             'input_' + data_type],
+                     config={'dataset_save_path': args.dataset_save_path},
+                     outputs=[join(args.dataset_save_path, args.save_format,
+                                   data_type, name + '.csv')
+                              for name in DATASET_NAMES])
+    pipeline.run()
+
+
+def scan(data_type):
+    """Collect paths to audio and transcript files.
+    Args:
+        data_type (string): train or dev or test
+    Returns:
+        paths (dict): lists of paths
+    """
+    if args.tool == 'htk':
+        audio_paths = path.htk(data_type=data_type)
+    else:
+        audio_paths = path.wav(data_type=data_type)
+    return {'audio': audio_paths,
+            'char': path.trans(data_type=data_type),
+            'phone': path.phone(data_type=data_type)}
+
+
+def extract(data_type, paths):
+    """Extract unnormalized features of wav files into the feature store.
+    Args:
+        data_type (string): train or dev or test
+        paths (dict): the result of `scan`
+    Returns:
+        store_path (string): path to the feature store (None if features
+            are not shared)
+    """
+    if args.save_format not in ['numpy', 'htk'] or args.tool == 'htk' or \
+            not bool(args.share_features):
+        return None
+    store_path = mkdir_join(args.feature_save_path, 'raw')
+    fill_feature_store(paths['audio'], args.tool, [CONFIG], store_path,
+                       num_workers=args.num_workers,
+                       batch_size=args.batch_size)
+    return store_path
+
+
+def make_input(data_type, paths, store_path, *unused):
+    """Read htk or wav files, and save input data and frame num dict.
+    Args:
+        data_type (string): train or dev or test
+        paths (dict): the result of `scan`
+        store_path (string): the result of `extract`
+    Returns:
+        frame_num_dict (dict)
+    """
+    print('=' * 50)
+    print(' ' * 20 + data_type + ' ' * 20)
+    print('=' * 50)
+
+    ########################################
+    # inputs
+    ########################################
+    print('=> Processing input data...')
+    if args.save_format not in ['numpy', 'htk']:
+        return None
+
+    input_save_path = mkdir_join(args.feature_save_path, args.save_format)
+    if data_type != 'train':
+        is_training = False
+
+        if args.normalize == 'no' and \
+                args.precision not in ['int16', 'int8']:
+            # NOTE: features are normalized on load
+            global_mean_male, global_std_male, global_mean_female, global_std_female = None, None, None, None
+        else:
+            # Load statistics over train dataset
+            global_mean_male = np.load(
+                join(input_save_path, 'train/global_mean_male.npy'))
+            global_std_male = np.load(
+                join(input_save_path, 'train/global_std_male.npy'))
+            global_mean_female = np.load(
+                join(input_save_path, 'train/global_mean_female.npy'))
+            global_std_female = np.load(
+                join(input_save_path, 'train/global_std_female.npy'))
+    else:
+        is_training = True
+        global_mean_male, global_std_male, global_mean_female, global_std_female = None, None, None, None
+
+    # Read htk or wav files, and save input data and frame num dict
+    _, _, _, _, frame_num_dict = read_audio(
+        audio_paths=paths['audio'],
+        tool=args.tool,
+        config=CONFIG,
+        normalize=args.normalize,
+        is_training=is_training,
+        save_path=mkdir_join(input_save_path, data_type),
+        save_format=args.save_format,
+        global_mean_male=global_mean_male,
+        global_std_male=global_std_male,
+        global_mean_female=global_mean_female,
+        global_std_female=global_std_female,
+        num_workers=args.num_workers,
+        max_memory=args.max_memory if args.max_memory > 0 else None,
+        store_path=store_path,
+        online_window=args.online_window,
+        stack_frames=args.stack_frames,
+        skip_frames=args.skip_frames,
+        precision=args.precision,
+        batch_size=args.batch_size)
+    # NOTE: ex.) save_path:
+    # timit/feature/save_format/data_type/*.npy
+
+    # Make a confirmation file to prove that dataset was saved
+    # correctly
+    with open(join(input_save_path, data_type, 'complete.txt'), 'w') as f:
+        f.write('')
+
+    return frame_num_dict
+
+
+def make_char(data_type, paths, *unused):
+    """
+    Args:
+        data_type (string): train or dev or test
+        paths (dict): the result of `scan`
+    Returns:
+        trans_dict (dict)
+    """
+    ########################################
+    # labels (character)
+    ########################################
+    print('\n=> Processing transcripts (char)...')
+    save_vocab_file = True if data_type == 'train' else False
+    is_test = True if data_type == 'test' else False
+    return read_char(
+        label_paths=paths['char'],
+        vocab_file_save_path=mkdir_join('./config', 'vocab_files'),
+        save_vocab_file=save_vocab_file,
+        is_test=is_test,
+        num_workers=args.num_workers)
+
+
+def make_phone(data_type, paths, *unused):
+    """
+    Args:
+        data_type (string): train or dev or test
+        paths (dict): the result of `scan`
+    Returns:
+        trans_dict (dict)
+    """
+    ########################################
+    # labels (phone)
+    ########################################
+    print('\n=> Processing transcripts (phone)...')
+    save_vocab_file = True if data_type == 'train' else False
+    is_test = True if data_type == 'test' else False
+    return read_phone(
+        label_paths=paths['phone'],
+        vocab_file_save_path=mkdir_join('./config', 'vocab_files'),
+        save_vocab_file=save_vocab_file,
+        is_test=is_test)
+
+
+def make_dataset(data_type, char_dict, phone_dict, frame_num_dict):
+    """Save dataset files.
+    Args:
+        data_type (string): train or dev or test
+        char_dict (dict): the result of `make_char`
+        phone_dict (dict): the result of `make_phone`
+        frame_num_dict (dict): the result of `make_input`
+    """
+    input_save_path = mkdir_join(args.feature_save_path, args.save_format)
+    if frame_num_dict is None:
         with open(join(input_save_path, data_type, 'frame_num.pickle'), 'rb') as f:
             frame_num_dict = pickle.load(f)
 
-        for utt_name, trans_list in tqdm(trans_dict.items()):
-            if args.save_format == 'numpy':
-                speaker = utt_name.split('_')[0]
-                input_utt_save_path = join(
-                    input_save_path, data_type, speaker, utt_name + '.npy')
-            elif args.save_format == 'htk':
-                speaker = utt_name.split('_')[0]
-                input_utt_save_path = join(
-                    input_save_path, data_type, speaker, utt_name + '.htk')
-            elif args.save_format == 'wav':
-                input_utt_save_path = path.utt2wav(utt_name)
-            else:
-                raise ValueError('save_format is numpy or htk or wav.')
-
-            assert isfile(input_utt_save_path)
-            frame_num = frame_num_dict[utt_name]
-
-            char_indices, char_indices_capital = trans_list
-
-            df_char = add_element(
-                df_char, [frame_num, input_utt_save_path, char_indices])
-            df_char_capital = add_element(
-                df_char_capital, [frame_num, input_utt_save_path, char_indices_capital])
-
-        df_char.to_csv(join(dataset_save_path, 'character.csv'))
-        df_char_capital.to_csv(
-            join(dataset_save_path, 'character_capital_divide.csv'))
-
-        ########################################
-        # labels (phone)
-        ########################################
-        print('\n=> Processing transcripts (phone)...')
-        trans_dict = read_phone(
-            label_paths=path.phone(data_type=data_type),
-            vocab_file_save_path=mkdir_join('./config', 'vocab_files'),
-            save_vocab_file=save_vocab_file,
-            is_test=is_test)
-
-        ########################################
-        # dataset (phone, csv)
-        ########################################
-        print('\n=> Saving dataset files (phone)...')
-        df_phone61 = pd.DataFrame([], columns=df_columns)
-        df_phone48 = pd.DataFrame([], columns=df_columns)
-        df_phone39 = pd.DataFrame([], columns=df_columns)
-
-        for utt_name, trans_list in tqdm(trans_dict.items()):
-            if args.save_format == 'numpy':
-                speaker = utt_name.split('_')[0]
-                input_utt_save_path = join(
-                    input_save_path, data_type, speaker, utt_name + '.npy')
-            elif args.save_format == 'htk':
-                speaker = utt_name.split('_')[0]
-                input_utt_save_path = join(
-                    input_save_path, data_type, speaker, utt_name + '.htk')
-            elif args.save_format == 'wav':
-                input_utt_save_path = path.utt2wav(utt_name)
-            else:
-                raise ValueError('save_format is numpy or htk or wav.')
-
-            assert isfile(input_utt_save_path)
-            frame_num = frame_num_dict[utt_name]
-
-            phone61_indices, phone48_indices, phone39_indices = trans_list
-
-            df_phone61 = add_element(
-                df_phone61, [frame_num, input_utt_save_path, phone61_indices])
-            df_phone48 = add_element(
-                df_phone48, [frame_num, input_utt_save_path, phone48_indices])
-            df_phone39 = add_element(
-                df_phone39, [frame_num, input_utt_save_path, phone39_indices])
-
-        df_phone61.to_csv(join(dataset_save_path, 'phone61.csv'))
-        df_phone48.to_csv(join(dataset_save_path, 'phone48.csv'))
-        df_phone39.to_csv(join(dataset_save_path, 'phone39.csv'))
+    ########################################
+    # dataset (character, csv)
+    ########################################
+    print('\n=> Saving dataset files (char)...')
+    dataset_save_path = mkdir_join(
+        args.dataset_save_path, args.save_format, data_type)
+    df_columns = ['frame_num', 'input_path', 'transcript']
+    df_char = pd.DataFrame([], columns=df_columns)
+    df_char_capital = pd.DataFrame([], columns=df_columns)
+
+    for utt_name, trans_list in tqdm(char_dict.items()):
+        if args.save_format == 'numpy':
+            speaker = utt_name.split('_')[0]
+            input_utt_save_path = join(
+                input_save_path, data_type, speaker, utt_name + '.npy')
+        elif args.save_format == 'htk':
+            speaker = utt_name.split('_')[0]
+            input_utt_save_path = join(
+                input_save_path, data_type, speaker, utt_name + '.htk')
+        elif args.save_format == 'wav':
+            input_utt_save_path = path.utt2wav(utt_name)
+        else:
+            raise ValueError('save_format is numpy or htk or wav.')
+
+        assert isfile(input_utt_save_path)
+        frame_num = frame_num_dict[utt_name]
+
+        char_indices, char_indices_capital = trans_list
+
+        df_char = add_element(
+            df_char, [frame_num, input_utt_save_path, char_indices])
+        df_char_capital = add_element(
+            df_char_capital, [frame_num, input_utt_save_path, char_indices_capital])
+
+    df_char.to_csv(join(dataset_save_path, 'character.csv'))
+    df_char_capital.to_csv(
+        join(dataset_save_path, 'character_capital_divide.csv'))
+
+    ########################################
+    # dataset (phone, csv)
+    ########################################
+    print('\n=> Saving dataset files (phone)...')
+    df_phone61 = pd.DataFrame([], columns=df_columns)
+    df_phone48 = pd.DataFrame([], columns=df_columns)
+    df_phone39 = pd.DataFrame([], columns=df_columns)
+
+    for utt_name, trans_list in tqdm(phone_dict.items()):
+        if args.save_format == 'numpy':
+            speaker = utt_name.split('_')[0]
+            input_utt_save_path = join(
+                input_save_path, data_type, speaker, utt_name + '.npy')
+        elif args.save_format == 'htk':
+            speaker = utt_name.split('_')[0]
+            input_utt_save_path = join(
+                input_save_path, data_type, speaker, utt_name + '.htk')
+        elif args.save_format == 'wav':
+            input_utt_save_path = path.utt2wav(utt_name)
+        else:
+            raise ValueError('save_format is numpy or htk or wav.')
+
+        assert isfile(input_utt_save_path)
+        frame_num = frame_num_dict[utt_name]
+
+        phone61_indices, phone48_indices, phone39_indices = trans_list
+
+        df_phone61 = add_element(
+            df_phone61, [frame_num, input_utt_save_path, phone61_indices])
+        df_phone48 = add_element(
+            df_phone48, [frame_num, input_utt_save_path, phone48_indices])
+        df_phone39 = add_element(
+            df_phone39, [frame_num, input_utt_save_path, phone39_indices])
+
+    df_phone61.to_csv(join(dataset_save_path, 'phone61.csv'))
+    df_phone48.to_csv(join(dataset_save_path, 'phone48.csv'))
+    df_phone39.to_csv(join(dataset_save_path, 'phone39.csv'))
 
 
 if __name__ == '__main__':
@@ -8,7 +8,8 @@ from __future__ import division
 from __future__ import print_function
 
 from os.path import join, basename, splitext
-from glob import glob
+
+from utils.catalog import Catalog
 
 
 class Path(object):
@@ -17,13 +18,18 @@ class Path(object):
         data_path (string): path to TIMIT corpus
         config_path (string): path to config dir
         htk_save_path (string, optional): path to htk files
+        catalog_path (string, optional): path to save the catalog of files
+            in the corpus. If None, directories are scanned every time.
     """
 
-    def __init__(self, data_path, config_path, htk_save_path=None):
+    def __init__(self, data_path, config_path, htk_save_path=None,
+                 catalog_path=None):
 
         self.data_path = data_path
         self.config_path = config_path
         self.htk_save_path = htk_save_path
+        self.catalog_path = catalog_path
+        self.catalog = Catalog(data_path, cache_path=catalog_path)
 
         # Paths to TIMIT data
         self.train_data_path = join(data_path, 'train')
@@ -56,7 +62,7 @@ class Path(object):
                         line = line.strip()
                         test_speakers.append(line)
 
-            for file_path in glob(join(data_path, '*/*/*')):
+            for file_path in self.catalog.glob(basename(data_path) + '/*/*/*'):
                 region, speaker, file_name = file_path.split('/')[-3:]
                 utt_index = basename(file_name)
                 ext = splitext(file_name)[1]
@@ -97,7 +103,8 @@ class Path(object):
         if self.htk_save_path is None:
             raise ValueError('Set path to htk files.')
 
-        return [p for p in glob(join(self.htk_save_path, data_type, '*/*.htk'))]
+        return Catalog(self.htk_save_path, cache_path=self.catalog_path).glob(
+            data_type + '/*/*.htk')
         # NOTE: ex.) timit/htk/data_type/speaker/speaker_utt-index.htk
 
     def trans(self, data_type):
@@ -13,6 +13,7 @@ from tqdm import tqdm
 
 from utils.labels.character import Char2idx
 from utils.util import mkdir_join
+from utils.parallel import ParallelExecutor, get_worker_state
 
 # NOTE:
 ############################################################
@@ -35,13 +36,14 @@ APOSTROPHE = '\''
 
 
 def read_char(label_paths, vocab_file_save_path, save_vocab_file=False,
-              is_test=False):
+              is_test=False, num_workers=1):
     """Read text transcript.
     Args:
         label_paths (list): list of paths to label files
         vocab_file_save_path (string): path to vocabulary files
         save_vocab_file (string): if True, save vocabulary files
         is_test (bool, optional): set True in case of the test set
+        num_workers (int, optional): the number of processes to tokenize
     Returns:
         trans_dict (dict):
             key (string) => utterance name
@@ -140,21 +142,63 @@ def read_char(label_paths, vocab_file_save_path, save_vocab_file=False,
 
     # Tokenize
     print('=====> Tokenize...')
-    char2idx = Char2idx(char_vocab_file_path)
-    char2idx_capital = Char2idx(
-        char_capital_vocab_file_path, capital_divide=True)
-    for utt_name, transcript in tqdm(trans_dict.items()):
-        if is_test:
+    if is_test:
+        for utt_name, transcript in trans_dict.items():
             trans_dict[utt_name] = [transcript, transcript]
             # NOTE: save as it is
-        else:
-            char_indices = char2idx(transcript)
-            char_indices_capital = char2idx_capital(transcript)
+    else:
+        executor = ParallelExecutor(
+            num_workers=num_workers,
+            initializer=_init_tokenizers,
+            initargs=(char_vocab_file_path, char_capital_vocab_file_path))
+        utt_names = list(trans_dict.keys())
+        indices_list = executor.map(
+            _Tokenizer(char_vocab_file_path, char_capital_vocab_file_path),
+            [trans_dict[utt_name] for utt_name in utt_names])
+        for utt_name, indices in zip(utt_names, indices_list):
+            if indices is None:
+                # Failed to tokenize
+                del trans_dict[utt_name]
+                continue
+            trans_dict[utt_name] = indices
+        executor.report()
 
-            char_indices = ' '.join(list(map(str, char_indices.tolist())))
-            char_indices_capital = ' '.join(
-                list(map(str, char_indices_capital.tolist())))
+    return trans_dict
 
-            trans_dict[utt_name] = [char_indices, char_indices_capital]
 
-    return trans_dict
+def _build_tokenizers(char_vocab_file_path, char_capital_vocab_file_path):
+    return (Char2idx(char_vocab_file_path),
+            Char2idx(char_capital_vocab_file_path, capital_divide=True))
+
+
+def _init_tokenizers(char_vocab_file_path, char_capital_vocab_file_path):
+    get_worker_state(
+        ('tokenizers', char_vocab_file_path, char_capital_vocab_file_path),
+        _build_tokenizers, char_vocab_file_path, char_capital_vocab_file_path)
+
+
+class _Tokenizer(object):
+    """Convert a transcript to indices with tokenizers built once per process.
+    Args:
+        char_vocab_file_path (string): path to the character vocabulary file
+        char_capital_vocab_file_path (string): path to the capital-divided
+            character vocabulary file
+    """
+
+    def __init__(self, char_vocab_file_path, char_capital_vocab_file_path):
+        self.char_vocab_file_path = char_vocab_file_path
+        self.char_capital_vocab_file_path = char_capital_vocab_file_path
+
+    def __call__(self, transcript):
+        char2idx, char2idx_capital = get_worker_state(
+            ('tokenizers', self.char_vocab_file_path,
+             self.char_capital_vocab_file_path),
+            _build_tokenizers, self.char_vocab_file_path,
+            self.char_capital_vocab_file_path)
+        char_indices = char2idx(transcript)
+        char_indices_capital = char2idx_capital(transcript)
+
+        char_indices = ' '.join(list(map(str, char_indices.tolist())))
+        char_indices_capital = ' '.join(
+            list(map(str, char_indices_capital.tolist())))
+        return [char_indices, char_indices_capital]
@@ -0,0 +1,236 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Catalog of files in a corpus, cached to skip scanning directories again."""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import os
+from os.path import join, isdir, isfile, abspath, splitext
+import hashlib
+import pickle
+from fnmatch import fnmatch
+from multiprocessing.pool import ThreadPool
+
+from utils.inputs.wav_split import read_wav_header
+
+try:
+    from os import scandir
+except ImportError:
+    scandir = None
+
+
+class Catalog(object):
+    """Files under a directory with their size and duration. Top-level
+       directories are scanned in parallel threads. The catalog is saved to
+       cache_path, and a top-level directory is scanned again only if the
+       modification time of a directory in it has changed (a file was added,
+       removed or renamed).
+    Args:
+        root (string): path to the directory
+        cache_path (string, optional): path to the directory to save the
+            catalog. If None, the catalog is not saved.
+        num_threads (int, optional): the number of threads to scan
+            top-level directories and check modification times
+    """
+
+    def __init__(self, root, cache_path=None, num_threads=8):
+        self.root = root
+        self.cache_path = cache_path
+        self.num_threads = num_threads
+        # key => top-level directory ('' for files in root),
+        # value => {'dirs': {directory: mtime},
+        #           'files': [(relative path, size, duration)]}
+        self.tops = {}
+        self.root_mtime = None
+
+        if cache_path is not None and isfile(self._cache_file()):
+            with open(self._cache_file(), 'rb') as f:
+                self.root_mtime, self.tops = pickle.load(f)
+        if self._update() and cache_path is not None:
+            self._save()
+
+        self._files = {}
+        for top in self.tops.values():
+            for rel_path, size, duration in top['files']:
+                self._files[rel_path] = (size, duration)
+
+    def _cache_file(self):
+        key = hashlib.md5(abspath(self.root).encode('utf-8')).hexdigest()
+        return join(self.cache_path, key + '.pickle')
+
+    def _save(self):
+        if not isdir(self.cache_path):
+            os.makedirs(self.cache_path)
+        tmp_path = '%s.%d.tmp' % (self._cache_file(), os.getpid())
+        with open(tmp_path, 'wb') as f:
+            pickle.dump((self.root_mtime, self.tops), f,
+                        protocol=pickle.HIGHEST_PROTOCOL)
+        os.rename(tmp_path, self._cache_file())
+
+    def _update(self):
+        """Scan directories which have changed.
+        Returns:
+            True if the catalog has changed
+        """
+        root_mtime = os.stat(self.root).st_mtime if isdir(self.root) else None
+        if root_mtime is None:
+            changed = len(self.tops) > 0 or self.root_mtime is not None
+            self.tops, self.root_mtime = {}, None
+            return changed
+
+        names = list(self.tops.keys())
+        root_changed = root_mtime != self.root_mtime
+        if root_changed:
+            # NOTE: top-level directories may have been added or removed
+            top_files = []
+            names = ['']
+            for name, is_dir, size in _list_dir(self.root):
+                if is_dir:
+                    names.append(name)
+                else:
+                    top_files.append((name, size, _duration(
+                        join(self.root, name))))
+            self.tops[''] = {'dirs': {}, 'files': top_files}
+            for name in list(self.tops.keys()):
+                if name not in names:
+                    del self.tops[name]
+            self.root_mtime = root_mtime
+
+        pool = ThreadPool(max(self.num_threads, 1))
+        try:
+            stale = [name for name, is_stale in zip(names, pool.map(
+                self._is_stale, names)) if is_stale]
+            for name, top in zip(stale, pool.map(self._scan, stale)):
+                self.tops[name] = top
+        finally:
+            pool.close()
+            pool.join()
+        return root_changed or len(stale) > 0
+
+    def _is_stale(self, name):
+        if name == '':
+            return False
+        if name not in self.tops.keys():
+            return True
+        for directory, mtime in self.tops[name]['dirs'].items():
+            try:
+                if os.stat(join(self.root, directory)).st_mtime != mtime:
+                    return True
+            except OSError:
+                return True
+        return False
+
+    def _scan(self, name):
+        top = {'dirs': {}, 'files': []}
+        directories = [name]
+        while len(directories) > 0:
+            directory = directories.pop()
+            try:
+                top['dirs'][directory] = os.stat(
+                    join(self.root, directory)).st_mtime
+                entries = _list_dir(join(self.root, directory))
+            except OSError:
+                continue
+            for entry_name, is_dir, size in entries:
+                rel_path = directory + '/' + entry_name
+                if is_dir:
+                    directories.append(rel_path)
+                else:
+                    top['files'].append((rel_path, size, _duration(
+                        join(self.root, rel_path))))
+        return top
+
+    def glob(self, pattern):
+        """Same as `glob.glob(join(root, pattern))` except that only files
+           are matched.
+        Args:
+            pattern (string): a pattern relative to root (ex. */*/*.wav)
+        Returns:
+            sorted paths to files
+        """
+        parts = pattern.split('/')
+        paths = []
+        for rel_path in self._files.keys():
+            names = rel_path.split('/')
+            if len(names) != len(parts):
+                continue
+            if all(fnmatch(name, part) and
+                   (name[0] != '.' or part[0] == '.')
+                   for name, part in zip(names, parts)):
+                paths.append(join(self.root, rel_path))
+        return sorted(paths)
+
+    def isfile(self, path):
+        """
+        Args:
+            path (string): path to a file under root
+        Returns:
+            True if the file is in the catalog
+        """
+        return self._rel_path(path) in self._files.keys()
+
+    def size(self, path):
+        """
+        Args:
+            path (string): path to a file under root
+        Returns:
+            the size of the file in bytes
+        """
+        return self._files[self._rel_path(path)][0]
+
+    def duration(self, path):
+        """
+        Args:
+            path (string): path to a file under root
+        Returns:
+            the duration of a WAV file in seconds from its header.
+                None if it is not a WAV file.
+        """
+        return self._files[self._rel_path(path)][1]
+
+    def _rel_path(self, path):
+        return os.path.relpath(path, self.root).replace(os.sep, '/')
+
+
+def _list_dir(path):
+    """
+    Args:
+        path (string): path to a directory
+    Returns:
+        list of (name, is_dir, size). The size is None for a broken link.
+    """
+    entries = []
+    if scandir is not None:
+        for entry in scandir(path):
+            if entry.is_dir():
+                entries.append((entry.name, True, 0))
+                continue
+            try:
+                entries.append((entry.name, False, entry.stat().st_size))
+            except OSError:
+                entries.append((entry.name, False, None))
+        return entries
+
+    for name in os.listdir(path):
+        entry_path = join(path, name)
+        if isdir(entry_path):
+            entries.append((name, True, 0))
+            continue
+        try:
+            entries.append((name, False, os.stat(entry_path).st_size))
+        except OSError:
+            entries.append((name, False, None))
+    return entries
+
+
+def _duration(path):
+    if splitext(path)[1].lower() != '.wav':
+        return None
+    try:
+        _, sampling_rate, _, _, frame_num = read_wav_header(path)
+    except (IOError, OSError, ValueError):
+        return None
+    return frame_num / sampling_rate
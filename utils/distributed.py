@@ -0,0 +1,349 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Reduce statistics over shards run on several nodes. Each shard sends its
+   sufficient statistics (sums and frame nums) to the reducer (shard 0),
+   and receives the merged ones before normalizing its features.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import os
+from os.path import join, isfile, isdir
+import time
+import socket
+import struct
+import pickle
+import hashlib
+import multiprocessing as mp
+import numpy as np
+
+
+class Transport(object):
+    """Exchange payloads between shards. Shard 0 is the reducer.
+    Args:
+        shard_index (int): the index of this shard
+        shard_num (int): the number of shards
+        timeout (float, optional): seconds to wait for other shards
+        run_id (string, optional): the identifier of the run (ex. a hash of
+            the configuration and the plan of shards). Payloads of another
+            run are not reduced.
+    """
+
+    def __init__(self, shard_index, shard_num, timeout=86400., run_id=''):
+        if shard_index < 0 or shard_index >= shard_num:
+            raise ValueError('shard_index must be in [0, shard_num).')
+        self.shard_index = shard_index
+        self.shard_num = shard_num
+        self.timeout = timeout
+        self.run_id = run_id
+
+    def allreduce(self, payload, reduce_func, tag):
+        """
+        Args:
+            payload (bytes): the payload of this shard
+            reduce_func (function): a function which takes the list of
+                payloads in the order of shards and returns the reduced one
+            tag (string): the name of this exchange. Shards exchange in the
+                same order of tags.
+        Returns:
+            the reduced payload (bytes)
+        """
+        raise NotImplementedError
+
+
+class DirectoryTransport(Transport):
+    """Exchange payloads through files in a directory shared by nodes
+       (ex. on NFS).
+    Args:
+        path (string): path to the shared directory
+        shard_index (int): the index of this shard
+        shard_num (int): the number of shards
+        timeout (float, optional): seconds to wait for other shards
+        run_id (string, optional): the identifier of the run. Files left by
+            another run (ex. one which crashed) are ignored.
+        poll (float, optional): seconds between checks of files
+    """
+
+    def __init__(self, path, shard_index, shard_num, timeout=86400.,
+                 run_id='', poll=1.):
+        super(DirectoryTransport, self).__init__(
+            shard_index, shard_num, timeout, run_id)
+        self.path = path
+        self.poll = poll
+
+    def _wait(self, path, accept=lambda data: True):
+        start = time.time()
+        while True:
+            if isfile(path):
+                with open(path, 'rb') as f:
+                    data = f.read()
+                if accept(data):
+                    return data
+            if time.time() - start > self.timeout:
+                raise IOError('Timed out waiting for %s.' % path)
+            time.sleep(self.poll)
+
+    def allreduce(self, payload, reduce_func, tag):
+        tag_path = join(self.path, tag)
+        try:
+            os.makedirs(tag_path)
+        except OSError:
+            if not isdir(tag_path):
+                raise
+        _write_atomic(join(tag_path, '%d.payload' % self.shard_index),
+                      pickle.dumps((self.run_id, payload), protocol=2))
+        digest = hashlib.md5(payload).hexdigest()
+        reduced_path = join(tag_path, 'reduced.payload')
+
+        if self.shard_index == 0:
+            # NOTE: a payload left by another run (ex. one which crashed
+            # before reducing) is waited on until its shard overwrites it
+            def _accept_payload(data):
+                return pickle.loads(data)[0] == self.run_id
+            payloads = [pickle.loads(self._wait(
+                join(tag_path, '%d.payload' % i),
+                accept=_accept_payload))[1] for i in range(self.shard_num)]
+            reduced = reduce_func(payloads)
+            digests = [hashlib.md5(p).hexdigest() for p in payloads]
+            _write_atomic(reduced_path, pickle.dumps(
+                (self.run_id, digests, reduced), protocol=2))
+            # NOTE: payloads are removed so that the next run does not
+            # reduce stale ones
+            for i in range(self.shard_num):
+                os.remove(join(tag_path, '%d.payload' % i))
+            return reduced
+
+        # NOTE: the reduced payload must include the payload of this shard,
+        # not one left by a previous run
+        def _accept(data):
+            run_id, digests, _ = pickle.loads(data)
+            return (run_id == self.run_id and
+                    len(digests) == self.shard_num and
+                    digests[self.shard_index] == digest)
+        return pickle.loads(self._wait(reduced_path, accept=_accept))[2]
+
+
+class SocketTransport(Transport):
+    """Exchange payloads over TCP. The reducer listens on the address and
+       the other shards connect to it.
+       NOTE: the reducer unpickles messages of any client which connects, so
+       the port must only be reachable from trusted nodes (ex. in a private
+       network of the cluster). Unpickling a crafted message can run
+       arbitrary code.
+    Args:
+        address (string): host:port of the reducer
+        shard_index (int): the index of this shard
+        shard_num (int): the number of shards
+        timeout (float, optional): seconds to wait for other shards
+        run_id (string, optional): the identifier of the run. A message of
+            another run is an error.
+    """
+
+    def __init__(self, address, shard_index, shard_num, timeout=86400.,
+                 run_id=''):
+        super(SocketTransport, self).__init__(
+            shard_index, shard_num, timeout, run_id)
+        host, port = address.rsplit(':', 1)
+        self.address = (host, int(port))
+
+    def allreduce(self, payload, reduce_func, tag):
+        if self.shard_index == 0:
+            return self._reduce(payload, reduce_func, tag)
+
+        message = pickle.dumps(
+            (self.run_id, self.shard_index, tag, payload), protocol=2)
+        start = time.time()
+        while True:
+            try:
+                sock = socket.create_connection(self.address, timeout=10)
+                try:
+                    sock.settimeout(self.timeout)
+                    _send(sock, message)
+                    return _recv(sock)
+                finally:
+                    sock.close()
+            except (socket.error, IOError):
+                # NOTE: the reducer is not listening yet, or closed the
+                # previous exchange before accepting this connection
+                if time.time() - start > self.timeout:
+                    raise IOError('Could not exchange with %s:%d.' %
+                                  self.address)
+                time.sleep(1.)
+
+    def _reduce(self, payload, reduce_func, tag):
+        server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        try:
+            server.bind(('', self.address[1]))
+            server.listen(self.shard_num)
+            server.settimeout(self.timeout)
+            payloads = [payload] + [None] * (self.shard_num - 1)
+            connections = {}
+            while len(connections) < self.shard_num - 1:
+                sock, _ = server.accept()
+                sock.settimeout(self.timeout)
+                run_id, shard_index, shard_tag, shard_payload = pickle.loads(
+                    _recv(sock))
+                if run_id != self.run_id:
+                    sock.close()
+                    raise ValueError('Shard %d is of the run %s while %s is '
+                                     'reduced.' % (shard_index, run_id,
+                                                   self.run_id))
+                if shard_tag != tag or shard_index in connections.keys():
+                    sock.close()
+                    raise ValueError('Shard %d sent %s while %s is reduced.'
+                                     % (shard_index, shard_tag, tag))
+                payloads[shard_index] = shard_payload
+                connections[shard_index] = sock
+            reduced = reduce_func(payloads)
+            for sock in connections.values():
+                _send(sock, reduced)
+                sock.close()
+            return reduced
+        finally:
+            server.close()
+
+
+class QueueTransport(Transport):
+    """Exchange payloads through multiprocessing queues among processes on
+       one machine. A stand-in of the other transports for tests.
+    Args:
+        queues (list): a queue per shard made by `run_local`
+        shard_index (int): the index of this shard
+        shard_num (int): the number of shards
+        timeout (float, optional): seconds to wait for other shards
+    """
+
+    def __init__(self, queues, shard_index, shard_num, timeout=86400.):
+        super(QueueTransport, self).__init__(shard_index, shard_num, timeout)
+        self.queues = queues
+
+    def allreduce(self, payload, reduce_func, tag):
+        if self.shard_index != 0:
+            self.queues[0].put((self.shard_index, tag, payload))
+            return self.queues[self.shard_index].get(timeout=self.timeout)
+
+        payloads = [payload] + [None] * (self.shard_num - 1)
+        for _ in range(self.shard_num - 1):
+            shard_index, shard_tag, shard_payload = self.queues[0].get(
+                timeout=self.timeout)
+            if shard_tag != tag:
+                raise ValueError('Shard %d sent %s while %s is reduced.' %
+                                 (shard_index, shard_tag, tag))
+            payloads[shard_index] = shard_payload
+        reduced = reduce_func(payloads)
+        for shard_index in range(1, self.shard_num):
+            self.queues[shard_index].put(reduced)
+        return reduced
+
+
+def make_transport(kind, address, shard_index, shard_num, run_id=''):
+    """
+    Args:
+        kind (string): dir or tcp
+        address (string): path to the shared directory (dir) or
+            host:port of the reducer (tcp). The port must only be reachable
+            from trusted nodes.
+        shard_index (int): the index of this shard
+        shard_num (int): the number of shards
+        run_id (string, optional): the identifier of the run, the same over
+            shards (see `Transport`)
+    Returns:
+        transport (Transport)
+    """
+    if kind == 'dir':
+        return DirectoryTransport(address, shard_index, shard_num,
+                                  run_id=run_id)
+    elif kind == 'tcp':
+        return SocketTransport(address, shard_index, shard_num,
+                               run_id=run_id)
+    else:
+        raise ValueError('kind must be "dir" or "tcp".')
+
+
+def _run_shard(func, queues, shard_index, shard_num, args, results):
+    transport = QueueTransport(queues, shard_index, shard_num)
+    results.put((shard_index, func(transport, *args)))
+
+
+def run_local(func, shard_num, args=()):
+    """Run shards as processes on one machine with `QueueTransport`.
+    Args:
+        func (function): a function which takes a transport and args
+        shard_num (int): the number of shards
+        args (tuple, optional): arguments of func
+    Returns:
+        results (list): the return values of func in the order of shards
+    """
+    queues = [mp.Queue() for _ in range(shard_num)]
+    results = mp.Queue()
+    processes = [mp.Process(target=_run_shard,
+                            args=(func, queues, i, shard_num, args, results))
+                 for i in range(shard_num)]
+    for process in processes:
+        process.start()
+    outputs = dict(results.get() for _ in range(shard_num))
+    for process in processes:
+        process.join()
+    return [outputs[i] for i in range(shard_num)]
+
+
+def allreduce_sum(transport, values, tag, dtype=np.float32):
+    """Sum values over all shards. A shard which has no data for a value
+       (ex. no female speakers) passes None.
+    Args:
+        transport (Transport): see `make_transport`
+        values (list): np.ndarray, number or None per value
+        tag (string): the name of this exchange
+        dtype (optional): the type of summed arrays. They are summed in
+            float64.
+    Returns:
+        values (list): sums over shards. None if all shards passed None.
+    """
+    def _sum(payloads):
+        shard_values = [pickle.loads(p) for p in payloads]
+        sums = []
+        for i in range(len(values)):
+            terms = [v[i] for v in shard_values if v[i] is not None]
+            if len(terms) == 0:
+                sums.append(None)
+                continue
+            total = np.sum(np.array(terms, dtype=np.float64), axis=0) \
+                if isinstance(terms[0], np.ndarray) else sum(terms)
+            sums.append(total)
+        return pickle.dumps(sums, protocol=2)
+
+    sums = pickle.loads(transport.allreduce(
+        pickle.dumps(values, protocol=2), _sum, tag))
+    return [total.astype(dtype) if isinstance(total, np.ndarray) else total
+            for total in sums]
+
+
+def _write_atomic(path, data):
+    tmp_path = '%s.%d.tmp' % (path, os.getpid())
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+    os.rename(tmp_path, path)
+
+
+def _send(sock, data):
+    sock.sendall(struct.pack('>Q', len(data)) + data)
+
+
+def _recv(sock):
+    header = _recv_bytes(sock, 8)
+    return _recv_bytes(sock, struct.unpack('>Q', header)[0])
+
+
+def _recv_bytes(sock, size):
+    chunks = []
+    while size > 0:
+        chunk = sock.recv(min(size, 1 << 20))
+        if not chunk:
+            raise IOError('Connection closed.')
+        chunks.append(chunk)
+        size -= len(chunk)
+    return b''.join(chunks)
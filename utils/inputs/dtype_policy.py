@@ -0,0 +1,57 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Types of data through feature extraction. Features are computed and
+   saved in the feature type (float32 by default) from extraction to
+   saving, and only statistics are accumulated in float64.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import numpy as np
+
+FEATURE_DTYPE = np.float32
+ACCUMULATOR_DTYPE = np.float64
+
+
+def check_dtype(input_utt, dtype, stage):
+    """Check the type of features handed over from a stage, so that an
+       upcast (ex. to float64) is found where it happens instead of
+       doubling memory silently in later stages.
+    Args:
+        input_utt (np.ndarray): A tensor of size `[T, feature_dim]`
+        dtype: the type of features
+        stage (string): the name of the stage which made input_utt
+    Returns:
+        input_utt (np.ndarray): the same array
+    """
+    if input_utt.dtype != np.dtype(dtype):
+        raise TypeError('%s made %s features, but %s is expected.' %
+                        (stage, input_utt.dtype, np.dtype(dtype).name))
+    return input_utt
+
+
+def sum_frames(input_utt):
+    """
+    Args:
+        input_utt (np.ndarray): A tensor of size `[T, feature_dim]`
+    Returns:
+        input_sum (np.ndarray): A tensor of size `[feature_dim]` in float64
+    """
+    return np.sum(input_utt, axis=0, dtype=ACCUMULATOR_DTYPE)
+
+
+def sum_squared_deviations(input_utt, mean):
+    """Deviations are computed in the type of features and summed in
+       float64, so features are not copied in float64.
+    Args:
+        input_utt (np.ndarray): A tensor of size `[T, feature_dim]`
+        mean (np.ndarray): A tensor of size `[feature_dim]`
+    Returns:
+        sq_sum (np.ndarray): A tensor of size `[feature_dim]` in float64
+    """
+    deviations = input_utt - np.asarray(mean, dtype=input_utt.dtype)
+    np.square(deviations, out=deviations)
+    return np.sum(deviations, axis=0, dtype=ACCUMULATOR_DTYPE)
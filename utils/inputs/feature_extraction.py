@@ -0,0 +1,278 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Extract input features of each audio file with the selected tool."""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+from utils.inputs.htk import read as read_htk
+from utils.inputs.wav2feature_python_speech_features import wav2features_batch as w2f_psf_batch
+from utils.inputs.wav2feature_python_speech_features import get_filterbank
+from utils.inputs.wav2feature_librosa import wav2features as w2f_librosa
+from utils.inputs.wav2feature_librosa import stft_params, get_mel_basis
+from utils.inputs.wav2feature_librosa import MFCC_MELS
+from utils.inputs.feature_store import FeatureStore
+from utils.parallel import ParallelExecutor
+from utils.inputs.dtype_policy import FEATURE_DTYPE, check_dtype
+
+TOOLS = ['htk', 'python_speech_features', 'librosa']
+
+# Sizes of shared memory slots to hand over features from worker processes
+UTTERANCE_SLOT_BYTES = 1 << 23  # 8MB per utterance
+RECORDING_SLOT_BYTES = 1 << 26  # 64MB per recording (CSJ, Switchboard)
+
+
+def extract_feature(audio_path, tool, config, store_path=None,
+                    dtype=FEATURE_DTYPE):
+    """Read a HTK file or extract features from a WAV file.
+    Args:
+        audio_path (string): path to a HTK or WAV file
+        tool (string): htk or python_speech_features or librosa
+        config (dict): a configuration for feature extraction
+        store_path (string, optional): path to the shared feature store.
+            If given, features extracted from a WAV file are saved there and
+            loaded instead of being extracted again.
+        dtype (optional): the type of data, default is np.float32
+    Returns:
+        input_utt (np.ndarray): A tensor of size `[T, feature_dim]`
+        sampPeriod (int): the sample period of the HTK file
+            (None except for htk)
+        parmKind (int): the parameter kind of the HTK file
+            (None except for htk)
+    """
+    if tool != 'htk':
+        if config is None:
+            raise ValueError('Set config dict.')
+        return extract_features(audio_path, tool, [config], store_path,
+                                dtype)[0], None, None
+
+    input_utt, sampPeriod, parmKind = read_htk(audio_path)
+    input_utt = input_utt.astype(dtype, copy=False)
+    # NOTE: audio_path is a htk file path in this case
+
+    return check_dtype(input_utt, dtype, tool), sampPeriod, parmKind
+
+
+def extract_features(audio_path, tool, configs, store_path=None,
+                     dtype=FEATURE_DTYPE):
+    """Extract several kinds of features from a WAV file at once. The file
+       is read once and the power spectrum is shared among configs.
+    Args:
+        audio_path (string): path to a WAV file
+        tool (string): python_speech_features or librosa
+        configs (list): configurations for feature extraction
+        store_path (string, optional): path to the shared feature store.
+            If given, each kind of features is saved in its own store, and
+            kinds already stored are loaded instead of being extracted.
+        dtype (optional): the type of data, default is np.float32
+    Returns:
+        input_utts (list): tensors of size `[T, feature_dim]` in the order
+            of configs
+    """
+    return extract_features_batch([audio_path], tool, configs, store_path,
+                                  dtype)[0]
+
+
+def extract_features_batch(audio_paths, tool, configs, store_path=None,
+                           dtype=FEATURE_DTYPE, update_store=True):
+    """Extract several kinds of features from several WAV files at once.
+       python_speech_features transforms frames of all files together
+       (librosa extracts features file by file).
+    Args:
+        audio_paths (list): paths to WAV files
+        tool (string): python_speech_features or librosa
+        configs (list): configurations for feature extraction
+        store_path (string, optional): path to the shared feature store
+        dtype (optional): the type of data, default is np.float32
+        update_store (bool, optional): if False, features are loaded from
+            the store but extracted ones are not saved there
+    Returns:
+        input_utts_list (list): lists of tensors of size `[T, feature_dim]`
+            in the order of configs, in the order of audio_paths
+    """
+    if tool not in ['python_speech_features', 'librosa']:
+        raise TypeError(
+            'tool must be "htk" or "python_speech_features"' +
+            ' or "librosa".')
+
+    input_utts_list = [[None] * len(configs) for _ in audio_paths]
+    stores = None
+    if store_path is not None:
+        stores = [FeatureStore(store_path, tool, config)
+                  for config in configs]
+        for input_utts, audio_path in zip(input_utts_list, audio_paths):
+            for i, store in enumerate(stores):
+                input_utt = store.load(audio_path)
+                if input_utt is not None:
+                    # NOTE: features may be stored by a run with another
+                    # dtype
+                    input_utts[i] = input_utt.astype(dtype, copy=False)
+
+    # Group files by kinds of features to extract
+    groups = {}
+    for j, input_utts in enumerate(input_utts_list):
+        indices = tuple(i for i in range(len(configs))
+                        if input_utts[i] is None)
+        if len(indices) > 0:
+            groups.setdefault(indices, []).append(j)
+
+    for indices, files in sorted(groups.items()):
+        group_configs = [configs[i] for i in indices]
+        group_paths = [audio_paths[j] for j in files]
+        if tool == 'python_speech_features':
+            extracted_list = w2f_psf_batch(group_paths, group_configs,
+                                           dtype=dtype)
+        else:
+            extracted_list = [w2f_librosa(audio_path, group_configs,
+                                          dtype=dtype)
+                              for audio_path in group_paths]
+        for j, extracted in zip(files, extracted_list):
+            for i, input_utt in zip(indices, extracted):
+                input_utts_list[j][i] = check_dtype(input_utt, dtype, tool)
+                if stores is not None and update_store:
+                    stores[i].save(audio_paths[j], input_utt)
+
+    return input_utts_list
+
+
+def init_feature_worker(tool, config):
+    """Build objects shared by all files once per worker process.
+    Args:
+        tool (string): htk or python_speech_features or librosa
+        config (dict or list): a configuration (or configurations) for
+            feature extraction
+    """
+    for config in config if isinstance(config, list) else [config]:
+        if tool == 'python_speech_features':
+            # NOTE: mfcc is computed over 26 filters
+            get_filterbank(26 if config['feature_type'] == 'mfcc'
+                           else config['channels'], 512,
+                           config['sampling_rate'], dtype=FEATURE_DTYPE)
+        elif tool == 'librosa':
+            _, _, n_fft = stft_params(config['sampling_rate'],
+                                      config['window'], config['slide'])
+            get_mel_basis(config['sampling_rate'], n_fft,
+                          MFCC_MELS if config['feature_type'] == 'mfcc'
+                          else config['channels'], dtype=FEATURE_DTYPE)
+
+
+class FeatureExtractor(object):
+    """Picklable wrapper of `extract_feature` for worker processes.
+    Args:
+        tool (string): htk or python_speech_features or librosa
+        config (dict): a configuration for feature extraction
+        store_path (string, optional): path to the shared feature store
+        dtype (optional): the type of data, default is np.float32
+        update_store (bool, optional): if False, features are loaded from
+            the store but extracted ones are not saved there
+    """
+
+    def __init__(self, tool, config, store_path=None, dtype=FEATURE_DTYPE,
+                 update_store=True):
+        self.tool = tool
+        self.config = config
+        self.store_path = store_path
+        self.dtype = dtype
+        self.update_store = update_store
+
+    def __call__(self, audio_path):
+        return self.extract_batch([audio_path])[0]
+
+    def extract_batch(self, audio_paths):
+        """Extract features of several files at once.
+        Args:
+            audio_paths (list): paths to HTK or WAV files
+        Returns:
+            results (list): return values of `__call__` in the order of
+                audio_paths
+        """
+        if self.tool == 'htk':
+            return [extract_feature(audio_path, self.tool, self.config,
+                                    dtype=self.dtype)
+                    for audio_path in audio_paths]
+        return [(input_utts[0], None, None)
+                for input_utts in extract_features_batch(
+                    audio_paths, self.tool, [self.config], self.store_path,
+                    self.dtype, self.update_store)]
+
+
+class _FeatureStoreFiller(object):
+    """Picklable function to save several kinds of features of a WAV file
+       in the feature store.
+    """
+
+    def __init__(self, tool, configs, store_path):
+        self.tool = tool
+        self.configs = configs
+        self.store_path = store_path
+
+    def __call__(self, audio_path):
+        self.extract_batch([audio_path])
+
+    def extract_batch(self, audio_paths):
+        stores = [FeatureStore(self.store_path, self.tool, config)
+                  for config in self.configs]
+        missing_paths = [p for p in audio_paths
+                         if not all(store.contains(p) for store in stores)]
+        if len(missing_paths) > 0:
+            extract_features_batch(missing_paths, self.tool, self.configs,
+                                   self.store_path)
+        return [None] * len(audio_paths)
+
+
+def fill_feature_store(audio_paths, tool, configs, store_path,
+                       num_workers=1, batch_size=1):
+    """Extract several kinds of features (ex. 40 and 80 channels of fbank
+       and MFCC) in one pass over audio files and save each kind in its own
+       feature store. Later runs with any of the configurations load
+       features from the store instead of reading audio files again.
+    Args:
+        audio_paths (list): paths to WAV files
+        tool (string): python_speech_features or librosa
+        configs (list): configurations for feature extraction
+        store_path (string): path to the shared feature store
+        num_workers (int, optional): the number of processes to extract
+            features
+        batch_size (int, optional): the number of files to extract features
+            of at once
+    """
+    print('=====> Extracting %d kinds of features at once...' % len(configs))
+    executor = ParallelExecutor(num_workers=num_workers,
+                                initializer=init_feature_worker,
+                                initargs=(tool, configs))
+    filler = _FeatureStoreFiller(tool, configs, store_path)
+    for _ in executor.imap_batched(filler, filler.extract_batch, audio_paths,
+                                   batch_size):
+        pass
+    executor.report()
+
+
+def parse_feature_specs(specs, config):
+    """
+    Args:
+        specs (string): kinds of features separated by commas. Each is
+            feature_type:channels (ex. fbank:80,mfcc:13).
+        config (dict): a configuration for feature extraction. The other
+            keys (window, slide, energy etc.) are shared with it.
+    Returns:
+        configs (list): configurations for feature extraction
+    """
+    configs = []
+    for spec in specs.split(','):
+        if spec == '':
+            continue
+        try:
+            feature_type, channels = spec.split(':')
+            channels = int(channels)
+        except ValueError:
+            raise ValueError('Set kinds of features as feature_type:channels '
+                             'separated by commas (ex. fbank:80,mfcc:13).')
+        if feature_type not in ['fbank', 'mfcc']:
+            raise ValueError('feature_type must be "fbank" or "mfcc".')
+        spec_config = dict(config)
+        spec_config['feature_type'] = feature_type
+        spec_config['channels'] = channels
+        configs.append(spec_config)
+    return configs
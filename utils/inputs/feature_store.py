@@ -0,0 +1,108 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Store unnormalized features per audio file to share them among data sizes
+   (ex. 100h, 460h and 960h of Librispeech) and passes over the data.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import os
+from os.path import join, abspath, isfile, isdir, dirname
+import hashlib
+import tempfile
+import numpy as np
+
+from utils.inputs.ledger import make_feature_hash
+
+SPILL_NAME = '.spill'
+
+
+class FeatureStore(object):
+    """Features are saved as npy files keyed by the configuration of
+       feature extraction (with the version of the tool) and the path, size
+       and modification time of the audio file, so an edited audio file or
+       a new version of the tool is extracted again.
+    Args:
+        store_path (string): path to the directory of the store
+        tool (string): htk or python_speech_features or librosa
+        config (dict): a configuration for feature extraction
+    """
+
+    def __init__(self, store_path, tool, config):
+        self.store_path = join(store_path, make_feature_hash(tool, config))
+
+    def path(self, audio_path):
+        """
+        Args:
+            audio_path (string): path to a WAV file
+        Returns:
+            path to the npy file in the store
+        """
+        stat = os.stat(audio_path)
+        key = hashlib.md5(('%s\t%d\t%d' % (
+            abspath(audio_path), stat.st_size,
+            int(stat.st_mtime))).encode('utf-8')).hexdigest()
+        return join(self.store_path, key[:2], key + '.npy')
+
+    def contains(self, audio_path):
+        """
+        Args:
+            audio_path (string): path to a WAV file
+        Returns:
+            True if features of the file have been stored
+        """
+        return isfile(self.path(audio_path))
+
+    def load(self, audio_path):
+        """
+        Args:
+            audio_path (string): path to a WAV file
+        Returns:
+            input_data (np.ndarray): A tensor of size `[T, feature_dim]`.
+                None if the file has not been stored.
+        """
+        if not self.contains(audio_path):
+            return None
+        return np.load(self.path(audio_path))
+
+    def save(self, audio_path, input_data):
+        """Save features atomically. Several processes may save the same
+           file at the same time.
+        Args:
+            audio_path (string): path to a WAV file
+            input_data (np.ndarray): A tensor of size `[T, feature_dim]`
+        """
+        path = self.path(audio_path)
+        try:
+            os.makedirs(dirname(path))
+        except OSError:
+            if not isdir(dirname(path)):
+                raise
+            # NOTE: made by another process
+        tmp_path = '%s.%d.tmp' % (path, os.getpid())
+        with open(tmp_path, 'wb') as f:
+            np.save(f, input_data)
+        os.rename(tmp_path, path)
+
+
+def make_spill_path(save_path=None):
+    """Make a directory to spill unnormalized features to in the first pass
+       over the data, so that later passes load them instead of extracting
+       them again. The caller removes it after the last pass.
+    Args:
+        save_path (string, optional): path to the directory of the output
+            features. The directory is made there, so that a resumed run
+            loads features spilled by the interrupted one. If None, a
+            temporary directory is made.
+    Returns:
+        spill_path (string): path to the directory
+    """
+    if save_path is None:
+        return tempfile.mkdtemp()
+    spill_path = join(save_path, SPILL_NAME)
+    if not isdir(spill_path):
+        os.makedirs(spill_path)
+    return spill_path
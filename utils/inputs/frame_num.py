@@ -0,0 +1,138 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Count frames of input features from headers of audio files, before
+   features are extracted."""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import math
+import decimal
+
+from utils.inputs.htk import read_header as read_htk_header
+from utils.inputs.wav_split import read_wav_header
+from utils.inputs.segmentation import pad_boundaries
+from utils.inputs.wav2feature_librosa import stft_params
+
+
+def read_sphere_header(sphere_path):
+    """Read the header of a NIST SPHERE file.
+    Args:
+        sphere_path (string): path to a SPHERE file
+    Returns:
+        channels (int): the number of channels
+        sampling_rate (int): the sampling rate
+        sample_size (int): bytes per sample of a channel
+        header_size (int): the byte offset of the first sample
+        frame_num (int): the number of samples per channel
+    """
+    with open(sphere_path, 'rb') as f:
+        if f.readline().strip() != b'NIST_1A':
+            raise ValueError('%s is not a SPHERE file.' % sphere_path)
+        header_size = int(f.readline().strip())
+        fields = {}
+        for line in f.read(header_size - f.tell()).split(b'\n'):
+            items = line.strip().split(None, 2)
+            if len(items) == 0 or items[0] == b'end_head':
+                break
+            if len(items) == 3:
+                fields[items[0].decode('ascii')] = items[2].decode('ascii')
+    return (int(fields.get('channel_count', 1)),
+            int(fields['sample_rate']),
+            int(fields.get('sample_n_bytes', 2)),
+            header_size,
+            int(fields['sample_count']))
+
+
+def read_sample_num(audio_path):
+    """
+    Args:
+        audio_path (string): path to a WAV or SPHERE file
+    Returns:
+        sample_num (int): the number of samples per channel
+        sampling_rate (int): the sampling rate
+    """
+    with open(audio_path, 'rb') as f:
+        magic = f.read(4)
+    if magic == b'RIFF':
+        _, sampling_rate, _, _, sample_num = read_wav_header(audio_path)
+    elif magic == b'NIST':
+        _, sampling_rate, _, _, sample_num = read_sphere_header(audio_path)
+    else:
+        raise ValueError('%s is not a WAV or SPHERE file.' % audio_path)
+    return sample_num, sampling_rate
+
+
+def _round_half_up(number):
+    # NOTE: the same as python_speech_features.sigproc.round_half_up
+    return int(decimal.Decimal(number).quantize(
+        decimal.Decimal('1'), rounding=decimal.ROUND_HALF_UP))
+
+
+def count_frames(sample_num, sampling_rate, tool, config):
+    """Count frames extracted from audio in the same way as each tool.
+    Args:
+        sample_num (int): the number of samples per channel
+        sampling_rate (int): the sampling rate
+        tool (string): python_speech_features or librosa
+        config (dict): a configuration for feature extraction
+    Returns:
+        frame_num (int): the number of frames
+    """
+    if tool == 'python_speech_features':
+        if config['feature_type'] == 'mfcc':
+            window, slide = 0.025, 0.01
+            # NOTE: mfcc of python_speech_features uses default windows
+        else:
+            window, slide = config['window'], config['slide']
+        frame_len = _round_half_up(window * sampling_rate)
+        frame_step = _round_half_up(slide * sampling_rate)
+        if sample_num <= frame_len:
+            return 1
+        return 1 + int(math.ceil((1.0 * sample_num - frame_len) / frame_step))
+    elif tool == 'librosa':
+        # NOTE: frames are centered at every slide
+        _, hop_length, _ = stft_params(
+            sampling_rate, config['window'], config['slide'])
+        return 1 + sample_num // hop_length
+    else:
+        raise TypeError('tool must be "python_speech_features" or "librosa".')
+
+
+def read_frame_num(audio_path, tool, config):
+    """Count frames of a file from its header.
+    Args:
+        audio_path (string): path to a HTK, WAV or SPHERE file
+        tool (string): htk or python_speech_features or librosa
+        config (dict): a configuration for feature extraction
+    Returns:
+        frame_num (int): the number of frames
+    """
+    if tool == 'htk':
+        return read_htk_header(audio_path)[0]
+    sample_num, sampling_rate = read_sample_num(audio_path)
+    return count_frames(sample_num, sampling_rate, tool, config)
+
+
+def count_utterance_frames(frame_num, utterance_dict, sil_duration=0):
+    """Count frames of utterances segmented in the same way as `segment`.
+    Args:
+        frame_num (int): the number of frames of the file
+        utterance_dict (dict): dictionary of utterance information
+            key (string) => utterance index
+            value (list) => [start_frame, end_frame, transcript, ...]
+        sil_duration (int, optional): duration of silence at both ends
+    Returns:
+        frame_num_dict (dict):
+            key (string) => utterance index
+            value (int) => the number of frames of the utterance
+    """
+    keys = sorted(list(utterance_dict.keys()))
+    start_frames, end_frames = pad_boundaries(
+        [utterance_dict[k][0] for k in keys],
+        [utterance_dict[k][1] for k in keys], sil_duration, frame_num)
+    return {str(k): int(end_frame - start_frame)
+            for k, start_frame, end_frame in zip(
+                keys, start_frames, end_frames)}
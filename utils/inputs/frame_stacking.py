@@ -0,0 +1,62 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Stack successive frames and skip frames to lower the frame rate
+   (https://arxiv.org/abs/1507.06947)."""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import numpy as np
+from numpy.lib.stride_tricks import as_strided
+
+
+def stacked_frame_num(frame_num, skip_frames):
+    """
+    Args:
+        frame_num (int): the number of frames before stacking
+        skip_frames (int): the number of frames to skip
+    Returns:
+        the number of frames after stacking
+    """
+    return -(-frame_num // skip_frames)
+
+
+def stack_frame(input_utt, stack_frames, skip_frames):
+    """Concatenate `stack_frames` successive frames into one frame every
+       `skip_frames` frames. Frames after the end are padded with zeros.
+    Args:
+        input_utt (np.ndarray): A tensor of size `[T, feature_dim]`
+        stack_frames (int): the number of frames to stack
+        skip_frames (int): the number of frames to skip
+    Returns:
+        stacked (np.ndarray): A tensor of size
+            `[ceil(T / skip_frames), feature_dim * stack_frames]`
+    """
+    if stack_frames < 1 or skip_frames < 1:
+        raise ValueError('stack_frames and skip_frames must be positive.')
+    if stack_frames == 1 and skip_frames == 1:
+        return input_utt
+
+    input_utt = np.ascontiguousarray(input_utt)
+    frame_num, feature_dim = input_utt.shape
+    frame_num_new = stacked_frame_num(frame_num, skip_frames)
+    stacked = np.zeros((frame_num_new, feature_dim * stack_frames),
+                       dtype=input_utt.dtype)
+
+    # NOTE: successive frames are contiguous in memory, so a stacked frame
+    # is a view of feature_dim * stack_frames values
+    full_num = min(max((frame_num - stack_frames) // skip_frames + 1, 0),
+                   frame_num_new)
+    if full_num > 0:
+        stride_t, stride_f = input_utt.strides
+        stacked[:full_num] = as_strided(
+            input_utt, shape=(full_num, feature_dim * stack_frames),
+            strides=(stride_t * skip_frames, stride_f), writeable=False)
+
+    # The last frames include padding
+    for t in range(full_num, frame_num_new):
+        frames = input_utt[t * skip_frames:t * skip_frames + stack_frames]
+        stacked[t, :frames.size] = frames.ravel()
+    return stacked
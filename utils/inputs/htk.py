@@ -9,9 +9,13 @@ from os.path import join
 from struct import unpack, pack
 import numpy as np
 
+# NOTE: a flag of parmKind. Features are saved as short integers with
+# scale & offset per dimension.
+COMPRESSED = 0o2000
+
 
 def read(htk_path):
-    """Read each HTK file.
+    """Read each HTK file. Compressed features are dequantized.
     Args:
         htk_path (string): path to a HTK file
     Returns:
@@ -31,6 +35,15 @@ def read(htk_path):
         # print(sampSize)  # feature dim * 4 (byte)
         # print(parmKind)
 
+        if parmKind & COMPRESSED:
+            # x = (short + B) / A per dimension
+            feature_dim = int(sampSize / 2)
+            A = np.fromfile(f, '>f4', count=feature_dim)
+            B = np.fromfile(f, '>f4', count=feature_dim)
+            input_data = np.fromfile(f, '>i2').reshape(-1, feature_dim)
+            input_data = ((input_data + B) / A).astype(np.float32)
+            return input_data, sampPeriod, parmKind & ~COMPRESSED
+
         # Read data
         feature_dim = int(sampSize / 4)
         f.seek(12, 0)
@@ -46,18 +59,57 @@ def read(htk_path):
     return input_data, sampPeriod, parmKind
 
 
-def write(input_data, htk_path, sampPeriod, parmKind):
+def read_header(htk_path):
+    """Read the header of each HTK file.
+    Args:
+        htk_path (string): path to a HTK file
+    Returns:
+        frame_num (int): the number of frames
+        sampPeriod (int):
+        sampSize (int): feature dim * 4 (byte)
+        parmKind (int):
+    """
+    with open(htk_path, "rb") as f:
+        spam = f.read(12)
+    if len(spam) < 12:
+        raise ValueError('%s is not a HTK file.' % htk_path)
+    frame_num, sampPeriod, sampSize, parmKind = unpack(">IIHH", spam)
+    if parmKind & COMPRESSED:
+        # NOTE: A & B of compressed features take 4 frames
+        frame_num -= 4
+    return frame_num, sampPeriod, sampSize, parmKind
+
+
+def write(input_data, htk_path, sampPeriod, parmKind, scale=None,
+          offset=None):
     """Save numpy array as a HTK file.
     Args:
         input_data (np.ndarray): A tensor of size (frame_num, feature_dim)
         htk_path (string): path to a HTK file
         sampPeriod (int):
         parmKind (int):
+        scale (np.ndarray, optional): if given, input_data are short
+            integers which mean `input_data * scale + offset`, and they are
+            saved compressed
+        offset (np.ndarray, optional): the offset per dimension of
+            compressed features
     """
     # print('...Saving: %s' % htk_path)
     with open(htk_path, "wb") as f:
-        # Write header
         frame_num, feature_dim = input_data.shape
+        if scale is not None:
+            # Write header
+            f.write(pack(">iihh", frame_num + 4, sampPeriod, feature_dim * 2,
+                         parmKind | COMPRESSED))
+
+            # Write A & B, and data
+            A = 1 / np.asarray(scale, dtype=np.float64)
+            np.asarray(A, dtype='>f4').tofile(f)
+            np.asarray(offset * A, dtype='>f4').tofile(f)
+            np.asarray(input_data, dtype='>i2').tofile(f)
+            return
+
+        # Write header
         sampSize = feature_dim * 4
         f.write(pack(">iihh", frame_num, sampPeriod, sampSize, parmKind))
 
@@ -0,0 +1,159 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Record saved input features per utterance to resume an interrupted run."""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import os
+from os.path import join, isfile, basename, dirname, getsize
+import json
+import hashlib
+import threading
+import numpy as np
+
+from utils.inputs.htk import write
+
+LEDGER_NAME = 'ledger.tsv'
+
+# NOTE: bump the version of a tool whenever features extracted by it change
+# (ex. the type of data, the sampling rate), so that features stored or
+# saved by an older version are extracted again instead of being reused
+FEATURE_VERSIONS = {
+    'htk': 1,
+    'python_speech_features': 1,
+    # 2: extracted at the native sampling rate, deltas over time, 40 mel
+    # bands for MFCC
+    'librosa': 2
+}
+
+
+def make_config_hash(*objs):
+    """Hash a configuration which determines the output features.
+    Args:
+        objs: dict, np.ndarray, string, number or None
+            (ex. tool, config, normalize, global mean & std)
+    Returns:
+        config_hash (string): a hex digest
+    """
+    md5 = hashlib.md5()
+    for obj in objs:
+        if isinstance(obj, np.ndarray):
+            md5.update(np.ascontiguousarray(obj).tobytes())
+        elif isinstance(obj, dict):
+            md5.update(json.dumps(obj, sort_keys=True).encode('utf-8'))
+        else:
+            md5.update(str(obj).encode('utf-8'))
+        md5.update(b'\t')
+    return md5.hexdigest()[:16]
+
+
+def make_feature_hash(tool, config, *objs):
+    """Hash a configuration of features extracted by a tool. The version of
+       the tool is included.
+    Args:
+        tool (string): htk or python_speech_features or librosa
+        config (dict): a configuration for feature extraction
+        objs: the other objects which determine the output features
+            (ex. normalize, global mean & std)
+    Returns:
+        config_hash (string): a hex digest
+    """
+    return make_config_hash(tool, FEATURE_VERSIONS.get(tool), config, *objs)
+
+
+class Ledger(object):
+    """An append-only record of saved utterances. Each line is
+       `utterance name, output path, the number of frames, file size,
+       config hash`. A file is written to a temporary path and renamed
+       before it is recorded, so a recorded file is always complete.
+    Args:
+        save_path (string): path to the directory of the ledger
+        save_format (string): numpy or htk
+        config_hash (string): hash of the configuration. Records with
+            another hash are ignored.
+    """
+
+    def __init__(self, save_path, save_format, config_hash):
+        if save_format not in ['numpy', 'htk']:
+            raise ValueError('save_format is numpy or htk.')
+        self.save_format = save_format
+        self.config_hash = config_hash
+        self.ledger_path = join(save_path, LEDGER_NAME)
+        self._lock = threading.Lock()
+
+        # key => utterance name, value => (path, frame num)
+        self.records = {}
+        if isfile(self.ledger_path):
+            with open(self.ledger_path, 'r') as f:
+                lines = f.readlines()
+            if len(lines) > 0 and not lines[-1].endswith('\n'):
+                # NOTE: the last line was broken by a crash
+                lines.pop()
+                with open(self.ledger_path, 'a') as f:
+                    f.write('\n')
+            for line in lines:
+                line = line.rstrip('\n').split('\t')
+                if len(line) != 5 or line[4] != config_hash:
+                    continue
+                utt_name, path, frame_num, file_size = line[:4]
+                if isfile(path) and getsize(path) == int(file_size):
+                    self.records[utt_name] = (path, int(frame_num))
+                elif utt_name in self.records.keys():
+                    del self.records[utt_name]
+
+    def is_done(self, utt_name):
+        """
+        Args:
+            utt_name (string): the name of an utterance
+        Returns:
+            True if the utterance has been saved with the same config
+        """
+        return utt_name in self.records.keys()
+
+    def save(self, utt_name, path, input_utt, sampPeriod=None,
+             parmKind=None, quantizer=None):
+        """Save input features atomically and record them.
+        Args:
+            utt_name (string): the name of an utterance
+            path (string): path to the npy or htk file
+            input_utt (np.ndarray): A tensor of size `[T, feature_dim]`
+            sampPeriod (int, optional): the sample period of the HTK file
+            parmKind (int, optional): the parameter kind of the HTK file
+            quantizer (Quantizer, optional): if given, features are saved
+                in its precision. HTK files are saved compressed (int16).
+        """
+        tmp_path = join(dirname(path), '.' + basename(path))
+        if quantizer is not None:
+            input_utt = quantizer.encode(input_utt)
+        if self.save_format == 'numpy':
+            with open(tmp_path, 'wb') as f:
+                np.save(f, input_utt)
+        elif quantizer is not None:
+            write(input_utt, htk_path=tmp_path,
+                  sampPeriod=sampPeriod, parmKind=parmKind,
+                  scale=quantizer.scale, offset=quantizer.offset)
+        else:
+            write(input_utt, htk_path=tmp_path,
+                  sampPeriod=sampPeriod, parmKind=parmKind)
+        os.rename(tmp_path, path)
+
+        frame_num = input_utt.shape[0]
+        with self._lock:
+            with open(self.ledger_path, 'a') as f:
+                f.write('%s\t%s\t%d\t%d\t%s\n' % (
+                    utt_name, path, frame_num, getsize(path),
+                    self.config_hash))
+            self.records[utt_name] = (path, frame_num)
+
+    def frame_num_dict(self):
+        """
+        Returns:
+            frame_num_dict (dict):
+                key => utterance name
+                value => the number of frames
+        """
+        return {utt_name: frame_num
+                for utt_name, (_, frame_num) in self.records.items()}
@@ -0,0 +1,117 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Causal sliding-window mean & variance normalization for streaming."""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import numpy as np
+
+
+class OnlineCMVN(object):
+    """Normalize each frame by mean & std over the last `window` frames
+       (including the frame itself). Frames can be fed chunk by chunk, and
+       the result is the same as feeding the whole utterance at once.
+    Args:
+        window (int, optional): the number of frames to compute mean & std
+        prior_mean (np.ndarray, optional): global mean over the training set.
+            A tensor of size `[feature_dim]`
+        prior_std (np.ndarray, optional): global std over the training set.
+            A tensor of size `[feature_dim]`
+        prior_frames (int, optional): while fewer than `window` frames have
+            been seen, the prior is counted as up to this number of frames
+        dtype (optional): the type of data, default is np.float32
+    """
+
+    def __init__(self, window=600, prior_mean=None, prior_std=None,
+                 prior_frames=200, dtype=np.float32):
+        if window < 1:
+            raise ValueError('window must be larger than 0.')
+        if (prior_mean is None) != (prior_std is None):
+            raise ValueError('Set both prior_mean and prior_std.')
+        self.window = window
+        self.prior_mean = prior_mean
+        self.prior_std = prior_std
+        self.prior_frames = prior_frames
+        self.dtype = dtype
+        self.reset()
+
+    def reset(self):
+        """Start a new utterance."""
+        self._shift = None
+        self._history = None
+        # NOTE: the last window - 1 frames (shifted)
+
+    def __call__(self, input_chunk):
+        """
+        Args:
+            input_chunk (np.ndarray): the next frames of the utterance.
+                A tensor of size `[T, feature_dim]`
+        Returns:
+            output_chunk (np.ndarray): the normalized frames.
+                A tensor of size `[T, feature_dim]`
+        """
+        frame_num, feature_dim = input_chunk.shape
+        if frame_num == 0:
+            return input_chunk.astype(self.dtype)
+
+        if self._shift is None:
+            # NOTE: sums of shifted frames lose less precision
+            if self.prior_mean is not None:
+                self._shift = np.asarray(self.prior_mean, dtype=np.float64)
+            else:
+                self._shift = input_chunk[0].astype(np.float64)
+            self._history = np.zeros((0, feature_dim), dtype=np.float64)
+
+        x = input_chunk.astype(np.float64) - self._shift
+        frames = np.concatenate([self._history, x], axis=0)
+        history_num = self._history.shape[0]
+
+        # Sums over the window by cumulative sums
+        cumsum = np.zeros((frames.shape[0] + 1, feature_dim))
+        np.cumsum(frames, axis=0, out=cumsum[1:])
+        cumsum_sq = np.zeros((frames.shape[0] + 1, feature_dim))
+        np.cumsum(frames ** 2, axis=0, out=cumsum_sq[1:])
+        end = np.arange(history_num + 1, history_num + frame_num + 1)
+        start = np.maximum(end - self.window, 0)
+        count = (end - start).astype(np.float64)[:, None]
+        window_sum = cumsum[end] - cumsum[start]
+        window_sum_sq = cumsum_sq[end] - cumsum_sq[start]
+
+        if self.prior_mean is not None:
+            # Fill the window with the prior at the beginning
+            prior_count = np.minimum(
+                self.window - count, self.prior_frames)
+            prior_count = np.maximum(prior_count, 0)
+            prior_mean = np.asarray(self.prior_mean, dtype=np.float64) - \
+                self._shift
+            prior_var = np.asarray(self.prior_std, dtype=np.float64) ** 2
+            window_sum += prior_count * prior_mean
+            window_sum_sq += prior_count * (prior_var + prior_mean ** 2)
+            count = count + prior_count
+
+        mean = window_sum / count
+        var = np.maximum(window_sum_sq / count - mean ** 2, 1e-10)
+        output_chunk = (x - mean) / np.sqrt(var)
+
+        self._history = frames[max(frames.shape[0] - self.window + 1, 0):]
+        return output_chunk.astype(self.dtype)
+
+
+def online_cmvn(input_utt, window=600, prior_mean=None, prior_std=None,
+                prior_frames=200, dtype=np.float32):
+    """Normalize a whole utterance in the same way as `OnlineCMVN`.
+    Args:
+        input_utt (np.ndarray): A tensor of size `[T, feature_dim]`
+        window (int, optional): the number of frames to compute mean & std
+        prior_mean (np.ndarray, optional): global mean over the training set
+        prior_std (np.ndarray, optional): global std over the training set
+        prior_frames (int, optional): the weight of the prior in frames
+        dtype (optional): the type of data, default is np.float32
+    Returns:
+        output_utt (np.ndarray): A tensor of size `[T, feature_dim]`
+    """
+    return OnlineCMVN(window, prior_mean, prior_std, prior_frames,
+                      dtype)(input_utt)
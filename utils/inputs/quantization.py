@@ -0,0 +1,277 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Store input features with reduced precision. Features are saved as
+   float16, or as integers with a scale & offset per dimension, and
+   dequantized when they are loaded.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import os
+from os.path import join, isfile, dirname
+import threading
+import numpy as np
+
+QUANTIZATION_NAME = 'quantization.npz'
+PRECISIONS = ['float32', 'float16', 'int16', 'int8']
+
+
+class Quantizer(object):
+    """Convert features to the precision to store them in, and record the
+       error of the conversion per dimension. Integers cover [low, high]
+       with equal steps. Values outside the range are clipped.
+    Args:
+        precision (string): float16 or int16 or int8
+        low (np.ndarray, optional): the lowest value per dimension.
+            Necessary for int16 and int8.
+        high (np.ndarray, optional): the highest value per dimension.
+            Necessary for int16 and int8.
+    """
+
+    def __init__(self, precision, low=None, high=None):
+        if precision not in PRECISIONS[1:]:
+            raise ValueError('precision must be "float16" or "int16" or "int8".')
+        self.precision = precision
+        self.dtype = np.dtype(precision)
+        self._lock = threading.Lock()
+
+        if self.dtype.kind == 'i':
+            if low is None or high is None:
+                raise ValueError('Set the range of features to store them '
+                                 'as integers.')
+            low = np.asarray(low, dtype=np.float64)
+            high = np.asarray(high, dtype=np.float64)
+            if np.any(high <= low):
+                raise ValueError('high must be larger than low.')
+            # NOTE: the range is symmetric around the offset, so -max is
+            # the lowest level and the smallest integer is not used
+            level_num = np.iinfo(self.dtype).max
+            self.scale = ((high - low) / (2 * level_num)).astype(np.float32)
+            self.offset = ((high + low) / 2).astype(np.float32)
+            self._max = level_num
+        else:
+            self.scale, self.offset = None, None
+
+        # NOTE: the hash of the ledger of the stored features (see
+        # `save_quantizer`)
+        self.config_hash = None
+
+        # Errors of stored features per dimension
+        self.frame_num = 0
+        self.abs_error_sum = None
+        self.max_abs_error = None
+        self.clip_num = None
+
+    def encode(self, input_utt):
+        """
+        Args:
+            input_utt (np.ndarray): A tensor of size `[T, feature_dim]`
+        Returns:
+            stored (np.ndarray): A tensor of size `[T, feature_dim]` in the
+                precision
+        """
+        if self.scale is None:
+            stored = input_utt.astype(self.dtype)
+            clip_num = np.zeros(input_utt.shape[1], dtype=np.int64)
+        else:
+            levels = np.rint((input_utt - self.offset) / self.scale)
+            clip_num = np.sum(np.abs(levels) > self._max, axis=0)
+            np.clip(levels, -self._max, self._max, out=levels)
+            stored = levels.astype(self.dtype)
+
+        abs_error = np.abs(self.decode(stored, dtype=np.float64) - input_utt)
+        with self._lock:
+            if self.abs_error_sum is None:
+                feature_dim = input_utt.shape[1]
+                self.abs_error_sum = np.zeros(feature_dim, dtype=np.float64)
+                self.max_abs_error = np.zeros(feature_dim, dtype=np.float64)
+                self.clip_num = np.zeros(feature_dim, dtype=np.int64)
+            self.frame_num += input_utt.shape[0]
+            self.abs_error_sum += np.sum(abs_error, axis=0)
+            if len(abs_error) > 0:
+                np.maximum(self.max_abs_error, np.max(abs_error, axis=0),
+                           out=self.max_abs_error)
+            self.clip_num += clip_num
+        return stored
+
+    def decode(self, stored, dtype=np.float32):
+        """
+        Args:
+            stored (np.ndarray): A tensor of size `[T, feature_dim]` in the
+                precision
+            dtype (optional): the type of data, default is np.float32
+        Returns:
+            input_utt (np.ndarray): A tensor of size `[T, feature_dim]`
+        """
+        if self.scale is None:
+            return stored.astype(dtype)
+        input_utt = np.multiply(stored, self.scale, dtype=dtype)
+        input_utt += self.offset
+        return input_utt
+
+    def merge(self, other):
+        """Add errors recorded by another quantizer with the same range
+           (ex. of another shard).
+        Args:
+            other (Quantizer): quantizer to merge into this one
+        """
+        if not self.is_compatible(other):
+            raise ValueError('Quantizers with another range are not merged.')
+        if other.abs_error_sum is None:
+            return
+        if self.abs_error_sum is None:
+            self.abs_error_sum = np.zeros_like(other.abs_error_sum)
+            self.max_abs_error = np.zeros_like(other.max_abs_error)
+            self.clip_num = np.zeros_like(other.clip_num)
+        self.frame_num += other.frame_num
+        self.abs_error_sum += other.abs_error_sum
+        np.maximum(self.max_abs_error, other.max_abs_error,
+                   out=self.max_abs_error)
+        self.clip_num += other.clip_num
+
+    def is_compatible(self, other):
+        """
+        Args:
+            other (Quantizer):
+        Returns:
+            True if features are stored in the same way by the same
+            configuration
+        """
+        if self.precision != other.precision:
+            return False
+        if self.config_hash != other.config_hash:
+            return False
+        if self.scale is None:
+            return True
+        return (np.array_equal(self.scale, other.scale) and
+                np.array_equal(self.offset, other.offset))
+
+    def report(self):
+        """Print the error of stored features."""
+        if self.frame_num == 0:
+            return
+        mean_abs_error = self.abs_error_sum / self.frame_num
+        print('=====> Stored as %s: %d frames, max abs error %.4g, '
+              'mean abs error %.4g (max over dimensions), %d values '
+              'clipped' % (self.precision, self.frame_num,
+                           np.max(self.max_abs_error),
+                           np.max(mean_abs_error), np.sum(self.clip_num)))
+
+    def save(self, path):
+        """Save the range and the error per dimension atomically. The file
+           is the fidelity report of the stored features.
+        Args:
+            path (string): path to the npz file
+        """
+        tables = {'precision': np.array(self.precision),
+                  'frame_num': np.array(self.frame_num, dtype=np.int64)}
+        if self.config_hash is not None:
+            tables['config_hash'] = np.array(self.config_hash)
+        if self.scale is not None:
+            tables['scale'] = self.scale
+            tables['offset'] = self.offset
+        if self.abs_error_sum is not None:
+            tables['abs_error_sum'] = self.abs_error_sum
+            tables['max_abs_error'] = self.max_abs_error
+            tables['mean_abs_error'] = self.abs_error_sum / max(
+                self.frame_num, 1)
+            tables['clip_num'] = self.clip_num
+        with open(path + '.tmp', 'wb') as f:
+            np.savez(f, **tables)
+        os.rename(path + '.tmp', path)
+
+    @classmethod
+    def load(cls, path):
+        """
+        Args:
+            path (string): path to the npz file
+        Returns:
+            quantizer (Quantizer)
+        """
+        with np.load(path) as tables:
+            quantizer = cls(str(tables['precision']), low=np.zeros(1),
+                            high=np.ones(1))
+            if 'scale' in tables.keys():
+                quantizer.scale = tables['scale']
+                quantizer.offset = tables['offset']
+            if 'config_hash' in tables.keys():
+                quantizer.config_hash = str(tables['config_hash'])
+            quantizer.frame_num = int(tables['frame_num'])
+            if 'abs_error_sum' in tables.keys():
+                quantizer.abs_error_sum = tables['abs_error_sum']
+                quantizer.max_abs_error = tables['max_abs_error']
+                quantizer.clip_num = tables['clip_num']
+        return quantizer
+
+
+def standard_quantizer(precision, mean, std, clip=4.):
+    """Make a quantizer from statistics of features over the training set.
+       Integers cover mean +-clip std per dimension. Features normalized
+       by the statistics have zero mean and unit variance.
+    Args:
+        precision (string): float16 or int16 or int8
+        mean (np.ndarray): A tensor of size `[feature_dim]`, or
+            `[group_num, feature_dim]` to cover features of all groups
+            (ex. male and female)
+        std (np.ndarray): the same size as mean
+        clip (float, optional): values beyond clip std are clipped
+    Returns:
+        quantizer (Quantizer)
+    """
+    mean = np.atleast_2d(np.asarray(mean, dtype=np.float64))
+    std = np.atleast_2d(np.asarray(std, dtype=np.float64))
+    # NOTE: statistics of a group without frames are NaN
+    low = np.nanmin(mean - clip * std, axis=0)
+    high = np.nanmax(mean + clip * std, axis=0)
+    # NOTE: a constant dimension is stored as its value
+    high = np.where(high > low, high, low + 1.)
+    return Quantizer(precision, low=low, high=high)
+
+
+def save_quantizer(quantizer, save_path, config_hash):
+    """Save the quantizer of features saved in save_path. Errors recorded
+       by an interrupted run with the same configuration are kept, and
+       those of another configuration (or of a run before it) are
+       discarded because all features are saved again.
+    Args:
+        quantizer (Quantizer): quantizer used by `Ledger.save`
+        save_path (string): path to the directory of the features
+        config_hash (string): the hash of the ledger of the features
+    """
+    quantizer.config_hash = config_hash
+    path = join(save_path, QUANTIZATION_NAME)
+    if isfile(path):
+        previous = Quantizer.load(path)
+        if previous.is_compatible(quantizer):
+            previous.merge(quantizer)
+            quantizer = previous
+    quantizer.save(path)
+    quantizer.report()
+
+
+_quantizers = {}
+
+
+def find_quantizer(input_path):
+    """Find the quantizer of a stored feature file. It is saved in the
+       directory of the features (ex. save_path/speaker/*.npy) or its
+       parent.
+    Args:
+        input_path (string): path to a npy file
+    Returns:
+        quantizer (Quantizer)
+    """
+    directory = dirname(input_path)
+    if directory not in _quantizers.keys():
+        for path in [join(directory, QUANTIZATION_NAME),
+                     join(dirname(directory), QUANTIZATION_NAME)]:
+            if isfile(path):
+                _quantizers[directory] = Quantizer.load(path)
+                break
+        else:
+            raise ValueError('%s is not found for %s.' %
+                             (QUANTIZATION_NAME, input_path))
+    return _quantizers[directory]
@@ -8,16 +8,111 @@ from __future__ import print_function
 """Segment an audio file into each utterance (save as numpy files)."""
 
 import numpy as np
-from collections import OrderedDict
 
-from utils.inputs.htk import read as read_htk
-from utils.inputs.wav2feature_python_speech_features import wav2feature as w2f_psf
-from utils.inputs.wav2feature_librosa import wav2feature as w2f_librosa
+from utils.inputs.feature_extraction import extract_feature
+from utils.inputs.dtype_policy import FEATURE_DTYPE, ACCUMULATOR_DTYPE
+
+
+def pad_boundaries(start_frames, end_frames, sil_duration, frame_num):
+    """Extend utterances with silence at both ends. If the gap between
+       two utterances is shorter than twice sil_duration, it is divided
+       in half.
+    Args:
+        start_frames (np.ndarray): start frames of utterances in order
+        end_frames (np.ndarray): end frames of utterances in order
+        sil_duration (int): duration of silence at both ends
+        frame_num (int): the number of frames in the file
+    Returns:
+        start_frames_extend (np.ndarray): padded start frames
+        end_frames_extend (np.ndarray): padded end frames (exclusive)
+    """
+    start_frames = np.asarray(start_frames, dtype=np.int64)
+    end_frames = np.asarray(end_frames, dtype=np.int64)
+    if len(start_frames) == 0:
+        return start_frames, end_frames
+
+    # NOTE: gaps[i] is the gap between utterance i - 1 and i
+    gaps = start_frames[1:] - end_frames[:-1]
+    half_gaps = np.trunc(gaps / 2).astype(np.int64)
+    is_long = gaps >= sil_duration * 2
+
+    start_frames_extend = np.empty_like(start_frames)
+    start_frames_extend[0] = max(start_frames[0] - sil_duration, 0)
+    start_frames_extend[1:] = np.where(
+        is_long, start_frames[1:] - sil_duration, start_frames[1:] - half_gaps)
+
+    end_frames_extend = np.empty_like(end_frames)
+    end_frames_extend[:-1] = np.where(
+        is_long, end_frames[:-1] + sil_duration, end_frames[:-1] + half_gaps)
+    end_frames_extend[-1] = min(end_frames[-1] + sil_duration, frame_num)
+
+    start_frames_extend = np.clip(start_frames_extend, 0, frame_num)
+    end_frames_extend = np.clip(end_frames_extend, start_frames_extend,
+                                frame_num)
+    # NOTE: segments of heavily overlapping utterances may be empty
+    return start_frames_extend, end_frames_extend
+
+
+class PrefixSums(object):
+    """Cumulative sums of frames in a file to compute the sum and squared
+       deviations of any segment in constant time, even if segments are
+       overlapping.
+    Args:
+        input_data (np.ndarray): A tensor of size `[T, feature_dim]`
+    """
+
+    def __init__(self, input_data):
+        frame_num, feature_dim = input_data.shape
+        # NOTE: sums of shifted frames lose less precision
+        self.shift = input_data[0].astype(ACCUMULATOR_DTYPE) \
+            if frame_num > 0 else np.zeros((feature_dim,))
+        self.cumsum = np.zeros((frame_num + 1, feature_dim),
+                               dtype=ACCUMULATOR_DTYPE)
+        np.cumsum(np.subtract(input_data, self.shift), axis=0,
+                  out=self.cumsum[1:])
+        self._input_data = input_data
+        self._cumsum_sq = None
+        # NOTE: cumulative sums of squares are computed on demand. Shifted
+        # frames in float64 are not kept.
+
+    def sums(self, start_frames, end_frames):
+        """
+        Args:
+            start_frames (np.ndarray): start frames of segments
+            end_frames (np.ndarray): end frames of segments (exclusive)
+        Returns:
+            sums (np.ndarray): A tensor of size `[N, feature_dim]`
+        """
+        frame_nums = (end_frames - start_frames)[:, None]
+        return self.cumsum[end_frames] - self.cumsum[start_frames] + \
+            frame_nums * self.shift
+
+    def squared_deviations(self, start_frames, end_frames, mean):
+        """
+        Args:
+            start_frames (np.ndarray): start frames of segments
+            end_frames (np.ndarray): end frames of segments (exclusive)
+            mean (np.ndarray): A tensor of size `[feature_dim]`
+        Returns:
+            squared_deviations (np.ndarray): sums of squared deviations
+                from the mean. A tensor of size `[N, feature_dim]`
+        """
+        frame_nums = (end_frames - start_frames)[:, None]
+        shifted_sums = self.cumsum[end_frames] - self.cumsum[start_frames]
+        if self._cumsum_sq is None:
+            self._cumsum_sq = np.zeros_like(self.cumsum)
+            x = np.subtract(self._input_data, self.shift)
+            np.square(x, out=x)
+            np.cumsum(x, axis=0, out=self._cumsum_sq[1:])
+        sq_sums = self._cumsum_sq[end_frames] - self._cumsum_sq[start_frames]
+        delta = np.asarray(mean, dtype=np.float64) - self.shift
+        return np.maximum(
+            sq_sums - 2 * delta * shifted_sums + frame_nums * delta ** 2, 0)
 
 
 def segment(audio_path, speaker, utterance_dict, is_training,
-            sil_duration=0., tool='htk', config=None, mean=None,
-            dtype=np.float32):
+            sil_duration=0, tool='htk', config=None, mean=None,
+            dtype=FEATURE_DTYPE, store_path=None):
     """Segment each HTK or WAV file into utterances. Normalization will not be
        conducted here.
     Args:
@@ -26,155 +121,135 @@ def segment(audio_path, speaker, utterance_dict, is_training,
         utterance_dict (dict): dictionary of utterance information
             key (string) => utterance index
             value (list) => [start_frame, end_frame, transcript (, transcript2)]
-        sil_duration (float): duration of silence at both ends. Default is 0.
+        sil_duration (int): duration of silence at both ends. Default is 0.
         tool (string): htk or python_speech_features or librosa
         config (dict): a configuration for feature extraction
         mean (np.ndarray):  A mean vector over the file
-        dtype (optional): default is np.float64
+        dtype (optional): the type of features, default is np.float32
+        store_path (string, optional): path to the shared feature store
     Returns:
         input_data_dict (dict):
             key (string) => utt_index
-            value (np.ndarray )=> a feature vector of size
+            value (np.ndarray )=> a view of feature vectors of size
                 `(frame_num, feature_dim)`
-        input_data_utt_sum (np.ndarray): A sum of feature vectors of a speaker
+        input_data_utt_sum (np.ndarray): A sum of feature vectors of a
+            speaker in float64 (None if is_training is False)
         mean (np.ndarray): A mean vector over the file
         stddev (np.ndarray): A stddev vector over the file
         total_frame_num_file (int): total frame num of the target speaker's utterances
+        utt_sum_dict (dict): (None if is_training is False)
+            key (string) => utt_index
+            value (np.ndarray) => a sum of feature vectors of the
+                utterance in float64
+        utt_squared_deviation_dict (dict): (None if is_training is False)
+            key (string) => utt_index
+            value (np.ndarray) => a sum of squared deviations of feature
+                vectors of the utterance from the mean in float64
     """
-    if tool != 'htk' and config is None:
-        raise ValueError('Set config dict.')
-
     # Read the HTK or WAV file
-    if tool == 'htk':
-        input_data, _, _ = read_htk(audio_path)
-    elif tool == 'python_speech_features':
-        input_data = w2f_psf(
-            audio_path,
-            feature_type=config['feature_type'],
-            feature_dim=config['channels'],
-            use_energy=config['energy'],
-            use_delta1=config['delta'],
-            use_delta2=config['deltadelta'],
-            window=config['window'],
-            slide=config['slide'])
-    elif tool == 'librosa':
-        input_data = w2f_librosa(
-            audio_path,
-            feature_type=config['feature_type'],
-            feature_dim=config['channels'],
-            use_energy=config['energy'],
-            use_delta1=config['delta'],
-            use_delta2=config['deltadelta'],
-            window=config['window'],
-            slide=config['slide'])
-
-    assert isinstance(utterance_dict, OrderedDict)
-    # NOTE: utterance_dict must be an instance of OrderedDict
+    input_data, _, _ = extract_feature(audio_path, tool, config, store_path,
+                                       dtype)
+
+    keys = sorted(list(utterance_dict.keys()))
+    start_frames = np.array([utterance_dict[k][0] for k in keys],
+                            dtype=np.int64)
+    end_frames = np.array([utterance_dict[k][1] for k in keys],
+                          dtype=np.int64)
+
+    # Check timestamps
+    for i in np.where(start_frames > end_frames)[0]:
+        print('Warning: time stamp is reversed.')
+        print('speaker index: %s' % speaker)
+        print('utterance index: %s' % keys[i])
+        print('start_frame: %.3f' % start_frames[i])
+        print('end_frame: %.3f' % end_frames[i])
+        raise ValueError
+    for i in np.where(end_frames[:-1] > start_frames[1:])[0]:
+        print('Warning: utterances are overlapping.')
+        print('speaker index: %s' % speaker)
+        print('utterance index: %s' % keys[i])
+        print('end_frame: %.3f' % end_frames[i])
+        print('start_frame_next: %.3f' % start_frames[i + 1])
 
     # Divide into each utterance
-    feature_dim = input_data.shape[1]
+    start_frames, end_frames = pad_boundaries(
+        start_frames, end_frames, sil_duration, input_data.shape[0])
     input_data_dict = {}
-    total_frame_num_file = 0
-    end_frame_pre = 0
-    utt_num = len(utterance_dict.keys())
-    input_data_utt_sum = np.zeros((feature_dim,), dtype=dtype)
-    stddev = np.zeros((feature_dim,), dtype=dtype)
-    keys = sorted(list(utterance_dict.keys()))
-    for i, utt_index in enumerate(keys):
-        utt_info = utterance_dict[utt_index]
-        start_frame, end_frame = utt_info[0], utt_info[1]
-
-        # Check timestamp
-        if start_frame > end_frame:
-            print('Warning: time stamp is reversed.')
-            print('speaker index: %s' % speaker)
-            print('utterance index: %s' % utt_index)
-            print('start_frame: %.3f' % start_frame)
-            print('end_frame: %.3f' % end_frame)
-            raise ValueError
-
-        # Check the first utterance
-        if i == 0:
-            if start_frame >= sil_duration:
-                start_frame_extend = start_frame - sil_duration
-            else:
-                start_frame_extend = 0
-
-            if len(utterance_dict) != 1:
-                start_frame_next = utterance_dict[keys[i + 1]][0]
-                if end_frame > start_frame_next:
-                    print('Warning: utterances are overlapping.')
-                    print('speaker index: %s' % speaker)
-                    print('utterance index: %s' % utt_index)
-                    print('end_frame: %.3f' % end_frame)
-                    print('start_frame_next: %.3f' % start_frame_next)
-
-                if start_frame_next - end_frame >= sil_duration * 2:
-                    end_frame_extend = end_frame + sil_duration
-                else:
-                    end_frame_extend = end_frame + \
-                        int((start_frame_next - end_frame) / 2)
-            else:
-                end_frame_extend = end_frame + sil_duration
-                # end_frame_extend = end_frame
-
-        # Check the last utterance
-        elif i == utt_num - 1:
-            if start_frame - end_frame_pre >= sil_duration * 2:
-                start_frame_extend = start_frame - sil_duration
-            else:
-                start_frame_extend = start_frame - \
-                    int((start_frame - end_frame_pre) / 2)
-
-            if input_data.shape[0] - end_frame >= sil_duration:
-                end_frame_extend = end_frame + sil_duration
-            else:
-                end_frame_extend = input_data.shape[0]  # last frame
-
-        # Check other utterances
-        else:
-            if start_frame - end_frame_pre >= sil_duration * 2:
-                start_frame_extend = start_frame - sil_duration
-            else:
-                start_frame_extend = start_frame - \
-                    int((start_frame - end_frame_pre) / 2)
-
-            start_frame_next = utterance_dict[keys[i + 1]][0]
-            if end_frame > start_frame_next:
-                print('Warning: utterances are overlapping.')
-                print('speaker index: %s' % speaker)
-                print('utterance index: %s' % utt_index)
-                print('end_frame: %.3f' % end_frame)
-                print('start_frame_next: %.3f' % start_frame_next)
-
-            if start_frame_next - end_frame >= sil_duration * 2:
-                end_frame_extend = end_frame + sil_duration
-            else:
-                end_frame_extend = end_frame + \
-                    int((start_frame_next - end_frame) / 2)
-
-        input_data_utt = input_data[start_frame_extend:end_frame_extend]
-        input_data_utt_sum += np.sum(input_data_utt, axis=0)
-        total_frame_num_file += (end_frame_extend - start_frame_extend)
-        input_data_dict[str(utt_index)] = input_data_utt
-
-        # For computing stddev over the file
-        if mean is not None:
-            stddev += np.sum(
-                np.abs(input_data_utt - mean) ** 2, axis=0)
+    for utt_index, start_frame, end_frame in zip(
+            keys, start_frames, end_frames):
+        input_data_dict[str(utt_index)] = input_data[start_frame:end_frame]
 
-        # Update
-        end_frame_pre = end_frame
+    total_frame_num_file = int(np.sum(end_frames - start_frames))
 
     if is_training:
+        # NOTE: cumulative sums over the file are built only for statistics
+        prefix_sums = PrefixSums(input_data)
+        utt_sums = prefix_sums.sums(start_frames, end_frames)
+        input_data_utt_sum = np.sum(utt_sums, axis=0)
         if mean is not None:
             # Compute stddev over the file
-            stddev = np.sqrt(stddev / (total_frame_num_file - 1))
+            utt_squared_deviations = prefix_sums.squared_deviations(
+                start_frames, end_frames, mean)
+            stddev = np.sqrt(np.sum(utt_squared_deviations, axis=0) /
+                             (total_frame_num_file - 1)).astype(dtype)
         else:
             # Compute mean over the file
-            mean = input_data_utt_sum / total_frame_num_file
+            mean = (input_data_utt_sum / total_frame_num_file).astype(dtype)
+            utt_squared_deviations = prefix_sums.squared_deviations(
+                start_frames, end_frames, mean)
             stddev = None
+        # NOTE: statistics of each utterance from the same cumulative sums,
+        # even if utterances are overlapping
+        utt_sum_dict = dict(zip(input_data_dict.keys(), utt_sums))
+        utt_squared_deviation_dict = dict(
+            zip(input_data_dict.keys(), utt_squared_deviations))
     else:
-        mean, stddev = None, None
+        input_data_utt_sum, mean, stddev = None, None, None
+        utt_sum_dict, utt_squared_deviation_dict = None, None
+
+    return (input_data_dict, input_data_utt_sum, mean, stddev,
+            total_frame_num_file, utt_sum_dict, utt_squared_deviation_dict)
+
+
+class Segmenter(object):
+    """Picklable wrapper of `segment` for worker processes.
+    Args:
+        is_training (bool): training or not
+        sil_duration (float, optional): duration of silence at both ends
+        tool (string, optional): htk or python_speech_features or librosa
+        config (dict, optional): a configuration for feature extraction
+        keep_features (bool, optional): if False, features of each
+            utterance are not returned (only statistics are returned)
+        store_path (string, optional): path to the shared feature store
+        dtype (optional): the type of features, default is np.float32
+    """
 
-    return input_data_dict, input_data_utt_sum, mean, stddev, total_frame_num_file
+    def __init__(self, is_training, sil_duration=0, tool='htk', config=None,
+                 keep_features=True, store_path=None, dtype=FEATURE_DTYPE):
+        self.is_training = is_training
+        self.sil_duration = sil_duration
+        self.tool = tool
+        self.config = config
+        self.keep_features = keep_features
+        self.store_path = store_path
+        self.dtype = dtype
+
+    def __call__(self, args):
+        """
+        Args:
+            args (tuple): (audio_path, speaker, utterance_dict, mean)
+        Returns:
+            same as `segment`
+        """
+        audio_path, speaker, utterance_dict, mean = args
+        outputs = segment(audio_path, speaker, utterance_dict,
+                          is_training=self.is_training,
+                          sil_duration=self.sil_duration,
+                          tool=self.tool,
+                          config=self.config,
+                          mean=mean,
+                          dtype=self.dtype,
+                          store_path=self.store_path)
+        if not self.keep_features:
+            outputs = (None,) + outputs[1:]
+        return outputs
@@ -0,0 +1,408 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Statistics of input features to normalize them on load."""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import os
+import math
+import random
+import numpy as np
+
+from utils.inputs.online_cmvn import online_cmvn
+
+STATISTICS_NAME = 'statistics.npz'
+
+
+class Statistics(object):
+    """Mean & std of features per group. Groups are named as `kind/value`
+       (ex. gender/m, speaker/fadg0, channel/A) and `global` for all
+       utterances. Statistics of each utterance are merged into those of
+       all its groups, so every group is computed in one pass over the data.
+    Args:
+        key_funcs (dict, optional):
+            key => the kind of groups (ex. gender, speaker, channel, corpus)
+            value => a function which takes the key of an utterance
+                (ex. the speaker name) and returns its group in the kind.
+                If it returns None, the utterance belongs to no group of
+                the kind.
+    """
+
+    def __init__(self, key_funcs=None):
+        self.key_funcs = key_funcs if key_funcs is not None else {}
+        # key => group name, value => group id
+        self.group_ids = {}
+        # NOTE: indexed by group id
+        self.frame_nums = []
+        self.means = []
+        self.m2s = []
+        # NOTE: m2 is the sum of squared differences from the mean
+
+    def groups(self, utt_key):
+        """
+        Args:
+            utt_key: the key of an utterance passed to key_funcs
+        Returns:
+            groups (list): names of groups the utterance belongs to
+        """
+        groups = ['global']
+        for kind, key_func in self.key_funcs.items():
+            value = key_func(utt_key)
+            if value is not None:
+                groups.append('%s/%s' % (kind, value))
+        return groups
+
+    def add(self, input_utt, utt_key=None):
+        """
+        Args:
+            input_utt (np.ndarray): A tensor of size `[T, feature_dim]`
+            utt_key (optional): the key of the utterance passed to key_funcs
+        """
+        frame_num = input_utt.shape[0]
+        if frame_num == 0:
+            return
+        utt_mean = np.mean(input_utt, axis=0, dtype=np.float64)
+        utt_m2 = np.sum((input_utt - utt_mean) ** 2, axis=0)
+        for group in self.groups(utt_key):
+            self._merge(group, frame_num, utt_mean, utt_m2)
+
+    def _merge(self, group, frame_num, mean, m2):
+        if group not in self.group_ids.keys():
+            self.group_ids[group] = len(self.frame_nums)
+            self.frame_nums.append(frame_num)
+            self.means.append(mean.copy())
+            self.m2s.append(m2.copy())
+            return
+
+        # NOTE: merge in the numerically stable way (Chan et al.)
+        group_id = self.group_ids[group]
+        frame_num_group = self.frame_nums[group_id]
+        total_frame_num = frame_num_group + frame_num
+        delta = mean - self.means[group_id]
+        self.means[group_id] += delta * frame_num / total_frame_num
+        self.m2s[group_id] += m2 + delta ** 2 * \
+            frame_num_group * frame_num / total_frame_num
+        self.frame_nums[group_id] = total_frame_num
+
+    def merge(self, other):
+        """Merge statistics computed over other utterances
+           (ex. on another node).
+        Args:
+            other (Statistics): statistics to merge into this
+        """
+        for group, group_id in sorted(other.group_ids.items(),
+                                      key=lambda x: x[1]):
+            self._merge(group, other.frame_nums[group_id],
+                        np.asarray(other.means[group_id], dtype=np.float64),
+                        np.asarray(other.m2s[group_id], dtype=np.float64))
+
+    def has_kind(self, kind):
+        """
+        Args:
+            kind (string): the kind of groups (ex. speaker)
+        Returns:
+            True if there are groups of the kind
+        """
+        return any(group.startswith(kind + '/')
+                   for group in self.group_ids.keys())
+
+    def mean(self, group):
+        """
+        Args:
+            group (string): the name of a group
+        Returns:
+            mean (np.ndarray): A tensor of size `[feature_dim]`
+        """
+        return self.means[self.group_ids[group]]
+
+    def std(self, group):
+        """
+        Args:
+            group (string): the name of a group
+        Returns:
+            std (np.ndarray): A tensor of size `[feature_dim]`
+        """
+        group_id = self.group_ids[group]
+        return np.sqrt(self.m2s[group_id] /
+                       max(self.frame_nums[group_id] - 1, 1))
+
+    def save(self, path):
+        """Save statistics atomically as a table indexed by group id.
+        Args:
+            path (string): path to the npz file
+        """
+        group_names = sorted(self.group_ids.keys(),
+                             key=lambda group: self.group_ids[group])
+        with open(path + '.tmp', 'wb') as f:
+            np.savez(f,
+                     groups=np.array(group_names, dtype=str),
+                     frame_nums=np.array(self.frame_nums, dtype=np.int64),
+                     means=np.array(self.means, dtype=np.float64),
+                     m2s=np.array(self.m2s, dtype=np.float64))
+        os.rename(path + '.tmp', path)
+
+    @classmethod
+    def load(cls, path):
+        """
+        Args:
+            path (string): path to the npz file
+        Returns:
+            statistics (Statistics): key_funcs are not restored
+        """
+        statistics = cls()
+        with np.load(path) as tables:
+            statistics.group_ids = {
+                str(group): i for i, group in enumerate(tables['groups'])}
+            statistics.frame_nums = list(tables['frame_nums'])
+            statistics.means = list(tables['means'])
+            statistics.m2s = list(tables['m2s'])
+        return statistics
+
+
+class Normalizer(object):
+    """Normalize unnormalized features when they are loaded. Features saved
+       with `normalize=no` can be normalized in any mode without saving them
+       again.
+    Args:
+        statistics (Statistics or string): statistics over the training set
+            or path to them
+        normalize (string):
+            no => normalization will be not conducted
+            global => normalize input features by global mean & std over
+                      the training set (per gender if gender is given)
+            utterance => normalize input features by mean & std per utterance
+            online => normalize input features by mean & std over the past
+                      `online_window` frames with global mean & std over
+                      the training set as the prior (per gender if gender
+                      is given)
+            others => normalize input features by mean & std per group of
+                      the kind (ex. speaker, channel, corpus)
+        is_training (bool, optional): If False, features are normalized by
+            global mean & std over the training set in any mode except no,
+            in the same way as `read_audio`.
+        dtype (optional): the type of data, default is np.float32
+        online_window (int, optional): the number of frames to compute
+            mean & std if normalize is online
+    """
+
+    def __init__(self, statistics, normalize, is_training=True,
+                 dtype=np.float32, online_window=600):
+        if not isinstance(statistics, Statistics):
+            statistics = Statistics.load(statistics)
+        if normalize not in ['global', 'utterance', 'online', 'no'] and \
+                not statistics.has_kind(normalize):
+            raise ValueError('There are no statistics per %s.' % normalize)
+        self.statistics = statistics
+        self.normalize = normalize
+        self.is_training = is_training
+        self.dtype = dtype
+        self.online_window = online_window
+        self._cache = {}
+
+    def _mean_and_inv_std(self, group):
+        if group not in self._cache.keys():
+            self._cache[group] = (
+                self.statistics.mean(group).astype(self.dtype),
+                (1 / self.statistics.std(group)).astype(self.dtype))
+        return self._cache[group]
+
+    def _gender_group(self, groups):
+        if groups.get('gender') is not None:
+            return 'gender/' + groups['gender']
+        return 'global'
+
+    def __call__(self, input_utt, **groups):
+        """Normalize features in place.
+        Args:
+            input_utt (np.ndarray): A tensor of size `[T, feature_dim]`
+            groups: the group of the utterance per kind
+                (ex. speaker='fadg0', gender='f')
+        Returns:
+            input_utt (np.ndarray): the normalized input_utt
+        """
+        if self.normalize == 'no':
+            return input_utt
+        elif self.normalize == 'online':
+            group = self._gender_group(groups)
+            input_utt[:] = online_cmvn(
+                input_utt, window=self.online_window,
+                prior_mean=self.statistics.mean(group),
+                prior_std=self.statistics.std(group), dtype=self.dtype)
+            return input_utt
+        elif self.normalize == 'utterance' and self.is_training:
+            mean = np.mean(input_utt, axis=0, dtype=self.dtype)
+            inv_std = 1 / np.std(input_utt, axis=0, dtype=self.dtype)
+        elif self.normalize == 'global' or not self.is_training:
+            mean, inv_std = self._mean_and_inv_std(self._gender_group(groups))
+        else:
+            if groups.get(self.normalize) is None:
+                raise ValueError('Set %s.' % self.normalize)
+            mean, inv_std = self._mean_and_inv_std(
+                self.normalize + '/' + groups[self.normalize])
+
+        np.subtract(input_utt, mean, out=input_utt)
+        np.multiply(input_utt, inv_std, out=input_utt)
+        return input_utt
+
+
+class StatisticsSampler(object):
+    """Choose files to compute statistics from by stratified random sampling,
+       and estimate how accurate the sampled mean is. Files are the sampling
+       units because frames in a file are correlated.
+    Args:
+        items (list): files (ex. paths to audio files)
+        group_func (function): a function which takes a file and returns
+            its group (ex. gender). Files are sampled in each group.
+        sample_rate (float, optional): the rate of files sampled per group.
+            At least one file is sampled per group.
+        max_frames (int, optional): the maximum number of frames per group.
+            Once a group is full, the rest of its files are not used.
+        seed (int, optional): the seed of the random sampling
+        frame_func (function, optional): a function which takes a file and
+            returns its number of frames (ex. `read_frame_num`). If given,
+            files up to max_frames per group are chosen here in the sampled
+            order, so that the files used do not depend on the order in
+            which they are added (ex. by several workers).
+    """
+
+    def __init__(self, items, group_func, sample_rate=1., max_frames=None,
+                 seed=0, frame_func=None):
+        if sample_rate <= 0 or sample_rate > 1:
+            raise ValueError('sample_rate must be in (0, 1].')
+        self.group_func = group_func
+        self.max_frames = max_frames
+
+        rng = random.Random(seed)
+        group_items = {}
+        for item in items:
+            group = group_func(item)
+            if group not in group_items.keys():
+                group_items[group] = []
+            group_items[group].append(item)
+        self.population_nums = {group: len(group_items[group])
+                                for group in group_items.keys()}
+        self.sampled = sample_rate < 1 or max_frames is not None
+        if not self.sampled:
+            # NOTE: all files in the original order
+            self.items = list(items)
+        else:
+            self.items = []
+            for group in sorted(group_items.keys()):
+                sample_num = int(math.ceil(
+                    len(group_items[group]) * sample_rate))
+                self.items += rng.sample(group_items[group],
+                                         max(sample_num, 1))
+            rng.shuffle(self.items)
+            # NOTE: shuffled so that files used before a group is full are
+            # also a random sample
+
+        self._capped = max_frames is not None and frame_func is not None
+        if self._capped:
+            group_frame_nums = {}
+            capped_items = []
+            for item in self.items:
+                group = group_func(item)
+                if group_frame_nums.get(group, 0) < max_frames:
+                    capped_items.append(item)
+                    group_frame_nums[group] = \
+                        group_frame_nums.get(group, 0) + frame_func(item)
+            self.items = capped_items
+
+        self.used_items = []
+        self._sampled = set(self.items)
+        # key => group, value => [unit num, frame num, sum, sum of squared
+        # sums, sum of frame num * sum, sum of squared frame nums]
+        self._sums = {}
+
+    def is_sampled(self, item):
+        """
+        Args:
+            item: a file
+        Returns:
+            True if the file is sampled and its group is not full
+        """
+        if item not in self._sampled:
+            return False
+        if self.max_frames is None or self._capped:
+            return True
+        group = self.group_func(item)
+        return (group not in self._sums.keys() or
+                self._sums[group][1] < self.max_frames)
+
+    def is_full(self):
+        """
+        Returns:
+            True if all groups have max_frames frames. Always False if
+            files are chosen by frame_func.
+        """
+        if self.max_frames is None or self._capped:
+            return False
+        return all(group in self._sums.keys() and
+                   self._sums[group][1] >= self.max_frames
+                   for group in self.population_nums.keys())
+
+    def add(self, item, input_sum, frame_num):
+        """Record a file used to compute statistics.
+        Args:
+            item: a file
+            input_sum (np.ndarray): the sum of features over frames in the
+                file. A tensor of size `[feature_dim]`
+            frame_num (int): the number of frames in the file
+        """
+        self.used_items.append(item)
+        group = self.group_func(item)
+        input_sum = np.asarray(input_sum, dtype=np.float64)
+        if group not in self._sums.keys():
+            self._sums[group] = [0, 0, 0., 0., 0., 0.]
+        sums = self._sums[group]
+        sums[0] += 1
+        sums[1] += frame_num
+        sums[2] = sums[2] + input_sum
+        sums[3] = sums[3] + input_sum ** 2
+        sums[4] = sums[4] + frame_num * input_sum
+        sums[5] += frame_num ** 2
+
+    def half_width(self, group, z=1.96):
+        """Half width of the confidence interval of the mean per dimension.
+           The mean is a ratio estimator over files (cluster sampling) with
+           the finite population correction.
+        Args:
+            group: a group
+            z (float, optional): 1.96 for the 95% confidence interval
+        Returns:
+            half_width (np.ndarray): A tensor of size `[feature_dim]`
+        """
+        unit_num, frame_num, input_sum, sq_sum, cross_sum, sq_frame_num = \
+            self._sums[group]
+        if unit_num < 2:
+            return np.full(np.shape(input_sum), np.inf)
+        mean = input_sum / frame_num
+        residual = sq_sum - 2 * mean * cross_sum + mean ** 2 * sq_frame_num
+        fpc = 1 - unit_num / self.population_nums[group]
+        var = fpc * np.maximum(residual, 0) / (unit_num * (unit_num - 1)) / \
+            (frame_num / unit_num) ** 2
+        return z * np.sqrt(var)
+
+    def report(self, std_func, save_path=None):
+        """Print the accuracy of the sampled statistics.
+        Args:
+            std_func (function): a function which takes a group and returns
+                its std. The half width is shown relative to it.
+            save_path (string, optional): path to a npz file to save the
+                half width per dimension of each group
+        """
+        print('=====> Statistics from %d of %d files' % (
+            len(self.used_items), sum(self.population_nums.values())))
+        half_widths = {}
+        for group in sorted(self._sums.keys()):
+            half_widths[str(group)] = self.half_width(group)
+            relative = half_widths[str(group)] / std_func(group)
+            print('  %s: %d files, %d frames, 95%% CI of mean within '
+                  '+-%.4f std (max over dimensions)' % (
+                      group, self._sums[group][0], self._sums[group][1],
+                      np.max(relative)))
+        if save_path is not None:
+            np.savez(save_path, **half_widths)
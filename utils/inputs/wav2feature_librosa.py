@@ -9,14 +9,22 @@ from __future__ import print_function
         https://github.com/librosa/librosa
 """
 
+import os
 import librosa
 import subprocess
+import tempfile
 import numpy as np
 
+from utils.parallel import get_worker_state
+
+# NOTE: the default of librosa (128) leaves empty mel bands with the FFT
+# size of a 25ms window
+MFCC_MELS = 40
+
 
 def wav2feature(wav_path, feature_type='logfbank', feature_dim=40,
                 use_energy=True, use_delta1=True, use_delta2=True,
-                window=0.025, slide=0.01, dtype=np.float64):
+                window=0.025, slide=0.01, dtype=np.float32):
     """Read wav file & convert to MFCC or log mel filterbank features.
     Args:
         wav_path (string): the path to a wav file
@@ -27,74 +35,158 @@ def wav2feature(wav_path, feature_type='logfbank', feature_dim=40,
         use_delta2 (bool, optional): if True, add delta delta features
         window (float, optional): window width to extract features
         slide (float, optional): extract features per 'slide'
-        dtype (optional): default is np.float64
+        dtype (optional): the type of data to compute features in,
+            default is np.float32
     Returns:
         feat (np.ndarray): A tensor of size `[T, feature_dim]`
     """
-    if feature_type == 'logmelfbank':
-        feature_type = 'logfbank'
-    if feature_type not in ['logfbank', 'fbank', 'mfcc']:
-        raise ValueError('feature_type is or "logfbank" or "fbank" or "mfcc".')
-    if use_delta2:
-        delta1 = True
-
-    # Read wav file
+    config = {'feature_type': feature_type,
+              'channels': feature_dim,
+              'energy': use_energy,
+              'delta': use_delta1,
+              'deltadelta': use_delta2,
+              'window': window,
+              'slide': slide}
+    return wav2features(wav_path, [config], dtype=dtype)[0]
+
+
+def wav2features(wav_path, configs, dtype=np.float32):
+    """Read wav file & convert to several kinds of features at once. The
+       file is read at its own sampling rate, and the power spectrum is
+       computed once over frames of the window & slide and shared among
+       all kinds of features.
+    Args:
+        wav_path (string): the path to a wav file
+        configs (list): configurations for feature extraction. Each is a
+            dict of feature_type, channels, energy, delta, deltadelta,
+            window and slide.
+        dtype (optional): the type of data to compute features in,
+            default is np.float32
+    Returns:
+        feats (list): tensors of size `[T, feature_dim]` in the order of
+            configs
+    """
+    for config in configs:
+        if config['feature_type'] not in ['logmelfbank', 'logfbank',
+                                          'fbank', 'mfcc']:
+            raise ValueError(
+                'feature_type is or "logfbank" or "fbank" or "mfcc".')
+
+    # Read wav file at the native sampling rate
     try:
-        y, sr = librosa.load(wav_path)
+        y, sr = librosa.load(wav_path, sr=None, dtype=dtype)
     except ValueError:
         # Read NIST file
-        wav_path_tmp = './tmp.wav'
-        # result = subprocess.call(['sph2pipe', '-f', 'wav', wav_path, wav_path_tmp])
-        result = subprocess.call(['sox', wav_path, '-t', 'wav', wav_path_tmp])
-
-        if result != 0:
-            raise ValueError
-
-        # Try again
-        y, sr = librosa.load(wav_path_tmp)
-        subprocess.call(['rm', wav_path_tmp])
-
-    if feature_type == 'mfcc':
-        feat = librosa.feature.mfcc(y=y,
-                                    sr=sr,
-                                    # S=None,
-                                    n_mfcc=feature_dim)
-        if use_energy:
-            rmse = librosa.feature.rmse(y=y,
-                                        frame_length=2048,
-                                        hop_length=512)[0]
-            feat = np.concatenate((feat, rmse), axis=0)
-    else:
-        feat = librosa.feature.melspectrogram(y=y,
-                                              sr=sr,
-                                              S=None,
-                                              n_fft=2048,
-                                              hop_length=512,
-                                              #   power=2.0,  # default is 2
-                                              n_mels=feature_dim,
-                                              fmin=0,
-                                              fmax=None)
-        # NOTE: feat: `[feature_dim, T]`
-
-        if feature_type == 'logfbank':
-            # feat = librosa.core.logamplitude(feat)
-            feat = librosa.core.spectrum.power_to_db(feat)
-        if use_energy:
-            rmse = librosa.feature.rmse(y=y,
-                                        frame_length=2048,
-                                        hop_length=512)
-            # NOTE: `[1, T]`
-            feat = np.concatenate((feat, rmse), axis=0)
-
-    # Convert to time-major
-    feat = feat.transpose((1, 0))
-
-    if use_delta2:
-        delta1_feat = librosa.feature.delta(feat, width=9)
-        delta2_feat = librosa.feature.delta(delta1_feat, width=9)
-        feat = np.concatenate((feat, delta1_feat, delta2_feat), axis=1)
-    elif delta1:
-        delta1_feat = librosa.feature.delta(feat, width=9)
-        feat = np.concatenate((feat, delta1_feat), axis=1)
-
-    return feat
+        # NOTE: use a unique temporary file so that several processes can
+        # convert files at the same time
+        fd, wav_path_tmp = tempfile.mkstemp(suffix='.wav')
+        os.close(fd)
+        try:
+            # result = subprocess.call(['sph2pipe', '-f', 'wav', wav_path, wav_path_tmp])
+            result = subprocess.call(
+                ['sox', wav_path, '-t', 'wav', wav_path_tmp])
+            if result != 0:
+                raise ValueError
+
+            # Try again
+            y, sr = librosa.load(wav_path_tmp, sr=None, dtype=dtype)
+        finally:
+            os.remove(wav_path_tmp)
+
+    spectra = {}
+    feats = []
+    for config in configs:
+        win_length, hop_length, n_fft = stft_params(
+            sr, config['window'], config['slide'])
+        if (win_length, hop_length) not in spectra:
+            magnitude = np.abs(librosa.stft(y, n_fft=n_fft,
+                                            hop_length=hop_length,
+                                            win_length=win_length))
+            spectra[win_length, hop_length] = {
+                'magnitude': magnitude, 'power': np.square(magnitude)}
+        spectrum = spectra[win_length, hop_length]
+        power_spec = spectrum['power']
+
+        if config['feature_type'] == 'mfcc':
+            mel_basis = get_mel_basis(sr, n_fft, MFCC_MELS, power_spec.dtype)
+            feat = librosa.feature.mfcc(
+                S=librosa.core.spectrum.power_to_db(
+                    np.dot(mel_basis, power_spec)),
+                n_mfcc=config['channels'])
+        else:
+            mel_basis = get_mel_basis(sr, n_fft, config['channels'],
+                                      power_spec.dtype)
+            feat = np.dot(mel_basis, power_spec)
+            # NOTE: feat: `[feature_dim, T]`
+
+            if config['feature_type'] in ['logmelfbank', 'logfbank']:
+                # feat = librosa.core.logamplitude(feat)
+                feat = librosa.core.spectrum.power_to_db(feat)
+        if config['energy']:
+            if 'rmse' not in spectrum:
+                # NOTE: computed over the same frames as the spectrum
+                spectrum['rmse'] = librosa.feature.rms(
+                    S=spectrum['magnitude'], frame_length=n_fft)
+                # NOTE: `[1, T]`
+            feat = np.concatenate((feat, spectrum['rmse']), axis=0)
+
+        # Convert to time-major
+        feat = feat.transpose((1, 0))
+
+        # NOTE: deltas over time. Edges are padded with the nearest frame,
+        # so utterances shorter than the width are also available.
+        if config['deltadelta']:
+            delta1_feat = librosa.feature.delta(feat, width=9, axis=0,
+                                                mode='nearest')
+            delta2_feat = librosa.feature.delta(delta1_feat, width=9, axis=0,
+                                                mode='nearest')
+            feat = np.concatenate((feat, delta1_feat, delta2_feat), axis=1)
+        elif config['delta']:
+            delta1_feat = librosa.feature.delta(feat, width=9, axis=0,
+                                                mode='nearest')
+            feat = np.concatenate((feat, delta1_feat), axis=1)
+
+        feats.append(feat.astype(dtype, copy=False))
+
+    return feats
+
+
+def stft_params(sampling_rate, window, slide):
+    """
+    Args:
+        sampling_rate (int): the sampling rate
+        window (float): window width in seconds
+        slide (float): slide in seconds
+    Returns:
+        win_length (int): the number of samples per window
+        hop_length (int): the number of samples per slide
+        n_fft (int): the FFT size, the smallest power of 2 which is not
+            shorter than a window
+    """
+    win_length = int(np.floor(window * sampling_rate + 0.5))
+    hop_length = int(np.floor(slide * sampling_rate + 0.5))
+    n_fft = 1
+    while n_fft < win_length:
+        n_fft *= 2
+    return win_length, hop_length, n_fft
+
+
+def get_mel_basis(sr, n_fft, n_mels, dtype=np.float32):
+    """Return the mel filterbank matrix. The matrix is built only once per
+       process.
+    Args:
+        sr (int): sampling rate
+        n_fft (int): the FFT size
+        n_mels (int): the number of mel bands
+        dtype (optional): the type of the matrix, default is np.float32
+    Returns:
+        np.ndarray: A tensor of size `[n_mels, n_fft // 2 + 1]`
+    """
+    return get_worker_state(('mel_basis', sr, n_fft, n_mels,
+                             np.dtype(dtype).name),
+                            _build_mel_basis, sr, n_fft, n_mels, dtype)
+
+
+def _build_mel_basis(sr, n_fft, n_mels, dtype):
+    return librosa.filters.mel(sr=sr, n_fft=n_fft, n_mels=n_mels, fmin=0,
+                               fmax=None).astype(dtype)
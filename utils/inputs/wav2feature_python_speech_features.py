@@ -9,15 +9,31 @@ from __future__ import print_function
         https://github.com/jameslyons/python_speech_features
 """
 
+import os
+import math
 import subprocess
+import tempfile
 import numpy as np
+from numpy.lib.stride_tricks import as_strided
 import scipy.io.wavfile
-from python_speech_features import mfcc, fbank
+from scipy.fftpack import dct
+from python_speech_features import get_filterbanks, sigproc
+
+from utils.parallel import get_worker_state
+
+# Analysis windows of frames
+_WINDOWS = {'hamming': np.hamming, 'rectangular': np.ones}
+
+# The number of frames per FFT call and the number of samples of files
+# whose frames are concatenated into one block. Frames and spectra of larger
+# blocks do not fit in the cache.
+FFT_BLOCK_FRAMES = 2048
+BLOCK_SAMPLES = 1 << 17
 
 
 def wav2feature(wav_path, feature_type='logfbank', feature_dim=40,
                 use_energy=True, use_delta1=True, use_delta2=True,
-                window=0.025, slide=0.01, dtype=np.float64):
+                window=0.025, slide=0.01, dtype=np.float32):
     """Read wav file & convert to MFCC or log mel filterbank features.
     Args:
         wav_path (string): the path to a wav file
@@ -28,75 +44,290 @@ def wav2feature(wav_path, feature_type='logfbank', feature_dim=40,
         use_delta2 (bool, optional): if True, add delta delta features
         window (float, optional): window width to extract features
         slide (float, optional): extract features per 'slide'
-        dtype (optional): default is np.float64
+        dtype (optional): the type of data to compute features in,
+            default is np.float32
     Returns:
         feat (np.ndarray): A tensor of size `[T, feature_dim]`
     """
-    if feature_type == 'logmelfbank':
-        feature_type = 'logfbank'
-    if feature_type not in ['logfbank', 'fbank', 'mfcc']:
-        raise ValueError('feature_type is or "logfbank" or "fbank" or "mfcc".')
-    if use_delta2:
-        delta1 = True
-
-    # Read wav file
+    config = {'feature_type': feature_type,
+              'channels': feature_dim,
+              'energy': use_energy,
+              'delta': use_delta1,
+              'deltadelta': use_delta2,
+              'window': window,
+              'slide': slide}
+    return wav2features(wav_path, [config], dtype=dtype)[0]
+
+
+def wav2features(wav_path, configs, dtype=np.float32):
+    """Read wav file & convert to several kinds of features at once. The
+       file is read once, and the power spectrum is computed once per
+       framing and shared among all kinds of features with that framing.
+    Args:
+        wav_path (string): the path to a wav file
+        configs (list): configurations for feature extraction. Each is a
+            dict of feature_type, channels, energy, delta, deltadelta,
+            window and slide.
+        dtype (optional): the type of data to compute features in,
+            default is np.float32
+    Returns:
+        feats (list): tensors of size `[T, feature_dim]` in the order of
+            configs
+    """
+    return wav2features_batch([wav_path], configs, dtype=dtype)[0]
+
+
+def wav2features_batch(wav_paths, configs, dtype=np.float32):
+    """Read wav files & convert to several kinds of features at once.
+       Frames of all files with the same sampling rate are concatenated
+       into one block, so that the FFT and the product with each mel
+       filterbank run once over the block instead of once per file.
+    Args:
+        wav_paths (list): paths to wav files
+        configs (list): configurations for feature extraction. Each is a
+            dict of feature_type, channels, energy, delta, deltadelta,
+            window and slide.
+        dtype (optional): the type of data to compute features in,
+            default is np.float32
+    Returns:
+        feats_list (list): lists of tensors of size `[T, feature_dim]` in
+            the order of configs, in the order of wav_paths
+    """
+    for config in configs:
+        if config['feature_type'] not in ['logmelfbank', 'logfbank',
+                                          'fbank', 'mfcc']:
+            raise ValueError(
+                'feature_type is or "logfbank" or "fbank" or "mfcc".')
+
+    audios = [read_wav(wav_path) for wav_path in wav_paths]
+
+    feats_list = [None] * len(wav_paths)
+    for fs in sorted(set(fs for fs, _ in audios)):
+        indices = [i for i, (fs_i, _) in enumerate(audios) if fs_i == fs]
+        # NOTE: long files are divided into blocks which fit in the cache
+        blocks, block_samples = [[]], 0
+        for i in indices:
+            if len(blocks[-1]) > 0 and \
+                    block_samples + len(audios[i][1]) > BLOCK_SAMPLES:
+                blocks.append([])
+                block_samples = 0
+            blocks[-1].append(i)
+            block_samples += len(audios[i][1])
+        for block in blocks:
+            block_feats_list = _features_block(
+                [audios[i][1] for i in block], fs, configs, dtype)
+            for i, feats in zip(block, block_feats_list):
+                feats_list[i] = feats
+    return feats_list
+
+
+def _features_block(audios, fs, configs, dtype):
+    """Compute features of signals with the same sampling rate over one
+       block of their frames. Deltas are computed per signal.
+    Returns:
+        feats_list (list): lists of tensors in the order of configs, in
+            the order of audios
+    """
+    spectra = {}
+    feats_list = [[] for _ in audios]
+    for config in configs:
+        feature_type = config['feature_type']
+        if feature_type == 'logmelfbank':
+            feature_type = 'logfbank'
+
+        if feature_type == 'mfcc':
+            # NOTE: mfcc of python_speech_features frames 25ms per 10ms
+            # without a window regardless of the config
+            framing = (0.025, 0.01, 'rectangular')
+        else:
+            framing = (config['window'], config['slide'], 'hamming')
+        if framing not in spectra:
+            spectra[framing] = _power_spectrum(audios,
+                                               samplerate=fs,
+                                               winlen=framing[0],
+                                               winstep=framing[1],
+                                               nfft=512,
+                                               preemph=0.97,
+                                               winfunc=_WINDOWS[framing[2]],
+                                               dtype=dtype)
+        pspec, energy_feat, offsets = spectra[framing]
+
+        if feature_type == 'mfcc':
+            feat = _mfcc(pspec, energy_feat,
+                         samplerate=fs,
+                         numcep=config['channels'],
+                         nfilt=26,
+                         nfft=512,
+                         ceplifter=22)
+        else:
+            feat = _mel(pspec,
+                        samplerate=fs,
+                        nfilt=config['channels'],
+                        nfft=512,
+                        lowfreq=0,
+                        highfreq=None)
+            if feature_type == 'logfbank':
+                feat = np.log(feat)
+        if config['energy']:
+            feat = np.concatenate((feat, energy_feat.reshape(-1, 1)), axis=1)
+            # NOTE: energy_feat may be not log-scale.
+
+        for feats, start, end in zip(feats_list, offsets[:-1], offsets[1:]):
+            feat_utt = feat[start:end]
+            if config['deltadelta']:
+                delta1_feat = _delta(feat_utt, N=2)
+                delta2_feat = _delta(delta1_feat, N=2)
+                feat_utt = np.concatenate(
+                    (feat_utt, delta1_feat, delta2_feat), axis=1)
+            elif config['delta']:
+                delta1_feat = _delta(feat_utt, N=2)
+                feat_utt = np.concatenate((feat_utt, delta1_feat), axis=1)
+            elif len(audios) > 1:
+                # NOTE: not a view of the whole block
+                feat_utt = feat_utt.copy()
+            feats.append(feat_utt)
+
+    return feats_list
+
+
+def read_wav(wav_path):
+    """Read a WAV file. NIST (SPHERE) files are converted by sox first.
+    Args:
+        wav_path (string): path to a WAV or NIST file
+    Returns:
+        fs (int): sampling rate
+        audio (np.ndarray): A tensor of size `[sample_num]`
+    """
     try:
         fs, audio = scipy.io.wavfile.read(wav_path)
     except ValueError:
         # Read NIST file
-        wav_path_tmp = './tmp.wav'
-        # result = subprocess.call(['sph2pipe', '-f', 'wav', wav_path, wav_path_tmp])
-        result = subprocess.call(['sox', wav_path, '-t', 'wav', wav_path_tmp])
-
-        if result != 0:
-            raise ValueError
-
-        # Try again
-        fs, audio = scipy.io.wavfile.read(wav_path_tmp)
-        subprocess.call(['rm', wav_path_tmp])
-
-    if feature_type == 'mfcc':
-        feat = mfcc(audio,
-                    samplerate=fs,
-                    numcep=feature_dim)
-        if use_energy:
-            energy_feat = fbank(audio,
-                                samplerate=fs,
-                                nfilt=feature_dim)[1]
-            energy_feat = energy_feat.reshape(-1, 1)
-            feat = np.concatenate((feat, energy_feat), axis=1)
-            # NOTE: only fbank function retures energy
+        # NOTE: use a unique temporary file so that several processes can
+        # convert files at the same time
+        fd, wav_path_tmp = tempfile.mkstemp(suffix='.wav')
+        os.close(fd)
+        try:
+            # result = subprocess.call(['sph2pipe', '-f', 'wav', wav_path, wav_path_tmp])
+            result = subprocess.call(
+                ['sox', wav_path, '-t', 'wav', wav_path_tmp])
+            if result != 0:
+                raise ValueError
+
+            # Try again
+            fs, audio = scipy.io.wavfile.read(wav_path_tmp)
+        finally:
+            os.remove(wav_path_tmp)
+    return fs, audio
+
+
+def get_filterbank(nfilt, nfft, samplerate, lowfreq=0, highfreq=None,
+                   dtype=np.float64):
+    """Return the mel filterbank matrix. The matrix is built only once per
+       process.
+    Args:
+        nfilt (int): the number of filters
+        nfft (int): the FFT size
+        samplerate (int): sampling rate
+        lowfreq (float, optional): lowest band edge of mel filters
+        highfreq (float, optional): highest band edge of mel filters
+        dtype (optional): the type of the matrix, default is np.float64
+    Returns:
+        np.ndarray: A tensor of size `[nfilt, nfft // 2 + 1]`
+    """
+    highfreq = highfreq or samplerate / 2
+    return get_worker_state(('filterbank', nfilt, nfft, samplerate,
+                             lowfreq, highfreq, np.dtype(dtype).name),
+                            _build_filterbank,
+                            nfilt, nfft, samplerate, lowfreq, highfreq, dtype)
+
+
+def _build_filterbank(nfilt, nfft, samplerate, lowfreq, highfreq, dtype):
+    return get_filterbanks(
+        nfilt, nfft, samplerate, lowfreq, highfreq).astype(dtype)
+
+
+def _framesig(signal, frame_len, frame_step):
+    """Same as python_speech_features.sigproc.framesig, but frames are
+       views of the padded signal and not windowed.
+    """
+    if len(signal) <= frame_len:
+        numframes = 1
     else:
-        fbank_feat, energy_feat = fbank(audio,
-                                        samplerate=fs,
-                                        winlen=window,
-                                        winstep=slide,
-                                        nfilt=feature_dim,
-                                        nfft=512,
-                                        lowfreq=0,
-                                        highfreq=None,
-                                        preemph=0.97,
-                                        winfunc=np.hamming)
-        if feature_type == 'logfbank':
-            feat = np.log(fbank_feat)
-        if use_energy:
-            energy_feat = energy_feat.reshape(-1, 1)
-            # logenergy = np.log(energy_feat)
-
-            feat = np.concatenate((feat, energy_feat), axis=1)
-            # NOTE: energy_feat may be not log-scale.
+        numframes = 1 + int(math.ceil(
+            (1.0 * len(signal) - frame_len) / frame_step))
 
-    if use_delta2:
-        delta1_feat = _delta(feat, N=2)
-        delta2_feat = _delta(delta1_feat, N=2)
-        feat = np.concatenate((feat, delta1_feat, delta2_feat), axis=1)
-    elif delta1:
-        delta1_feat = _delta(feat, N=2)
-        feat = np.concatenate((feat, delta1_feat), axis=1)
+    padsignal = np.zeros(((numframes - 1) * frame_step + frame_len,),
+                         dtype=signal.dtype)
+    padsignal[:len(signal)] = signal
+    stride = padsignal.strides[0]
+    return as_strided(padsignal, shape=(numframes, frame_len),
+                      strides=(stride * frame_step, stride),
+                      writeable=False)
 
+
+def _power_spectrum(signals, samplerate, winlen, winstep, nfft, preemph,
+                    winfunc, dtype=np.float64):
+    """Same as the first half of python_speech_features.fbank applied to
+       each signal, but computes in dtype over one block of frames of all
+       signals.
+    Returns:
+        pspec (np.ndarray): A tensor of size `[sum of T, nfft // 2 + 1]`
+        energy (np.ndarray): A tensor of size `[sum of T]`
+        offsets (np.ndarray): the first frame of each signal in the block
+            and the number of all frames at the end
+    """
+    frame_len = int(sigproc.round_half_up(winlen * samplerate))
+    frame_step = int(sigproc.round_half_up(winstep * samplerate))
+    frames_list = [
+        _framesig(sigproc.preemphasis(np.asarray(signal, dtype=dtype),
+                                      preemph), frame_len, frame_step)
+        for signal in signals]
+    offsets = np.cumsum([0] + [len(frames) for frames in frames_list])
+
+    # NOTE: windowed frames are written into the block directly
+    window = winfunc(frame_len).astype(dtype)
+    block = np.empty((offsets[-1], frame_len), dtype=dtype)
+    for frames, start, end in zip(frames_list, offsets[:-1], offsets[1:]):
+        np.multiply(frames, window, out=block[start:end])
+
+    pspec = np.empty((len(block), nfft // 2 + 1), dtype=dtype)
+    for start in range(0, len(block), FFT_BLOCK_FRAMES):
+        end = start + FFT_BLOCK_FRAMES
+        np.square(np.abs(np.fft.rfft(block[start:end], nfft)),
+                  out=pspec[start:end])
+    pspec /= nfft
+    energy = np.sum(pspec, 1)
+    energy[energy == 0] = np.finfo(float).eps
+    return pspec, energy, offsets
+
+
+def _mel(pspec, samplerate, nfilt, nfft, lowfreq, highfreq):
+    """Same as the second half of python_speech_features.fbank, but reuses
+       the filterbank matrix across calls.
+    """
+    fb = get_filterbank(nfilt, nfft, samplerate, lowfreq, highfreq,
+                        pspec.dtype)
+    feat = np.dot(pspec, fb.T)
+    feat[feat == 0] = np.finfo(float).eps
+    return feat
+
+
+def _mfcc(pspec, energy, samplerate, numcep, nfilt, nfft, ceplifter):
+    """Same as python_speech_features.mfcc after the power spectrum."""
+    feat = np.log(_mel(pspec, samplerate, nfilt, nfft, 0, None))
+    feat = dct(feat, type=2, axis=1, norm='ortho')[:, :numcep]
+    feat *= _lifter(feat.shape[1], ceplifter, feat.dtype)
+    feat[:, 0] = np.log(energy)
     return feat
 
 
+def _lifter(numcep, ceplifter, dtype):
+    if ceplifter <= 0:
+        return np.ones(numcep, dtype=dtype)
+    n = np.arange(numcep)
+    return (1 + (ceplifter / 2.) * np.sin(np.pi * n / ceplifter)).astype(dtype)
+
+
 def _delta(feat, N):
     """Compute delta features from a feature vector sequence.
     Args:
@@ -112,11 +343,12 @@ def _delta(feat, N):
         raise ValueError('N must be an integer >= 1')
     NUMFRAMES = len(feat)
     denominator = 2 * sum([i**2 for i in range(1, N + 1)])
-    delta_feat = np.empty_like(feat)
+    delta_feat = np.zeros_like(feat)
     # padded version of feat
     padded = np.pad(feat, ((N, N), (0, 0)), mode='edge')
-    for t in range(NUMFRAMES):
-        # [t : t+2*N+1] == [(N+t)-N : (N+t)+N+1]
-        delta_feat[t] = np.dot(np.arange(-N, N + 1),
-                               padded[t: t + 2 * N + 1]) / denominator
+    for n in range(1, N + 1):
+        # NOTE: all frames at once in the type of feat
+        delta_feat += n * (padded[N + n:N + n + NUMFRAMES] -
+                           padded[N - n:N - n + NUMFRAMES])
+    delta_feat /= denominator
     return delta_feat
@@ -1,20 +1,25 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 
-"""Split a WAV file into each utterance."""
+"""Split a WAV file into each utterance, or refer to each utterance in the
+   WAV file without copying it."""
 
 from __future__ import absolute_import
 from __future__ import division
 from __future__ import print_function
 
+import os
 from os.path import basename, join
+import struct
 import numpy as np
-import wave
-from tqdm import tqdm
 from utils.util import mkdir_join
+from utils.parallel import ParallelExecutor
 
+MANIFEST_NAME = 'wav_manifest.tsv'
+SAMPLE_DTYPES = {1: np.uint8, 2: np.dtype('<i2'), 4: np.dtype('<i4')}
 
-def split_wav(wav_paths, save_path, speaker_dict):
+
+def split_wav(wav_paths, save_path, speaker_dict, num_workers=1):
     """Read WAV files & divide them with respect to each utterance.
     Args:
         wav_paths (list): path to WAV files
@@ -24,28 +29,103 @@ def split_wav(wav_paths, save_path, speaker_dict):
             value => the dictionary of utterance information of each speaker
                 key => utterance index
                 value => [start_frame, end_frame, transcript]
+        num_workers (int, optional): the number of processes. Files which
+            fail are skipped and reported at the end.
     """
     # Read each WAV file
     print('==> Reading WAV files...')
-    print(speaker_dict.keys())
-    for wav_path in tqdm(wav_paths):
-        speaker = basename(wav_path).split('.')[0]
+    split_args = []
+    for wav_path in wav_paths:
+        channels = read_wav_header(wav_path)[0]
+        split_args.append((wav_path, [
+            (speaker, channel, speaker_dict[speaker],
+             mkdir_join(save_path, speaker))
+            for speaker, channel in _channel_speakers(
+                _speaker(wav_path), channels, speaker_dict)]))
+
+    executor = ParallelExecutor(num_workers=num_workers)
+    for _ in executor.imap(_split, split_args):
+        pass
+    executor.report(save_path=join(save_path, 'failed_files.txt'))
 
-        # NOTE: For Switchboard
-        speaker = speaker.replace('sw0', 'sw')
-        speaker = speaker.replace('sw_', 'sw')
-        speaker = speaker.replace('en_', 'en')
 
-        utt_dict = speaker_dict[speaker]
-        wav_utt_save_path = mkdir_join(save_path, speaker)
+def _split(args):
+    wav_path, speaker_args = args
 
-        # Read a wav file
-        audio = Audio(file_path=wav_path)
-        audio_data = audio.read()
+    # Read a wav file
+    audio = Audio(file_path=wav_path)
+    audio_data = audio.read()
 
-        # Split per utterance & save as wav files
+    # Split per utterance & save as wav files
+    # NOTE: the buffer is shared by speakers in channels of the file
+    for speaker, channel, utt_dict, wav_utt_save_path in speaker_args:
         audio.split(audio_data, utt_dict, speaker,
-                    save_path=wav_utt_save_path)
+                    save_path=wav_utt_save_path, channel=channel)
+
+
+def _speaker(wav_path):
+    speaker = basename(wav_path).split('.')[0]
+
+    # NOTE: For Switchboard
+    speaker = speaker.replace('sw0', 'sw')
+    speaker = speaker.replace('sw_', 'sw')
+    speaker = speaker.replace('en_', 'en')
+    return speaker
+
+
+def _channel_speakers(speaker, channels, speaker_dict):
+    """
+    Args:
+        speaker (string): the speaker of a WAV file
+        channels (int): the number of channels of the WAV file
+        speaker_dict (dict): the dictionary of utterances of each speaker
+    Returns:
+        list of (speaker, channel). The channel is -1 if the speaker has
+            all channels.
+    """
+    if channels == 1:
+        return [(speaker, 0)]
+    if speaker in speaker_dict.keys():
+        return [(speaker, -1)]
+
+    # NOTE: a speaker per channel (ex. sw2001-A, sw2001-B)
+    channel_speakers = [(speaker + '-' + chr(ord('A') + channel), channel)
+                        for channel in range(channels)]
+    channel_speakers = [(channel_speaker, channel)
+                        for channel_speaker, channel in channel_speakers
+                        if channel_speaker in speaker_dict.keys()]
+    if len(channel_speakers) == 0:
+        raise KeyError(speaker)
+    return channel_speakers
+
+
+def frame_to_sample(frame, sampling_rate):
+    """Convert a frame (10ms) to a sample with integer math. Float math
+       (ex. int((201 / 100) * 8000) = 16079) loses samples.
+    Args:
+        frame (int): the index of a frame
+        sampling_rate (int): the sampling rate
+    Returns:
+        the index of the sample
+    """
+    return int(round(frame * sampling_rate)) // 100
+
+
+def wav_header(channels, sampling_rate, sample_size, data_size):
+    """
+    Args:
+        channels (int): the number of channels
+        sampling_rate (int): the sampling rate
+        sample_size (int): bytes per sample of a channel
+        data_size (int): bytes of samples
+    Returns:
+        the 44-byte header of a PCM WAV file
+    """
+    return struct.pack(
+        '<4sI4s4sIHHIIHH4sI', b'RIFF', 36 + data_size, b'WAVE',
+        b'fmt ', 16, 1, channels, sampling_rate,
+        sampling_rate * channels * sample_size, channels * sample_size,
+        sample_size * 8, b'data', data_size)
 
 
 class Audio(object):
@@ -60,48 +140,235 @@ class Audio(object):
     def read(self):
         """Return audio file as array of integer.
         Returns:
-            audio_data: np.ndarray, shape of (frame_num,)
+            audio_data: np.ndarray, shape of (frame_num, channels)
         """
-        # Read wav file
-        with wave.open(self.file_path, "r") as wav:
-            # Move to head of the audio file
-            wav.rewind()
+        self.channels, self.sampling_rate, self.sample_size, data_offset, \
+            self.frame_num = read_wav_header(self.file_path)
+        if self.sample_size not in SAMPLE_DTYPES.keys():
+            raise ValueError('%d-byte samples are not supported.' %
+                             self.sample_size)
 
-            self.frame_num = wav.getnframes()
-            self.sampling_rate = wav.getframerate()  # 16,000 Hz
-            self.channels = wav.getnchannels()
-            self.sample_size = wav.getsampwidth()  # 2
+        # Read to buffer as binary format at once
+        with open(self.file_path, 'rb') as f:
+            f.seek(data_offset)
+            buf = f.read(self.frame_num * self.channels * self.sample_size)
 
-            # Read to buffer as binary format
-            buf = wav.readframes(self.frame_num)
+        audio_data = np.frombuffer(buf, dtype=SAMPLE_DTYPES[self.sample_size])
+        return audio_data.reshape((self.frame_num, self.channels))
 
-        if self.channels == 1:
-            audio_data = np.frombuffer(buf, dtype="int16")
-        elif self.channels == 2:
-            audio_data = np.frombuffer(buf, dtype="int32")
-
-        return audio_data
-
-    def split(self, audio_data, utterance_dict, speaker, save_path):
+    def split(self, audio_data, utterance_dict, speaker, save_path,
+              channel=-1):
         """
         Args:
-            audio_data:
+            audio_data: the result of `read`
             utterance_dict: the dictionary of utterance information of each speaker
                 key => utterance index
                 value => [start_frame, end_frame, transcript]
             speaker:
             save_path: path to save each WAV file
+            channel (int, optional): the channel to save. If -1, all
+                channels are saved.
         """
+        channels = self.channels if channel < 0 else 1
         for utt_index, utt_info in sorted(utterance_dict.items(),
                                           key=lambda x: x[0]):
             start_frame, end_frame = utt_info[:2]
-            start_frame = int((start_frame / 100) * self.sampling_rate)
-            end_frame = int((end_frame / 100) * self.sampling_rate)
-            audio_data_split = audio_data[start_frame:end_frame]
-
-            with wave.Wave_write(
-                    join(save_path, speaker + '_' + str(utt_index) + ".wav")) as w:
-                w.setnchannels(self.channels)
-                w.setsampwidth(self.sample_size)
-                w.setframerate(self.sampling_rate)
-                w.writeframes(audio_data_split)
+            start_sample = frame_to_sample(start_frame, self.sampling_rate)
+            end_sample = frame_to_sample(end_frame, self.sampling_rate)
+            audio_data_split = audio_data[start_sample:end_sample]
+            if channel >= 0:
+                audio_data_split = audio_data_split[:, channel]
+            buf = np.ascontiguousarray(audio_data_split).tobytes()
+
+            with open(join(save_path, speaker + '_' + str(utt_index) + ".wav"),
+                      'wb') as f:
+                f.write(wav_header(channels, self.sampling_rate,
+                                   self.sample_size, len(buf)))
+                f.write(buf)
+
+
+def read_wav_header(wav_path):
+    """Read the header of a WAV file without reading samples.
+    Args:
+        wav_path (string): path to a WAV file
+    Returns:
+        channels (int): the number of channels
+        sampling_rate (int): the sampling rate
+        sample_size (int): bytes per sample of a channel
+        data_offset (int): the byte offset of the first sample
+        frame_num (int): the number of samples per channel
+    """
+    with open(wav_path, 'rb') as f:
+        header = f.read(12)
+        if len(header) < 12:
+            raise ValueError('%s is not a WAV file.' % wav_path)
+        riff, _, wave_id = struct.unpack('<4sI4s', header)
+        if riff != b'RIFF' or wave_id != b'WAVE':
+            raise ValueError('%s is not a WAV file.' % wav_path)
+        channels = None
+        while True:
+            chunk_header = f.read(8)
+            if len(chunk_header) < 8:
+                raise ValueError('%s has no data chunk.' % wav_path)
+            chunk_id, chunk_size = struct.unpack('<4sI', chunk_header)
+            if chunk_id == b'fmt ':
+                fmt = f.read(16)
+                if len(fmt) < 16:
+                    raise ValueError('%s has a broken fmt chunk.' % wav_path)
+                audio_format, channels, sampling_rate, _, block_align, _ = \
+                    struct.unpack('<HHIIHH', fmt)
+                if audio_format not in [1, 0xFFFE]:
+                    raise ValueError('%s is not PCM.' % wav_path)
+                f.seek(chunk_size - 16 + chunk_size % 2, 1)
+            elif chunk_id == b'data':
+                if channels is None:
+                    raise ValueError('%s has no fmt chunk.' % wav_path)
+                data_offset = f.tell()
+                # NOTE: the size may be wrong in streamed files
+                data_size = min(chunk_size,
+                                os.fstat(f.fileno()).st_size - data_offset)
+                return (channels, sampling_rate, block_align // channels,
+                        data_offset, data_size // block_align)
+            else:
+                # NOTE: chunks are padded to even sizes
+                f.seek(chunk_size + chunk_size % 2, 1)
+
+
+def make_wav_manifest(wav_paths, save_path, speaker_dict):
+    """Save a manifest of utterances in WAV files instead of splitting them.
+       Each line is `utt_name, source WAV file, sample offset, sample count,
+       channel` separated by tabs. Only headers of WAV files are read.
+    Args:
+        wav_paths (list): path to WAV files
+        save_path (string): path to save the manifest
+        speaker_dict (dict): the dictionary of utterances of each speaker
+            key => speaker
+            value => the dictionary of utterance information of each speaker
+                key => utterance index
+                value => [start_frame, end_frame, transcript]
+    Returns:
+        frame_num_dict (dict):
+            key => utt_name
+            value => the number of frames (10ms) of the utterance
+    """
+    print('==> Making the manifest of WAV files...')
+    frame_num_dict = {}
+    lines = []
+    for wav_path in wav_paths:
+        channels, sampling_rate, _, _, frame_num = read_wav_header(wav_path)
+        for speaker, channel in _channel_speakers(
+                _speaker(wav_path), channels, speaker_dict):
+            # NOTE: channel -1 means all channels as in split files
+            for utt_index, utt_info in sorted(speaker_dict[speaker].items(),
+                                              key=lambda x: x[0]):
+                start_frame, end_frame = utt_info[:2]
+                start_sample = min(
+                    frame_to_sample(start_frame, sampling_rate), frame_num)
+                end_sample = min(
+                    frame_to_sample(end_frame, sampling_rate), frame_num)
+                utt_name = speaker + '_' + str(utt_index)
+                lines.append('%s\t%s\t%d\t%d\t%d\n' % (
+                    utt_name, os.path.abspath(wav_path), start_sample,
+                    max(end_sample - start_sample, 0), channel))
+                frame_num_dict[utt_name] = end_frame - start_frame
+
+    manifest_path = join(save_path, MANIFEST_NAME)
+    with open(manifest_path + '.tmp', 'w') as f:
+        f.writelines(lines)
+    os.rename(manifest_path + '.tmp', manifest_path)
+    return frame_num_dict
+
+
+class WavManifest(object):
+    """Read utterances in WAV files listed in a manifest. Samples are
+       memory-mapped, so only the pages of read utterances are loaded.
+    Args:
+        manifest_path (string): path to the manifest made by
+            `make_wav_manifest`
+    """
+
+    def __init__(self, manifest_path):
+        self.manifest_path = manifest_path
+        # key => utt_name, value => (source, offset, count, channel)
+        self.segments = {}
+        with open(manifest_path, 'r') as f:
+            for line in f:
+                utt_name, source, offset, count, channel = \
+                    line.rstrip('\n').split('\t')
+                self.segments[utt_name] = (
+                    source, int(offset), int(count), int(channel))
+        self._headers = {}
+        self._source = None
+        self._samples = None
+        # NOTE: only the last source is mapped to bound open files
+
+    def reference(self, utt_name):
+        """
+        Args:
+            utt_name (string): the name of an utterance
+        Returns:
+            a string to refer to the utterance in dataset files
+        """
+        return self.manifest_path + '#' + utt_name
+
+    def header(self, source):
+        """
+        Args:
+            source (string): path to a WAV file
+        Returns:
+            same as `read_wav_header`
+        """
+        if source not in self._headers.keys():
+            self._headers[source] = read_wav_header(source)
+        return self._headers[source]
+
+    def read(self, utt_name):
+        """
+        Args:
+            utt_name (string): the name of an utterance
+        Returns:
+            audio_data (np.memmap): a read-only view of samples of size
+                `[sample_num]` (one channel) or `[sample_num, channels]`
+        """
+        source, offset, count, channel = self.segments[utt_name]
+        channels, _, sample_size, data_offset, frame_num = \
+            self.header(source)
+        if sample_size not in SAMPLE_DTYPES.keys():
+            raise ValueError('%d-byte samples are not supported.' %
+                             sample_size)
+        if source != self._source:
+            self._samples = np.memmap(
+                source, dtype=SAMPLE_DTYPES[sample_size], mode='r',
+                offset=data_offset, shape=(frame_num, channels))
+            self._source = source
+        audio_data = self._samples[offset:offset + count]
+        if channel >= 0:
+            return audio_data[:, channel]
+        return audio_data
+
+    def wav_bytes(self, utt_name):
+        """
+        Args:
+            utt_name (string): the name of an utterance
+        Returns:
+            the utterance as the content of a WAV file
+        """
+        source, _, _, channel = self.segments[utt_name]
+        channels, sampling_rate, sample_size, _, _ = self.header(source)
+        if channel >= 0:
+            channels = 1
+        data = np.ascontiguousarray(self.read(utt_name)).tobytes()
+        return wav_header(channels, sampling_rate, sample_size,
+                          len(data)) + data
+
+    def write(self, utt_name, wav_path):
+        """Write the utterance to a WAV file for tools which need a path.
+        Args:
+            utt_name (string): the name of an utterance
+            wav_path (string): path to the WAV file
+        Returns:
+            wav_path (string): path to the WAV file
+        """
+        with open(wav_path, 'wb') as f:
+            f.write(self.wav_bytes(utt_name))
+        return wav_path
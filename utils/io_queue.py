@@ -0,0 +1,139 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Overlap disk I/O with computation by bounded background threads."""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import sys
+import threading
+import numpy as np
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+_END = object()
+
+
+def prefetch(func, items, buffer_size=4):
+    """Apply func to the next `buffer_size` items in a background thread
+       while the caller consumes the previous results.
+    Args:
+        func (function): a function which takes one item
+            (ex. reading & decoding an audio file)
+        items (iterable): inputs of func
+        buffer_size (int, optional): the maximum number of results computed
+            ahead. The thread blocks when the buffer is full.
+    Yields:
+        result: the return value of func(item) in the order of items
+    """
+    if buffer_size < 1:
+        for item in items:
+            yield func(item)
+        return
+
+    buffer = queue.Queue(maxsize=buffer_size)
+    stop = threading.Event()
+
+    def _put(obj):
+        while not stop.is_set():
+            try:
+                buffer.put(obj, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _run():
+        try:
+            for item in items:
+                if not _put((func(item), None)):
+                    return
+        except Exception:
+            _put((None, sys.exc_info()))
+            return
+        _put((_END, None))
+
+    thread = threading.Thread(target=_run)
+    thread.daemon = True
+    thread.start()
+    try:
+        while True:
+            result, exc_info = buffer.get()
+            if exc_info is not None:
+                raise exc_info[1]
+            if result is _END:
+                break
+            yield result
+    finally:
+        stop.set()
+        thread.join()
+
+
+class AsyncWriter(object):
+    """Write files in background threads. The caller blocks when too many
+       writes are pending.
+    Args:
+        num_threads (int, optional): the number of writer threads.
+            If 0, write in the caller's thread.
+        max_pending (int, optional): the maximum number of pending writes
+    """
+
+    def __init__(self, num_threads=2, max_pending=16):
+        self.num_threads = num_threads
+        self._queue = queue.Queue(maxsize=max_pending)
+        self._errors = []
+        self._threads = []
+        for _ in range(num_threads):
+            thread = threading.Thread(target=self._run)
+            thread.daemon = True
+            thread.start()
+            self._threads.append(thread)
+
+    def _run(self):
+        while True:
+            task = self._queue.get()
+            if task is _END:
+                break
+            func, args, kwargs = task
+            try:
+                func(*args, **kwargs)
+            except Exception as e:
+                self._errors.append(e)
+
+    def submit(self, func, *args, **kwargs):
+        """Call func(*args, **kwargs) in a writer thread. Memory-mapped
+           arrays (ex. views of the shared memory slab) may be reused after
+           this call returns, so they are copied.
+        Args:
+            func (function): a function to write a file
+                (ex. np.save or htk.write)
+        """
+        if self._errors:
+            raise self._errors[0]
+        args = tuple(np.array(a) if isinstance(a, np.memmap) else a
+                     for a in args)
+        if self.num_threads == 0:
+            func(*args, **kwargs)
+        else:
+            self._queue.put((func, args, kwargs))
+
+    def close(self):
+        """Wait for all pending writes. Errors in writer threads are raised."""
+        for _ in self._threads:
+            self._queue.put(_END)
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+        if self._errors:
+            raise self._errors[0]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
@@ -0,0 +1,216 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Load mini-batches of utterances with similar lengths from dataset files
+   (ex. dataset/numpy/train/character.csv) made by `make_dataset`.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+from os.path import splitext
+from multiprocessing.pool import ThreadPool
+import numpy as np
+import pandas as pd
+
+from utils.io_queue import prefetch
+from utils.inputs.htk import read as read_htk
+from utils.inputs.quantization import find_quantizer
+
+
+class BucketSampler(object):
+    """Group utterances with similar lengths into mini-batches. The padded
+       size of each mini-batch (the number of utterances * the longest
+       length) is at most max_frames, except for an utterance longer than
+       max_frames which makes a mini-batch by itself.
+    Args:
+        frame_nums (list): the number of frames of each utterance
+        max_frames (int): the maximum number of padded frames per mini-batch
+        bucket_width (int, optional): utterances whose lengths differ by
+            less than this are shuffled among themselves before batching
+        max_batch_size (int, optional): the maximum number of utterances
+            per mini-batch. If None, only max_frames limits it.
+        shuffle (bool, optional): if True, shuffle utterances in each bucket
+            and the order of mini-batches every epoch
+        seed (int, optional): a random seed
+    """
+
+    def __init__(self, frame_nums, max_frames, bucket_width=1,
+                 max_batch_size=None, shuffle=False, seed=0):
+        if max_frames < 1:
+            raise ValueError('max_frames must be positive.')
+        if bucket_width < 1:
+            raise ValueError('bucket_width must be positive.')
+        self.frame_nums = np.asarray(frame_nums, dtype=np.int64)
+        self.max_frames = max_frames
+        self.bucket_width = bucket_width
+        self.max_batch_size = max_batch_size
+        self.shuffle = shuffle
+        self.seed = seed
+
+    def batches(self, epoch=0):
+        """
+        Args:
+            epoch (int, optional): an epoch to change the order by
+        Returns:
+            list of np.ndarray of indices of utterances
+        """
+        rng = np.random.RandomState(self.seed + epoch)
+        buckets = self.frame_nums // self.bucket_width
+        if self.shuffle:
+            order = np.lexsort((rng.permutation(len(buckets)), buckets))
+        else:
+            order = np.argsort(buckets, kind='mergesort')
+
+        batches = []
+        begin, max_len = 0, 0
+        for i, index in enumerate(order):
+            frame_num = self.frame_nums[index]
+            new_max_len = max(max_len, frame_num)
+            batch_size = i - begin + 1
+            if i > begin and (
+                    batch_size * new_max_len > self.max_frames or
+                    (self.max_batch_size is not None and
+                     batch_size > self.max_batch_size)):
+                batches.append(order[begin:i])
+                begin, new_max_len = i, frame_num
+            max_len = new_max_len
+        if begin < len(order):
+            batches.append(order[begin:])
+
+        if self.shuffle:
+            batches = [batches[i] for i in rng.permutation(len(batches))]
+        return batches
+
+
+def read_input(input_path):
+    """Read features of an utterance. Features saved with reduced precision
+       are dequantized.
+    Args:
+        input_path (string): path to a npy or HTK file
+    Returns:
+        input_utt (np.ndarray): A tensor of size `[T, feature_dim]`
+    """
+    ext = splitext(input_path)[1]
+    if ext == '.npy':
+        input_utt = np.load(input_path, mmap_mode='r')
+        if input_utt.dtype.kind == 'i':
+            return find_quantizer(input_path).decode(input_utt)
+        elif input_utt.dtype == np.float16:
+            return input_utt.astype(np.float32)
+        return input_utt
+    elif ext == '.htk':
+        return read_htk(input_path)[0]
+    else:
+        raise ValueError('input_path must be a npy or HTK file.')
+
+
+class BatchLoader(object):
+    """Load padded mini-batches in background threads while the caller
+       consumes the previous ones. Batches are written into preallocated
+       buffers which are reused, so a yielded array is valid only until the
+       next mini-batch is requested. Copy it to keep it.
+    Args:
+        dataset_path (string): path to a dataset file
+        max_frames (int): the maximum number of padded frames per mini-batch
+        bucket_width (int, optional): see `BucketSampler`
+        max_batch_size (int, optional): see `BucketSampler`
+        shuffle (bool, optional): see `BucketSampler`
+        seed (int, optional): a random seed
+        num_threads (int, optional): the number of threads to read
+            files of a mini-batch
+        buffer_size (int, optional): the number of mini-batches loaded ahead
+        pad_value (float, optional): a value of padded frames
+        dtype (optional): default is np.float32
+        read_func (function, optional): a function to read features from
+            input_path. Default is `read_input`.
+        label_func (function, optional): a function to convert a transcript
+            to a label. If None, transcripts of indices are converted to
+            np.ndarray of indices, and other transcripts (ex. words or
+            characters in the test set) to lists of tokens.
+    """
+
+    def __init__(self, dataset_path, max_frames, bucket_width=1,
+                 max_batch_size=None, shuffle=False, seed=0, num_threads=2,
+                 buffer_size=4, pad_value=0., dtype=np.float32,
+                 read_func=read_input, label_func=None):
+        # NOTE: an empty transcript is read as an empty string, not NaN
+        df = pd.read_csv(dataset_path, dtype={'transcript': str},
+                         keep_default_na=False)
+        self.input_paths = list(df['input_path'])
+        self.frame_nums = np.array(df['frame_num'], dtype=np.int64)
+        if label_func is None:
+            label_func = _find_label_func(df['transcript'])
+        self.labels = [label_func(transcript)
+                       for transcript in df['transcript']]
+        self.sampler = BucketSampler(
+            self.frame_nums, max_frames, bucket_width=bucket_width,
+            max_batch_size=max_batch_size, shuffle=shuffle, seed=seed)
+        self.num_threads = num_threads
+        self.buffer_size = max(buffer_size, 0)
+        self.pad_value = pad_value
+        self.dtype = dtype
+        self.read_func = read_func
+        self.epoch = 0
+
+        # NOTE: batches in the queue, one being loaded and one held by the
+        # caller never share a buffer
+        self._buffers = [None] * (self.buffer_size + 2)
+
+    def __len__(self):
+        return len(self.sampler.batches(self.epoch))
+
+    def _buffer(self, slot, size):
+        if self._buffers[slot] is None or self._buffers[slot].size < size:
+            self._buffers[slot] = np.empty(size, dtype=self.dtype)
+        return self._buffers[slot][:size]
+
+    def __iter__(self):
+        """
+        Yields:
+            inputs (np.ndarray): A tensor of size
+                `[B, max_frame_num, feature_dim]`
+            frame_nums (np.ndarray): the number of frames of each utterance
+            labels (list): labels of each utterance (see `label_func`)
+        """
+        batches = self.sampler.batches(self.epoch)
+        self.epoch += 1
+        pool = ThreadPool(max(self.num_threads, 1))
+
+        def _load(item):
+            step, indices = item
+            input_utts = pool.map(
+                self.read_func, [self.input_paths[i] for i in indices])
+            frame_nums = np.array([x.shape[0] for x in input_utts],
+                                  dtype=np.int64)
+            for i, frame_num in zip(indices, frame_nums):
+                if frame_num != self.frame_nums[i]:
+                    raise ValueError(
+                        'The number of frames of %s differs from the dataset '
+                        'file.' % self.input_paths[i])
+            feature_dim = input_utts[0].shape[1]
+            shape = (len(indices), int(frame_nums.max()), feature_dim)
+            inputs = self._buffer(
+                step % len(self._buffers), int(np.prod(shape))).reshape(shape)
+            for i, input_utt in enumerate(input_utts):
+                inputs[i, :frame_nums[i]] = input_utt
+                inputs[i, frame_nums[i]:] = self.pad_value
+            return inputs, frame_nums, [self.labels[i] for i in indices]
+
+        try:
+            for batch in prefetch(_load, enumerate(batches),
+                                  buffer_size=self.buffer_size):
+                yield batch
+        finally:
+            pool.close()
+            pool.join()
+
+
+def _find_label_func(transcripts):
+    # NOTE: transcripts of the test set are saved as they are
+    for transcript in transcripts:
+        for token in transcript.split():
+            if not token.lstrip('-').isdigit():
+                return lambda transcript: transcript.split()
+    return lambda transcript: np.array(transcript.split(), dtype=np.int32)
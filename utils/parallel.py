@@ -7,8 +7,25 @@ from __future__ import absolute_import
 from __future__ import division
 from __future__ import print_function
 
-
+import os
+import threading
+import traceback
 import multiprocessing as mp
+from tqdm import tqdm
+
+from utils.shared_buffer import SharedSlab
+from utils.io_queue import prefetch
+
+try:
+    from threadpoolctl import threadpool_limits
+except ImportError:
+    threadpool_limits = None
+
+BLAS_ENV_VARS = ['OMP_NUM_THREADS', 'OPENBLAS_NUM_THREADS', 'MKL_NUM_THREADS',
+                 'VECLIB_MAXIMUM_THREADS', 'NUMEXPR_NUM_THREADS']
+
+# Objects built once per process (filterbank matrices, tokenizers etc.)
+_worker_state = {}
 
 
 def make_parallel(func, args, core=mp.cpu_count()):
@@ -19,6 +36,310 @@ def make_parallel(func, args, core=mp.cpu_count()):
     Returns:
         result_tuple (tuple): tuple of returns
     """
-    p = mp.Pool(core - 1)
-    result_tuple = p.map(func, args)
+    pool = mp.Pool(max(core - 1, 1))
+    try:
+        result_tuple = pool.map(func, args)
+    finally:
+        pool.close()
+        pool.join()
     return result_tuple
+
+
+def get_worker_state(key, builder, *args):
+    """Return an object cached in the current process. The object is built
+       by `builder(*args)` only the first time it is requested.
+    Args:
+        key (hashable): the name of the object
+        builder (function): a function to build the object
+    Returns:
+        the cached object
+    """
+    if key not in _worker_state:
+        _worker_state[key] = builder(*args)
+    return _worker_state[key]
+
+
+def set_blas_threads(num_threads):
+    """Limit the number of threads used by BLAS libraries in this process.
+       Environment variables only take effect in processes which have not
+       loaded numpy yet, so threadpoolctl is used as well if installed.
+    Args:
+        num_threads (int): the number of threads
+    """
+    for env_var in BLAS_ENV_VARS:
+        os.environ[env_var] = str(num_threads)
+    if threadpool_limits is not None:
+        threadpool_limits(limits=num_threads)
+
+
+def _init_worker(blas_threads, initializer, initargs, slab=None):
+    if blas_threads is not None:
+        set_blas_threads(blas_threads)
+    if slab is not None:
+        slab.attach()
+    _worker_state['_slab'] = slab
+    if initializer is not None:
+        initializer(*initargs)
+
+
+def _call_safely(func_item):
+    func, index, item = func_item
+    try:
+        result = func(item)
+        slab = _worker_state.get('_slab')
+        if slab is not None:
+            # Send only descriptors of arrays written in the shared slab
+            return index, slab.encode(result), None
+        return index, (None, result), None
+    except Exception:
+        return index, None, traceback.format_exc()
+
+
+class _Backpressure(object):
+    """Feed tasks to a process pool only while fewer than `max_pending`
+       results are waiting to be consumed.
+    Args:
+        tasks (list): tasks for the pool
+        max_pending (int): the maximum number of pending results
+    """
+
+    def __init__(self, tasks, max_pending):
+        self.tasks = tasks
+        self._semaphore = threading.Semaphore(max_pending)
+        self._stopped = False
+
+    def __iter__(self):
+        # NOTE: this is consumed in the task handler thread of the pool
+        for task in self.tasks:
+            self._semaphore.acquire()
+            if self._stopped:
+                return
+            yield task
+
+    def release(self):
+        """Called after a result is consumed."""
+        self._semaphore.release()
+
+    def stop(self):
+        """Unblock the task handler so that the pool can be terminated."""
+        self._stopped = True
+        self._semaphore.release()
+
+
+class ParallelExecutor(object):
+    """Run a function over many files in a process pool. Files which raise
+       an exception are quarantined and reported at the end instead of
+       stopping the whole run.
+    Args:
+        num_workers (int, optional): the number of worker processes.
+            If 1, run in the current process.
+        initializer (function, optional): called once in each worker
+            (and once in the current process if num_workers == 1)
+        initargs (tuple, optional): arguments for initializer
+        blas_threads (int, optional): the number of BLAS threads per worker
+            to avoid oversubscription
+        chunksize (int, optional): the number of files sent to a worker at
+            once. If None, decided from the number of files and workers.
+        max_chunksize (int, optional): upper bound of the adaptive chunksize
+        slot_bytes (int, optional): if set, workers write arrays in their
+            results into a shared memory-mapped slab of slots of this size
+            and send back only (offset, shape) descriptors. Arrays yielded
+            by `imap` are then views which are valid until the next item
+            is requested, so copy them to keep them longer.
+        prefetch_num (int, optional): if num_workers == 1, the number of
+            files processed ahead in a background thread while the caller
+            consumes the previous results. If 0, run strictly serially.
+        max_pending (int, optional): the maximum number of results which
+            are computed but not consumed yet. If None, workers never wait
+            for the caller, so results may pile up in memory.
+    """
+
+    def __init__(self, num_workers=1, initializer=None, initargs=(),
+                 blas_threads=1, chunksize=None, max_chunksize=64,
+                 slot_bytes=None, prefetch_num=4, max_pending=None):
+        if num_workers is None or num_workers < 1:
+            num_workers = max(mp.cpu_count() - 1, 1)
+        self.num_workers = num_workers
+        self.initializer = initializer
+        self.initargs = initargs
+        self.blas_threads = blas_threads
+        self.chunksize = chunksize
+        self.max_chunksize = max_chunksize
+        self.slot_bytes = slot_bytes
+        self.prefetch_num = prefetch_num
+        self.max_pending = max_pending
+        self.failures = []
+        self._failed_keys = set([])
+        self._initialized = False
+
+    def _chunksize(self, item_num):
+        if self.chunksize is not None:
+            return self.chunksize
+        chunksize, extra = divmod(item_num, self.num_workers * 4)
+        if extra:
+            chunksize += 1
+        max_chunksize = self.max_chunksize
+        if self.slot_bytes is not None:
+            # NOTE: results of a chunk are sent at once, so a large chunk
+            # holds many slots at the same time
+            max_chunksize = min(max_chunksize, 2)
+        if self.max_pending is not None:
+            # NOTE: a chunk must fit in the pending results
+            max_chunksize = min(max_chunksize,
+                                self.max_pending // self.num_workers)
+        return max(1, min(chunksize, max_chunksize))
+
+    def imap(self, func, items, desc=None, progress=True):
+        """Apply func to each item. Results are yielded in the order of
+           completion.
+        Args:
+            func (function): a picklable function which takes one item
+            items (list): inputs of func (ex. paths to audio files)
+            desc (string, optional): description for the progress bar
+            progress (bool, optional): if True, show a progress bar
+        Yields:
+            item: an input of func
+            result: the return value of func(item)
+        """
+        items = list(items)
+        for index, result in self._imap_indexed(func, items, desc, progress):
+            yield items[index], result
+
+    def imap_batched(self, func, batch_func, items, batch_size, desc=None,
+                     progress=True):
+        """Same as `imap`, but batch_func is applied to batch_size items at
+           once. A batch which raises an exception is run again item by item
+           with func, so that only the items which fail are quarantined.
+        Args:
+            func (function): a picklable function which takes one item
+            batch_func (function): a picklable function which takes a list
+                of items and returns a list of results of func
+            items (list): inputs of func (ex. paths to audio files)
+            batch_size (int): the number of items per batch
+            desc (string, optional): description for the progress bar
+            progress (bool, optional): if True, show a progress bar
+        Yields:
+            item: an input of func
+            result: the return value of func(item)
+        """
+        items = list(items)
+        if batch_size <= 1:
+            for item, result in self.imap(func, items, desc, progress):
+                yield item, result
+            return
+
+        batches = [items[i:i + batch_size]
+                   for i in range(0, len(items), batch_size)]
+        failure_num = len(self.failures)
+        for batch, results in self.imap(batch_func, batches, desc, progress):
+            for item, result in zip(batch, results):
+                yield item, result
+
+        # Run failed batches again item by item
+        failed_batches = [batch for batch, _ in self.failures[failure_num:]]
+        del self.failures[failure_num:]
+        for batch in failed_batches:
+            self._failed_keys.discard(str(batch))
+            for item, result in self.imap(func, batch, progress=False):
+                yield item, result
+
+    def map(self, func, items, desc=None, progress=True):
+        """Apply func to each item.
+        Args:
+            func (function): a picklable function which takes one item
+            items (list): inputs of func
+            desc (string, optional): description for the progress bar
+            progress (bool, optional): if True, show a progress bar
+        Returns:
+            results (list): return values in the order of items. Failed
+                items are set to None.
+        """
+        items = list(items)
+        results = [None] * len(items)
+        for index, result in self._imap_indexed(func, items, desc, progress,
+                                                use_slab=False):
+            results[index] = result
+        return results
+
+    def _imap_indexed(self, func, items, desc, progress, use_slab=True):
+        tasks = [(func, i, item) for i, item in enumerate(items)]
+
+        slab = None
+        pending = None
+        if self.num_workers == 1:
+            if not self._initialized:
+                _init_worker(None, self.initializer, self.initargs)
+                self._initialized = True
+            prefetch_num = self.prefetch_num
+            if self.max_pending is not None:
+                prefetch_num = min(prefetch_num, self.max_pending)
+            # NOTE: decode the next files while the caller normalizes and
+            # saves the previous ones
+            results = prefetch(_call_safely, tasks, prefetch_num)
+            pool = None
+        else:
+            chunksize = self._chunksize(len(tasks))
+            if self.max_pending is not None:
+                # The pool takes a next task only after a result is consumed
+                chunksize = min(chunksize, self.max_pending)
+                pending = _Backpressure(tasks, self.max_pending)
+                tasks_iter = iter(pending)
+            else:
+                tasks_iter = tasks
+            if use_slab and self.slot_bytes is not None:
+                slab = SharedSlab(
+                    slot_num=self.num_workers * (chunksize + 1),
+                    slot_bytes=self.slot_bytes)
+            pool = mp.Pool(self.num_workers,
+                           initializer=_init_worker,
+                           initargs=(self.blas_threads, self.initializer,
+                                     self.initargs, slab))
+            results = pool.imap_unordered(
+                _call_safely, tasks_iter, chunksize=chunksize)
+
+        try:
+            for index, result, error in tqdm(results, total=len(tasks),
+                                             desc=desc, disable=not progress):
+                if error is not None:
+                    if str(items[index]) not in self._failed_keys:
+                        # NOTE: the same file may fail in several passes
+                        self._failed_keys.add(str(items[index]))
+                        self.failures.append((items[index], error))
+                    if pending is not None:
+                        pending.release()
+                    continue
+                slot, result = result
+                if slab is None:
+                    yield index, result
+                else:
+                    yield index, slab.decode(slot, result)
+                    # NOTE: the views are released after they are consumed
+                    slab.release(slot)
+                if pending is not None:
+                    pending.release()
+        finally:
+            if pending is not None:
+                pending.stop()
+            if pool is not None:
+                pool.terminate()
+                pool.join()
+            if slab is not None:
+                slab.close()
+
+    def report(self, save_path=None):
+        """Print quarantined items.
+        Args:
+            save_path (string, optional): path to a file to record them
+        """
+        if len(self.failures) == 0:
+            return
+        print('=====> %d files failed and were skipped:' % len(self.failures))
+        for item, error in self.failures:
+            print('  %s' % str(item))
+            print('    ' + error.strip().split('\n')[-1])
+        if save_path is not None:
+            with open(save_path, 'w') as f:
+                for item, error in self.failures:
+                    f.write('%s\n' % str(item))
+                    f.write(error)
+
@@ -0,0 +1,154 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""A small pipeline runner which reruns only stages whose inputs changed."""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import os
+from os.path import join, isfile, exists
+import hashlib
+import pickle
+from collections import OrderedDict
+
+from utils.util import mkdir
+from utils.inputs.ledger import make_config_hash
+
+
+class Stage(object):
+    """A step of the pipeline.
+    Args:
+        name (string): the name of the stage
+        func (function): called as `func(*results of inputs)`. The return
+            value must be picklable.
+        inputs (list): names of stages whose results are passed to func
+        config (dict): a configuration which determines the result
+        always (bool): if True, run every time (ex. scanning the corpus).
+            Sizes and modification times of files in the result are
+            included in its content hash, so that later stages are rerun
+            when the files change.
+        outputs (list): paths to files or directories made by func
+            (ex. CSV files, complete.txt of features). The stage is run
+            again if any of them is missing.
+    """
+
+    def __init__(self, name, func, inputs=(), config=None, always=False,
+                 outputs=()):
+        self.name = name
+        self.func = func
+        self.inputs = list(inputs)
+        self.config = config if config is not None else {}
+        self.always = always
+        self.outputs = list(outputs)
+
+
+class Pipeline(object):
+    """Run stages in the order of dependencies. The result of each stage is
+       cached with a key computed from its config and the content hashes of
+       the results of its inputs. A stage is skipped if the key is the same
+       as the last run and all of its outputs exist.
+    Args:
+        cache_path (string): path to the directory to save results
+    """
+
+    def __init__(self, cache_path):
+        self.cache_path = mkdir(cache_path)
+        self.stages = OrderedDict()
+        self.results = {}
+        self._hashes = {}
+
+    def add(self, name, func, inputs=(), config=None, always=False,
+            outputs=()):
+        """Add a stage. See `Stage` for the arguments."""
+        if name in self.stages.keys():
+            raise ValueError('Stage %s already exists.' % name)
+        for input_name in inputs:
+            if input_name not in self.stages.keys():
+                raise ValueError('Add stage %s before %s.' %
+                                 (input_name, name))
+        self.stages[name] = Stage(name, func, inputs, config, always,
+                                  outputs)
+
+    def run(self, name=None):
+        """Run a stage and stages it depends on.
+        Args:
+            name (string, optional): the name of the stage. If None, run
+                all stages.
+        Returns:
+            result: the result of the stage (None if name is None)
+        """
+        if name is None:
+            for name in self.stages.keys():
+                self.run(name)
+            return None
+        if name in self.results.keys():
+            return self.results[name]
+
+        stage = self.stages[name]
+        input_results = [self.run(input_name) for input_name in stage.inputs]
+        key = make_config_hash(
+            name, stage.config, *[self._hashes[n] for n in stage.inputs])
+
+        cache_file = join(self.cache_path, name + '.pickle')
+        cache = None
+        if not stage.always and isfile(cache_file):
+            with open(cache_file, 'rb') as f:
+                cache = pickle.load(f)
+        missing = []
+        if cache is not None and cache['key'] == key:
+            # NOTE: outputs may have been deleted after the last run
+            missing = [p for p in cache.get('outputs', []) + stage.outputs
+                       if not exists(p)]
+        if cache is not None and cache['key'] == key and len(missing) == 0:
+            print('=> Stage %s: up to date.' % name)
+            result, content_hash = cache['result'], cache['hash']
+        else:
+            if len(missing) > 0:
+                print('=> Stage %s: %s is missing.' % (name, missing[0]))
+            print('=> Stage %s: running...' % name)
+            result = stage.func(*input_results)
+            content_hash = _content_hash(result, stat_files=stage.always)
+            with open(cache_file + '.tmp', 'wb') as f:
+                pickle.dump({'key': key, 'hash': content_hash,
+                             'result': result, 'outputs': stage.outputs},
+                            f, protocol=2)
+            os.rename(cache_file + '.tmp', cache_file)
+
+        self.results[name] = result
+        self._hashes[name] = content_hash
+        return result
+
+
+def _content_hash(result, stat_files=False):
+    md5 = hashlib.md5(pickle.dumps(_canonical(result), protocol=2))
+    if stat_files:
+        for path in _collect_strings(result):
+            if isfile(path):
+                stat = os.stat(path)
+                md5.update(('%s\t%d\t%d\n' % (
+                    path, stat.st_size, int(stat.st_mtime))).encode('utf-8'))
+    return md5.hexdigest()
+
+
+def _canonical(obj):
+    # NOTE: the order of items in a dict does not change its content
+    if isinstance(obj, dict):
+        return sorted((k, _canonical(v)) for k, v in obj.items())
+    elif isinstance(obj, (list, tuple)):
+        return [_canonical(o) for o in obj]
+    return obj
+
+
+def _collect_strings(obj):
+    if isinstance(obj, str):
+        yield obj
+    elif isinstance(obj, (list, tuple)):
+        for o in obj:
+            for s in _collect_strings(o):
+                yield s
+    elif isinstance(obj, dict):
+        for o in obj.values():
+            for s in _collect_strings(o):
+                yield s
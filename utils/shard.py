@@ -0,0 +1,265 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Split feature extraction of a large training set into shards run on
+   several nodes, and merge their outputs into those of a single run.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import os
+from os.path import join, isfile, isdir, relpath
+import shutil
+import heapq
+import pickle
+import numpy as np
+
+from utils.inputs.ledger import LEDGER_NAME
+from utils.inputs.statistics import Statistics, STATISTICS_NAME
+from utils.inputs.quantization import Quantizer, QUANTIZATION_NAME
+
+SHARD_DIR = '.shards'
+JOB_NAME = 'job.txt'
+COMPLETE_NAME = 'complete.txt'
+
+
+def plan_shards(items, shard_num, group_func, weight_func):
+    """Partition files into shards with near-equal total frames. All files
+       of a group (ex. a speaker) go to the same shard, so statistics per
+       group are computed in one shard. Groups are assigned from the
+       largest one to the shard with the fewest frames.
+    Args:
+        items (list): files (ex. paths to audio files)
+        shard_num (int): the number of shards
+        group_func (function): a function which takes a file and returns
+            its group
+        weight_func (function): a function which takes a file and returns
+            its cost (ex. the number of frames from `read_frame_num`)
+    Returns:
+        shards (list): lists of files in the original order per shard
+        shard_frame_nums (list): the total weight per shard
+    """
+    if shard_num < 1:
+        raise ValueError('shard_num must be positive.')
+    group_weights = {}
+    item_groups = []
+    for item in items:
+        group = group_func(item)
+        group_weights[group] = group_weights.get(group, 0) + weight_func(item)
+        item_groups.append(group)
+
+    heap = [(0, shard_index) for shard_index in range(shard_num)]
+    group_shards = {}
+    for group in sorted(group_weights.keys(),
+                        key=lambda g: (-group_weights[g], g)):
+        weight, shard_index = heapq.heappop(heap)
+        group_shards[group] = shard_index
+        heapq.heappush(heap, (weight + group_weights[group], shard_index))
+
+    shards = [[] for _ in range(shard_num)]
+    for item, group in zip(items, item_groups):
+        shards[group_shards[group]].append(item)
+    shard_frame_nums = [0] * shard_num
+    for weight, shard_index in heap:
+        shard_frame_nums[shard_index] = weight
+    return shards, shard_frame_nums
+
+
+def shard_path(save_path, shard_index):
+    """
+    Args:
+        save_path (string): path to the directory of the whole outputs
+        shard_index (int): the index of a shard
+    Returns:
+        path to the directory of outputs of the shard
+    """
+    return join(save_path, SHARD_DIR, str(shard_index))
+
+
+def write_jobs(shards, save_path):
+    """Save files of each shard as a job manifest, one path per line.
+       Every node computes the same plan, so writing it again is harmless.
+    Args:
+        shards (list): the result of `plan_shards`
+        save_path (string): path to the directory of the whole outputs
+    """
+    for shard_index, items in enumerate(shards):
+        job_dir = shard_path(save_path, shard_index)
+        if not isdir(job_dir):
+            try:
+                os.makedirs(job_dir)
+            except OSError:
+                if not isdir(job_dir):
+                    raise
+        job_path = join(job_dir, JOB_NAME)
+        tmp_path = '%s.%d.tmp' % (job_path, os.getpid())
+        with open(tmp_path, 'w') as f:
+            for item in items:
+                f.write(item + '\n')
+        os.rename(tmp_path, job_path)
+
+
+def read_job(save_path, shard_index):
+    """
+    Args:
+        save_path (string): path to the directory of the whole outputs
+        shard_index (int): the index of a shard
+    Returns:
+        audio_paths (list): files of the shard to pass to `read_audio`
+    """
+    with open(join(shard_path(save_path, shard_index), JOB_NAME), 'r') as f:
+        return [line.rstrip('\n') for line in f if line.strip() != '']
+
+
+def reduce_shards(save_path, shard_num):
+    """Merge outputs of shards into save_path as if they were made by a
+       single run. Directories of features are moved (speakers do not
+       overlap among shards), paths in ledgers are rewritten, and
+       statistics, errors of quantization and frame num dicts are merged.
+       Global mean & std must be the same in all shards.
+    Args:
+        save_path (string): path to the directory of the whole outputs
+        shard_num (int): the number of shards
+    Returns:
+        frame_num_dict (dict):
+            key => utterance name
+            value => the number of frames
+    """
+    shard_paths = [shard_path(save_path, i) for i in range(shard_num)]
+    incomplete = [str(i) for i, p in enumerate(shard_paths)
+                  if not isfile(join(p, COMPLETE_NAME))]
+    if len(incomplete) > 0:
+        raise ValueError('Shards %s have not been completed.' %
+                         ', '.join(incomplete))
+
+    frame_num_dict = {}
+    statistics = None
+    quantizer = None
+    failed_lines = []
+    for p in shard_paths:
+        # Features are saved per speaker
+        for name in sorted(os.listdir(p)):
+            if isdir(join(p, name)):
+                _move_tree(join(p, name), join(save_path, name))
+
+        _append_lines(join(p, LEDGER_NAME), join(save_path, LEDGER_NAME),
+                      p, save_path, column=1)
+
+        if isfile(join(p, 'frame_num.pickle')):
+            with open(join(p, 'frame_num.pickle'), 'rb') as f:
+                frame_num_dict.update(pickle.load(f))
+
+        if isfile(join(p, STATISTICS_NAME)):
+            shard_statistics = Statistics.load(join(p, STATISTICS_NAME))
+            if statistics is None:
+                statistics = shard_statistics
+            else:
+                statistics.merge(shard_statistics)
+
+        if isfile(join(p, QUANTIZATION_NAME)):
+            shard_quantizer = Quantizer.load(join(p, QUANTIZATION_NAME))
+            if quantizer is None:
+                quantizer = shard_quantizer
+            else:
+                quantizer.merge(shard_quantizer)
+
+        if isfile(join(p, 'failed_files.txt')):
+            with open(join(p, 'failed_files.txt'), 'r') as f:
+                failed_lines += f.readlines()
+
+    if statistics is not None:
+        statistics.save(join(save_path, STATISTICS_NAME))
+    if quantizer is not None:
+        quantizer.save(join(save_path, QUANTIZATION_NAME))
+    # NOTE: global mean & std exchanged by shards (see `utils.distributed`)
+    # are the same in all shards. Shards which did not exchange them have
+    # their own ones, which are not those of the whole training set.
+    global_names = [[name for name in sorted(os.listdir(p))
+                     if name.startswith('global_') and name.endswith('.npy')]
+                    for p in shard_paths]
+    for p, names in zip(shard_paths[1:], global_names[1:]):
+        if names != global_names[0]:
+            raise ValueError('Global mean & std of %s differ from shard 0.' %
+                             p)
+        for name in names:
+            if not np.array_equal(np.load(join(p, name)),
+                                  np.load(join(shard_paths[0], name))):
+                raise ValueError(
+                    '%s differs from shard 0. Set shard_transport to '
+                    'exchange statistics among shards.' % join(p, name))
+    for name in global_names[0]:
+        shutil.copyfile(join(shard_paths[0], name), join(save_path, name))
+    with open(join(save_path, 'frame_num.pickle'), 'wb') as f:
+        pickle.dump(frame_num_dict, f)
+    if len(failed_lines) > 0:
+        with open(join(save_path, 'failed_files.txt'), 'w') as f:
+            f.writelines(failed_lines)
+
+    return frame_num_dict
+
+
+def _move_tree(src, dst):
+    if not isdir(dst):
+        os.rename(src, dst)
+        return
+    # NOTE: moved by a previous reduce which was interrupted
+    for name in os.listdir(src):
+        if isdir(join(src, name)):
+            _move_tree(join(src, name), join(dst, name))
+        else:
+            os.rename(join(src, name), join(dst, name))
+    os.rmdir(src)
+
+
+def _append_lines(src, dst, src_dir, dst_dir, column):
+    """Append lines of a TSV file of a shard, replacing src_dir in the
+       paths of the column with dst_dir. Lines already in dst are skipped.
+    """
+    if not isfile(src):
+        return
+    existing = set()
+    if isfile(dst):
+        with open(dst, 'r') as f:
+            existing = set(f.readlines())
+    with open(src, 'r') as f:
+        lines = f.readlines()
+    with open(dst, 'a') as f:
+        for line in lines:
+            if not line.endswith('\n'):
+                # NOTE: the last line was broken by a crash
+                continue
+            fields = line.rstrip('\n').split('\t')
+            if len(fields) <= column:
+                continue
+            fields[column] = join(dst_dir, relpath(fields[column], src_dir))
+            line = '\t'.join(fields) + '\n'
+            if line not in existing:
+                f.write(line)
+                existing.add(line)
+
+
+def prepare_shard(items, save_path, shard_num, shard_index, group_func,
+                  weight_func):
+    """Plan shards, save their job manifests and read the job of a shard.
+    Args:
+        items (list): files (ex. paths to audio files)
+        save_path (string): path to the directory of the whole outputs
+        shard_num (int): the number of shards
+        shard_index (int): the index of the shard to run
+        group_func (function): see `plan_shards`
+        weight_func (function): see `plan_shards`
+    Returns:
+        items (list): files of the shard
+        save_path (string): path to the directory of outputs of the shard
+    """
+    if shard_index < 0 or shard_index >= shard_num:
+        raise ValueError('shard_index must be in [0, shard_num).')
+    shards, shard_frame_nums = plan_shards(
+        items, shard_num, group_func, weight_func)
+    write_jobs(shards, save_path)
+    print('=====> Shard %d/%d: %d files, %d frames (%d frames in total)' %
+          (shard_index, shard_num, len(shards[shard_index]),
+           shard_frame_nums[shard_index], sum(shard_frame_nums)))
+    return read_job(save_path, shard_index), shard_path(save_path, shard_index)
@@ -0,0 +1,170 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Hand over arrays from worker processes to the parent through a shared
+   memory-mapped slab instead of pickling them through a pipe.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import os
+import tempfile
+import multiprocessing as mp
+import numpy as np
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+ALIGNMENT = 64
+
+
+class SharedArray(object):
+    """Descriptor of an array written in the slab.
+    Args:
+        offset (int): byte offset in the slab
+        shape (tuple): shape of the array
+        dtype (string): dtype of the array
+    """
+
+    def __init__(self, offset, shape, dtype):
+        self.offset = offset
+        self.shape = shape
+        self.dtype = dtype
+
+
+class SharedSlab(object):
+    """A preallocated memory-mapped file on tmpfs divided into fixed-size
+       slots. A worker writes all arrays of one result into a free slot and
+       sends back only their descriptors. The parent reads them as views
+       and releases the slot after consuming them. If no slot is free or
+       the arrays do not fit in a slot, they are pickled as usual.
+    Args:
+        slot_num (int): the number of slots
+        slot_bytes (int): the size of each slot in bytes
+    """
+
+    def __init__(self, slot_num, slot_bytes):
+        self.slot_num = slot_num
+        self.slot_bytes = slot_bytes
+
+        save_dir = '/dev/shm' if os.path.isdir('/dev/shm') else None
+        fd, self.path = tempfile.mkstemp(prefix='slab_', dir=save_dir)
+        os.close(fd)
+        self._slab = np.memmap(self.path, dtype=np.uint8, mode='w+',
+                               shape=(slot_num * slot_bytes,))
+
+        self.free_slots = mp.Queue()
+        for slot in range(slot_num):
+            self.free_slots.put(slot)
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_slab'] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+
+    def attach(self):
+        """Map the slab in a worker process."""
+        if self._slab is None:
+            self._slab = np.memmap(self.path, dtype=np.uint8, mode='r+',
+                                   shape=(self.slot_num * self.slot_bytes,))
+
+    def close(self):
+        """Unmap and remove the slab (called by the parent)."""
+        self._slab = None
+        if os.path.isfile(self.path):
+            os.remove(self.path)
+
+    def _view(self, offset, shape, dtype):
+        dtype = np.dtype(dtype)
+        size = int(np.prod(shape)) * dtype.itemsize
+        return self._slab[offset:offset + size].view(dtype).reshape(shape)
+
+    def encode(self, result):
+        """Write arrays in result into a free slot (called by a worker).
+        Args:
+            result: a return value which may contain np.ndarray in
+                tuple, list or dict
+        Returns:
+            slot (int): the slot index, or None if not written
+            result: result whose arrays are replaced with SharedArray
+        """
+        arrays = []
+        _collect_arrays(result, arrays)
+        if len(arrays) == 0:
+            return None, result
+
+        total_bytes = sum(_aligned(a.nbytes) for a in arrays)
+        if total_bytes > self.slot_bytes:
+            return None, result
+        try:
+            slot = self.free_slots.get_nowait()
+        except queue.Empty:
+            return None, result
+
+        offsets = {}
+        offset = slot * self.slot_bytes
+        for a in arrays:
+            self._view(offset, a.shape, a.dtype)[...] = a
+            offsets[id(a)] = offset
+            offset += _aligned(a.nbytes)
+        return slot, _replace(
+            result, lambda a: SharedArray(offsets[id(a)], a.shape, a.dtype.str),
+            np.ndarray)
+
+    def decode(self, slot, result):
+        """Replace descriptors with views of the slab (called by the parent).
+           The views are valid until `release(slot)` is called.
+        Args:
+            slot (int): the slot index returned by `encode`
+            result: the result returned by `encode`
+        Returns:
+            result whose descriptors are replaced with np.ndarray
+        """
+        if slot is None:
+            return result
+        return _replace(
+            result, lambda d: self._view(d.offset, d.shape, d.dtype),
+            SharedArray)
+
+    def release(self, slot):
+        """Make the slot writable by workers again."""
+        if slot is not None:
+            self.free_slots.put(slot)
+
+
+def _aligned(nbytes):
+    return (nbytes + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+
+
+def _collect_arrays(obj, arrays):
+    if isinstance(obj, np.ndarray):
+        if obj.dtype != object:
+            arrays.append(obj)
+    elif isinstance(obj, (tuple, list)):
+        for o in obj:
+            _collect_arrays(o, arrays)
+    elif isinstance(obj, dict):
+        for o in obj.values():
+            _collect_arrays(o, arrays)
+
+
+def _replace(obj, func, target_type):
+    if isinstance(obj, target_type):
+        if isinstance(obj, np.ndarray) and obj.dtype == object:
+            return obj
+        return func(obj)
+    elif isinstance(obj, tuple):
+        return tuple(_replace(o, func, target_type) for o in obj)
+    elif isinstance(obj, list):
+        return [_replace(o, func, target_type) for o in obj]
+    elif isinstance(obj, dict):
+        return obj.__class__(
+            (k, _replace(v, func, target_type)) for k, v in obj.items())
+    return obj
@@ -0,0 +1,102 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Test for the cached catalog of files in a corpus."""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import os
+import sys
+import time
+import shutil
+import tempfile
+import unittest
+import wave
+from glob import glob
+from os.path import join
+import numpy as np
+
+sys.path.append('../../')
+from utils.catalog import Catalog
+
+
+class CountingCatalog(Catalog):
+
+    scanned = []
+
+    def _scan(self, name):
+        self.scanned.append(name)
+        return super(CountingCatalog, self)._scan(name)
+
+
+class TestCatalog(unittest.TestCase):
+
+    def test(self):
+
+        root = tempfile.mkdtemp()
+        cache_path = join(tempfile.mkdtemp(), '.catalog')
+        try:
+            for subset in ['train', 'test']:
+                for speaker in ['spk1', 'spk2']:
+                    os.makedirs(join(root, subset, speaker, 'ch1'))
+                    for i in range(3):
+                        with wave.open(join(root, subset, speaker, 'ch1',
+                                            '%d.wav' % i), 'w') as w:
+                            w.setnchannels(1)
+                            w.setsampwidth(2)
+                            w.setframerate(16000)
+                            w.writeframes(np.zeros(
+                                8000 * (i + 1), dtype=np.int16).tobytes())
+                        with open(join(root, subset, speaker, 'ch1',
+                                       '%d.txt' % i), 'w') as f:
+                            f.write('transcript')
+            with open(join(root, 'SPEAKERS.TXT'), 'w') as f:
+                f.write('spk1 | F')
+            with open(join(root, 'train', 'spk1', 'ch1', '.hidden.wav'),
+                      'w') as f:
+                f.write('')
+
+            catalog = CountingCatalog(root, cache_path=cache_path)
+            self.assertEqual(sorted(CountingCatalog.scanned),
+                             ['test', 'train'])
+            for pattern in ['*/*/*/*', 'train/*/*/*.wav', '*', '*/*/*/1.*',
+                            'test/spk?/ch1/*.txt', '*/*']:
+                self.assertEqual(
+                    catalog.glob(pattern),
+                    sorted(p for p in glob(join(root, pattern))
+                           if os.path.isfile(p)))
+            wav_path = join(root, 'train', 'spk2', 'ch1', '1.wav')
+            self.assertTrue(catalog.isfile(wav_path))
+            self.assertEqual(catalog.duration(wav_path), 1.)
+            self.assertEqual(catalog.size(wav_path), 44 + 32000)
+            self.assertIsNone(catalog.duration(wav_path.replace('wav', 'txt')))
+
+            # Nothing changed
+            del CountingCatalog.scanned[:]
+            catalog = CountingCatalog(root, cache_path=cache_path)
+            self.assertEqual(CountingCatalog.scanned, [])
+            self.assertEqual(len(catalog.glob('*/*/*/*.wav')), 12)
+
+            # Only the changed top-level directory is scanned again
+            time.sleep(0.01)
+            os.remove(join(root, 'test', 'spk1', 'ch1', '0.wav'))
+            os.makedirs(join(root, 'dev', 'spk3'))
+            with open(join(root, 'dev', 'spk3', '0.txt'), 'w') as f:
+                f.write('transcript')
+            catalog = CountingCatalog(root, cache_path=cache_path)
+            self.assertEqual(sorted(CountingCatalog.scanned), ['dev', 'test'])
+            self.assertEqual(len(catalog.glob('*/*/*/*.wav')), 11)
+            self.assertEqual(catalog.glob('dev/*/*'),
+                             [join(root, 'dev', 'spk3', '0.txt')])
+
+            # A directory which does not exist
+            self.assertEqual(Catalog(join(root, 'none')).glob('*'), [])
+        finally:
+            shutil.rmtree(root)
+            shutil.rmtree(os.path.dirname(cache_path))
+
+
+if __name__ == '__main__':
+    unittest.main()
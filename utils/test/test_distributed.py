@@ -0,0 +1,132 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Test for reducing statistics over shards."""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import sys
+import os
+import shutil
+import pickle
+import socket
+import tempfile
+import time
+import threading
+import unittest
+import numpy as np
+
+sys.path.append('../../')
+from utils.distributed import DirectoryTransport, SocketTransport
+from utils.distributed import run_local, allreduce_sum, _send
+
+
+def _values(shard_index):
+    # NOTE: shard 1 has no data of the second value
+    return [np.arange(3, dtype=np.float32) * (shard_index + 1),
+            None if shard_index == 1 else np.ones(2, dtype=np.float32),
+            10 * shard_index, None]
+
+
+def _exchange(transport, rounds=2):
+    results = []
+    for i in range(rounds):
+        results.append(allreduce_sum(
+            transport, _values(transport.shard_index + i), tag='round%d' % i))
+    return results
+
+
+def _run_threads(make, shard_num):
+    results = [None] * shard_num
+
+    def _run(shard_index):
+        results[shard_index] = _exchange(make(shard_index))
+    threads = [threading.Thread(target=_run, args=(i,))
+               for i in range(shard_num)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+
+class TestDistributed(unittest.TestCase):
+
+    def test(self):
+
+        self.check(run_local(_exchange, 3), 3)
+
+        path = tempfile.mkdtemp()
+        try:
+            make = lambda i: DirectoryTransport(path, i, 3, poll=0.01)
+            self.check(_run_threads(make, 3), 3)
+            # Run again in the same directory
+            self.check(_run_threads(make, 3), 3)
+
+            # NOTE: payloads left by a run which crashed before reducing
+            for i in range(2):
+                os.makedirs(os.path.join(path, 'stale', 'round%d' % i))
+                for shard_index in [1, 2]:
+                    with open(os.path.join(path, 'stale', 'round%d' % i,
+                                           '%d.payload' % shard_index),
+                              'wb') as f:
+                        f.write(pickle.dumps(('crashed', pickle.dumps(
+                            _values(100), protocol=2)), protocol=2))
+            self.check(_run_threads(lambda i: DirectoryTransport(
+                os.path.join(path, 'stale'), i, 3, run_id='run',
+                poll=0.01), 3), 3)
+        finally:
+            shutil.rmtree(path)
+
+        sock = socket.socket()
+        sock.bind(('', 0))
+        port = sock.getsockname()[1]
+        sock.close()
+        self.check(_run_threads(lambda i: SocketTransport(
+            'localhost:%d' % port, i, 3, timeout=60), 3), 3)
+        self.check_another_run(port)
+
+    def check_another_run(self, port):
+
+        # NOTE: a shard of another run connects to the reducer
+        def _connect():
+            while True:
+                try:
+                    sock = socket.create_connection(('localhost', port))
+                    break
+                except socket.error:
+                    time.sleep(0.01)
+            _send(sock, pickle.dumps(
+                ('another', 1, 'round0', pickle.dumps(_values(1))),
+                protocol=2))
+            sock.close()
+        thread = threading.Thread(target=_connect)
+        thread.start()
+        with self.assertRaises(ValueError):
+            allreduce_sum(SocketTransport(
+                'localhost:%d' % port, 0, 2, timeout=60, run_id='run'),
+                _values(0), tag='round0')
+        thread.join()
+
+    def check(self, results, shard_num):
+
+        for i in range(2):
+            values = [_values(shard_index + i)
+                      for shard_index in range(shard_num)]
+            expected = [
+                np.sum([v[0] for v in values], axis=0),
+                np.sum([v[1] for v in values if v[1] is not None], axis=0),
+                sum(v[2] for v in values)]
+            for shard_results in results:
+                mean, ones, count, none = shard_results[i]
+                self.assertEqual(mean.dtype, np.float32)
+                self.assertTrue(np.allclose(mean, expected[0]))
+                self.assertTrue(np.allclose(ones, expected[1]))
+                self.assertEqual(count, expected[2])
+                self.assertIsNone(none)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,114 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Test for types of data through feature extraction."""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import sys
+import shutil
+import tempfile
+import unittest
+import wave
+from os.path import join
+import numpy as np
+
+sys.path.append('../../')
+from utils.inputs.dtype_policy import check_dtype, sum_frames
+from utils.inputs.dtype_policy import sum_squared_deviations
+from utils.inputs.feature_extraction import extract_feature
+from utils.inputs.segmentation import segment
+
+
+class TestDtypePolicy(unittest.TestCase):
+
+    def test(self):
+
+        self.check_statistics()
+
+        self.save_path = tempfile.mkdtemp()
+        try:
+            self.check_extraction()
+        finally:
+            shutil.rmtree(self.save_path)
+
+    def check_statistics(self):
+
+        np.random.seed(0)
+        input_utt = (np.random.randn(1000, 5) * 3 + 100).astype(np.float32)
+        mean = np.mean(input_utt.astype(np.float64), axis=0)
+
+        input_sum = sum_frames(input_utt)
+        self.assertEqual(input_sum.dtype, np.float64)
+        self.assertTrue(np.allclose(
+            input_sum, np.sum(input_utt.astype(np.float64), axis=0)))
+
+        sq_sum = sum_squared_deviations(input_utt, mean)
+        self.assertEqual(sq_sum.dtype, np.float64)
+        self.assertTrue(np.allclose(
+            sq_sum, np.sum((input_utt.astype(np.float64) - mean) ** 2,
+                           axis=0), rtol=1e-4))
+
+        self.assertTrue(check_dtype(input_utt, np.float32, 'test')
+                        is input_utt)
+        with self.assertRaises(TypeError):
+            check_dtype(input_utt.astype(np.float64), np.float32, 'test')
+
+    def check_extraction(self):
+
+        wav_path = join(self.save_path, 'utt.wav')
+        with wave.open(wav_path, 'w') as w:
+            w.setnchannels(1)
+            w.setsampwidth(2)
+            w.setframerate(16000)
+            w.writeframes(np.random.randint(
+                -1000, 1000, size=16000).astype(np.int16).tobytes())
+
+        for feature_type in ['logfbank', 'fbank', 'mfcc']:
+            config = {'feature_type': feature_type, 'channels': 40,
+                      'sampling_rate': 16000, 'window': 0.025,
+                      'slide': 0.01, 'energy': True, 'delta': True,
+                      'deltadelta': True}
+            features = {}
+            for dtype in [np.float32, np.float64]:
+                features[dtype] = extract_feature(
+                    wav_path, 'python_speech_features', config,
+                    dtype=dtype)[0]
+                self.assertEqual(features[dtype].dtype, dtype)
+            # NOTE: computed in float32 with small errors
+            scale = np.max(np.abs(features[np.float64]), axis=0)
+            self.assertTrue(np.all(
+                np.abs(features[np.float32] - features[np.float64]) <=
+                1e-4 * scale))
+
+            # Features from the store
+            store_path = join(self.save_path, 'store')
+            for _ in range(2):
+                input_utt = extract_feature(
+                    wav_path, 'python_speech_features', config,
+                    store_path=store_path)[0]
+                self.assertEqual(input_utt.dtype, np.float32)
+
+            input_data_dict, input_sum, mean, _, frame_num, _, _ = segment(
+                wav_path, 'spk', {'0': [10, 50, ''], '1': [60, 90, '']},
+                is_training=True, tool='python_speech_features',
+                config=config)
+            self.assertEqual(input_data_dict['0'].dtype, np.float32)
+            self.assertEqual(input_sum.dtype, np.float64)
+            self.assertEqual(mean.dtype, np.float32)
+            self.assertEqual(frame_num, 70)
+
+            # Statistics are not computed for evaluation sets
+            input_data_dict, input_sum, mean, _, frame_num, _, _ = segment(
+                wav_path, 'spk', {'0': [10, 50, ''], '1': [60, 90, '']},
+                is_training=False, tool='python_speech_features',
+                config=config)
+            self.assertEqual(input_data_dict['1'].shape[0], 30)
+            self.assertTrue(input_sum is None and mean is None)
+            self.assertEqual(frame_num, 70)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,141 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Test for extracting features of several utterances at once. Run with
+   `benchmark` to compare the speed with the per-utterance path.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import sys
+import shutil
+import tempfile
+import timeit
+import unittest
+import wave
+from os.path import join
+import numpy as np
+
+sys.path.append('../../')
+from utils.inputs.wav2feature_python_speech_features import wav2features
+from utils.inputs.wav2feature_python_speech_features import wav2features_batch
+from utils.inputs.feature_extraction import FeatureExtractor
+
+CONFIG = {'feature_type': 'fbank', 'channels': 40, 'sampling_rate': 16000,
+          'window': 0.025, 'slide': 0.01, 'energy': True, 'delta': True,
+          'deltadelta': True}
+CONFIGS = [CONFIG,
+           dict(CONFIG, channels=80, energy=False, delta=False,
+                deltadelta=False),
+           dict(CONFIG, feature_type='mfcc', channels=13)]
+
+
+def _make_wav_files(save_path, utt_num, min_duration, max_duration,
+                    sampling_rates=(16000,)):
+    np.random.seed(0)
+    wav_paths = []
+    for i in range(utt_num):
+        fs = sampling_rates[i % len(sampling_rates)]
+        wav_path = join(save_path, 'utt%d.wav' % i)
+        with wave.open(wav_path, 'w') as w:
+            w.setnchannels(1)
+            w.setsampwidth(2)
+            w.setframerate(fs)
+            w.writeframes((np.random.randn(int(fs * np.random.uniform(
+                min_duration, max_duration))) * 1000).astype(
+                    np.int16).tobytes())
+        wav_paths.append(wav_path)
+    return wav_paths
+
+
+class TestFeatureBatch(unittest.TestCase):
+
+    def test(self):
+
+        self.save_path = tempfile.mkdtemp()
+        try:
+            self.check(utt_num=7, sampling_rates=(16000,))
+            # Files with another sampling rate in the same batch
+            self.check(utt_num=5, sampling_rates=(16000, 8000))
+            self.check_extractor()
+        finally:
+            shutil.rmtree(self.save_path)
+
+    def check(self, utt_num, sampling_rates):
+
+        wav_paths = _make_wav_files(self.save_path, utt_num, 0.01, 1.,
+                                    sampling_rates)
+        for dtype in [np.float32, np.float64]:
+            feats_list = wav2features_batch(wav_paths, CONFIGS, dtype=dtype)
+            self.assertEqual(len(feats_list), utt_num)
+            for wav_path, feats in zip(wav_paths, feats_list):
+                # NOTE: the same as features of each file except rounding
+                # errors of FFT and matrix products over another number of
+                # frames
+                rtol = 1e-5 if dtype == np.float32 else 1e-12
+                for feat, expected in zip(
+                        feats, wav2features(wav_path, CONFIGS, dtype=dtype)):
+                    self.assertEqual(feat.dtype, dtype)
+                    self.assertEqual(feat.shape, expected.shape)
+                    self.assertTrue(np.allclose(
+                        feat, expected, rtol=rtol,
+                        atol=rtol * np.max(np.abs(expected))))
+                    self.assertTrue(feat.flags['OWNDATA'] or
+                                    feat.base.shape == feat.shape)
+
+    def check_extractor(self):
+
+        wav_paths = _make_wav_files(self.save_path, 4, 0.1, 0.5)
+        extractor = FeatureExtractor('python_speech_features', CONFIG)
+        results = extractor.extract_batch(wav_paths)
+        for wav_path, (input_utt, sampPeriod, parmKind) in zip(wav_paths,
+                                                               results):
+            self.assertEqual((sampPeriod, parmKind), (None, None))
+            expected = extractor(wav_path)[0]
+            self.assertTrue(np.allclose(
+                input_utt, expected, rtol=1e-5,
+                atol=1e-5 * np.max(np.abs(expected))))
+
+
+def benchmark(batch_sizes=(1, 4, 8, 16, 32, 64), repeat=9):
+    """Compare the time to extract features of 128 utterances per
+       utterance and per batch. Utterances are as short as in LibriSpeech
+       (0.3-1s) or as long as in TIMIT (1.5-4.5s).
+    """
+    for min_duration, max_duration in [(0.3, 1.), (1.5, 4.5)]:
+        save_path = tempfile.mkdtemp()
+        try:
+            wav_paths = _make_wav_files(save_path, 128, min_duration,
+                                        max_duration)
+            elapsed = dict((batch_size, []) for batch_size in batch_sizes)
+            for _ in range(repeat):
+                # NOTE: batch sizes are measured in turn against noise
+                for batch_size in batch_sizes:
+                    start = timeit.default_timer()
+                    if batch_size == 1:
+                        for wav_path in wav_paths:
+                            wav2features(wav_path, [CONFIG])
+                    else:
+                        for i in range(0, len(wav_paths), batch_size):
+                            wav2features_batch(
+                                wav_paths[i:i + batch_size], [CONFIG])
+                    elapsed[batch_size].append(
+                        timeit.default_timer() - start)
+        finally:
+            shutil.rmtree(save_path)
+
+        print('%.1f-%.1fs utterances' % (min_duration, max_duration))
+        per_utterance = np.median(elapsed[1])
+        for batch_size in batch_sizes:
+            print('  batch_size %d: %.3f sec (x%.2f)' % (
+                batch_size, np.median(elapsed[batch_size]),
+                per_utterance / np.median(elapsed[batch_size])))
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1 and sys.argv[1] == 'benchmark':
+        benchmark()
+    else:
+        unittest.main()
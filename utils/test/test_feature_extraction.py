@@ -0,0 +1,169 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Test for extracting several kinds of features at once."""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import sys
+import shutil
+import tempfile
+import unittest
+import wave
+from os.path import join
+import numpy as np
+from python_speech_features import mfcc, fbank, delta
+import librosa
+
+sys.path.append('../../')
+from utils.inputs.wav2feature_python_speech_features import wav2features
+from utils.inputs.wav2feature_librosa import wav2features as w2f_librosa
+from utils.inputs.wav2feature_librosa import get_mel_basis
+from utils.inputs.feature_extraction import extract_feature
+from utils.inputs.feature_extraction import fill_feature_store
+from utils.inputs.feature_extraction import parse_feature_specs
+from utils.inputs.feature_extraction import FeatureExtractor
+from utils.inputs.feature_store import FeatureStore, make_spill_path
+
+CONFIG = {'feature_type': 'fbank', 'channels': 40, 'sampling_rate': 16000,
+          'window': 0.025, 'slide': 0.01, 'energy': True, 'delta': True,
+          'deltadelta': True}
+
+
+class TestFeatureExtraction(unittest.TestCase):
+
+    def test(self):
+
+        self.save_path = tempfile.mkdtemp()
+        try:
+            np.random.seed(0)
+            self.wav_paths = []
+            for i in range(3):
+                wav_path = join(self.save_path, 'utt%d.wav' % i)
+                with wave.open(wav_path, 'w') as w:
+                    w.setnchannels(1)
+                    w.setsampwidth(2)
+                    w.setframerate(16000)
+                    w.writeframes(np.random.randint(
+                        -1000, 1000, size=8000 * (i + 1)).astype(
+                            np.int16).tobytes())
+                self.wav_paths.append(wav_path)
+
+            self.configs = [CONFIG] + parse_feature_specs(
+                'fbank:80,mfcc:13', CONFIG)
+            self.check_specs()
+            self.check_python_speech_features()
+            self.check_librosa()
+            self.check_store()
+            self.check_spill()
+        finally:
+            shutil.rmtree(self.save_path)
+
+    def check_specs(self):
+
+        self.assertEqual([(c['feature_type'], c['channels'])
+                          for c in self.configs],
+                         [('fbank', 40), ('fbank', 80), ('mfcc', 13)])
+        self.assertEqual(self.configs[1]['window'], CONFIG['window'])
+        self.assertEqual(parse_feature_specs('', CONFIG), [])
+        for specs in ['fbank', 'fbank:x', 'logfbank:40']:
+            with self.assertRaises(ValueError):
+                parse_feature_specs(specs, CONFIG)
+
+    def check_python_speech_features(self):
+
+        wav_path = self.wav_paths[0]
+        feats = wav2features(wav_path, self.configs, dtype=np.float64)
+        signal = np.frombuffer(wave.open(wav_path).readframes(8000),
+                               dtype=np.int16)
+        for config, feat in zip(self.configs, feats):
+            # Same as python_speech_features
+            if config['feature_type'] == 'mfcc':
+                expected = np.concatenate(
+                    (mfcc(signal, numcep=config['channels']),
+                     fbank(signal)[1].reshape(-1, 1)), axis=1)
+            else:
+                feat_fbank, energy = fbank(signal, nfilt=config['channels'],
+                                           winfunc=np.hamming)
+                expected = np.concatenate(
+                    (feat_fbank, energy.reshape(-1, 1)), axis=1)
+            delta1 = delta(expected, 2)
+            expected = np.concatenate(
+                (expected, delta1, delta(delta1, 2)), axis=1)
+            self.assertTrue(np.allclose(feat, expected, rtol=1e-10,
+                                        atol=1e-10))
+
+        # One kind at a time
+        for config, feat in zip(self.configs,
+                                wav2features(wav_path, self.configs)):
+            self.assertEqual(feat.dtype, np.float32)
+            self.assertTrue(np.array_equal(
+                feat, wav2features(wav_path, [config])[0]))
+
+    def check_librosa(self):
+
+        # NOTE: 8000 samples at 16kHz
+        wav_path = self.wav_paths[0]
+        y, sr = librosa.load(wav_path, sr=None)
+        self.assertEqual(sr, 16000)
+        configs = self.configs + [dict(CONFIG, window=0.032, slide=0.02)]
+        feats = w2f_librosa(wav_path, configs)
+        for config, feat in zip(configs, feats):
+            # Frames of the window & slide at the native sampling rate
+            hop_length = int(config['slide'] * 16000)
+            self.assertEqual(feat.shape[0], 1 + 8000 // hop_length)
+            self.assertEqual(feat.dtype, np.float32)
+            self.assertTrue(np.all(np.isfinite(feat)))
+            self.assertTrue(np.array_equal(
+                feat, w2f_librosa(wav_path, [config])[0]))
+
+        # Energy over the same frames
+        magnitude = np.abs(librosa.stft(y, n_fft=512, hop_length=160,
+                                        win_length=400))
+        self.assertTrue(np.allclose(
+            feats[0][:, 40], librosa.feature.rms(S=magnitude,
+                                                 frame_length=512)[0],
+            rtol=1e-5))
+        # The mel basis is built once
+        self.assertTrue(get_mel_basis(16000, 512, 40) is
+                        get_mel_basis(16000, 512, 40))
+
+    def check_store(self):
+
+        store_path = join(self.save_path, 'raw')
+        fill_feature_store(self.wav_paths, 'python_speech_features',
+                           self.configs, store_path)
+        for config in self.configs:
+            store = FeatureStore(store_path, 'python_speech_features', config)
+            for wav_path in self.wav_paths:
+                self.assertTrue(store.contains(wav_path))
+                self.assertTrue(np.array_equal(
+                    store.load(wav_path),
+                    extract_feature(wav_path, 'python_speech_features',
+                                    config)[0]))
+
+    def check_spill(self):
+
+        spill_path = make_spill_path(self.save_path)
+        self.assertTrue(spill_path.startswith(self.save_path))
+        store = FeatureStore(spill_path, 'python_speech_features', CONFIG)
+
+        # Features are loaded but not saved
+        extractor = FeatureExtractor('python_speech_features', CONFIG,
+                                     spill_path, update_store=False)
+        input_utt = extractor(self.wav_paths[0])[0]
+        self.assertFalse(store.contains(self.wav_paths[0]))
+
+        extractor = FeatureExtractor('python_speech_features', CONFIG,
+                                     spill_path)
+        self.assertTrue(np.array_equal(
+            extractor.extract_batch(self.wav_paths[:1])[0][0], input_utt))
+        self.assertTrue(store.contains(self.wav_paths[0]))
+        self.assertTrue(np.array_equal(store.load(self.wav_paths[0]),
+                                       input_utt))
+
+
+if __name__ == '__main__':
+    unittest.main()
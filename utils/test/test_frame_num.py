@@ -0,0 +1,114 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Test for counting frames from headers of audio files."""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import sys
+import shutil
+import tempfile
+import unittest
+import wave
+from os.path import join
+import numpy as np
+
+sys.path.append('../../')
+from utils.inputs.frame_num import read_frame_num, read_sample_num
+from utils.inputs.frame_num import count_utterance_frames
+from utils.inputs.feature_extraction import extract_feature
+from utils.inputs.segmentation import segment
+from utils.inputs.htk import write as write_htk
+
+
+class TestFrameNum(unittest.TestCase):
+
+    def test(self):
+
+        self.save_path = tempfile.mkdtemp()
+        try:
+            self.check_wav()
+            self.check_sphere()
+            self.check_htk()
+            self.check_utterances()
+        finally:
+            shutil.rmtree(self.save_path)
+
+    def _write_wav(self, sample_num, sampling_rate):
+        wav_path = join(self.save_path, '%d_%d.wav' %
+                        (sample_num, sampling_rate))
+        with wave.open(wav_path, 'w') as w:
+            w.setnchannels(1)
+            w.setsampwidth(2)
+            w.setframerate(sampling_rate)
+            w.writeframes(np.random.randint(
+                -1000, 1000, size=sample_num).astype(np.int16).tobytes())
+        return wav_path
+
+    def check_wav(self):
+
+        np.random.seed(0)
+        for sampling_rate in [16000, 8000]:
+            # NOTE: include files shorter than a window
+            for sample_num in [100, 400, 401, 4000, 16161, 24000]:
+                wav_path = self._write_wav(sample_num, sampling_rate)
+                self.assertEqual(read_sample_num(wav_path),
+                                 (sample_num, sampling_rate))
+
+                for tool, feature_type, window, slide in [
+                        ('python_speech_features', 'logfbank', 0.025, 0.01),
+                        ('python_speech_features', 'fbank', 0.032, 0.015),
+                        ('python_speech_features', 'mfcc', 0.025, 0.01),
+                        ('librosa', 'logfbank', 0.025, 0.01),
+                        ('librosa', 'mfcc', 0.032, 0.015)]:
+                    config = {'feature_type': feature_type, 'channels': 40,
+                              'sampling_rate': sampling_rate,
+                              'window': window, 'slide': slide,
+                              'energy': False, 'delta': True,
+                              'deltadelta': False}
+                    input_utt, _, _ = extract_feature(wav_path, tool, config)
+                    self.assertEqual(
+                        read_frame_num(wav_path, tool, config),
+                        input_utt.shape[0])
+
+    def check_sphere(self):
+
+        sphere_path = join(self.save_path, 'sw0001.sph')
+        header = ('NIST_1A\n   1024\nsample_count -i 8000\n'
+                  'sample_rate -i 8000\nchannel_count -i 2\n'
+                  'sample_n_bytes -i 2\nend_head\n')
+        with open(sphere_path, 'wb') as f:
+            f.write(header.ljust(1024).encode('ascii'))
+            f.write(np.zeros(8000 * 2, dtype=np.int16).tobytes())
+        self.assertEqual(read_sample_num(sphere_path), (8000, 8000))
+        self.assertEqual(read_frame_num(
+            sphere_path, 'python_speech_features',
+            {'feature_type': 'fbank', 'window': 0.025, 'slide': 0.01}), 99)
+
+    def check_htk(self):
+
+        htk_path = join(self.save_path, 'a.htk')
+        write_htk(np.zeros((123, 40), dtype=np.float32), htk_path,
+                  sampPeriod=100000, parmKind=838)
+        self.assertEqual(read_frame_num(htk_path, 'htk', None), 123)
+
+    def check_utterances(self):
+
+        utterance_dict = {'0001': [15, 30, 'a'], '0002': [60, 66, 'b'],
+                          '0003': [70, 72, 'c'], '0004': [76, 98, 'd']}
+        htk_path = join(self.save_path, 'speaker.htk')
+        write_htk(np.zeros((100, 3), dtype=np.float32), htk_path,
+                  sampPeriod=100000, parmKind=838)
+        for sil_duration in [0, 10]:
+            input_data_dict = segment(
+                htk_path, 'speaker', utterance_dict, is_training=True,
+                sil_duration=sil_duration)[0]
+            self.assertEqual(
+                count_utterance_frames(100, utterance_dict, sil_duration),
+                {k: v.shape[0] for k, v in input_data_dict.items()})
+
+
+if __name__ == '__main__':
+    unittest.main()
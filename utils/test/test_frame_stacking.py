@@ -0,0 +1,66 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Test for stacking and skipping frames."""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import sys
+import unittest
+import numpy as np
+
+sys.path.append('../../')
+from utils.inputs.frame_stacking import stack_frame, stacked_frame_num
+
+
+def _stack_frame_naive(input_utt, stack_frames, skip_frames):
+    frame_num, feature_dim = input_utt.shape
+    stacked = []
+    for t in range(0, frame_num, skip_frames):
+        frame = np.zeros((stack_frames, feature_dim), dtype=input_utt.dtype)
+        frames = input_utt[t:t + stack_frames]
+        frame[:len(frames)] = frames
+        stacked.append(frame.reshape(-1))
+    return np.array(stacked)
+
+
+class TestFrameStacking(unittest.TestCase):
+
+    def test(self):
+
+        self.check(frame_num=100, stack_frames=3, skip_frames=3)
+        self.check(frame_num=101, stack_frames=4, skip_frames=3)
+        self.check(frame_num=57, stack_frames=8, skip_frames=3)
+        # Frames are skipped without stacking
+        self.check(frame_num=50, stack_frames=1, skip_frames=3)
+        self.check(frame_num=50, stack_frames=2, skip_frames=5)
+        # Shorter than stack_frames
+        self.check(frame_num=2, stack_frames=4, skip_frames=2)
+        self.check(frame_num=1, stack_frames=3, skip_frames=3)
+
+        input_utt = np.random.randn(10, 3).astype(np.float32)
+        self.assertTrue(stack_frame(input_utt, 1, 1) is input_utt)
+        with self.assertRaises(ValueError):
+            stack_frame(input_utt, 0, 1)
+
+    def check(self, frame_num, stack_frames, skip_frames):
+
+        input_utt = np.random.randn(frame_num, 5).astype(np.float32)
+        stacked = stack_frame(input_utt, stack_frames, skip_frames)
+        expected = _stack_frame_naive(input_utt, stack_frames, skip_frames)
+
+        self.assertEqual(stacked.dtype, np.float32)
+        self.assertEqual(stacked.shape, expected.shape)
+        self.assertEqual(stacked.shape[0],
+                         stacked_frame_num(frame_num, skip_frames))
+        self.assertTrue(np.array_equal(stacked, expected))
+        # NOTE: not a view of the input
+        stacked[:] = 0
+        self.assertTrue(np.array_equal(
+            input_utt, _stack_frame_naive(input_utt, 1, 1)))
+
+
+if __name__ == '__main__':
+    unittest.main()
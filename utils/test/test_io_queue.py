@@ -0,0 +1,77 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Test for read-ahead and write-behind queues."""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import sys
+import shutil
+import tempfile
+import unittest
+from os.path import join
+import numpy as np
+
+sys.path.append('../../')
+from utils.io_queue import prefetch, AsyncWriter
+
+
+def _read(x):
+    if x == 7:
+        raise IOError('broken file')
+    return x * 2
+
+
+class TestIOQueue(unittest.TestCase):
+
+    def test(self):
+
+        self.check_prefetch(buffer_size=0)
+        self.check_prefetch(buffer_size=3)
+        self.check_writer(num_threads=0)
+        self.check_writer(num_threads=2)
+
+    def check_prefetch(self, buffer_size):
+
+        self.assertEqual(list(prefetch(_read, range(5), buffer_size)),
+                         [0, 2, 4, 6, 8])
+
+        # Errors are raised in the caller in the order of items
+        results = []
+        with self.assertRaises(IOError):
+            for result in prefetch(_read, range(10), buffer_size):
+                results.append(result)
+        self.assertEqual(results, [x * 2 for x in range(7)])
+
+        # Stop consuming in the middle
+        for result in prefetch(_read, range(100), buffer_size):
+            break
+
+    def check_writer(self, num_threads):
+
+        save_path = tempfile.mkdtemp()
+        try:
+            buffer = np.memmap(join(save_path, 'buffer'), dtype=np.float32,
+                               mode='w+', shape=(4, 3))
+            with AsyncWriter(num_threads=num_threads, max_pending=2) as writer:
+                for i in range(10):
+                    buffer[...] = i
+                    writer.submit(np.save, join(save_path, '%d.npy' % i),
+                                  buffer)
+            for i in range(10):
+                data = np.load(join(save_path, '%d.npy' % i))
+                self.assertTrue(np.all(data == i))
+
+            writer = AsyncWriter(num_threads=num_threads)
+            with self.assertRaises(IOError):
+                writer.submit(np.save, join(save_path, 'no_dir', '0.npy'),
+                              np.zeros((2, 2)))
+                writer.close()
+        finally:
+            shutil.rmtree(save_path)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,95 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Test for the ledger of saved utterances."""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import sys
+import shutil
+import tempfile
+import unittest
+from os.path import join
+import numpy as np
+
+sys.path.append('../../')
+from utils.inputs.ledger import Ledger, make_config_hash
+from utils.inputs.ledger import make_feature_hash, FEATURE_VERSIONS
+from utils.inputs.htk import read
+
+
+class TestLedger(unittest.TestCase):
+
+    def test(self):
+
+        self.check(save_format='numpy')
+        self.check(save_format='htk')
+        self.check_version()
+
+    def check_version(self):
+
+        config = {'channels': 40}
+        config_hash = make_feature_hash('librosa', config, 'global')
+        self.assertEqual(config_hash, make_feature_hash(
+            'librosa', config, 'global'))
+        self.assertNotEqual(config_hash, make_config_hash(
+            'librosa', config, 'global'))
+
+        # Features of an older version are not reused
+        version = FEATURE_VERSIONS['librosa']
+        try:
+            FEATURE_VERSIONS['librosa'] = version + 1
+            self.assertNotEqual(config_hash, make_feature_hash(
+                'librosa', config, 'global'))
+        finally:
+            FEATURE_VERSIONS['librosa'] = version
+
+    def check(self, save_format):
+
+        print('==================================================')
+        print('  save_format: %s' % save_format)
+        print('==================================================')
+
+        save_path = tempfile.mkdtemp()
+        try:
+            config_hash = make_config_hash('htk', {'channels': 40}, 'global')
+            ledger = Ledger(save_path, save_format, config_hash)
+            for i in range(3):
+                ledger.save('utt%d' % i, join(save_path, 'utt%d' % i),
+                            np.full((i + 1, 4), i, dtype=np.float32),
+                            sampPeriod=100000, parmKind=9)
+            if save_format == 'numpy':
+                self.assertTrue(np.all(np.load(join(save_path, 'utt2')) == 2))
+            else:
+                self.assertTrue(np.all(read(join(save_path, 'utt2'))[0] == 2))
+
+            # Broken last line and file
+            with open(join(save_path, 'ledger.tsv'), 'a') as f:
+                f.write('utt3\t')
+            with open(join(save_path, 'utt1'), 'r+b') as f:
+                f.truncate(10)
+
+            ledger = Ledger(save_path, save_format, config_hash)
+            self.assertTrue(ledger.is_done('utt0'))
+            self.assertFalse(ledger.is_done('utt1'))
+            self.assertEqual(ledger.frame_num_dict(), {'utt0': 1, 'utt2': 3})
+            ledger.save('utt1', join(save_path, 'utt1'),
+                        np.ones((2, 4), dtype=np.float32),
+                        sampPeriod=100000, parmKind=9)
+
+            ledger = Ledger(save_path, save_format, config_hash)
+            self.assertEqual(ledger.frame_num_dict(),
+                             {'utt0': 1, 'utt1': 2, 'utt2': 3})
+
+            # Records with another config are ignored
+            config_hash = make_config_hash('htk', {'channels': 80}, 'global')
+            ledger = Ledger(save_path, save_format, config_hash)
+            self.assertEqual(ledger.frame_num_dict(), {})
+        finally:
+            shutil.rmtree(save_path)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,141 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Test for the length-bucketed batch loader."""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import sys
+import shutil
+import tempfile
+import unittest
+from os.path import join
+import numpy as np
+import pandas as pd
+
+sys.path.append('../../')
+from utils.loader import BucketSampler, BatchLoader
+
+
+class TestLoader(unittest.TestCase):
+
+    def test(self):
+
+        self.check_sampler()
+        self.check_loader(num_threads=1, buffer_size=0)
+        self.check_loader(num_threads=3, buffer_size=2)
+        self.check_text_transcript()
+
+    def check_sampler(self):
+
+        np.random.seed(0)
+        frame_nums = np.random.randint(10, 300, size=200)
+        frame_nums[5] = 1000
+        for shuffle in [False, True]:
+            sampler = BucketSampler(frame_nums, max_frames=1200,
+                                    bucket_width=20, max_batch_size=16,
+                                    shuffle=shuffle, seed=1)
+            batches = sampler.batches(epoch=0)
+            self.assertEqual(sorted(np.concatenate(batches).tolist()),
+                             list(range(200)))
+            for indices in batches:
+                self.assertTrue(len(indices) <= 16)
+                self.assertTrue(
+                    len(indices) * frame_nums[indices].max() <= 1200 or
+                    len(indices) == 1)
+            if shuffle:
+                self.assertNotEqual(
+                    [b.tolist() for b in batches],
+                    [b.tolist() for b in sampler.batches(epoch=1)])
+
+        # An utterance longer than max_frames
+        self.assertEqual(
+            [b.tolist() for b in BucketSampler(
+                [30, 500, 40], max_frames=100).batches()],
+            [[0, 2], [1]])
+
+    def check_loader(self, num_threads, buffer_size):
+
+        save_path = tempfile.mkdtemp()
+        try:
+            np.random.seed(0)
+            rows = []
+            inputs = {}
+            for i in range(30):
+                input_path = join(save_path, 'utt%d.npy' % i)
+                inputs[input_path] = np.random.randn(
+                    np.random.randint(5, 80), 4).astype(np.float32)
+                np.save(input_path, inputs[input_path])
+                rows.append([inputs[input_path].shape[0], input_path,
+                             '%d %d 3' % (i, i + 1)])
+            pd.DataFrame(rows, columns=['frame_num', 'input_path',
+                                        'transcript']).to_csv(
+                join(save_path, 'character.csv'))
+
+            loader = BatchLoader(
+                join(save_path, 'character.csv'), max_frames=200,
+                bucket_width=10, shuffle=True, num_threads=num_threads,
+                buffer_size=buffer_size)
+            for epoch in range(2):
+                seen = []
+                buffers = set()
+                for batch_inputs, frame_nums, labels in loader:
+                    self.assertTrue(batch_inputs.shape[0] *
+                                    batch_inputs.shape[1] <= 200)
+                    self.assertEqual(batch_inputs.shape[1], frame_nums.max())
+                    buffers.add(id(batch_inputs.base.base))
+                    for x, frame_num, label in zip(
+                            batch_inputs, frame_nums, labels):
+                        i = int(label[0])
+                        input_utt = inputs[join(save_path, 'utt%d.npy' % i)]
+                        self.assertTrue(np.array_equal(x[:frame_num],
+                                                       input_utt))
+                        self.assertTrue(np.all(x[frame_num:] == 0))
+                        self.assertEqual(label.tolist(), [i, i + 1, 3])
+                        seen.append(i)
+                self.assertEqual(sorted(seen), list(range(30)))
+                # NOTE: buffers are reused over mini-batches
+                self.assertTrue(len(buffers) <= buffer_size + 2)
+
+            # Stop in the middle
+            for batch in loader:
+                break
+        finally:
+            shutil.rmtree(save_path)
+
+    def check_text_transcript(self):
+
+        save_path = tempfile.mkdtemp()
+        try:
+            rows = []
+            for i, transcript in enumerate(
+                    ['she had your', 'dark suit', '']):
+                input_path = join(save_path, 'utt%d.npy' % i)
+                np.save(input_path, np.zeros((10 + i, 4), dtype=np.float32))
+                rows.append([10 + i, input_path, transcript])
+            pd.DataFrame(rows, columns=['frame_num', 'input_path',
+                                        'transcript']).to_csv(
+                join(save_path, 'character.csv'))
+
+            # Transcripts of the test set are saved as they are
+            loader = BatchLoader(join(save_path, 'character.csv'),
+                                 max_frames=100)
+            labels = [label for _, _, batch_labels in loader
+                      for label in batch_labels]
+            self.assertEqual(labels, [['she', 'had', 'your'],
+                                      ['dark', 'suit'], []])
+
+            # Decode labels by the caller
+            loader = BatchLoader(join(save_path, 'character.csv'),
+                                 max_frames=100,
+                                 label_func=lambda t: t.replace(' ', '_'))
+            self.assertEqual(loader.labels,
+                             ['she_had_your', 'dark_suit', ''])
+        finally:
+            shutil.rmtree(save_path)
+
+
+if __name__ == '__main__':
+    unittest.main()
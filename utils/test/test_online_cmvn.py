@@ -0,0 +1,78 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Test for causal sliding-window mean & variance normalization."""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import sys
+import unittest
+import numpy as np
+
+sys.path.append('../../')
+from utils.inputs.online_cmvn import OnlineCMVN, online_cmvn
+
+
+class TestOnlineCMVN(unittest.TestCase):
+
+    def test(self):
+
+        np.random.seed(0)
+        input_utt = np.random.randn(100, 4).astype(np.float32) * 10 + 500
+        prior_mean = np.full(4, 500.)
+        prior_std = np.full(4, 10.)
+
+        self.check_naive(input_utt, window=20)
+        self.check_naive(input_utt, window=20, prior_mean=prior_mean,
+                         prior_std=prior_std, prior_frames=5)
+        self.check_naive(input_utt, window=1000, prior_mean=prior_mean,
+                         prior_std=prior_std, prior_frames=200)
+
+        # Chunk by chunk
+        output_utt = online_cmvn(input_utt, window=30, prior_mean=prior_mean,
+                                 prior_std=prior_std)
+        cmvn = OnlineCMVN(window=30, prior_mean=prior_mean,
+                          prior_std=prior_std)
+        output_chunks = [cmvn(input_utt[i:i + 7]) for i in range(0, 100, 7)]
+        self.assertTrue(np.allclose(np.concatenate(output_chunks, axis=0),
+                                    output_utt, atol=1e-5))
+        self.assertEqual(output_utt.dtype, np.float32)
+
+        # A new utterance
+        cmvn.reset()
+        self.assertTrue(np.allclose(cmvn(input_utt), output_utt, atol=1e-5))
+
+        with self.assertRaises(ValueError):
+            OnlineCMVN(window=0)
+        with self.assertRaises(ValueError):
+            OnlineCMVN(prior_mean=prior_mean)
+
+    def check_naive(self, input_utt, window, prior_mean=None, prior_std=None,
+                    prior_frames=200):
+
+        output_utt = online_cmvn(input_utt, window=window,
+                                 prior_mean=prior_mean, prior_std=prior_std,
+                                 prior_frames=prior_frames)
+        x = input_utt.astype(np.float64)
+        for t in range(x.shape[0]):
+            frames = x[max(t + 1 - window, 0):t + 1]
+            count = frames.shape[0]
+            frame_sum = np.sum(frames, axis=0)
+            frame_sum_sq = np.sum(frames ** 2, axis=0)
+            if prior_mean is not None:
+                prior_count = max(min(window - count, prior_frames), 0)
+                frame_sum += prior_count * prior_mean
+                frame_sum_sq += prior_count * (prior_std ** 2 +
+                                               prior_mean ** 2)
+                count += prior_count
+            mean = frame_sum / count
+            var = np.maximum(frame_sum_sq / count - mean ** 2, 1e-10)
+            self.assertTrue(np.allclose(output_utt[t],
+                                        (x[t] - mean) / np.sqrt(var),
+                                        atol=1e-3))
+
+
+if __name__ == '__main__':
+    unittest.main()
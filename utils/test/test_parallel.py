@@ -0,0 +1,105 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Test for the process-pool executor."""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import sys
+import unittest
+import numpy as np
+
+sys.path.append('../../')
+from utils.parallel import ParallelExecutor, get_worker_state
+
+
+def _init():
+    get_worker_state('scale', lambda: 10)
+
+
+def _func(x):
+    if x == 3:
+        raise ValueError('broken file')
+    return x * get_worker_state('scale', lambda: 10)
+
+
+def _func_batch(xs):
+    return [_func(x) for x in xs]
+
+
+def _make_features(x):
+    return {'utt': np.full((x + 1, 4), x, dtype=np.float32)}, x
+
+
+class TestParallel(unittest.TestCase):
+
+    def test(self):
+
+        self.check(num_workers=1)
+        self.check(num_workers=3)
+        self.check_backpressure(num_workers=1)
+        self.check_backpressure(num_workers=3)
+        self.check_shared_memory(slot_bytes=1 << 10)
+        self.check_shared_memory(slot_bytes=64)
+        # NOTE: large results do not fit in a slot and are pickled
+        self.check_batched(num_workers=1)
+        self.check_batched(num_workers=3)
+
+    def check_batched(self, num_workers):
+
+        executor = ParallelExecutor(num_workers=num_workers,
+                                    initializer=_init)
+        for batch_size in [1, 4, 30]:
+            results = sorted(executor.imap_batched(
+                _func, _func_batch, range(20), batch_size, progress=False))
+            self.assertEqual(results,
+                             [(x, x * 10) for x in range(20) if x != 3])
+            # NOTE: only the file which fails in a batch is quarantined
+            self.assertEqual([x for x, _ in executor.failures], [3])
+
+    def check_backpressure(self, num_workers):
+
+        executor = ParallelExecutor(num_workers=num_workers, max_pending=2,
+                                    slot_bytes=1 << 10)
+        results = sorted(executor.imap(_func, range(20), progress=False))
+        self.assertEqual(results, [(x, x * 10) for x in range(20) if x != 3])
+
+        # Stop consuming in the middle
+        for x, result in executor.imap(_func, range(20), progress=False):
+            break
+
+    def check_shared_memory(self, slot_bytes):
+
+        executor = ParallelExecutor(num_workers=2, slot_bytes=slot_bytes)
+        for x, (feat_dict, x_result) in executor.imap(
+                _make_features, range(10), progress=False):
+            self.assertEqual(x, x_result)
+            self.assertEqual(feat_dict['utt'].shape, (x + 1, 4))
+            self.assertEqual(feat_dict['utt'].dtype, np.float32)
+            self.assertTrue(np.all(feat_dict['utt'] == x))
+
+    def check(self, num_workers):
+
+        print('==================================================')
+        print('  num_workers: %d' % num_workers)
+        print('==================================================')
+
+        executor = ParallelExecutor(num_workers=num_workers,
+                                    initializer=_init)
+        results = executor.map(_func, range(20), progress=False)
+        self.assertEqual(results[3], None)
+        self.assertEqual(results[:3] + results[4:],
+                         [x * 10 for x in range(20) if x != 3])
+
+        # The same file failed again is reported only once
+        results = sorted(executor.imap(_func, range(5), progress=False))
+        self.assertEqual(results, [(0, 0), (1, 10), (2, 20), (4, 40)])
+        self.assertEqual(len(executor.failures), 1)
+        self.assertEqual(executor.failures[0][0], 3)
+        executor.report()
+
+
+if __name__ == '__main__':
+    unittest.main()
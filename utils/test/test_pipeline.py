@@ -0,0 +1,109 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Test for the pipeline runner."""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+from os.path import join
+
+sys.path.append('../../')
+from utils.pipeline import Pipeline
+
+
+class TestPipeline(unittest.TestCase):
+
+    def test(self):
+
+        cache_path = tempfile.mkdtemp()
+        try:
+            calls = []
+            source = {'a': 1, 'b': 2}
+
+            def build(config):
+                pipeline = Pipeline(cache_path)
+                pipeline.add('scan', lambda: dict(source), always=True)
+                pipeline.add('label',
+                             lambda x: calls.append('label') or sorted(x),
+                             inputs=['scan'])
+                pipeline.add('input',
+                             lambda x: calls.append('input') or len(x),
+                             inputs=['scan'], config=config)
+                pipeline.add('dataset',
+                             lambda x, y: calls.append('dataset') or (x, y),
+                             inputs=['label', 'input'])
+                return pipeline
+
+            build({'normalize': 'global'}).run()
+            self.assertEqual(calls, ['label', 'input', 'dataset'])
+
+            # Nothing changed
+            del calls[:]
+            pipeline = build({'normalize': 'global'})
+            pipeline.run()
+            self.assertEqual(calls, [])
+            self.assertEqual(pipeline.results['dataset'], (['a', 'b'], 2))
+
+            # The result of input is the same, so dataset is not rerun
+            del calls[:]
+            build({'normalize': 'speaker'}).run()
+            self.assertEqual(calls, ['input'])
+
+            # The source changed
+            del calls[:]
+            source['c'] = 3
+            self.assertEqual(
+                build({'normalize': 'speaker'}).run('dataset'),
+                (['a', 'b', 'c'], 3))
+            self.assertEqual(calls, ['label', 'input', 'dataset'])
+
+            with self.assertRaises(ValueError):
+                Pipeline(cache_path).add('label', len, inputs=['scan'])
+
+            self.check_outputs(cache_path)
+        finally:
+            shutil.rmtree(cache_path)
+
+    def check_outputs(self, cache_path):
+
+        calls = []
+        csv_path = join(cache_path, 'dataset.csv')
+
+        def make_csv(config):
+            calls.append('csv')
+            with open(csv_path, 'w') as f:
+                f.write(config['normalize'])
+            return csv_path
+
+        def build():
+            pipeline = Pipeline(cache_path)
+            pipeline.add('config', lambda: {'normalize': 'global'})
+            pipeline.add('csv', make_csv, inputs=['config'],
+                         outputs=[csv_path])
+            return pipeline
+
+        build().run()
+        self.assertEqual(calls, ['csv'])
+
+        # Outputs exist
+        del calls[:]
+        build().run()
+        self.assertEqual(calls, [])
+
+        # An output was deleted
+        os.remove(csv_path)
+        build().run()
+        self.assertEqual(calls, ['csv'])
+        with open(csv_path) as f:
+            self.assertEqual(f.read(), 'global')
+
+
+if __name__ == '__main__':
+    unittest.main()
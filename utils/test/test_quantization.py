@@ -0,0 +1,162 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Test for saving features with reduced precision."""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import sys
+import shutil
+import tempfile
+import unittest
+from os.path import join
+import numpy as np
+
+sys.path.append('../../')
+from utils.inputs.quantization import Quantizer, standard_quantizer
+from utils.inputs.quantization import save_quantizer, QUANTIZATION_NAME
+from utils.inputs.ledger import Ledger
+from utils.inputs.htk import read, read_header
+from utils.loader import read_input
+from utils.util import mkdir_join
+
+
+class TestQuantization(unittest.TestCase):
+
+    def test(self):
+
+        np.random.seed(0)
+        input_utt = np.random.randn(200, 6).astype(np.float32)
+        input_utt[0, 0] = 10.
+
+        self.check_quantizer(input_utt)
+        self.check_statistics()
+        for save_format, precision in [('numpy', 'float16'),
+                                       ('numpy', 'int8'),
+                                       ('numpy', 'int16'),
+                                       ('htk', 'int16')]:
+            self.check_save(input_utt, save_format, precision)
+
+    def check_quantizer(self, input_utt):
+
+        for precision, max_error in [('int8', 4. / 127), ('int16', 4. / 32767)]:
+            quantizer = standard_quantizer(
+                precision, np.zeros(6), np.ones(6))
+            stored = quantizer.encode(input_utt)
+            self.assertEqual(stored.dtype, np.dtype(precision))
+            error = np.abs(quantizer.decode(stored) - input_utt)
+            # NOTE: a clipped value
+            self.assertTrue(np.isclose(error[0, 0], 6., atol=1e-5))
+            error[0, 0] = 0
+            self.assertTrue(np.all(error <= max_error / 2 + 1e-6))
+
+            # Errors per dimension
+            self.assertEqual(quantizer.frame_num, 200)
+            self.assertEqual(quantizer.clip_num.tolist(), [1, 0, 0, 0, 0, 0])
+            self.assertTrue(np.isclose(quantizer.max_abs_error[0], 6.,
+                                       atol=1e-5))
+            self.assertTrue(np.allclose(
+                quantizer.abs_error_sum[1:],
+                np.sum(np.abs(quantizer.decode(stored, np.float64) -
+                              input_utt), axis=0)[1:]))
+
+            # Merge errors of another part
+            other = standard_quantizer(
+                precision, np.zeros(6), np.ones(6))
+            other.encode(input_utt[:50] / 2)
+            quantizer.merge(other)
+            self.assertEqual(quantizer.frame_num, 250)
+            with self.assertRaises(ValueError):
+                quantizer.merge(standard_quantizer(
+                    precision, np.zeros(6), np.ones(6), clip=3.))
+
+        quantizer = Quantizer('float16')
+        stored = quantizer.encode(input_utt)
+        self.assertEqual(stored.dtype, np.float16)
+        self.assertTrue(np.allclose(quantizer.decode(stored), input_utt,
+                                    rtol=1e-3))
+        with self.assertRaises(ValueError):
+            Quantizer('int8')
+
+    def check_statistics(self):
+
+        # Unnormalized features of two groups (ex. male and female)
+        np.random.seed(1)
+        mean = np.array([[-5., 0., 100., 3.], [5., 1., 120., 3.]])
+        std = np.array([[1., 2., 10., 0.], [3., 2., 20., 0.]])
+        input_utts = [np.random.randn(300, 4) * s + m
+                      for m, s in zip(mean, std)]
+        quantizer = standard_quantizer('int8', mean, std)
+        for input_utt in input_utts:
+            error = np.abs(quantizer.decode(
+                quantizer.encode(input_utt), dtype=np.float64) - input_utt)
+            self.assertTrue(np.all(error <= quantizer.scale / 2 + 1e-4))
+        self.assertEqual(np.sum(quantizer.clip_num), 0)
+        self.assertTrue(np.allclose(
+            quantizer.offset, [(-9. + 17.) / 2, 0.5, (40. + 200.) / 2, 3.5]))
+        # NOTE: the step is smaller for a dimension with smaller std
+        self.assertTrue(quantizer.scale[1] < quantizer.scale[2])
+
+    def check_save(self, input_utt, save_format, precision):
+
+        save_path = tempfile.mkdtemp()
+        try:
+            quantizer = standard_quantizer(
+                precision, np.zeros(6), np.ones(6)) \
+                if precision != 'float16' else Quantizer(precision)
+            ledger = Ledger(save_path, save_format, 'hash')
+            ext = '.npy' if save_format == 'numpy' else '.htk'
+            path = mkdir_join(save_path, 'spk0', 'utt0' + ext)
+            ledger.save('utt0', path, input_utt, sampPeriod=100000,
+                        parmKind=838, quantizer=quantizer)
+            save_quantizer(quantizer, save_path, ledger.config_hash)
+            self.assertEqual(ledger.frame_num_dict(), {'utt0': 200})
+
+            if save_format == 'htk':
+                _, sampPeriod, parmKind = read(path)
+                self.assertEqual((sampPeriod, parmKind), (100000, 838))
+                self.assertEqual(read_header(path)[0], 200)
+
+            # Report of the whole features
+            saved = Quantizer.load(join(save_path, QUANTIZATION_NAME))
+            self.assertEqual(saved.precision, precision)
+            self.assertEqual(saved.frame_num, 200)
+            self.assertTrue(np.allclose(saved.max_abs_error,
+                                        quantizer.max_abs_error))
+            with np.load(join(save_path, QUANTIZATION_NAME)) as report:
+                self.assertTrue(np.allclose(
+                    report['mean_abs_error'],
+                    quantizer.abs_error_sum / quantizer.frame_num))
+
+            loaded = read_input(path)
+            self.assertEqual(loaded.dtype, np.float32)
+            self.assertTrue(np.allclose(
+                loaded, quantizer.decode(quantizer.encode(input_utt))))
+
+            # Errors of an interrupted run are kept when resuming it
+            resumed = standard_quantizer(
+                precision, np.zeros(6), np.ones(6)) \
+                if precision != 'float16' else Quantizer(precision)
+            resumed.encode(input_utt[:50])
+            save_quantizer(resumed, save_path, 'hash')
+            self.assertEqual(Quantizer.load(
+                join(save_path, QUANTIZATION_NAME)).frame_num, 250)
+
+            # Errors of another configuration are discarded because all
+            # features are saved again
+            other = standard_quantizer(
+                precision, np.zeros(6), np.ones(6)) \
+                if precision != 'float16' else Quantizer(precision)
+            other.encode(input_utt[:50])
+            save_quantizer(other, save_path, 'another hash')
+            saved = Quantizer.load(join(save_path, QUANTIZATION_NAME))
+            self.assertEqual(saved.frame_num, 50)
+            self.assertEqual(saved.config_hash, 'another hash')
+        finally:
+            shutil.rmtree(save_path)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,106 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Test for segmentation of a file into utterances."""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import sys
+import shutil
+import tempfile
+import unittest
+from os.path import join
+import numpy as np
+
+sys.path.append('../../')
+from utils.inputs.segmentation import pad_boundaries, PrefixSums, segment
+from utils.inputs.htk import write as write_htk
+
+
+class TestSegmentation(unittest.TestCase):
+
+    def test(self):
+
+        self.check_pad_boundaries()
+        self.check_prefix_sums()
+        self.check_utterance_statistics()
+
+    def check_pad_boundaries(self):
+
+        # A long gap, short gaps and the end of the file
+        start_frames, end_frames = pad_boundaries(
+            [15, 60, 70, 76], [30, 66, 72, 98], sil_duration=10,
+            frame_num=100)
+        self.assertEqual(list(start_frames), [5, 50, 68, 74])
+        self.assertEqual(list(end_frames), [40, 68, 74, 100])
+
+        # Overlapping utterances
+        start_frames, end_frames = pad_boundaries(
+            [0, 20], [30, 50], sil_duration=0, frame_num=60)
+        self.assertEqual(list(start_frames), [0, 25])
+        self.assertEqual(list(end_frames), [25, 50])
+
+        start_frames, end_frames = pad_boundaries(
+            [], [], sil_duration=10, frame_num=60)
+        self.assertEqual(len(start_frames), 0)
+
+    def check_prefix_sums(self):
+
+        np.random.seed(0)
+        input_data = np.random.randn(200, 3).astype(np.float32) * 10 + 1000
+        start_frames = np.array([0, 10, 50, 50, 120])
+        end_frames = np.array([30, 60, 50, 200, 130])
+        mean = np.mean(input_data, axis=0)
+
+        prefix_sums = PrefixSums(input_data)
+        sums = prefix_sums.sums(start_frames, end_frames)
+        squared_deviations = prefix_sums.squared_deviations(
+            start_frames, end_frames, mean)
+        for i, (start_frame, end_frame) in enumerate(
+                zip(start_frames, end_frames)):
+            x = input_data[start_frame:end_frame].astype(np.float64)
+            self.assertTrue(np.allclose(sums[i], np.sum(x, axis=0)))
+            self.assertTrue(np.allclose(squared_deviations[i],
+                                        np.sum((x - mean) ** 2, axis=0)))
+
+    def check_utterance_statistics(self):
+
+        save_path = tempfile.mkdtemp()
+        try:
+            np.random.seed(1)
+            input_data = np.random.randn(100, 3).astype(np.float32) + 50
+            htk_path = join(save_path, 'speaker.htk')
+            write_htk(input_data, htk_path, sampPeriod=100000, parmKind=838)
+            # NOTE: 0001 and 0002 are overlapping
+            utterance_dict = {'0001': [15, 30, 'a'], '0002': [28, 66, 'b'],
+                              '0003': [70, 72, 'c'], '0004': [76, 98, 'd']}
+            for mean in [None, np.full(3, 49., dtype=np.float32)]:
+                outputs = segment(htk_path, 'speaker', utterance_dict,
+                                  is_training=True, sil_duration=10,
+                                  mean=mean)
+                input_data_dict, _, file_mean = outputs[:3]
+                utt_sum_dict, utt_squared_deviation_dict = outputs[5:]
+                if mean is None:
+                    mean = file_mean
+                self.assertEqual(sorted(utt_sum_dict.keys()),
+                                 sorted(input_data_dict.keys()))
+                for utt_index, input_utt in input_data_dict.items():
+                    x = input_utt.astype(np.float64)
+                    self.assertTrue(np.allclose(
+                        utt_sum_dict[utt_index], np.sum(x, axis=0)))
+                    self.assertTrue(np.allclose(
+                        utt_squared_deviation_dict[utt_index],
+                        np.sum((x - mean) ** 2, axis=0)))
+
+            # Not computed for evaluation sets
+            outputs = segment(htk_path, 'speaker', utterance_dict,
+                              is_training=False)
+            self.assertTrue(outputs[5] is None and outputs[6] is None)
+        finally:
+            shutil.rmtree(save_path)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,154 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Test for splitting the training set into shards and merging them."""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+import pickle
+from os.path import join, isfile
+import numpy as np
+
+sys.path.append('../../')
+from utils.shard import plan_shards, prepare_shard, reduce_shards, shard_path
+from utils.inputs.ledger import Ledger
+from utils.inputs.statistics import Statistics, STATISTICS_NAME
+from utils.util import mkdir_join
+
+
+class TestShard(unittest.TestCase):
+
+    def test(self):
+
+        self.check_plan()
+        self.check_reduce()
+
+    def check_plan(self):
+
+        np.random.seed(0)
+        items = ['spk%d-%d' % (np.random.randint(40), i) for i in range(500)]
+        weights = {item: np.random.randint(100, 2000) for item in items}
+        shards, shard_frame_nums = plan_shards(
+            items, 4, group_func=lambda item: item.split('-')[0],
+            weight_func=lambda item: weights[item])
+
+        self.assertEqual(sorted(sum(shards, [])), sorted(items))
+        for shard, frame_num in zip(shards, shard_frame_nums):
+            self.assertEqual(sum(weights[item] for item in shard), frame_num)
+            # NOTE: the original order is kept
+            self.assertEqual(shard, [item for item in items if item in shard])
+        speakers = [set(item.split('-')[0] for item in shard)
+                    for shard in shards]
+        for i in range(4):
+            for j in range(i + 1, 4):
+                self.assertEqual(speakers[i] & speakers[j], set())
+        max_speaker_frames = max(
+            sum(weights[item] for item in items if item.startswith(s + '-'))
+            for s in set(item.split('-')[0] for item in items))
+        self.assertTrue(max(shard_frame_nums) - min(shard_frame_nums) <=
+                        max_speaker_frames)
+
+    def check_reduce(self):
+
+        save_path = tempfile.mkdtemp()
+        try:
+            np.random.seed(1)
+            input_utts = {}
+            for speaker in ['spk%d' % i for i in range(7)]:
+                for i in range(3):
+                    input_utts['%s-%d' % (speaker, i)] = np.random.randn(
+                        np.random.randint(10, 50), 3).astype(np.float32)
+            items = sorted(input_utts.keys())
+            key_funcs = {'speaker': lambda speaker: speaker}
+
+            # Each shard runs on its own node
+            for shard_index in range(3):
+                shard_items, shard_save_path = prepare_shard(
+                    items, save_path, 3, shard_index,
+                    group_func=lambda item: item.split('-')[0],
+                    weight_func=lambda item: input_utts[item].shape[0])
+                ledger = Ledger(shard_save_path, 'numpy', 'hash')
+                statistics = Statistics(key_funcs=key_funcs)
+                for item in shard_items:
+                    speaker = item.split('-')[0]
+                    ledger.save(item, mkdir_join(
+                        shard_save_path, speaker, item + '.npy'),
+                        input_utts[item])
+                    statistics.add(input_utts[item], speaker)
+                statistics.save(join(shard_save_path, STATISTICS_NAME))
+                with open(join(shard_save_path, 'frame_num.pickle'),
+                          'wb') as f:
+                    pickle.dump(ledger.frame_num_dict(), f)
+                if shard_index < 2:
+                    with self.assertRaises(ValueError):
+                        reduce_shards(save_path, 3)
+                with open(join(shard_save_path, 'complete.txt'), 'w') as f:
+                    f.write('')
+
+            frame_num_dict = reduce_shards(save_path, 3)
+
+            # The same as a single run
+            statistics = Statistics(key_funcs=key_funcs)
+            for item in items:
+                statistics.add(input_utts[item], item.split('-')[0])
+            merged = Statistics.load(join(save_path, STATISTICS_NAME))
+            self.assertEqual(sorted(merged.group_ids.keys()),
+                             sorted(statistics.group_ids.keys()))
+            for group in statistics.group_ids.keys():
+                self.assertTrue(np.allclose(merged.mean(group),
+                                            statistics.mean(group)))
+                self.assertTrue(np.allclose(merged.std(group),
+                                            statistics.std(group)))
+
+            expected = {item: input_utts[item].shape[0] for item in items}
+            self.assertEqual(frame_num_dict, expected)
+            with open(join(save_path, 'frame_num.pickle'), 'rb') as f:
+                self.assertEqual(pickle.load(f), expected)
+            ledger = Ledger(save_path, 'numpy', 'hash')
+            self.assertEqual(ledger.frame_num_dict(), expected)
+            for item in items:
+                path = join(save_path, item.split('-')[0], item + '.npy')
+                self.assertEqual(ledger.records[item][0], path)
+                self.assertTrue(np.array_equal(np.load(path),
+                                               input_utts[item]))
+
+            # Merging again changes nothing
+            with open(join(save_path, 'ledger.tsv'), 'r') as f:
+                ledger_lines = f.readlines()
+            self.assertEqual(reduce_shards(save_path, 3), expected)
+            with open(join(save_path, 'ledger.tsv'), 'r') as f:
+                self.assertEqual(f.readlines(), ledger_lines)
+            self.assertFalse(isfile(join(save_path, 'failed_files.txt')))
+            self.assertEqual(len(os.listdir(join(save_path, 'spk0'))), 3)
+
+            # Global mean & std exchanged by shards
+            global_mean = np.random.randn(3).astype(np.float32)
+            for shard_index in range(3):
+                np.save(join(shard_path(save_path, shard_index),
+                             'global_mean_male.npy'), global_mean)
+            reduce_shards(save_path, 3)
+            self.assertTrue(np.array_equal(
+                np.load(join(save_path, 'global_mean_male.npy')),
+                global_mean))
+
+            # Global mean & std of each shard only
+            np.save(join(shard_path(save_path, 2), 'global_mean_male.npy'),
+                    global_mean + 1)
+            with self.assertRaises(ValueError):
+                reduce_shards(save_path, 3)
+            os.remove(join(shard_path(save_path, 2), 'global_mean_male.npy'))
+            with self.assertRaises(ValueError):
+                reduce_shards(save_path, 3)
+        finally:
+            shutil.rmtree(save_path)
+
+
+if __name__ == '__main__':
+    unittest.main()
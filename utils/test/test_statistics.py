@@ -0,0 +1,140 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Test for statistics to normalize features on load."""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import sys
+import shutil
+import tempfile
+import unittest
+from os.path import join
+import numpy as np
+
+sys.path.append('../../')
+from utils.inputs.statistics import Statistics, Normalizer
+from utils.inputs.statistics import StatisticsSampler
+from utils.inputs.online_cmvn import online_cmvn
+
+
+class TestStatistics(unittest.TestCase):
+
+    def test(self):
+
+        self.check_statistics()
+        self.check_sampler()
+
+    def check_statistics(self):
+
+        np.random.seed(0)
+        utterances = [(np.random.randn(np.random.randint(1, 50), 3).astype(
+            np.float32) * 100 + 1000, 'spk%d' % (i % 3)) for i in range(10)]
+
+        statistics = Statistics(key_funcs={
+            'speaker': lambda speaker: speaker,
+            'side': lambda speaker: 'odd' if speaker == 'spk1' else None})
+        for input_utt, speaker in utterances:
+            statistics.add(input_utt, speaker)
+        self.assertEqual(statistics.groups('spk1'),
+                         ['global', 'speaker/spk1', 'side/odd'])
+
+        save_path = tempfile.mkdtemp()
+        try:
+            statistics.save(join(save_path, 'statistics.npz'))
+            statistics = Statistics.load(join(save_path, 'statistics.npz'))
+        finally:
+            shutil.rmtree(save_path)
+        self.assertEqual(len(statistics.group_ids), 5)
+
+        all_utt = np.concatenate([x for x, _ in utterances], axis=0)
+        self.assertTrue(np.allclose(statistics.mean('global'),
+                                    np.mean(all_utt, axis=0, dtype=np.float64)))
+        self.assertTrue(np.allclose(statistics.std('global'),
+                                    np.std(all_utt, axis=0, ddof=1,
+                                           dtype=np.float64)))
+        spk_utt = np.concatenate(
+            [x for x, s in utterances if s == 'spk1'], axis=0)
+        self.assertTrue(np.allclose(statistics.std('speaker/spk1'),
+                                    np.std(spk_utt, axis=0, ddof=1,
+                                           dtype=np.float64)))
+        self.assertTrue(np.allclose(statistics.mean('side/odd'),
+                                    statistics.mean('speaker/spk1')))
+
+        # Normalize in place
+        input_utt = utterances[1][0].copy()
+        normalizer = Normalizer(statistics, 'speaker')
+        self.assertIs(normalizer(input_utt, speaker='spk1'), input_utt)
+        self.assertTrue(np.allclose(
+            input_utt, (utterances[1][0] - statistics.mean('speaker/spk1')) /
+            statistics.std('speaker/spk1'), atol=1e-4))
+
+        with self.assertRaises(ValueError):
+            Normalizer(statistics, 'channel')
+
+        # Evaluation sets are normalized by global statistics
+        input_utt = utterances[1][0].copy()
+        Normalizer(statistics, 'speaker', is_training=False)(input_utt)
+        self.assertTrue(np.allclose(
+            input_utt, (utterances[1][0] - statistics.mean('global')) /
+            statistics.std('global'), atol=1e-4))
+
+        # Online normalization with global statistics as the prior
+        input_utt = utterances[1][0].copy()
+        Normalizer(statistics, 'online', online_window=10)(input_utt)
+        self.assertTrue(np.allclose(input_utt, online_cmvn(
+            utterances[1][0], window=10, prior_mean=statistics.mean('global'),
+            prior_std=statistics.std('global')), atol=1e-5))
+
+    def check_sampler(self):
+
+        np.random.seed(0)
+        files = ['m%d' % i for i in range(100)] + ['f%d' % i for i in range(20)]
+        frame_nums = {f: np.random.randint(50, 100) for f in files}
+        file_means = {f: np.random.randn(2) for f in files}
+
+        # All files in the original order
+        sampler = StatisticsSampler(files, group_func=lambda f: f[0])
+        self.assertFalse(sampler.sampled)
+        self.assertEqual(sampler.items, files)
+
+        sampler = StatisticsSampler(files, group_func=lambda f: f[0],
+                                    sample_rate=0.1)
+        self.assertEqual(len(sampler.items), 12)
+        self.assertEqual(len([f for f in sampler.items if f[0] == 'f']), 2)
+
+        sampler = StatisticsSampler(files, group_func=lambda f: f[0],
+                                    sample_rate=0.5, max_frames=500)
+        for f in sampler.items:
+            if sampler.is_full():
+                break
+            if sampler.is_sampled(f):
+                sampler.add(f, file_means[f] * frame_nums[f], frame_nums[f])
+        self.assertTrue(sampler.is_full())
+        for group in ['m', 'f']:
+            used = [f for f in sampler.used_items if f[0] == group]
+            self.assertLess(sum(frame_nums[f] for f in used[:-1]), 500)
+            half_width = sampler.half_width(group)
+            self.assertEqual(half_width.shape, (2,))
+            self.assertTrue(np.all(half_width > 0) and
+                            np.all(np.isfinite(half_width)))
+
+        # Files chosen in advance do not depend on the order of adding them
+        sampler = StatisticsSampler(files, group_func=lambda f: f[0],
+                                    sample_rate=0.5, max_frames=500,
+                                    frame_func=lambda f: frame_nums[f])
+        for group in ['m', 'f']:
+            chosen = [f for f in sampler.items if f[0] == group]
+            self.assertLess(sum(frame_nums[f] for f in chosen[:-1]), 500)
+            self.assertTrue(sum(frame_nums[f] for f in chosen) >= 500)
+        for f in sorted(sampler.items, key=lambda f: frame_nums[f]):
+            self.assertFalse(sampler.is_full())
+            self.assertTrue(sampler.is_sampled(f))
+            sampler.add(f, file_means[f] * frame_nums[f], frame_nums[f])
+        self.assertEqual(sorted(sampler.used_items), sorted(sampler.items))
+
+
+if __name__ == '__main__':
+    unittest.main()
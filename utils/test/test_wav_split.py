@@ -0,0 +1,91 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Test for splitting WAV files and the manifest of utterances in them."""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import sys
+import shutil
+import tempfile
+import unittest
+import wave
+from os.path import join
+import numpy as np
+
+sys.path.append('../../')
+from utils.inputs.wav_split import split_wav, make_wav_manifest
+from utils.inputs.wav_split import WavManifest, MANIFEST_NAME
+
+
+class TestWavSplit(unittest.TestCase):
+
+    def test(self):
+
+        save_path = tempfile.mkdtemp()
+        try:
+            np.random.seed(0)
+            speaker_dict = {}
+            wav_paths = []
+            samples = {}
+            for speaker, channels in [('mono', 1), ('stereo', 2), ('two', 2)]:
+                wav_path = join(save_path, speaker + '.wav')
+                samples[speaker] = np.random.randint(
+                    -1000, 1000, size=(32000, channels)).astype(np.int16)
+                with wave.open(wav_path, 'w') as w:
+                    w.setnchannels(channels)
+                    w.setsampwidth(2)
+                    w.setframerate(8000)
+                    w.writeframes(samples[speaker].tobytes())
+                wav_paths.append(wav_path)
+                speaker_dict[speaker] = {
+                    '0001': [10, 55, 'a'], '0002': [60, 120, 'b'],
+                    '0003': [201, 250, 'c']}
+
+            # A speaker per channel
+            speaker_dict['two-A'] = speaker_dict.pop('two')
+            speaker_dict['two-B'] = {'0001': [30, 90, 'd']}
+
+            split_wav(wav_paths, join(save_path, 'split'), speaker_dict,
+                      num_workers=2)
+            frame_num_dict = make_wav_manifest(
+                wav_paths, save_path, speaker_dict)
+            self.assertEqual(frame_num_dict['mono_0002'], 60)
+
+            manifest = WavManifest(join(save_path, MANIFEST_NAME))
+            self.assertEqual(len(manifest.segments), 10)
+            # NOTE: 201 frames are 16080 samples at 8kHz
+            self.assertEqual(manifest.segments['mono_0003'][1:3], (16080, 3920))
+            self.assertTrue(np.array_equal(manifest.read('two-B_0001'),
+                                           samples['two'][2400:7200, 1]))
+            for speaker, channels in [('mono', 1), ('stereo', 2),
+                                      ('two-A', 1), ('two-B', 1)]:
+                for utt_index in sorted(speaker_dict[speaker].keys()):
+                    utt_name = speaker + '_' + utt_index
+                    with wave.open(join(save_path, 'split', speaker,
+                                        utt_name + '.wav'), 'r') as w:
+                        split_frames = w.readframes(w.getnframes())
+
+                    audio_data = manifest.read(utt_name)
+                    self.assertIsInstance(audio_data, np.memmap)
+                    self.assertEqual(audio_data.ndim, 1 if channels == 1 else 2)
+                    self.assertEqual(
+                        np.ascontiguousarray(audio_data).tobytes(),
+                        split_frames)
+
+                    # A real file for tools which need a path
+                    wav_path = manifest.write(
+                        utt_name, join(save_path, 'tmp.wav'))
+                    with wave.open(wav_path, 'r') as w:
+                        self.assertEqual(w.getnchannels(), channels)
+                        self.assertEqual(w.getframerate(), 8000)
+                        self.assertEqual(w.readframes(w.getnframes()),
+                                         split_frames)
+        finally:
+            shutil.rmtree(save_path)
+
+
+if __name__ == '__main__':
+    unittest.main()